@@ -1,13 +1,29 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Body, Depends
-from typing import Dict, Any, List
+from fastapi import APIRouter, File, UploadFile, HTTPException, Body, Depends, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Any, List, Optional, Union
+import asyncio
 import datetime
+import json
+import math
 import uuid
 import os
 
-from app.services.ocr_service import OCRService
+from app.services.ocr_engine import OCREngine
 from app.services.parser_service import ParserService
 from app.services.calculation_service import CalculationService
+from app.services.receipt_pipeline import ReceiptPipeline
+from app.services.resilience import CircuitOpenError
+from app.services.admission import AdmissionController, AdmissionRejectedError, AdmissionTicket
+from app.services.deadlines import DeadlineExceededError, DeadlinePolicy, deadlineScope, remainingTime
+from app.services.job_queue import DONE, FAILED, JobWorkerPool
+from app.services.image_preprocessor import ImageTooLargeError
+from app.services.upload_limits import UploadLimits, UploadRejectedError
+from app.services.api_key_pool import KeyPoolExhaustedError
+from app.core.lifecycle import getServiceContainer
 from app.models.receipt import ReceiptParseResponse, ReceiptSplitRequest, ReceiptSplitResponse
+from app.models.job import JobStatusResponse
 from app.models.item import Item
 
 router = APIRouter()
@@ -20,99 +36,579 @@ processed_receipts_db: Dict[str, ReceiptParseResponse] = {}
 # --- Dependencias de Servicios ---
 # Usar Depends de FastAPI permite la inyección de dependencias, facilitando las pruebas
 # y la configuración de los servicios (ej. pasar configuraciones específicas).
+# Los servicios se crean una sola vez al arrancar la app (ver app.core.lifecycle) y
+# estas funciones solo devuelven la instancia compartida. En los tests se sustituyen
+# con app.dependency_overrides.
 
-def getOcrService():
-    """Provee una instancia del servicio OCR (ahora usando Gemini)."""
-    # OCRService ahora maneja la obtención de la API key desde variables de entorno
-    # o usa la que se le pase directamente (o la hardcodeada como fallback).
-    # No es necesario pasarle la API key aquí explícitamente si está como variable de entorno GEMINI_API_KEY.
-    return OCRService()
+def getOcrService(
+    request: Request,
+    engine: Optional[str] = Query(None, description="Motor OCR a usar (ej. 'gemini', 'tesseract'). Por defecto, OCR_ENGINE."),
+) -> Optional[OCREngine]:
+    """
+    Provee el motor OCR compartido: el pedido en `?engine=` o el configurado por defecto.
+    Devuelve None si no se pudo crear (ej. falta GEMINI_API_KEY); el endpoint lo notifica al cliente.
+    """
+    container = getServiceContainer(request.app)
+    if engine is not None and engine not in container.engine_names:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Motor OCR '{engine}' no soportado. Disponibles: {', '.join(container.engine_names)}"
+        )
+    return container.getOcrEngine(engine)
+
+def getParserService(request: Request) -> ParserService:
+    """Provee el servicio de parsing compartido."""
+    return getServiceContainer(request.app).parser_service
+
+def getCalculationService(request: Request) -> CalculationService:
+    """Provee el servicio de cálculo compartido."""
+    return getServiceContainer(request.app).calculation_service
+
+def getReceiptPipeline(request: Request) -> ReceiptPipeline:
+    """Provee el pipeline de procesamiento de tickets compartido (OCR + caché + parsing)."""
+    return getServiceContainer(request.app).pipeline
+
+def getAdmissionController(request: Request) -> Optional[AdmissionController]:
+    """Provee el control de admisión compartido (None si está desactivado)."""
+    return getServiceContainer(request.app).admission
 
-def getParserService():
-    """Provee una instancia del servicio de parsing."""
-    return ParserService()
+def getDeadlinePolicy(request: Request) -> DeadlinePolicy:
+    """Provee la política de plazos por petición compartida."""
+    return getServiceContainer(request.app).deadlines
 
-def getCalculationService():
-    """Provee una instancia del servicio de cálculo."""
-    return CalculationService()
+def getJobPool(request: Request) -> Optional[JobWorkerPool]:
+    """Provee la cola de trabajos asíncronos compartida (None si está desactivada)."""
+    return getServiceContainer(request.app).jobs
+
+def getUploadLimits(request: Request) -> UploadLimits:
+    """Provee los límites de tamaño, tipo y píxeles de las imágenes subidas."""
+    return getServiceContainer(request.app).upload_limits
 
 # --- Endpoints de la API ---
 
-@router.post("/upload", response_model=ReceiptParseResponse)
+async def _processReceiptImage(
+    image_bytes: bytes,
+    filename: Optional[str],
+    ocr_service: OCREngine,
+    parser_service: ParserService,
+    pipeline: ReceiptPipeline,
+) -> ReceiptParseResponse:
+    """
+    Procesa una imagen de ticket (OCR + parsing) y guarda el resultado en la "DB".
+
+    Lo comparten la subida individual y la subida por lotes, de modo que ambas
+    producen y almacenan exactamente el mismo `ReceiptParseResponse`.
+    Las imágenes que no son tickets también se guardan; decidir si eso es un error
+    para el cliente le corresponde al endpoint.
+
+    Raises:
+        HTTPException: 500 si falla el OCR o el parsing.
+    """
+    try:
+        # Extraer texto de la imagen (OCR asíncrono, sin bloquear el event loop) y parsearlo
+        # para obtener items y otros datos. Si la misma imagen ya se procesó, el pipeline
+        # devuelve el resultado cacheado sin llamar al modelo.
+        receipt_id = str(uuid.uuid4()) # Generar un ID único para este ticket procesado
+        parsed_data_dict = await pipeline.extractAndParse(
+            image_bytes, ocr_service, parser_service, receipt_id=receipt_id
+        )
+        return _storeReceipt(receipt_id, filename, parsed_data_dict)
+    except Exception as e:
+        raise _httpErrorFor(e)
+
+def _storeReceipt(receipt_id: str, filename: Optional[str], parsed_data_dict: Dict[str, Any]) -> ReceiptParseResponse:
+    """Crea el `ReceiptParseResponse` a partir de los datos parseados y lo guarda en la "DB"."""
+    response = ReceiptParseResponse.fromParsed(receipt_id, filename, parsed_data_dict)
+    processed_receipts_db[receipt_id] = response # Guardar en la "DB" en memoria
+    return response
+
+def _causeOfType(e: BaseException, error_type: type) -> Optional[BaseException]:
+    """El propio error o la primera de sus causas que sea de `error_type`, o None."""
+    cause: Optional[BaseException] = e
+    while cause is not None:
+        if isinstance(cause, error_type):
+            return cause
+        cause = cause.__cause__
+    return None
+
+def _httpErrorFor(e: Exception) -> HTTPException:
+    """Traduce un error del OCR/parsing a la respuesta HTTP que recibe el cliente."""
+    if isinstance(e, HTTPException):
+        # Las HTTPExceptions se propagan sin modificar (errores 400, 404, etc.)
+        return e
+    if isinstance(e, UploadRejectedError):
+        # Demasiado grande (413) o no es una imagen soportada (415): se ha visto sin decodificarla.
+        return HTTPException(status_code=e.status_code, detail=e.detail)
+    if isinstance(e, ImageTooLargeError):
+        # Demasiados píxeles para decodificarla (bomba de descompresión o imagen enorme).
+        return HTTPException(status_code=413, detail=str(e))
+    if isinstance(e, AdmissionRejectedError):
+        # Cola de trabajo llena: se rechaza al momento para no degradar al resto.
+        return HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+    if isinstance(e, DeadlineExceededError):
+        # Se agotó el plazo de la petición antes de tener respuesta del modelo.
+        return HTTPException(status_code=504, detail=str(e))
+    if isinstance(e, CircuitOpenError):
+        # El modelo está fallando de forma continuada: se responde al momento en lugar de
+        # esperar a otro timeout, indicando cuándo volver a intentarlo.
+        return HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+    exhausted = _causeOfType(e, KeyPoolExhaustedError)
+    if exhausted is not None:
+        # Ninguna clave de Gemini tiene cupo (llega envuelto por el servicio OCR): no es
+        # un fallo del servidor, se indica cuándo habrá cupo otra vez.
+        return HTTPException(
+            status_code=503,
+            detail=str(exhausted),
+            headers={"Retry-After": str(max(1, math.ceil(exhausted.retry_after)))}
+        )
+    if isinstance(e, RuntimeError):
+        # Captura específicamente el error si Tesseract no está configurado/instalado
+        if "Tesseract no encontrado" in str(e):
+            # Es importante dar un error claro al cliente/frontend en este caso.
+            return HTTPException(status_code=500, detail=f"Error de configuración del servidor: {e}")
+        # Otros errores de runtime durante el OCR/parsing
+        return HTTPException(status_code=500, detail=f"Error procesando la imagen: {e}")
+    # Cualquier otra excepción inesperada
+    # En producción, se debería loggear este error detalladamente.
+    return HTTPException(status_code=500, detail=f"Error inesperado en el servidor: {e}")
+
+def _notTicketDetail(response: ReceiptParseResponse) -> str:
+    """Mensaje de error para una imagen que el OCR no reconoce como ticket."""
+    return response.error_message or "La imagen proporcionada no parece ser un ticket de compra o factura válido."
+
+async def _admit(admission: Optional[AdmissionController]) -> Optional[AdmissionTicket]:
+    """Espera turno en la cola de trabajo OCR; 429 si está llena."""
+    if admission is None:
+        return None
+    try:
+        return await admission.acquire()
+    except AdmissionRejectedError as e:
+        raise _httpErrorFor(e)
+
+@asynccontextmanager
+async def _admitted(admission: Optional[AdmissionController]) -> AsyncIterator[None]:
+    """`async with _admitted(admission):` — procesa con un hueco de la cola y lo devuelve al salir."""
+    ticket = await _admit(admission)
+    try:
+        yield
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+def _requestDeadline(request: Request, deadlines: DeadlinePolicy) -> Optional[float]:
+    """Plazo de la petición (el de la cabecera o el configurado); 400 si la cabecera no es válida."""
+    try:
+        return deadlines.timeoutFor(request.headers.get(deadlines.header))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _waitForDisconnect(request: Request) -> None:
+    """Termina cuando el cliente cierra la conexión (el cuerpo ya se ha leído entero)."""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def _runForClient(request: Request, deadlines: DeadlinePolicy, timeout: Optional[float], work):
+    """
+    Ejecuta `work` (una corrutina) con el plazo `timeout` y la cancela si vence o si el
+    cliente se desconecta, para no seguir gastando cola y llamadas al modelo en una
+    respuesta que nadie va a leer.
+
+    Raises:
+        HTTPException: 504 si vence el plazo; 499 si el cliente se ha desconectado.
+    """
+    # La tarea copia el contexto al crearse: el plazo llega hasta la llamada al modelo.
+    with deadlineScope(timeout):
+        task = asyncio.ensure_future(work)
+    disconnect = asyncio.ensure_future(_waitForDisconnect(request))
+    try:
+        done, _ = await asyncio.wait({task, disconnect}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    if task in done:
+        error = task.exception()
+        if isinstance(error, HTTPException) and error.status_code == 504:
+            deadlines.record("deadline_exceeded")
+        else:
+            deadlines.record("completed")
+        return task.result()
+    if disconnect in done:
+        deadlines.record("cancelled_disconnect")
+        raise HTTPException(status_code=499, detail="El cliente cerró la conexión")
+    deadlines.record("deadline_exceeded")
+    raise _httpErrorFor(DeadlineExceededError("El plazo de la petición ha vencido"))
+
+async def _checkUpload(file: UploadFile, limits: UploadLimits) -> None:
+    """Comprueba el tamaño y la firma del archivo sin leerlo entero; 413/415 si no es válido."""
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="El archivo subido debe ser una imagen.")
+    try:
+        await limits.check(file)
+    except UploadRejectedError as e:
+        raise _httpErrorFor(e)
+
+async def _readUpload(file: UploadFile, limits: UploadLimits) -> bytes:
+    """Lee el archivo ya comprobado (como mucho `UPLOAD_MAX_BYTES`); 413 si es demasiado grande."""
+    try:
+        return await limits.read(file)
+    except UploadRejectedError as e:
+        raise _httpErrorFor(e)
+
+def _requireOcrService(request: Request, ocr_service: Optional[OCREngine]) -> OCREngine:
+    """Lanza 503 si el motor OCR pedido no se pudo crear al arrancar."""
+    if ocr_service is None:
+        ocr_error = getServiceContainer(request.app).getOcrError(request.query_params.get("engine"))
+        raise HTTPException(status_code=503, detail=f"Servicio OCR no disponible: {ocr_error}")
+    return ocr_service
+
+@router.post("/upload", response_model=ReceiptParseResponse, responses={202: {"model": JobStatusResponse}})
 async def uploadReceiptImage(
+    request: Request,
     file: UploadFile = File(..., description="Archivo de imagen del ticket (PNG, JPG, etc.)"),
-    ocr_service: OCRService = Depends(getOcrService),
-    parser_service: ParserService = Depends(getParserService)
+    mode: str = Query("sync", pattern="^(sync|async)$", description="'async' encola la imagen y responde 202 al momento."),
+    callback_url: Optional[str] = Query(None, description="Con mode=async, URL a la que se envía (POST) el resultado."),
+    ocr_service: Optional[OCREngine] = Depends(getOcrService),
+    parser_service: ParserService = Depends(getParserService),
+    pipeline: ReceiptPipeline = Depends(getReceiptPipeline),
+    admission: Optional[AdmissionController] = Depends(getAdmissionController),
+    deadlines: DeadlinePolicy = Depends(getDeadlinePolicy),
+    jobs: Optional[JobWorkerPool] = Depends(getJobPool),
+    upload_limits: UploadLimits = Depends(getUploadLimits)
 ):
     """
     Endpoint para subir una imagen de un ticket.
     La imagen se procesa con OCR para extraer texto, y luego se parsea para identificar ítems y totales.
     Devuelve los datos parseados del ticket, incluyendo un ID único para futuras operaciones.
+    Si la cola de trabajo OCR está llena responde 429 con `Retry-After`; si se agota el
+    plazo de la petición (ver `X-Request-Timeout`), 504. Si el cliente se desconecta, el
+    trabajo pendiente se cancela. Si la imagen pasa de `UPLOAD_MAX_BYTES` o de
+    `IMAGE_MAX_PIXELS` responde 413, y si su contenido no es una imagen soportada, 415.
+
+    Con `mode=async` la imagen se guarda en la cola de trabajos y se responde 202 con el
+    estado del trabajo; el resultado se consulta en `/jobs/{job_id}` (o sus eventos SSE
+    en `/jobs/{job_id}/events`) o llega por POST a `callback_url`.
     """
-    if not file.content_type or not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="El archivo subido debe ser una imagen.")
+    await _checkUpload(file, upload_limits)
 
+    ocr_service = _requireOcrService(request, ocr_service)
+    if mode == "async":
+        return await _enqueueJob(request, file, jobs, callback_url, upload_limits)
+    timeout = _requestDeadline(request, deadlines)
+
+    async def process() -> ReceiptParseResponse:
+        # La espera en la cola también cuenta para el plazo. La imagen se lee (del
+        # fichero temporal de la subida) ya con hueco: solo las admitidas ocupan memoria.
+        async with _admitted(admission):
+            image_bytes = await _readUpload(file, upload_limits)
+            return await _processReceiptImage(image_bytes, file.filename, ocr_service, parser_service, pipeline)
+
+    response = await _runForClient(request, deadlines, timeout, process())
+
+    # Si no es un ticket válido, devolver error 400 con el mensaje DESPUÉS de guardar la respuesta
+    if not response.is_ticket:
+        raise HTTPException(status_code=400, detail=_notTicketDetail(response))
+
+    return response
+
+@router.post("/upload/stream")
+async def uploadReceiptImageStream(
+    request: Request,
+    file: UploadFile = File(..., description="Archivo de imagen del ticket (PNG, JPG, etc.)"),
+    ocr_service: Optional[OCREngine] = Depends(getOcrService),
+    parser_service: ParserService = Depends(getParserService),
+    pipeline: ReceiptPipeline = Depends(getReceiptPipeline),
+    admission: Optional[AdmissionController] = Depends(getAdmissionController),
+    deadlines: DeadlinePolicy = Depends(getDeadlinePolicy),
+    upload_limits: UploadLimits = Depends(getUploadLimits)
+):
+    """
+    Igual que /upload, pero devuelve el resultado como Server-Sent Events a medida que
+    el modelo lo genera, para que el cliente pueda mostrar los ítems sin esperar al final.
+
+    Eventos:
+    - `item`: un `Item` en cuanto se ha leído (los IDs son los definitivos).
+    - `receipt`: el `ReceiptParseResponse` completo (con los totales), idéntico al que
+      devolvería /upload y ya guardado.
+    - `error`: `{"status_code", "detail"}` si el procesamiento falla o la imagen no es
+      un ticket (en ese caso también con `receipt_id`).
+    """
+    await _checkUpload(file, upload_limits)
+
+    ocr_service = _requireOcrService(request, ocr_service)
+    timeout = _requestDeadline(request, deadlines)
+    # El hueco se pide antes de empezar la respuesta, para poder contestar 429.
+    ticket = await _admit(admission)
     try:
-        image_bytes = await file.read()
-        # Extraer texto de la imagen usando el servicio OCR
-        raw_text = ocr_service.extractTextFromImage(image_bytes)
-        # Parsear el texto extraído para obtener items y otros datos
-        parsed_data_dict = parser_service.parseTextToItems(raw_text)
+        image_bytes = await _readUpload(file, upload_limits)
+    except BaseException:
+        if ticket is not None:
+            ticket.release()
+        raise
+    filename = file.filename
 
-        receipt_id = str(uuid.uuid4()) # Generar un ID único para este ticket procesado
-        
-        # Verificar si la imagen es un ticket válido
-        is_ticket = parsed_data_dict.get("is_ticket", True)
-        error_message = parsed_data_dict.get("error_message")
-        detected_content = parsed_data_dict.get("detected_content")
-        
-        # Crear el objeto de respuesta con los datos parseados
-        response = ReceiptParseResponse(
-            receipt_id=receipt_id,
-            filename=file.filename,
-            upload_timestamp=datetime.datetime.now(datetime.timezone.utc), # Usar UTC para consistencia
-            items=parsed_data_dict.get("items", []),
-            subtotal=parsed_data_dict.get("subtotal"),
-            tax=parsed_data_dict.get("tax"),
-            total=parsed_data_dict.get("total"),
-            raw_text=raw_text,
-            is_ticket=is_ticket,
-            error_message=error_message,
-            detected_content=detected_content
+    async def streamEvents():
+        receipt_id = str(uuid.uuid4())
+        # Si el cliente se desconecta, Starlette cancela este generador (y con él la
+        # llamada al modelo); el plazo acota la llamada igual que en /upload.
+        try:
+            with deadlineScope(timeout):
+                async for event, payload in pipeline.streamAndParse(
+                    image_bytes, ocr_service, parser_service, receipt_id=receipt_id
+                ):
+                    if event == "item":
+                        yield _sseEvent("item", payload.model_dump(mode="json"))
+                    else:
+                        response = _storeReceipt(receipt_id, filename, payload)
+                        if not response.is_ticket:
+                            yield _sseEvent("error", {
+                                "status_code": 400,
+                                "detail": _notTicketDetail(response),
+                                "receipt_id": receipt_id,
+                            })
+                        else:
+                            yield _sseEvent("receipt", response.model_dump(mode="json"))
+                deadlines.record("completed")
+        except asyncio.CancelledError:
+            deadlines.record("cancelled_disconnect")
+            raise
+        except Exception as e:
+            error = _httpErrorFor(e)
+            deadlines.record("deadline_exceeded" if error.status_code == 504 else "completed")
+            yield _sseEvent("error", {"status_code": error.status_code, "detail": error.detail})
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    return StreamingResponse(
+        streamEvents(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Por si el stream no llega a empezar (cliente desconectado); `release` es idempotente.
+        background=BackgroundTask(ticket.release) if ticket is not None else None
+    )
+
+async def _enqueueJob(
+    request: Request,
+    file: UploadFile,
+    jobs: Optional[JobWorkerPool],
+    callback_url: Optional[str],
+    upload_limits: UploadLimits,
+) -> JSONResponse:
+    """Guarda la imagen en la cola de trabajos y responde 202 con el estado del trabajo."""
+    if jobs is None:
+        raise HTTPException(status_code=503, detail="El modo asíncrono no está activado en el servidor.")
+    if callback_url is not None:
+        # Solo hosts permitidos con direcciones públicas (ver `CallbackPolicy`); resolver el
+        # nombre bloquea, así que fuera del event loop.
+        try:
+            await asyncio.to_thread(jobs.callback_policy.check, callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    image_bytes = await _readUpload(file, upload_limits)
+    job_id = await jobs.submit(image_bytes, file.filename, request.query_params.get("engine"), callback_url)
+    job = await jobs.get(job_id)
+    status_url = str(request.url_for("getJobStatus", job_id=job_id))
+    return JSONResponse(
+        status_code=202,
+        content=JobStatusResponse.fromJob(job).model_dump(mode="json"),
+        headers={"Location": status_url},
+    )
+
+def _requireJob(job) -> None:
+    """Lanza 404 si el trabajo no existe (o la cola asíncrona está desactivada)."""
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado con el ID proporcionado.")
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def getJobStatus(job_id: str, jobs: Optional[JobWorkerPool] = Depends(getJobPool)):
+    """
+    Estado de un trabajo de subida asíncrona. Cuando `status` es "done" incluye el
+    ticket procesado en `receipt` (también disponible en `/{receipt_id}` con el mismo ID).
+    """
+    job = await jobs.get(job_id) if jobs is not None else None
+    _requireJob(job)
+    return JobStatusResponse.fromJob(job)
+
+@router.get("/jobs/{job_id}/events")
+async def streamJobEvents(job_id: str, jobs: Optional[JobWorkerPool] = Depends(getJobPool)):
+    """
+    Progreso de un trabajo asíncrono como Server-Sent Events.
+
+    Eventos:
+    - `stage`: `{"job_id", "status", "stage", "attempts"}` cada vez que el trabajo avanza
+      (queued -> decoded -> ocr -> parsed).
+    - `done` / `failed`: el `JobStatusResponse` final; después se cierra el stream.
+    """
+    job = await jobs.get(job_id) if jobs is not None else None
+    _requireJob(job)
+
+    async def streamEvents():
+        current = job
+        last = None
+        while True:
+            progress = (current.status, current.stage, current.attempts)
+            if current.status in (DONE, FAILED):
+                yield _sseEvent(current.status, JobStatusResponse.fromJob(current).model_dump(mode="json"))
+                return
+            if progress != last:
+                last = progress
+                yield _sseEvent("stage", {
+                    "job_id": current.job_id, "status": current.status,
+                    "stage": current.stage, "attempts": current.attempts,
+                })
+            await jobs.waitForUpdate(job_id, timeout=1.0)
+            current = await jobs.get(job_id)
+
+    return StreamingResponse(
+        streamEvents(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _sseEvent(event: str, data: Any) -> str:
+    """Formatea un evento Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/upload/batch")
+async def uploadReceiptImagesBatch(
+    request: Request,
+    files: List[UploadFile] = File(..., description="Imágenes de los tickets (PNG, JPG, etc.)"),
+    max_concurrency: Optional[int] = Query(None, ge=1, description="Máximo de imágenes procesadas a la vez"),
+    ocr_service: Optional[OCREngine] = Depends(getOcrService),
+    parser_service: ParserService = Depends(getParserService),
+    pipeline: ReceiptPipeline = Depends(getReceiptPipeline),
+    admission: Optional[AdmissionController] = Depends(getAdmissionController),
+    deadlines: DeadlinePolicy = Depends(getDeadlinePolicy),
+    upload_limits: UploadLimits = Depends(getUploadLimits)
+):
+    """
+    Endpoint para subir varios tickets a la vez (ej. todos los de un viaje).
+
+    Las imágenes se procesan en paralelo (con un máximo de imágenes simultáneas) y la
+    respuesta es un stream NDJSON: una línea JSON por archivo, en el orden en que
+    terminan, sin esperar al más lento. Cada línea incluye `index` (posición del
+    archivo en la petición), `filename` y `status_code`; si es 200 incluye `receipt`
+    (el mismo `ReceiptParseResponse` que devuelve /upload), si no, `detail`.
+    Cada ticket se guarda igual que en una subida individual. Las imágenes que no caben
+    en la cola de trabajo OCR tienen `status_code` 429 y `retry_after` (segundos); las
+    que no pasan los límites de subida, 413 (demasiado grandes) o 415 (no son imágenes).
+
+    El plazo de la petición (ver `X-Request-Timeout`) vale para todo el lote: las imágenes
+    que no terminan a tiempo tienen `status_code` 504. Si el cliente se desconecta, el
+    trabajo pendiente se cancela.
+    """
+    settings = getServiceContainer(request.app).settings
+    if len(files) > settings.batch_max_files:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Demasiados archivos en el lote: {len(files)} (máximo {settings.batch_max_files})."
         )
-        
-        processed_receipts_db[receipt_id] = response # Guardar en la "DB" en memoria
-        
-        # Si no es un ticket válido, devolver error 400 con el mensaje DESPUÉS de guardar la respuesta
-        if not is_ticket:
-            raise HTTPException(
-                status_code=400, 
-                detail=error_message or "La imagen proporcionada no parece ser un ticket de compra o factura válido."
-            )
-        
-        return response
-
-    except HTTPException:
-        # Re-lanzar HTTPExceptions sin modificar (errores 400, 404, etc.)
-        raise
-    except RuntimeError as e:
-        # Captura específicamente el error si Tesseract no está configurado/instalado
-        if "Tesseract no encontrado" in str(e):
-            # Es importante dar un error claro al cliente/frontend en este caso.
-            raise HTTPException(status_code=500, detail=f"Error de configuración del servidor: {e}")
-        # Otros errores de runtime durante el OCR/parsing
-        raise HTTPException(status_code=500, detail=f"Error procesando la imagen: {e}")
-    except Exception as e:
-        # Captura cualquier otra excepción inesperada
-        # En producción, se debería loggear este error detalladamente.
-        raise HTTPException(status_code=500, detail=f"Error inesperado en el servidor: {e}")
+    ocr_service = _requireOcrService(request, ocr_service)
+    timeout = _requestDeadline(request, deadlines)
+    concurrency = min(max_concurrency or settings.batch_max_concurrency, settings.batch_max_concurrency)
+
+    # Aquí solo se comprueban el tamaño declarado y la firma; los que no pasan los límites
+    # de subida quedan como su error (400, 413 o 415). Los UploadFile (en memoria hasta
+    # 1 MB, en disco el resto) siguen abiertos hasta que se envía la respuesta entera.
+    uploads = []
+    for index, file in enumerate(files):
+        try:
+            await _checkUpload(file, upload_limits)
+            upload: Union[UploadFile, HTTPException] = file
+        except HTTPException as e:
+            upload = e
+        uploads.append((index, file.filename, upload))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def processOne(index: int, filename: Optional[str], upload: Union[UploadFile, HTTPException]) -> Dict[str, Any]:
+        line: Dict[str, Any] = {"index": index, "filename": filename}
+        if isinstance(upload, HTTPException):
+            line.update(status_code=upload.status_code, detail=upload.detail)
+            return line
+
+        async def process() -> ReceiptParseResponse:
+            async with semaphore, _admitted(admission):
+                # Se lee ya con hueco: como mucho `concurrency` imágenes en memoria a la vez.
+                image_bytes = await _readUpload(upload, upload_limits)
+                return await _processReceiptImage(image_bytes, filename, ocr_service, parser_service, pipeline)
+
+        try:
+            try:
+                # La espera por el semáforo y la cola también cuenta para el plazo.
+                response = await asyncio.wait_for(process(), timeout=remainingTime())
+            except asyncio.TimeoutError:
+                raise _httpErrorFor(DeadlineExceededError("El plazo de la petición ha vencido"))
+        except HTTPException as e:
+            line.update(status_code=e.status_code, detail=e.detail)
+            if e.headers and "Retry-After" in e.headers:
+                line["retry_after"] = int(e.headers["Retry-After"])
+            return line
+        if not response.is_ticket:
+            line.update(status_code=400, detail=_notTicketDetail(response), receipt_id=response.receipt_id)
+        else:
+            line.update(status_code=200, receipt=response.model_dump(mode="json"))
+        return line
+
+    async def streamResults():
+        # Las tareas copian el contexto al crearse: el plazo llega hasta cada llamada al modelo.
+        with deadlineScope(timeout):
+            tasks = [asyncio.create_task(processOne(*upload)) for upload in uploads]
+        # Starlette no siempre avisa de la desconexión hasta el siguiente envío, que puede
+        # tardar lo que la imagen más lenta: se vigila aparte, como en /upload.
+        disconnect = asyncio.ensure_future(_waitForDisconnect(request))
+        pending = set(tasks)
+        outcome = "cancelled_disconnect"
+        expired = False
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending | {disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnect in done:
+                    return
+                for finished in done:
+                    pending.discard(finished)
+                    line = finished.result()
+                    expired = expired or line["status_code"] == 504
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+            outcome = "deadline_exceeded" if expired else "completed"
+        finally:
+            # Si el cliente se desconecta, no seguir procesando imágenes que nadie leerá
+            disconnect.cancel()
+            for task in tasks:
+                task.cancel()
+            deadlines.record(outcome)
+
+    return StreamingResponse(streamResults(), media_type="application/x-ndjson")
+
+async def _findReceipt(request: Request, receipt_id: str) -> Optional[ReceiptParseResponse]:
+    """Busca un ticket en la "DB" y, si no está, entre los resultados de la cola de trabajos."""
+    receipt_data = processed_receipts_db.get(receipt_id)
+    jobs = getServiceContainer(request.app).jobs
+    if receipt_data is None and jobs is not None:
+        job = await jobs.get(receipt_id)
+        if job is not None and job.status == DONE and job.result is not None:
+            receipt_data = ReceiptParseResponse.model_validate(job.result)
+            processed_receipts_db[receipt_id] = receipt_data
+    return receipt_data
 
 @router.get("/{receipt_id}", response_model=ReceiptParseResponse)
-async def getReceiptData(receipt_id: str):
+async def getReceiptData(receipt_id: str, request: Request):
     """
     Obtiene los datos de un ticket procesado previamente, usando su ID.
     """
-    receipt_data = processed_receipts_db.get(receipt_id)
+    receipt_data = await _findReceipt(request, receipt_id)
     if not receipt_data:
         raise HTTPException(status_code=404, detail="Ticket no encontrado con el ID proporcionado.")
     return receipt_data
@@ -120,6 +616,7 @@ async def getReceiptData(receipt_id: str):
 @router.post("/{receipt_id}/split", response_model=ReceiptSplitResponse)
 async def splitReceipt(
     receipt_id: str,
+    request: Request,
     split_request: ReceiptSplitRequest, # Los datos para la división vienen en el cuerpo del request
     calculation_service: CalculationService = Depends(getCalculationService)
 ):
@@ -127,7 +624,7 @@ async def splitReceipt(
     Calcula la división de un ticket (previamente procesado y identificado por `receipt_id`)
     basado en las asignaciones de ítems a usuarios proporcionadas en `split_request`.
     """
-    parsed_receipt_data = processed_receipts_db.get(receipt_id)
+    parsed_receipt_data = await _findReceipt(request, receipt_id)
     if not parsed_receipt_data:
         raise HTTPException(status_code=404, detail="Ticket no encontrado para dividir. Primero debe ser subido y procesado.")
 
@@ -0,0 +1,260 @@
+from functools import lru_cache
+from typing import Optional
+import os
+
+from pydantic import BaseModel
+
+
+class Settings(BaseModel):
+    """
+    Configuración de la aplicación.
+
+    Cada campo puede sobrescribirse con una variable de entorno del mismo nombre
+    en mayúsculas (ej. `ocr_max_concurrency` -> `OCR_MAX_CONCURRENCY`).
+    Pydantic se encarga de convertir el texto de la variable al tipo del campo.
+
+    Attributes:
+        ocr_max_concurrency (int): Número máximo de llamadas OCR simultáneas que se
+            descargan a hilos desde el event loop.
+        ocr_engine (str): Motor OCR por defecto ("gemini" o "tesseract"); cada petición
+            puede elegir otro con `?engine=`.
+        tesseract_enabled (bool): Crea el motor local Tesseract (además de Gemini).
+        tesseract_cmd (Optional[str]): Ruta al ejecutable de Tesseract; vacío = buscarlo en el PATH.
+        tesseract_psm (int): Modo de segmentación de página (`--psm`) de Tesseract.
+        gemini_api_keys (Optional[str]): Claves API de Gemini separadas por comas; con ellas
+            las llamadas se reparten entre las claves según su cupo (en lugar de GEMINI_API_KEY).
+        gemini_key_requests_per_minute (float): Llamadas por minuto permitidas a cada clave.
+        gemini_key_burst (int): Llamadas seguidas que admite una clave con cupo completo.
+        gemini_key_cooldown_seconds (float): Tiempo que se aparta una clave tras un error de
+            cuota (se dobla con cada error seguido).
+        gemini_key_cooldown_max_seconds (float): Tiempo máximo que se aparta una clave.
+        gemini_key_max_wait_seconds (float): Espera máxima a que alguna clave tenga cupo.
+        ocr_model (str): Modelo de Gemini que lee los tickets (el nivel barato si hay escalado).
+        ocr_escalation_model (Optional[str]): Modelo más capaz al que se escala cuando la
+            respuesta del primero no es coherente; vacío = sin enrutado por niveles.
+        ocr_routing_policy (str): "escalate" (el barato primero, escalando según la confianza),
+            "primary" (solo el barato) o "strong" (solo el más capaz).
+        ocr_escalation_min_confidence (float): Confianza (0-1) por debajo de la cual se escala.
+        ocr_escalation_tolerance (float): Diferencia admitida al comprobar que los importes cuadran.
+        ocr_batching_enabled (bool): Agrupa las imágenes que llegan casi a la vez en una sola
+            llamada a Gemini.
+        ocr_batch_max_size (int): Imágenes máximas por llamada agrupada.
+        ocr_batch_max_wait_seconds (float): Tiempo que una imagen espera a que se le unan otras.
+        ocr_resilience_enabled (bool): Aplica timeouts, reintentos, cobertura y disyuntor a Gemini.
+        ocr_attempt_timeout_seconds (float): Tiempo máximo de cada intento; 0 = sin límite.
+        ocr_max_attempts (int): Intentos totales por extracción (1 = sin reintentos).
+        ocr_backoff_base_seconds (float): Espera base antes del primer reintento (se dobla en cada uno).
+        ocr_backoff_max_seconds (float): Espera máxima entre reintentos.
+        ocr_hedging_enabled (bool): Lanza un segundo intento si el primero supera el percentil de latencia.
+        ocr_hedge_percentile (float): Percentil (0-1) de latencia a partir del cual se cubre.
+        ocr_hedge_min_samples (int): Latencias observadas necesarias antes de empezar a cubrir.
+        ocr_fallback_engine (Optional[str]): Motor al que se desvían las peticiones si Gemini
+            falla o el circuito está abierto (ej. "tesseract"); vacío = sin alternativa.
+        circuit_breaker_enabled (bool): Activa el disyuntor del motor remoto.
+        circuit_breaker_failure_rate (float): Tasa de fallos (0-1) que abre el circuito.
+        circuit_breaker_window (int): Intentos recientes sobre los que se calcula la tasa.
+        circuit_breaker_min_calls (int): Intentos mínimos en la ventana antes de poder abrir.
+        circuit_breaker_open_seconds (float): Tiempo que el circuito permanece abierto.
+        ocr_tiling_enabled (bool): Procesa los tickets muy largos por franjas en paralelo.
+        ocr_tiling_min_aspect_ratio (float): Relación alto/ancho a partir de la cual se corta en franjas.
+        ocr_tile_aspect_ratio (float): Relación alto/ancho de cada franja.
+        ocr_tile_overlap (float): Fracción (0-0.5) de cada franja que se solapa con la siguiente.
+        ocr_tile_max_width (int): Ancho máximo (píxeles) de las franjas; 0 = sin límite.
+        ocr_max_tiles (int): Número máximo de franjas por imagen.
+        ocr_json_repair_enabled (bool): Repara las respuestas JSON mal formadas del modelo en
+            lugar de descartarlas y repetir la llamada.
+        ocr_keep_raw_text (bool): Devuelve y guarda en cada ticket la respuesta original del
+            motor OCR (`raw_text`); desactivado, la respuesta solo se decodifica y se descarta.
+        receipt_prefilter_enabled (bool): Descarta en local, sin llamar al modelo, las imágenes
+            que claramente no son tickets (sin líneas de texto o sin papel). Desactivado por
+            defecto: sin `receipt_prefilter_tesseract` descarta los tickets desvaídos o de poco
+            contraste (`benchmarks/eval_receipt_prefilter.py`: 10 de 51 tickets sintéticos
+            descartados por error, 19,6 %, todos los desvaídos; 0 de los 41 normales).
+        receipt_prefilter_min_side (int): Lado menor (píxeles) por debajo del cual la imagen no se
+            juzga y pasa siempre al motor OCR.
+        receipt_prefilter_min_text_lines (int): Líneas de texto mínimas para considerar la imagen un ticket.
+        receipt_prefilter_min_paper_fraction (float): Fracción (0-1) mínima de píxeles de papel claro.
+        receipt_prefilter_max_width_ratio (float): Relación ancho/alto máxima de una imagen con poco texto.
+        receipt_prefilter_tesseract (bool): Antes de descartar una imagen, la confirma con una pasada
+            rápida de Tesseract (si está instalado).
+        merchant_templates_enabled (bool): Aprende el formato de los tickets de cada comercio y
+            lee en local (Tesseract + regex) los de comercios conocidos, sin llamar al modelo.
+        merchant_templates_min_similarity (float): Similitud (0-1) mínima entre las cabeceras de
+            dos tickets para considerarlos del mismo comercio.
+        merchant_templates_min_confidence (float): Confianza (0-1) mínima de una lectura con
+            plantilla para no llamar al modelo.
+        merchant_templates_max_entries (int): Número máximo de plantillas guardadas.
+        merchant_templates_path (Optional[str]): Fichero SQLite donde se guardan las plantillas;
+            vacío = solo en memoria.
+        ocr_cache_enabled (bool): Activa la caché de resultados OCR por hash de imagen.
+        ocr_cache_max_entries (int): Entradas máximas del nivel en memoria (LRU).
+        ocr_cache_ttl_seconds (float): Tiempo de vida de cada entrada; 0 = sin caducidad.
+        ocr_cache_disk_path (Optional[str]): Fichero SQLite del nivel en disco; vacío = desactivado.
+        ocr_cache_disk_max_entries (int): Entradas máximas del nivel en disco.
+        ocr_cache_store_parsed (bool): Guarda también el resultado del parser en la caché.
+        duplicate_detection_enabled (bool): Activa la detección de casi duplicados por hash perceptual.
+        duplicate_max_distance (int): Distancia de Hamming máxima (sobre 256 bits) entre duplicados.
+        duplicate_index_max_entries (int): Número de tickets recientes recordados por el índice.
+        duplicate_mode (str): "flag" (solo marcar) o "reuse" (reutilizar el resultado anterior).
+        upload_max_bytes (int): Tamaño máximo (bytes) de cada imagen subida; las mayores se
+            rechazan con 413 sin leerlas enteras.
+        image_max_pixels (int): Píxeles máximos que se decodifican de una imagen; los JPEG
+            mayores se decodifican ya reducidos y el resto de formatos se rechaza (413).
+        image_preprocessing_enabled (bool): Reduce y recomprime la imagen antes de enviarla al modelo.
+        image_max_side (int): Lado más largo máximo (píxeles) de la imagen enviada; 0 = sin límite.
+        image_output_format (str): Formato de la imagen enviada ("JPEG" o "WEBP").
+        image_quality (int): Calidad de compresión (1-100).
+        image_grayscale (bool): Permite enviar en escala de grises las imágenes casi sin color.
+        image_grayscale_max_saturation (float): Saturación media (0-1) máxima para pasar a grises.
+        image_crop_enabled (bool): Recorta y endereza el ticket dentro de la foto (sin mesa ni fondo).
+        image_crop_min_confidence (float): Confianza (0-1) mínima de la detección para recortar;
+            por debajo se usa la foto entera.
+        image_crop_min_area_ratio (float): Fracción mínima de la foto que debe ocupar el ticket detectado.
+        image_preprocessing_workers (int): Procesos dedicados al preprocesado de imágenes;
+            0 = en los hilos del pool OCR.
+        single_flight_enabled (bool): Agrupa subidas idénticas simultáneas en una sola llamada al modelo.
+        batch_max_files (int): Número máximo de archivos en una subida por lotes.
+        batch_max_concurrency (int): Imágenes de un mismo lote procesadas a la vez.
+        admission_enabled (bool): Limita el trabajo OCR en curso y en cola; con la cola llena
+            las subidas responden 429.
+        admission_max_concurrency (int): Imágenes procesándose a la vez en todo el servidor.
+        admission_max_queue_depth (int): Imágenes que pueden esperar turno antes de rechazar.
+        request_deadline_seconds (float): Plazo de cada subida (cola, OCR y parsing); 0 = sin plazo.
+        request_deadline_max_seconds (float): Plazo máximo que puede pedir un cliente; 0 = sin máximo.
+        request_deadline_header (str): Cabecera con la que el cliente pide un plazo (en segundos).
+        jobs_enabled (bool): Permite las subidas asíncronas (`/upload?mode=async`).
+        jobs_db_path (str): Fichero SQLite de la cola de trabajos (la carpeta se crea si no
+            existe). ":memory:" = solo en memoria, para tests: los trabajos pendientes se
+            pierden al reiniciar.
+        jobs_workers (int): Trabajos asíncronos que se procesan a la vez.
+        jobs_max_attempts (int): Intentos por trabajo antes de darlo por fallido.
+        jobs_lease_seconds (float): Plazo de cada intento; pasado, el trabajo se vuelve a entregar.
+        jobs_retention_hours (float): Horas que se guardan los trabajos terminados; 0 = siempre.
+        jobs_callback_allowed_hosts (Optional[str]): Hosts a los que se pueden enviar callbacks,
+            separados por comas (`*.dominio` admite subdominios); vacío = cualquier host con
+            direcciones públicas. Nunca se envían a direcciones privadas o internas.
+        rate_limit_enabled (bool): Limita las peticiones de cada cliente (429 al superarlo).
+        rate_limit_upload_per_minute (float): Subidas por minuto permitidas a cada cliente.
+        rate_limit_upload_burst (int): Subidas seguidas que admite un cliente con el cupo completo.
+        rate_limit_read_per_minute (float): Consultas (GET y /split) por minuto por cliente.
+        rate_limit_read_burst (int): Consultas seguidas que admite un cliente con el cupo completo.
+        rate_limit_max_clients (int): Clientes seguidos por clase de ruta (se descartan los
+            que llevan más tiempo sin peticiones).
+        rate_limit_client_header (str): Cabecera con la API key del cliente.
+        rate_limit_api_keys (Optional[str]): API keys válidas de los clientes, separadas por
+            comas. Solo las peticiones con una de ellas se limitan por clave; el resto, por IP.
+    """
+    ocr_max_concurrency: int = 4
+    ocr_engine: str = "gemini"
+    tesseract_enabled: bool = True
+    tesseract_cmd: Optional[str] = None
+    tesseract_psm: int = 6
+    gemini_api_keys: Optional[str] = None
+    gemini_key_requests_per_minute: float = 15.0
+    gemini_key_burst: int = 4
+    gemini_key_cooldown_seconds: float = 10.0
+    gemini_key_cooldown_max_seconds: float = 120.0
+    gemini_key_max_wait_seconds: float = 2.0
+    ocr_model: str = "gemini-1.5-flash-latest"
+    ocr_escalation_model: Optional[str] = None
+    ocr_routing_policy: str = "escalate"
+    ocr_escalation_min_confidence: float = 0.75
+    ocr_escalation_tolerance: float = 0.05
+    ocr_batching_enabled: bool = False
+    ocr_batch_max_size: int = 4
+    ocr_batch_max_wait_seconds: float = 0.05
+    ocr_resilience_enabled: bool = True
+    ocr_attempt_timeout_seconds: float = 30.0
+    ocr_max_attempts: int = 3
+    ocr_backoff_base_seconds: float = 0.5
+    ocr_backoff_max_seconds: float = 4.0
+    ocr_hedging_enabled: bool = False
+    ocr_hedge_percentile: float = 0.95
+    ocr_hedge_min_samples: int = 20
+    ocr_fallback_engine: Optional[str] = None
+    circuit_breaker_enabled: bool = True
+    circuit_breaker_failure_rate: float = 0.5
+    circuit_breaker_window: int = 20
+    circuit_breaker_min_calls: int = 10
+    circuit_breaker_open_seconds: float = 30.0
+    ocr_tiling_enabled: bool = True
+    ocr_tiling_min_aspect_ratio: float = 3.0
+    ocr_tile_aspect_ratio: float = 1.5
+    ocr_tile_overlap: float = 0.15
+    ocr_tile_max_width: int = 1200
+    ocr_max_tiles: int = 12
+    ocr_json_repair_enabled: bool = True
+    ocr_keep_raw_text: bool = False
+    receipt_prefilter_enabled: bool = False
+    receipt_prefilter_min_side: int = 256
+    receipt_prefilter_min_text_lines: int = 3
+    receipt_prefilter_min_paper_fraction: float = 0.08
+    receipt_prefilter_max_width_ratio: float = 2.5
+    receipt_prefilter_tesseract: bool = False
+    merchant_templates_enabled: bool = False
+    merchant_templates_min_similarity: float = 0.6
+    merchant_templates_min_confidence: float = 0.9
+    merchant_templates_max_entries: int = 1000
+    merchant_templates_path: Optional[str] = None
+    ocr_cache_enabled: bool = True
+    ocr_cache_max_entries: int = 256
+    ocr_cache_ttl_seconds: float = 86400.0
+    ocr_cache_disk_path: Optional[str] = None
+    ocr_cache_disk_max_entries: int = 10000
+    ocr_cache_store_parsed: bool = True
+    duplicate_detection_enabled: bool = True
+    duplicate_max_distance: int = 10
+    duplicate_index_max_entries: int = 100000
+    duplicate_mode: str = "flag"
+    upload_max_bytes: int = 20 * 1024 * 1024
+    image_max_pixels: int = 40_000_000
+    image_preprocessing_enabled: bool = True
+    image_max_side: int = 2048
+    image_output_format: str = "JPEG"
+    image_quality: int = 85
+    image_grayscale: bool = True
+    image_grayscale_max_saturation: float = 0.12
+    image_crop_enabled: bool = True
+    image_crop_min_confidence: float = 0.7
+    image_crop_min_area_ratio: float = 0.15
+    image_preprocessing_workers: int = 0
+    single_flight_enabled: bool = True
+    batch_max_files: int = 50
+    batch_max_concurrency: int = 8
+    admission_enabled: bool = True
+    admission_max_concurrency: int = 8
+    admission_max_queue_depth: int = 32
+    request_deadline_seconds: float = 60.0
+    request_deadline_max_seconds: float = 120.0
+    request_deadline_header: str = "X-Request-Timeout"
+    jobs_enabled: bool = True
+    jobs_db_path: str = "data/jobs.sqlite3"
+    jobs_workers: int = 2
+    jobs_max_attempts: int = 3
+    jobs_lease_seconds: float = 300.0
+    jobs_retention_hours: float = 24.0
+    jobs_callback_allowed_hosts: Optional[str] = None
+    rate_limit_enabled: bool = False
+    rate_limit_upload_per_minute: float = 20.0
+    rate_limit_upload_burst: int = 5
+    rate_limit_read_per_minute: float = 300.0
+    rate_limit_read_burst: int = 60
+    rate_limit_max_clients: int = 10000
+    rate_limit_client_header: str = "X-API-Key"
+    rate_limit_api_keys: Optional[str] = None
+
+    @classmethod
+    def fromEnv(cls) -> "Settings":
+        """Construye la configuración a partir de las variables de entorno definidas."""
+        overrides = {}
+        for field_name in cls.model_fields:
+            env_value = os.getenv(field_name.upper())
+            if env_value is not None and env_value != "":
+                overrides[field_name] = env_value
+        return cls(**overrides)
+
+
+@lru_cache
+def getSettings() -> Settings:
+    """Devuelve la configuración del proceso (se lee una sola vez del entorno)."""
+    return Settings.fromEnv()
@@ -0,0 +1,301 @@
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Callable, List
+
+from fastapi import FastAPI
+
+from app.core.config import Settings, getSettings
+from app.services.admission import AdmissionController
+from app.services.api_key_pool import ApiKeyPool
+from app.services.calculation_service import CalculationService
+from app.services.deadlines import DeadlinePolicy
+from app.services.image_preprocessor import ImagePreprocessor
+from app.services.job_queue import Job, JobWorkerPool
+from app.services.micro_batching import MicroBatchingOCREngine
+from app.services.model_routing import TieredOCREngine
+from app.services.ocr_engine import OCREngine
+from app.services.ocr_service import OCRService
+from app.services.parser_service import ParserService
+from app.services.preprocess_pool import PreprocessPool
+from app.services.rate_limiter import RateLimiter
+from app.services.receipt_pipeline import ReceiptPipeline
+from app.services.resilience import ResilientOCREngine
+from app.services.tesseract_ocr_service import TesseractOCRService
+from app.services.tiled_ocr import TiledOCREngine, TileSplitter
+from app.services.upload_limits import UploadLimits
+from app.models.job import JobStatusResponse
+from app.models.receipt import ReceiptParseResponse
+
+
+class ServiceContainer:
+    """
+    Servicios compartidos por todas las peticiones del proceso.
+
+    Se construyen una sola vez (en el arranque de la app) en lugar de en cada petición:
+    así `genai.configure` y la creación del `GenerativeModel` no se repiten, el cliente
+    del modelo puede reutilizar conexiones y las cachés/métricas son globales.
+    Los endpoints acceden a ellos a través de las dependencias de `receipts.py`, que
+    los tests pueden sustituir con `app.dependency_overrides`.
+
+    Puede haber varios motores OCR (`ocr_engines`, por nombre); `default_engine` es el
+    que se usa cuando la petición no elige uno.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        ocr_engines: Dict[str, OCREngine],
+        parser_service: ParserService,
+        calculation_service: CalculationService,
+        pipeline: ReceiptPipeline,
+        image_preprocessor: Optional[ImagePreprocessor] = None,
+        preprocess_pool: Optional[PreprocessPool] = None,
+        ocr_errors: Optional[Dict[str, str]] = None,
+        default_engine: str = "gemini",
+        admission: Optional[AdmissionController] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        deadlines: Optional[DeadlinePolicy] = None,
+        jobs: Optional[JobWorkerPool] = None,
+        upload_limits: Optional[UploadLimits] = None,
+    ):
+        self.settings = settings
+        self.ocr_engines = ocr_engines
+        self.parser_service = parser_service
+        self.calculation_service = calculation_service
+        self.pipeline = pipeline
+        self.image_preprocessor = image_preprocessor
+        self.preprocess_pool = preprocess_pool
+        self.ocr_errors = ocr_errors or {}
+        self.default_engine = default_engine
+        self.admission = admission
+        self.rate_limiter = rate_limiter
+        self.deadlines = deadlines or DeadlinePolicy(default_seconds=None)
+        self.jobs = jobs
+        self.upload_limits = upload_limits or UploadLimits()
+
+    @property
+    def engine_names(self) -> List[str]:
+        """Motores configurados, estén disponibles o no."""
+        return sorted(set(self.ocr_engines) | set(self.ocr_errors))
+
+    def getOcrEngine(self, name: Optional[str] = None) -> Optional[OCREngine]:
+        """Devuelve el motor pedido (o el por defecto), o None si no se pudo crear."""
+        return self.ocr_engines.get(name or self.default_engine)
+
+    def getOcrError(self, name: Optional[str] = None) -> Optional[str]:
+        """Motivo por el que el motor pedido (o el por defecto) no está disponible."""
+        return self.ocr_errors.get(name or self.default_engine)
+
+    @property
+    def ocr_service(self) -> Optional[OCREngine]:
+        return self.getOcrEngine()
+
+    @property
+    def ocr_error(self) -> Optional[str]:
+        return self.getOcrError()
+
+    @classmethod
+    def build(cls, settings: Settings) -> "ServiceContainer":
+        """
+        Construye todos los servicios a partir de la configuración.
+
+        Si un motor OCR no se puede crear (por ejemplo, falta GEMINI_API_KEY) la app
+        arranca igualmente: el error se guarda y `/upload` responde 503 con él cuando
+        se pide ese motor.
+
+        Raises:
+            ValueError: Si `ocr_engine` no es un motor conocido.
+        """
+        image_preprocessor = None
+        if settings.image_preprocessing_enabled:
+            image_preprocessor = ImagePreprocessor.fromSettings(settings)
+        preprocess_pool = PreprocessPool.fromSettings(settings, image_preprocessor)
+
+        def makeGemini(model_name: str) -> OCRService:
+            return OCRService(
+                image_preprocessor=image_preprocessor,
+                max_concurrency=settings.ocr_max_concurrency,
+                request_timeout=settings.ocr_attempt_timeout_seconds or None,
+                repair_json=settings.ocr_json_repair_enabled,
+                model_name=model_name,
+                # Un pool por modelo: Gemini limita el cupo por proyecto y modelo.
+                key_pool=ApiKeyPool.fromSettings(settings),
+                preprocess_pool=preprocess_pool,
+            )
+
+        factories = {
+            "gemini": lambda: makeGemini(settings.ocr_model),
+        }
+        if settings.tesseract_enabled:
+            factories["tesseract"] = lambda: TesseractOCRService(
+                tesseract_cmd=settings.tesseract_cmd,
+                page_segmentation_mode=settings.tesseract_psm,
+                image_preprocessor=image_preprocessor,
+                max_concurrency=settings.ocr_max_concurrency,
+            )
+        if settings.ocr_engine not in factories:
+            raise ValueError(
+                f"Motor OCR '{settings.ocr_engine}' no soportado. Usa uno de: {sorted(factories)}"
+            )
+
+        ocr_engines: Dict[str, OCREngine] = {}
+        ocr_errors: Dict[str, str] = {}
+        for name, factory in factories.items():
+            try:
+                ocr_engines[name] = factory()
+            except (ValueError, RuntimeError) as e:
+                ocr_errors[name] = str(e)
+
+        # Modelo más capaz para el enrutado por niveles (mismas capas que el principal).
+        escalation_engine: Optional[OCREngine] = None
+        if "gemini" in ocr_engines and settings.ocr_escalation_model:
+            escalation_engine = makeGemini(settings.ocr_escalation_model)
+
+        fallback = None
+        if settings.ocr_fallback_engine and settings.ocr_fallback_engine != "gemini":
+            fallback = ocr_engines.get(settings.ocr_fallback_engine)
+        splitter = TileSplitter.fromSettings(settings) if settings.ocr_tiling_enabled else None
+
+        def wrap(name: str, engine: OCREngine) -> OCREngine:
+            if settings.ocr_batching_enabled and name == "gemini":
+                # Por dentro de la resiliencia: un lote fallido se reintenta imagen a imagen.
+                engine = MicroBatchingOCREngine.fromSettings(engine, settings)
+            if settings.ocr_resilience_enabled and name == "gemini":
+                engine = ResilientOCREngine.fromSettings(engine, settings, fallback=fallback)
+            if splitter is not None:
+                # Por fuera de la resiliencia: cada franja se reintenta por separado.
+                engine = TiledOCREngine(engine, splitter, max_pixels=settings.image_max_pixels)
+            return engine
+
+        ocr_engines = {name: wrap(name, engine) for name, engine in ocr_engines.items()}
+        if escalation_engine is not None:
+            # Por fuera de las franjas: la confianza se mide sobre el ticket completo.
+            ocr_engines["gemini"] = TieredOCREngine.fromSettings(
+                [
+                    (settings.ocr_model, ocr_engines["gemini"]),
+                    (settings.ocr_escalation_model, wrap("gemini", escalation_engine)),
+                ],
+                settings,
+            )
+
+        container = cls(
+            settings=settings,
+            ocr_engines=ocr_engines,
+            parser_service=ParserService(),
+            calculation_service=CalculationService(),
+            # Las plantillas de comercios leen en local con Tesseract (si está configurado).
+            pipeline=ReceiptPipeline.fromSettings(settings, local_reader=ocr_engines.get("tesseract")),
+            image_preprocessor=image_preprocessor,
+            preprocess_pool=preprocess_pool,
+            ocr_errors=ocr_errors,
+            default_engine=settings.ocr_engine,
+            admission=AdmissionController.fromSettings(settings),
+            rate_limiter=RateLimiter.fromSettings(settings),
+            deadlines=DeadlinePolicy.fromSettings(settings),
+            upload_limits=UploadLimits.fromSettings(settings),
+        )
+        container.jobs = JobWorkerPool.fromSettings(
+            settings, container.runJob, describe=lambda job: JobStatusResponse.fromJob(job).model_dump(mode="json")
+        )
+        return container
+
+    async def runJob(self, job: Job, on_stage: Callable[[str], None]) -> Dict[str, Any]:
+        """
+        Procesa un trabajo de la cola asíncrona igual que `/upload` procesa una imagen.
+
+        El `receipt_id` del ticket es el ID del trabajo, así que procesar dos veces el
+        mismo trabajo produce el mismo ticket.
+
+        Raises:
+            RuntimeError: Si el motor OCR del trabajo no está disponible.
+        """
+        ocr_service = self.getOcrEngine(job.engine)
+        if ocr_service is None:
+            raise RuntimeError(f"Servicio OCR no disponible: {self.getOcrError(job.engine)}")
+        parsed = await self.pipeline.extractAndParse(
+            job.image, ocr_service, self.parser_service, receipt_id=job.job_id, on_stage=on_stage
+        )
+        return ReceiptParseResponse.fromParsed(job.job_id, job.filename, parsed).model_dump(mode="json")
+
+    def warmUp(self) -> None:
+        """Calienta los servicios que tienen costes de primera llamada."""
+        for engine in self.ocr_engines.values():
+            engine.warmUp()
+        if self.preprocess_pool is not None:
+            self.preprocess_pool.warmUp()
+
+    def close(self) -> None:
+        """Libera los recursos de todos los servicios."""
+        for engine in self.ocr_engines.values():
+            engine.close()
+        self.pipeline.close()
+        if self.preprocess_pool is not None:
+            self.preprocess_pool.close()
+        if self.jobs is not None:
+            self.jobs.close()
+
+    def _layerStats(self, layer_type: type) -> Dict[str, Any]:
+        """Métricas de la capa `layer_type` de cada motor (los envoltorios exponen `engine`)."""
+        stats = {}
+        for name, engine in self.ocr_engines.items():
+            while engine is not None and not isinstance(engine, layer_type):
+                engine = getattr(engine, "engine", None)
+            if engine is not None:
+                stats[name] = engine.getStats()
+        return stats
+
+    def getStats(self) -> Dict[str, Any]:
+        """Reúne las métricas de todos los componentes."""
+        stats = self.pipeline.getStats()
+        stats["ocr_engines"] = {
+            "default": self.default_engine,
+            "available": sorted(self.ocr_engines),
+            "unavailable": dict(self.ocr_errors),
+        }
+        stats["resilience"] = self._layerStats(ResilientOCREngine)
+        stats["tiling"] = self._layerStats(TiledOCREngine)
+        stats["routing"] = self._layerStats(TieredOCREngine)
+        stats["batching"] = self._layerStats(MicroBatchingOCREngine)
+        stats["model_output"] = self._layerStats(OCRService)
+        stats["admission"] = self.admission.getStats() if self.admission is not None else None
+        stats["deadlines"] = self.deadlines.getStats()
+        stats["uploads"] = self.upload_limits.getStats()
+        stats["jobs"] = self.jobs.getStats() if self.jobs is not None else None
+        stats["rate_limit"] = self.rate_limiter.getStats() if self.rate_limiter is not None else None
+        stats["image_preprocessing"] = (
+            self.image_preprocessor.getStats() if self.image_preprocessor is not None else None
+        )
+        if stats["image_preprocessing"] is not None and self.preprocess_pool is not None:
+            stats["image_preprocessing"]["process_pool"] = self.preprocess_pool.getStats()
+        return stats
+
+
+def getServiceContainer(app: FastAPI) -> ServiceContainer:
+    """
+    Devuelve los servicios de la app.
+
+    Normalmente los crea el `lifespan`; si la app se usa sin él (por ejemplo, con un
+    `TestClient` creado fuera de un bloque `with`) se construyen aquí la primera vez.
+    """
+    container = getattr(app.state, "services", None)
+    if container is None:
+        container = ServiceContainer.build(getSettings())
+        app.state.services = container
+    return container
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Crea y calienta los servicios al arrancar la app y los cierra al apagarla."""
+    container = ServiceContainer.build(getSettings())
+    container.warmUp()
+    app.state.services = container
+    if container.jobs is not None:
+        # Retoma los trabajos asíncronos que quedaron pendientes antes del reinicio.
+        container.jobs.start()
+    try:
+        yield
+    finally:
+        if container.jobs is not None:
+            await container.jobs.stop()
+        container.close()
+        app.state.services = None
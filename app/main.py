@@ -2,13 +2,31 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.endpoints import receipts
+from app.core.lifecycle import lifespan, getServiceContainer
+from app.services.rate_limiter import RateLimitMiddleware
+from app.services.upload_limits import UploadLimitMiddleware
 # En el futuro, podríamos añadir más routers aquí, por ejemplo, para usuarios o grupos:
 # from app.api.endpoints import users, groups
 
 app = FastAPI(
     title="TicketSplitter API",
     description="API para dividir tickets y facturas.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan  # Crea los servicios compartidos al arrancar y los cierra al apagar
+)
+
+# Tamaño máximo de las subidas (ver UPLOAD_MAX_BYTES): corta los cuerpos demasiado
+# grandes antes de que se lean. Es el más interno, así que el rate limiting va antes.
+app.add_middleware(
+    UploadLimitMiddleware,
+    getLimits=lambda current_app: getServiceContainer(current_app).upload_limits,
+)
+
+# Límite de peticiones por cliente (ver RATE_LIMIT_* en la configuración). Se añade antes
+# que CORS para quedar por dentro: las respuestas 429 también llevan las cabeceras CORS.
+app.add_middleware(
+    RateLimitMiddleware,
+    getLimiter=lambda current_app: getServiceContainer(current_app).rate_limiter,
 )
 
 # Configuración de CORS (Cross-Origin Resource Sharing)
@@ -33,4 +51,9 @@ app.include_router(receipts.router, prefix="/api/v1/receipts", tags=["Receipts"]
 @app.get("/health", tags=["Health"])
 async def healthCheck():
     """Endpoint simple para verificar que la API está funcionando."""
-    return {"status": "ok"} 
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/metrics", tags=["Health"])
+async def getMetrics():
+    """Devuelve las métricas internas del procesamiento de tickets (caché de OCR, etc.)."""
+    return getServiceContainer(app).getStats() 
\ No newline at end of file
@@ -0,0 +1,47 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+from .receipt import ReceiptParseResponse
+import datetime
+
+class JobStatusResponse(BaseModel):
+    """
+    Modelo del estado de un trabajo de subida asíncrona (`/upload?mode=async`).
+
+    Es lo que devuelve `GET /jobs/{job_id}`, lo que llevan los eventos SSE y lo que se
+    envía por POST a la `callback_url` del trabajo cuando termina.
+
+    Attributes:
+        job_id (str): Identificador del trabajo; también será el `receipt_id` del ticket.
+        status (str): "queued", "processing", "done" o "failed".
+        stage (str): Progreso: "queued", "decoded", "ocr" o "parsed".
+        attempts (int): Veces que se ha empezado a procesar el trabajo.
+        filename (Optional[str]): Nombre original del archivo subido.
+        created_at (datetime): Fecha y hora de la subida.
+        updated_at (datetime): Fecha y hora del último cambio de estado.
+        error (Optional[str]): Último error (si falló algún intento).
+        receipt (Optional[ReceiptParseResponse]): El ticket procesado, cuando `status` es "done".
+    """
+    job_id: str
+    status: str
+    stage: str
+    attempts: int = 0
+    filename: Optional[str] = None
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+    error: Optional[str] = Field(default=None, description="Último error del trabajo, si lo hubo")
+    receipt: Optional[ReceiptParseResponse] = Field(default=None, description="Resultado, cuando el trabajo ha terminado")
+
+    @classmethod
+    def fromJob(cls, job) -> "JobStatusResponse":
+        """Crea la respuesta a partir de un `Job` de `app.services.job_queue`."""
+        return cls(
+            job_id=job.job_id,
+            status=job.status,
+            stage=job.stage,
+            attempts=job.attempts,
+            filename=job.filename,
+            created_at=datetime.datetime.fromtimestamp(job.created_at, datetime.timezone.utc),
+            updated_at=datetime.datetime.fromtimestamp(job.updated_at, datetime.timezone.utc),
+            error=job.error,
+            receipt=job.result,
+        )
@@ -56,12 +56,32 @@ class ReceiptParseResponse(ReceiptBase):
         is_ticket (bool): Indica si la imagen procesada es un ticket válido.
         error_message (Optional[str]): Mensaje de error si la imagen no es un ticket válido.
         detected_content (Optional[str]): Descripción de lo que se detectó en la imagen si no es un ticket.
+        duplicate_of (Optional[str]): receipt_id de un ticket subido antes que parece la misma imagen.
     """
     receipt_id: str # Identificador único asignado al recibo procesado (ej. UUID).
     items: List[Item] = Field(default_factory=list) # Lista de ítems parseados del recibo.
     is_ticket: bool = Field(default=True, description="Indica si la imagen procesada es un ticket válido")
     error_message: Optional[str] = Field(default=None, description="Mensaje de error si la imagen no es un ticket válido")
     detected_content: Optional[str] = Field(default=None, description="Descripción de lo que se detectó en la imagen si no es un ticket")
+    duplicate_of: Optional[str] = Field(default=None, description="receipt_id de un ticket anterior casi idéntico, si se detectó")
+
+    @classmethod
+    def fromParsed(cls, receipt_id: str, filename: Optional[str], parsed_data: Dict) -> "ReceiptParseResponse":
+        """Crea la respuesta a partir del diccionario de `ReceiptPipeline.extractAndParse`."""
+        return cls(
+            receipt_id=receipt_id,
+            filename=filename,
+            upload_timestamp=datetime.datetime.now(datetime.timezone.utc), # Usar UTC para consistencia
+            items=parsed_data.get("items", []),
+            subtotal=parsed_data.get("subtotal"),
+            tax=parsed_data.get("tax"),
+            total=parsed_data.get("total"),
+            raw_text=parsed_data.get("raw_text"),
+            is_ticket=parsed_data.get("is_ticket", True), # Verificar si la imagen es un ticket válido
+            error_message=parsed_data.get("error_message"),
+            detected_content=parsed_data.get("detected_content"),
+            duplicate_of=parsed_data.get("duplicate_of")
+        )
 
 class ItemAssignment(BaseModel):
     """
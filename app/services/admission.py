@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+
+from app.core.config import Settings
+from app.services.resilience import LatencyTracker
+
+
+class AdmissionRejectedError(RuntimeError):
+    """La cola de trabajo OCR está llena: la petición se rechaza sin procesarla."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """Hueco concedido a una petición; `release` lo devuelve (se puede llamar varias veces)."""
+
+    def __init__(self, controller: "AdmissionController", admitted_at: float):
+        self._controller = controller
+        self._admitted_at = admitted_at
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self._admitted_at)
+
+
+class AdmissionController:
+    """
+    Control de admisión del trabajo OCR: como mucho `max_concurrency` peticiones en
+    proceso y `max_queue_depth` esperando turno (en orden de llegada).
+
+    Con la cola llena, `acquire` falla al momento con `AdmissionRejectedError` (el
+    endpoint responde 429) en lugar de acumular trabajo que acabaría en timeouts para
+    todos. El `retry_after` se estima con la mediana reciente de lo que tarda cada petición:
+    el tiempo que tardaría en vaciarse la cola actual.
+
+    Pensado para usarse desde el event loop (no es seguro entre hilos).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_queue_depth: int = 32,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            max_concurrency: Peticiones procesándose a la vez.
+            max_queue_depth: Peticiones esperando turno; 0 = rechazar en cuanto no haya hueco.
+            clock: Reloj (sustituible en los tests).
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue_depth = max(0, max_queue_depth)
+        self._clock = clock
+        self._running = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+        self._waits = LatencyTracker()
+        self._service_times = LatencyTracker()
+        self._lock = threading.Lock()
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "max_queue_depth_seen": 0}
+
+    @classmethod
+    def fromSettings(cls, settings: Settings) -> Optional["AdmissionController"]:
+        if not settings.admission_enabled:
+            return None
+        return cls(
+            max_concurrency=settings.admission_max_concurrency,
+            max_queue_depth=settings.admission_max_queue_depth,
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def retryAfter(self) -> float:
+        """Segundos estimados hasta que haya hueco para una petición nueva."""
+        service_time = self._service_times.percentile(0.5) or 1.0
+        return service_time * (self.queue_depth + 1) / self.max_concurrency
+
+    async def acquire(self) -> AdmissionTicket:
+        """
+        Espera turno para procesar una petición.
+
+        Raises:
+            AdmissionRejectedError: Si la cola ya está llena.
+        """
+        started_at = self._clock()
+        if self._running < self.max_concurrency and not self._waiters:
+            self._running += 1
+            return self._admit(started_at, queued=False)
+        if len(self._waiters) >= self.max_queue_depth:
+            self._count("rejected")
+            raise AdmissionRejectedError(
+                f"El servidor está procesando demasiados tickets ({self._running} en curso, "
+                f"{len(self._waiters)} en cola); inténtalo de nuevo más tarde",
+                retry_after=self.retryAfter(),
+            )
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        with self._lock:
+            self._stats["max_queue_depth_seen"] = max(self._stats["max_queue_depth_seen"], len(self._waiters))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # El cliente se ha ido: si ya se le había pasado el hueco, se pasa al siguiente.
+            if waiter.done() and not waiter.cancelled():
+                self._release(None)
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        return self._admit(started_at, queued=True)
+
+    def _admit(self, started_at: float, queued: bool) -> AdmissionTicket:
+        now = self._clock()
+        self._waits.add(now - started_at)
+        self._count("admitted")
+        if queued:
+            self._count("queued")
+        return AdmissionTicket(self, now)
+
+    def _release(self, admitted_at: Optional[float]) -> None:
+        if admitted_at is not None:
+            self._service_times.add(self._clock() - admitted_at)
+        # El hueco pasa directamente al primero de la cola (sin decrementar `_running`).
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._running -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """`async with controller.slot():` — espera turno y lo devuelve al salir."""
+        ticket = await self.acquire()
+        try:
+            yield
+        finally:
+            ticket.release()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+
+    def getStats(self) -> Dict[str, Any]:
+        """Peticiones en curso y en cola, esperas (p50/p95) y rechazos."""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats.update(
+            running=self._running,
+            queue_depth=self.queue_depth,
+            max_concurrency=self.max_concurrency,
+            max_queue_depth=self.max_queue_depth,
+            wait_p50_seconds=self._waits.percentile(0.5),
+            wait_p95_seconds=self._waits.percentile(0.95),
+            service_p50_seconds=self._service_times.percentile(0.5),
+            retry_after_seconds=round(self.retryAfter(), 2),
+        )
+        return stats
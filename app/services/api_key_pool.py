@@ -0,0 +1,231 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from google.api_core import exceptions as google_exceptions
+
+from app.core.config import Settings
+from app.services.deadlines import remainingTime
+
+
+class KeyPoolExhaustedError(RuntimeError):
+    """Ninguna clave del pool tiene cupo disponible en el tiempo de espera permitido."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class KeyLease(NamedTuple):
+    """Clave asignada a una llamada; se devuelve al pool con `ApiKeyPool.release`."""
+    key_id: str
+    api_key: str
+
+
+def isQuotaError(error: BaseException) -> bool:
+    """Indica si el error (o alguna de sus causas) es un 429 / cuota agotada de Google."""
+    cause: Optional[BaseException] = error
+    while cause is not None:
+        if isinstance(cause, google_exceptions.TooManyRequests):
+            return True
+        cause = cause.__cause__
+    return False
+
+
+def isPoolExhausted(error: BaseException) -> bool:
+    """Indica si el error (o alguna de sus causas) es un `KeyPoolExhaustedError`."""
+    cause: Optional[BaseException] = error
+    while cause is not None:
+        if isinstance(cause, KeyPoolExhaustedError):
+            return True
+        cause = cause.__cause__
+    return False
+
+
+class _KeyState:
+    """Presupuesto (cubo de fichas) y contadores de una clave."""
+
+    def __init__(self, key_id: str, api_key: str, capacity: float, now: float):
+        self.key_id = key_id
+        self.api_key = api_key
+        self.tokens = capacity
+        self.updated_at = now
+        self.cooldown_until = 0.0
+        self.consecutive_throttles = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+
+
+class ApiKeyPool:
+    """
+    Reparte las llamadas a Gemini entre varias claves API (o proyectos).
+
+    Cada clave tiene un cubo de fichas que se rellena a `requests_per_minute` y admite
+    ráfagas de hasta `burst` llamadas. Cada llamada va a la clave con más fichas
+    disponibles (a igualdad, la que tenga menos llamadas en curso). Una clave que
+    responde con un error de cuota (429) se vacía y se aparta durante un tiempo que se
+    dobla con cada error seguido, hasta `cooldown_max`.
+
+    Si ninguna clave tiene cupo, `acquire` espera hasta `max_wait` segundos (sin pasar
+    del plazo de la petición, ver `app.services.deadlines`) a que lo haya y, si no,
+    lanza `KeyPoolExhaustedError`. Es contrapresión local, no un fallo de Gemini: la
+    capa de resiliencia no lo reintenta ni lo cuenta en el disyuntor, y la API responde
+    503 con el `retry_after` del error.
+
+    Es seguro usarlo desde los hilos del pool de `OCREngine`.
+    """
+
+    def __init__(
+        self,
+        api_keys: Sequence[str],
+        requests_per_minute: float = 15.0,
+        burst: int = 4,
+        cooldown_base: float = 10.0,
+        cooldown_max: float = 120.0,
+        max_wait: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Args:
+            api_keys: Claves del pool (las repetidas o vacías se ignoran).
+            requests_per_minute: Llamadas por minuto permitidas a cada clave.
+            burst: Llamadas seguidas que admite una clave con el cubo lleno.
+            cooldown_base: Segundos que se aparta una clave tras su primer error de cuota.
+            cooldown_max: Tiempo máximo que se aparta una clave.
+            max_wait: Segundos que `acquire` espera a que alguna clave tenga cupo.
+            clock, sleep: Reloj y espera (sustituibles en los tests).
+
+        Raises:
+            ValueError: Si no hay ninguna clave.
+        """
+        unique_keys = list(dict.fromkeys(key.strip() for key in api_keys if key and key.strip()))
+        if not unique_keys:
+            raise ValueError("El pool de claves de Gemini necesita al menos una clave")
+        self.rate = max(requests_per_minute, 0.001) / 60.0
+        self.capacity = float(max(1, burst))
+        self.cooldown_base = cooldown_base
+        self.cooldown_max = cooldown_max
+        self.max_wait = max_wait
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        now = clock()
+        # Los identificadores no revelan la clave: solo su posición y sus últimos caracteres.
+        self._keys: List[_KeyState] = [
+            _KeyState(f"key-{index}...{api_key[-4:]}", api_key, self.capacity, now)
+            for index, api_key in enumerate(unique_keys, start=1)
+        ]
+        self._waits = 0
+        self._exhausted = 0
+
+    @classmethod
+    def fromSettings(cls, settings: Settings) -> Optional["ApiKeyPool"]:
+        """Pool de `gemini_api_keys` (separadas por comas), o None si no hay ninguna."""
+        keys = [key for key in (settings.gemini_api_keys or "").split(",") if key.strip()]
+        if not keys:
+            return None
+        return cls(
+            keys,
+            requests_per_minute=settings.gemini_key_requests_per_minute,
+            burst=settings.gemini_key_burst,
+            cooldown_base=settings.gemini_key_cooldown_seconds,
+            cooldown_max=settings.gemini_key_cooldown_max_seconds,
+            max_wait=settings.gemini_key_max_wait_seconds,
+        )
+
+    @property
+    def api_keys(self) -> Dict[str, str]:
+        """Clave de cada identificador, para crear un cliente por clave."""
+        return {state.key_id: state.api_key for state in self._keys}
+
+    def _refill(self, state: _KeyState, now: float) -> None:
+        state.tokens = min(self.capacity, state.tokens + (now - state.updated_at) * self.rate)
+        state.updated_at = now
+
+    def _waitTime(self, state: _KeyState, now: float) -> float:
+        """Segundos hasta que la clave pueda atender una llamada."""
+        cooldown = max(0.0, state.cooldown_until - now)
+        missing = max(0.0, 1.0 - state.tokens)
+        return max(cooldown, missing / self.rate)
+
+    def acquire(self) -> KeyLease:
+        """
+        Reserva una ficha de la clave con más margen.
+
+        Raises:
+            KeyPoolExhaustedError: Si ninguna clave tiene cupo en `max_wait` segundos (o en
+                lo que quede del plazo de la petición, si es menos).
+        """
+        max_wait = self.max_wait
+        remaining = remainingTime()
+        if remaining is not None:
+            # Esperar más de lo que queda del plazo solo retrasaría el 504.
+            max_wait = min(max_wait, max(0.0, remaining))
+        deadline = self._clock() + max_wait
+        waited = False
+        while True:
+            with self._lock:
+                now = self._clock()
+                for state in self._keys:
+                    self._refill(state, now)
+                ready = [s for s in self._keys if s.cooldown_until <= now and s.tokens >= 1.0]
+                if ready:
+                    state = max(ready, key=lambda s: (s.tokens, -s.in_flight, -s.calls))
+                    state.tokens -= 1.0
+                    state.in_flight += 1
+                    state.calls += 1
+                    if waited:
+                        self._waits += 1
+                    return KeyLease(state.key_id, state.api_key)
+                wait = min(self._waitTime(state, now) for state in self._keys)
+                if now + wait > deadline:
+                    self._exhausted += 1
+                    raise KeyPoolExhaustedError(
+                        f"Todas las claves de Gemini han agotado su cupo; reintenta en {wait:.1f} s",
+                        retry_after=wait,
+                    )
+            waited = True
+            self._sleep(wait)
+
+    def release(self, lease: KeyLease, error: Optional[BaseException] = None) -> None:
+        """Devuelve la clave al pool; un error de cuota la aparta durante un tiempo."""
+        with self._lock:
+            state = next(s for s in self._keys if s.key_id == lease.key_id)
+            state.in_flight -= 1
+            if error is None:
+                state.consecutive_throttles = 0
+                return
+            state.errors += 1
+            if isQuotaError(error):
+                state.throttled += 1
+                state.consecutive_throttles += 1
+                cooldown = min(self.cooldown_max, self.cooldown_base * 2 ** (state.consecutive_throttles - 1))
+                now = self._clock()
+                state.cooldown_until = now + cooldown
+                state.tokens = 0.0
+                state.updated_at = now
+
+    def getStats(self) -> Dict[str, Any]:
+        """Uso de cada clave (fichas consumidas del cubo), llamadas, errores de cuota y esperas."""
+        with self._lock:
+            now = self._clock()
+            keys = {}
+            for state in self._keys:
+                self._refill(state, now)
+                keys[state.key_id] = {
+                    "calls": state.calls,
+                    "in_flight": state.in_flight,
+                    "errors": state.errors,
+                    "throttled": state.throttled,
+                    "utilisation": round(1 - state.tokens / self.capacity, 4),
+                    "cooling_down_seconds": round(max(0.0, state.cooldown_until - now), 2),
+                }
+            return {
+                "keys": keys,
+                "requests_per_minute_per_key": round(self.rate * 60, 2),
+                "waits": self._waits,
+                "exhausted": self._exhausted,
+            }
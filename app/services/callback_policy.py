@@ -0,0 +1,165 @@
+import functools
+import http.client
+import ipaddress
+import json
+import socket
+import urllib.request
+from typing import Any, Callable, Dict, List, Sequence
+from urllib.parse import urlparse
+
+from app.core.config import Settings
+
+
+class CallbackPolicy:
+    """
+    Qué `callback_url` se aceptan y cómo se les envía el resultado de un trabajo.
+
+    La URL la pone el cliente, pero el POST sale del servidor: sin límites, cualquiera
+    podría usarlo para llegar a servicios internos (SSRF), como la API de metadatos de la
+    nube en 169.254.169.254.
+
+    - Solo URLs http(s) y, si hay `allowed_hosts`, solo a esos hosts (`*.dominio` admite
+      también sus subdominios).
+    - El host se resuelve y se rechaza si alguna de sus direcciones no es pública
+      (privada, loopback, link-local, reservada, multicast...).
+    - Al enviar se vuelve a comprobar todo y la conexión se abre con la dirección ya
+      comprobada: un DNS que cambia de respuesta entre la subida y el envío no sirve.
+    - No se siguen redirecciones ni se usan los proxies del entorno: una respuesta 3xx
+      es un envío fallido.
+    """
+
+    def __init__(
+        self,
+        allowed_hosts: Sequence[str] = (),
+        resolve: Callable[..., List[tuple]] = socket.getaddrinfo,
+    ):
+        """
+        Args:
+            allowed_hosts: Hosts a los que se pueden enviar callbacks; vacío = cualquiera
+                con direcciones públicas.
+            resolve: Resolución de nombres, con la firma de `socket.getaddrinfo`
+                (sustituible en los tests).
+        """
+        self.allowed_hosts = [host.strip().lower().rstrip(".") for host in allowed_hosts if host and host.strip()]
+        self._resolve = resolve
+        self._opener = urllib.request.OpenerDirector()
+        for handler in (
+            _CheckedHTTPHandler(self),
+            _CheckedHTTPSHandler(self),
+            urllib.request.HTTPDefaultErrorHandler(),
+            urllib.request.HTTPErrorProcessor(),
+        ):
+            self._opener.add_handler(handler)
+
+    @classmethod
+    def fromSettings(cls, settings: Settings) -> "CallbackPolicy":
+        return cls((settings.jobs_callback_allowed_hosts or "").split(","))
+
+    def _hostAllowed(self, host: str) -> bool:
+        if not self.allowed_hosts:
+            return True
+        for allowed in self.allowed_hosts:
+            if allowed.startswith("*."):
+                if host == allowed[2:] or host.endswith(allowed[1:]):
+                    return True
+            elif host == allowed:
+                return True
+        return False
+
+    def check(self, url: str) -> None:
+        """
+        Comprueba una `callback_url` (resuelve su host, así que bloquea).
+
+        Raises:
+            ValueError: Si la URL no es http(s), su host no está permitido o no es público.
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError("callback_url debe ser una URL http(s) absoluta.")
+        host = parsed.hostname.rstrip(".")
+        if not self._hostAllowed(host):
+            raise ValueError(f"callback_url: el host {host} no está entre los permitidos.")
+        self.publicAddress(host, parsed.port or (443 if parsed.scheme == "https" else 80))
+
+    def publicAddress(self, host: str, port: int) -> str:
+        """
+        Resuelve `host` y devuelve la dirección con la que conectar.
+
+        Raises:
+            ValueError: Si no se puede resolver o alguna de sus direcciones no es pública.
+        """
+        try:
+            addresses = [info[4][0] for info in self._resolve(host, port, type=socket.SOCK_STREAM)]
+        except (OSError, UnicodeError) as e:
+            raise ValueError(f"callback_url: no se puede resolver el host {host}: {e}") from e
+        if not addresses:
+            raise ValueError(f"callback_url: el host {host} no tiene direcciones.")
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split("%")[0])
+            if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+                ip = ip.ipv4_mapped
+            if not ip.is_global or ip.is_multicast:
+                raise ValueError(f"callback_url: {host} apunta a una dirección no pública ({address}).")
+        return addresses[0]
+
+    def post(self, url: str, payload: Dict[str, Any], timeout: float) -> None:
+        """
+        POST de `payload` como JSON (bloqueante), con las mismas comprobaciones que `check`.
+
+        Raises:
+            ValueError: Si la URL ya no es válida (ej. el host resuelve ahora a una IP privada).
+            urllib.error.URLError: Si la respuesta no es 2xx (también las redirecciones).
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError("callback_url debe ser una URL http(s) absoluta.")
+        if not self._hostAllowed(parsed.hostname.rstrip(".")):
+            raise ValueError(f"callback_url: el host {parsed.hostname} no está entre los permitidos.")
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with self._opener.open(request, timeout=timeout):
+            pass
+
+
+class _CheckedConnectionMixin:
+    """Conexión que comprueba la dirección del host justo al conectar y usa esa misma."""
+
+    def __init__(self, *args: Any, policy: CallbackPolicy, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._policy = policy
+        self._create_connection = self._connectChecked
+
+    def _connectChecked(self, address: tuple, timeout: Any = None, source_address: Any = None) -> socket.socket:
+        host, port = address
+        return socket.create_connection((self._policy.publicAddress(host, port), port), timeout, source_address)
+
+
+class _CheckedHTTPConnection(_CheckedConnectionMixin, http.client.HTTPConnection):
+    pass
+
+
+class _CheckedHTTPSConnection(_CheckedConnectionMixin, http.client.HTTPSConnection):
+    # El certificado y el SNI se validan con el nombre del host, no con la dirección.
+    pass
+
+
+class _CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, policy: CallbackPolicy):
+        super().__init__()
+        self.policy = policy
+
+    def http_open(self, req: urllib.request.Request) -> http.client.HTTPResponse:
+        return self.do_open(functools.partial(_CheckedHTTPConnection, policy=self.policy), req)
+
+
+class _CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, policy: CallbackPolicy):
+        super().__init__()
+        self.policy = policy
+
+    def https_open(self, req: urllib.request.Request) -> http.client.HTTPResponse:
+        return self.do_open(functools.partial(_CheckedHTTPSConnection, policy=self.policy), req, context=self._context)
@@ -0,0 +1,129 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from app.core.config import Settings
+
+
+class DeadlineExceededError(RuntimeError):
+    """Se ha agotado el plazo de la petición: no tiene sentido seguir (ni reintentar)."""
+
+
+# Instante (time.monotonic) en que vence la petición en curso; None = sin plazo.
+# `OCREngine` copia el contexto a sus hilos, así que llega hasta la llamada al modelo.
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def deadlineScope(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Fija el plazo de lo que se ejecute dentro del bloque (y de las tareas que se creen
+    en él). Un plazo anterior más corto se mantiene.
+    """
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            # Un generador asíncrono abandonado se cierra desde otro contexto; el suyo
+            # ya no lo usa nadie, así que no hay nada que restaurar.
+            pass
+
+
+def remainingTime() -> Optional[float]:
+    """Segundos que quedan del plazo actual (pueden ser negativos), o None si no hay plazo."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def boundedTimeout(timeout: Optional[float]) -> Optional[float]:
+    """
+    El menor entre `timeout` y lo que queda del plazo actual.
+
+    Raises:
+        DeadlineExceededError: Si el plazo ya ha vencido.
+    """
+    remaining = remainingTime()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceededError("El plazo de la petición ha vencido")
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+class DeadlinePolicy:
+    """
+    Plazo de cada petición de OCR y métricas de las que no llegan a terminar.
+
+    El plazo es `default_seconds` o el que pida el cliente en la cabecera `header`
+    (en segundos), sin pasar de `max_seconds`.
+    """
+
+    def __init__(
+        self,
+        default_seconds: Optional[float] = 60.0,
+        max_seconds: Optional[float] = 120.0,
+        header: str = "X-Request-Timeout",
+    ):
+        """
+        Args:
+            default_seconds: Plazo sin cabecera; None o 0 = sin plazo.
+            max_seconds: Plazo máximo que puede pedir un cliente; None o 0 = sin máximo.
+            header: Cabecera con el plazo pedido por el cliente.
+        """
+        self.default_seconds = default_seconds or None
+        self.max_seconds = max_seconds or None
+        self.header = header
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0, "client_deadlines": 0, "completed": 0,
+            "deadline_exceeded": 0, "cancelled_disconnect": 0,
+        }
+
+    @classmethod
+    def fromSettings(cls, settings: Settings) -> "DeadlinePolicy":
+        return cls(
+            default_seconds=settings.request_deadline_seconds,
+            max_seconds=settings.request_deadline_max_seconds,
+            header=settings.request_deadline_header,
+        )
+
+    def timeoutFor(self, header_value: Optional[str]) -> Optional[float]:
+        """
+        Plazo (segundos) de una petición a partir del valor de la cabecera.
+
+        Raises:
+            ValueError: Si la cabecera no es un número de segundos positivo.
+        """
+        self.record("requests")
+        if header_value is None or header_value.strip() == "":
+            return self.default_seconds
+        try:
+            seconds = float(header_value)
+        except ValueError:
+            seconds = float("nan")
+        if not seconds > 0 or seconds == float("inf"):
+            raise ValueError(f"La cabecera {self.header} debe ser un número de segundos positivo")
+        self.record("client_deadlines")
+        return min(seconds, self.max_seconds) if self.max_seconds else seconds
+
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def getStats(self) -> Dict[str, Any]:
+        """Peticiones terminadas, canceladas por desconexión del cliente y fuera de plazo."""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["default_seconds"] = self.default_seconds
+        stats["max_seconds"] = self.max_seconds
+        return stats
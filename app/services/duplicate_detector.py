@@ -0,0 +1,221 @@
+import io
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, NamedTuple
+
+from PIL import Image, ImageOps
+
+
+def computeDHash(image: Image.Image, hash_size: int = 16) -> int:
+    """
+    Calcula el "difference hash" (dHash) perceptual de una imagen.
+
+    La imagen se reduce a escala de grises de (hash_size + 1) x hash_size píxeles y cada
+    bit indica si un píxel es más claro que su vecino de la derecha. Dos fotos de la
+    misma escena (re-encodadas, reescaladas, con otro brillo) dan hashes muy parecidos.
+
+    Args:
+        image: Imagen PIL ya decodificada.
+        hash_size: Lado del hash; el resultado tiene hash_size * hash_size bits.
+
+    Returns:
+        int: Hash como entero sin signo.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    row_width = hash_size + 1
+    value = 0
+    for row in range(hash_size):
+        offset = row * row_width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def computeDHashFromBytes(image_bytes: bytes, hash_size: int = 16) -> int:
+    """
+    Decodifica la imagen y calcula su dHash.
+
+    Aplica la orientación EXIF (una foto girada por el móvil debe dar el mismo hash) y
+    usa el modo draft de Pillow para que los JPEG grandes se decodifiquen ya reducidos.
+
+    Raises:
+        ValueError: Si los bytes no son una imagen válida.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        image = ImageOps.exif_transpose(image)
+        return computeDHash(image, hash_size)
+    except Exception as e:
+        raise ValueError(f"Los bytes de la imagen no son válidos: {e}") from e
+
+
+def hammingDistance(hash_a: int, hash_b: int) -> int:
+    """Número de bits distintos entre dos hashes."""
+    return (hash_a ^ hash_b).bit_count()
+
+
+class MultiIndexHashIndex:
+    """
+    Índice de hashes binarios para búsquedas por distancia de Hamming (multi-index hashing).
+
+    Cada hash se divide en `max_distance + 1` trozos y se indexa en una tabla por trozo.
+    Por el principio del palomar, dos hashes a distancia <= max_distance coinciden
+    exactamente en al menos un trozo, así que una consulta solo compara contra los
+    candidatos que comparten algún trozo en lugar de contra todo el índice.
+    A diferencia de un BK-tree, permite borrar entradas, lo que hace posible acotar
+    el índice a los N hashes más recientes.
+    """
+
+    def __init__(self, hash_bits: int, max_distance: int, max_entries: int = 100000):
+        """
+        Args:
+            hash_bits: Número de bits de los hashes indexados.
+            max_distance: Distancia de Hamming máxima que se quiere poder buscar.
+            max_entries: Número máximo de hashes; al superarlo se expulsan los más antiguos.
+        """
+        self.hash_bits = hash_bits
+        self.max_distance = max(0, max_distance)
+        self.max_entries = max(1, max_entries)
+        chunk_count = min(self.max_distance + 1, hash_bits)
+        base_width, remainder = divmod(hash_bits, chunk_count)
+        self._chunks: List[Tuple[int, int]] = []  # (desplazamiento, máscara) de cada trozo
+        shift = 0
+        for index in range(chunk_count):
+            width = base_width + (1 if index < remainder else 0)
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables: List[Dict[int, set]] = [{} for _ in self._chunks]
+        self._entries: "OrderedDict[int, Tuple[int, Any]]" = OrderedDict()
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, hash_value: int, value: Any) -> None:
+        """Indexa un hash junto con un valor asociado."""
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (hash_value, value)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((hash_value >> shift) & mask, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int) -> None:
+        hash_value, _ = self._entries.pop(entry_id)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            chunk = (hash_value >> shift) & mask
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[chunk]
+
+    def findNearest(self, hash_value: int, max_distance: Optional[int] = None) -> Optional[Tuple[int, Any]]:
+        """
+        Busca el hash indexado más cercano dentro de la distancia dada.
+
+        Returns:
+            Optional[Tuple[int, Any]]: (distancia, valor) del mejor candidato, o None.
+            Ante empates gana la entrada más reciente.
+        """
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        candidates = set()
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            bucket = table.get((hash_value >> shift) & mask)
+            if bucket:
+                candidates.update(bucket)
+        best: Optional[Tuple[int, int, Any]] = None
+        for entry_id in candidates:
+            indexed_hash, value = self._entries[entry_id]
+            distance = hammingDistance(hash_value, indexed_hash)
+            if distance <= limit and (best is None or (distance, -entry_id) < (best[0], -best[1])):
+                best = (distance, entry_id, value)
+        return (best[0], best[2]) if best is not None else None
+
+
+class DuplicateMatch(NamedTuple):
+    """Ticket anterior casi idéntico a la imagen consultada."""
+    distance: int
+    cache_key: str
+    receipt_id: Optional[str]
+
+
+class DuplicateDetector:
+    """
+    Detecta subidas casi duplicadas (misma foto re-encodada o repetida) por hash perceptual.
+
+    Modos:
+    - "flag": la imagen se procesa normalmente, pero se indica el ticket anterior parecido.
+    - "reuse": se reutiliza el resultado del ticket anterior (si sigue en la caché de OCR)
+      en lugar de volver a llamar al modelo.
+    """
+
+    MODES = ("flag", "reuse")
+
+    def __init__(self, max_distance: int = 10, hash_size: int = 16,
+                 max_entries: int = 100000, mode: str = "flag"):
+        """
+        Args:
+            max_distance: Distancia de Hamming máxima para considerar dos imágenes duplicadas.
+            hash_size: Lado del dHash (hash_size^2 bits).
+            max_entries: Número de tickets recientes que se recuerdan.
+            mode: "flag" o "reuse".
+
+        Raises:
+            ValueError: Si el modo no es válido.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Modo de detección de duplicados no válido: {mode}. Opciones: {self.MODES}")
+        self.mode = mode
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self._index = MultiIndexHashIndex(hash_size * hash_size, max_distance, max_entries)
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "matches": 0, "reused": 0, "hash_failures": 0}
+
+    def computeHash(self, image_bytes: bytes) -> Optional[int]:
+        """Calcula el hash perceptual; devuelve None si la imagen no se puede decodificar."""
+        try:
+            return computeDHashFromBytes(image_bytes, self.hash_size)
+        except ValueError:
+            with self._lock:
+                self._stats["hash_failures"] += 1
+            return None
+
+    def findMatch(self, hash_value: int) -> Optional[DuplicateMatch]:
+        """Busca un ticket reciente casi idéntico."""
+        with self._lock:
+            self._stats["lookups"] += 1
+            found = self._index.findNearest(hash_value, self.max_distance)
+            if found is None:
+                return None
+            self._stats["matches"] += 1
+        distance, (cache_key, receipt_id) = found
+        return DuplicateMatch(distance, cache_key, receipt_id)
+
+    def recordReuse(self) -> None:
+        """Registra que se evitó una llamada al modelo reutilizando un duplicado."""
+        with self._lock:
+            self._stats["reused"] += 1
+
+    def add(self, hash_value: int, cache_key: str, receipt_id: Optional[str] = None) -> None:
+        """Recuerda el hash de un ticket procesado."""
+        with self._lock:
+            self._index.add(hash_value, (cache_key, receipt_id))
+
+    def clear(self) -> None:
+        """Olvida todos los hashes indexados."""
+        with self._lock:
+            self._index = MultiIndexHashIndex(self.hash_size * self.hash_size, self.max_distance,
+                                              self._index.max_entries)
+
+    def getStats(self) -> Dict[str, Any]:
+        """Devuelve los contadores del detector y el tamaño del índice."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["indexed"] = len(self._index)
+            stats["mode"] = self.mode
+        return stats
@@ -0,0 +1,262 @@
+import io
+import math
+import threading
+from typing import Optional, Dict, Any, NamedTuple
+
+from PIL import Image, ImageOps, ImageStat
+
+from app.core.config import Settings
+from app.services.receipt_cropper import ReceiptCropper
+
+
+class ImageTooLargeError(ValueError):
+    """La imagen tiene más píxeles de los que se pueden decodificar (posible bomba de descompresión)."""
+
+
+def openImage(image_bytes: bytes, max_pixels: int = 0, max_side: int = 0) -> Image.Image:
+    """
+    Abre la imagen (solo lee la cabecera) acotando los píxeles que se van a decodificar.
+
+    En JPEG, el modo draft decodifica directamente a 1/2, 1/4 u 1/8 de resolución: se
+    usa para no pasar mucho de `max_side` y para que una foto con más de `max_pixels`
+    píxeles se decodifique ya reducida. Los demás formatos no se pueden reducir al
+    decodificar, así que si superan `max_pixels` se rechazan sin decodificarlos.
+
+    Args:
+        image_bytes: Bytes de la imagen.
+        max_pixels: Píxeles máximos de la imagen decodificada. 0 = sin límite (solo el de Pillow).
+        max_side: Lado más largo que se necesita. 0 = resolución completa.
+
+    Raises:
+        ImageTooLargeError: Si la imagen supera `max_pixels` incluso reducida, o el límite
+            de bombas de descompresión de Pillow.
+        Exception: Los errores de Pillow si los bytes no son una imagen válida.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(f"La imagen tiene demasiados píxeles: {e}") from e
+    width, height = image.size
+    box = (max_side, max_side) if max_side > 0 else None
+    if max_pixels > 0 and width * height > max_pixels:
+        # Menor reducción (potencia de 2, como las del decodificador JPEG) que cabe en el límite.
+        factor = 2 ** math.ceil(math.log2(math.sqrt(width * height / max_pixels)))
+        reduced = (width // factor, height // factor)
+        box = reduced if box is None else (min(box[0], reduced[0]), min(box[1], reduced[1]))
+    if box is not None:
+        image.draft("RGB", box)
+    if max_pixels > 0 and image.width * image.height > max_pixels:
+        raise ImageTooLargeError(
+            f"La imagen tiene demasiados píxeles ({width}x{height}); el máximo es {max_pixels}."
+        )
+    return image
+
+
+class PreparedImage(NamedTuple):
+    """
+    Imagen lista para enviarse al modelo.
+
+    Attributes:
+        data: Bytes codificados que se envían.
+        mime_type: Tipo MIME de `data` (ej. "image/jpeg").
+        width: Ancho final en píxeles.
+        height: Alto final en píxeles.
+        grayscale: Si se convirtió a escala de grises.
+        original_size_bytes: Tamaño de la imagen tal como se subió.
+        encoded_size_bytes: Tamaño de `data`.
+        cropped: Si se recortó el ticket del resto de la foto.
+    """
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    grayscale: bool
+    original_size_bytes: int
+    encoded_size_bytes: int
+    cropped: bool = False
+
+    def asBlob(self) -> Dict[str, Any]:
+        """Devuelve la imagen en el formato de blob que acepta `generate_content`."""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+
+class ImagePreprocessor:
+    """
+    Prepara las fotos de tickets antes de enviarlas al modelo.
+
+    Una foto de móvil de 12MP enviada tal cual multiplica los bytes subidos, la
+    latencia y el coste en tokens sin mejorar la lectura del texto. Este paso:
+    - aplica la orientación EXIF y descarta los metadatos,
+    - recorta y endereza el ticket si se detecta con confianza (ver `ReceiptCropper`),
+    - limita el lado más largo de la imagen,
+    - convierte a escala de grises cuando la imagen apenas tiene color,
+    - vuelve a codificar en JPEG/WebP con la calidad configurada.
+    """
+
+    FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+    def __init__(
+        self,
+        max_side: int = 2048,
+        output_format: str = "JPEG",
+        quality: int = 85,
+        grayscale: bool = True,
+        grayscale_max_saturation: float = 0.12,
+        cropper: Optional[ReceiptCropper] = None,
+        max_pixels: int = 0,
+    ):
+        """
+        Args:
+            max_side: Longitud máxima (píxeles) del lado más largo. 0 = sin límite.
+            output_format: "JPEG" o "WEBP".
+            quality: Calidad de compresión (1-100).
+            grayscale: Permite convertir a escala de grises las imágenes sin color relevante.
+            grayscale_max_saturation: Saturación media (0-1) por debajo de la cual se
+                considera seguro descartar el color.
+            cropper: Detector del ticket dentro de la foto. None = no recortar.
+            max_pixels: Píxeles máximos que se decodifican (ver `openImage`). 0 = sin límite.
+
+        Raises:
+            ValueError: Si el formato de salida no está soportado.
+        """
+        output_format = output_format.upper()
+        if output_format not in self.FORMATS:
+            raise ValueError(f"Formato de salida no soportado: {output_format}. Opciones: {list(self.FORMATS)}")
+        self.max_side = max_side
+        self.output_format = output_format
+        self.quality = quality
+        self.grayscale = grayscale
+        self.grayscale_max_saturation = grayscale_max_saturation
+        self.cropper = cropper
+        self.max_pixels = max_pixels
+        self._lock = threading.Lock()
+        self._stats = {
+            "images": 0, "original_bytes": 0, "encoded_bytes": 0, "grayscale_images": 0, "cropped_images": 0,
+        }
+
+    def getOptions(self) -> Dict[str, Any]:
+        """Argumentos con los que crear un preprocesador igual (ej. en otro proceso)."""
+        return {
+            "max_side": self.max_side,
+            "output_format": self.output_format,
+            "quality": self.quality,
+            "grayscale": self.grayscale,
+            "grayscale_max_saturation": self.grayscale_max_saturation,
+            "cropper": self.cropper,
+            "max_pixels": self.max_pixels,
+        }
+
+    @classmethod
+    def fromSettings(cls, settings: Settings) -> "ImagePreprocessor":
+        """Construye el preprocesador a partir de la configuración."""
+        return cls(
+            max_side=settings.image_max_side,
+            output_format=settings.image_output_format,
+            quality=settings.image_quality,
+            grayscale=settings.image_grayscale,
+            grayscale_max_saturation=settings.image_grayscale_max_saturation,
+            cropper=ReceiptCropper.fromSettings(settings) if settings.image_crop_enabled else None,
+            max_pixels=settings.image_max_pixels,
+        )
+
+    def decode(self, image_bytes: bytes) -> Image.Image:
+        """
+        Decodifica la imagen, la endereza según su EXIF, recorta el ticket (con `cropper`)
+        y la reduce a `max_side`.
+
+        Returns:
+            Image.Image: Imagen RGB sin metadatos. Si se ha recortado, `info["cropped"]` es True.
+
+        Raises:
+            ImageTooLargeError: Si la imagen tiene más de `max_pixels` píxeles y no es un
+                JPEG que se pueda decodificar reducido.
+            ValueError: Si los bytes de la imagen no son válidos.
+        """
+        try:
+            # En JPEG, el modo draft decodifica directamente a 1/2, 1/4 u 1/8 de
+            # resolución, mucho más barato que decodificar 12MP y reducir después.
+            image = openImage(image_bytes, max_pixels=self.max_pixels, max_side=self.max_side)
+            image = ImageOps.exif_transpose(image)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            detection = None
+            if self.cropper is not None:
+                # Antes de reducir: el recorte conserva toda la resolución del ticket.
+                image, detection = self.cropper.crop(image)
+            if self.max_side > 0 and max(image.size) > self.max_side:
+                image.thumbnail((self.max_side, self.max_side), Image.Resampling.LANCZOS)
+            image.info["cropped"] = detection is not None
+            return image
+        except ImageTooLargeError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Los bytes de la imagen no son válidos: {e}") from e
+
+    def isGrayscaleSafe(self, image: Image.Image) -> bool:
+        """Indica si la imagen tiene tan poco color que puede pasarse a grises sin perder información."""
+        sample = image.copy()
+        sample.thumbnail((128, 128))
+        mean_saturation = ImageStat.Stat(sample.convert("HSV")).mean[1] / 255.0
+        return mean_saturation <= self.grayscale_max_saturation
+
+    def encode(self, image: Image.Image, original_size_bytes: int = 0) -> PreparedImage:
+        """
+        Codifica una imagen ya decodificada con el formato y calidad configurados.
+
+        Args:
+            image: Imagen devuelta por `decode`.
+            original_size_bytes: Tamaño de la subida original, para las métricas.
+        """
+        cropped = bool(image.info.get("cropped"))
+        grayscale = self.grayscale and self.isGrayscaleSafe(image)
+        if grayscale:
+            image = image.convert("L")
+        buffer = io.BytesIO()
+        save_options: Dict[str, Any] = {"quality": self.quality}
+        if self.output_format == "JPEG":
+            save_options["optimize"] = True
+        else:
+            save_options["method"] = 4
+        image.save(buffer, format=self.output_format, **save_options)
+        data = buffer.getvalue()
+
+        prepared = PreparedImage(
+            data=data,
+            mime_type=self.FORMATS[self.output_format],
+            width=image.width,
+            height=image.height,
+            grayscale=grayscale,
+            original_size_bytes=original_size_bytes,
+            encoded_size_bytes=len(data),
+            cropped=cropped,
+        )
+        self.recordStats(prepared)
+        return prepared
+
+    def recordStats(self, prepared: PreparedImage) -> None:
+        """Suma una imagen preparada a las métricas (también las preparadas en otro proceso)."""
+        with self._lock:
+            self._stats["images"] += 1
+            self._stats["original_bytes"] += prepared.original_size_bytes
+            self._stats["encoded_bytes"] += prepared.encoded_size_bytes
+            self._stats["grayscale_images"] += int(prepared.grayscale)
+            self._stats["cropped_images"] += int(prepared.cropped)
+
+    def prepare(self, image_bytes: bytes) -> PreparedImage:
+        """
+        Ejecuta el preprocesamiento completo sobre los bytes subidos.
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+        """
+        return self.encode(self.decode(image_bytes), original_size_bytes=len(image_bytes))
+
+    def getStats(self) -> Dict[str, Any]:
+        """Devuelve los bytes acumulados antes y después del preprocesamiento."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["reduction_ratio"] = (
+            round(1 - stats["encoded_bytes"] / stats["original_bytes"], 4) if stats["original_bytes"] else 0.0
+        )
+        return stats
+
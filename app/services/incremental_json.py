@@ -0,0 +1,103 @@
+import json
+from typing import Any, Dict, List, Optional
+
+
+class IncrementalItemsParser:
+    """
+    Extrae los elementos de `items` de un JSON de ticket a medida que llega por trozos.
+
+    Recorre cada carácter una sola vez, llevando la cuenta del anidamiento y de si está
+    dentro de una cadena, y en cuanto se cierra un objeto del array `items` del objeto
+    raíz lo decodifica y lo devuelve. El resto del documento (totales, `is_ticket`...) no
+    se interpreta aquí: cuando el stream termina, el texto completo (`text`) se parsea
+    de la forma habitual con `ParserService`.
+
+    Ignora lo que haya antes de la primera llave (ej. el marcador ```json).
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._buffer = ""      # Texto del elemento de `items` en curso
+        self._depth = 0        # Anidamiento de {} y [] desde el objeto raíz
+        self._in_string = False
+        self._escaped = False
+        self._last_key: Optional[str] = None
+        self._items_depth: Optional[int] = None  # Profundidad del array `items`
+        self._capturing = False
+        self._key_chars: List[str] = []
+        self._started = False
+        self._finished = False
+
+    @property
+    def text(self) -> str:
+        """Todo el texto recibido hasta ahora."""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        Añade un trozo de texto y devuelve los elementos de `items` completados con él.
+
+        Los elementos que no son JSON válido se descartan; `ParserService` los tratará
+        igual al parsear el texto completo.
+        """
+        self._chunks.append(chunk)
+        completed: List[Dict[str, Any]] = []
+        for char in chunk:
+            if self._finished:
+                break
+            if not self._started:
+                if char != "{":
+                    continue
+                self._started = True
+
+            if self._capturing:
+                self._buffer += char
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        # Posible clave del objeto raíz; solo cuenta si le sigue un `[`.
+                        self._last_key = "".join(self._key_chars)
+                elif self._depth == 1:
+                    self._key_chars.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._key_chars = []
+            elif char in "{[":
+                self._depth += 1
+                if char == "[" and self._depth == 2 and self._last_key == "items":
+                    self._items_depth = self._depth
+                elif char == "{" and self._items_depth is not None and self._depth == self._items_depth + 1:
+                    self._capturing = True
+                    self._buffer = char
+            elif char in "}]":
+                if (char == "}" and self._capturing and self._items_depth is not None
+                        and self._depth == self._items_depth + 1):
+                    self._capturing = False
+                    item = self._decode(self._buffer)
+                    if item is not None:
+                        completed.append(item)
+                    self._buffer = ""
+                if char == "]" and self._items_depth is not None and self._depth == self._items_depth:
+                    self._items_depth = None
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finished = True
+            elif char == "," and self._depth == 1:
+                self._last_key = None
+        return completed
+
+    @staticmethod
+    def _decode(fragment: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = json.loads(fragment)
+        except json.JSONDecodeError:
+            return None
+        return value if isinstance(value, dict) else None
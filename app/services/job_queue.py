@@ -0,0 +1,468 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Set
+
+from app.core.config import Settings
+from app.services.callback_policy import CallbackPolicy
+from app.services.deadlines import deadlineScope
+
+
+logger = logging.getLogger(__name__)
+
+
+# Estados de un trabajo. `stage` detalla el progreso dentro de "processing":
+# queued -> decoded (imagen leída, sin resultado reutilizable) -> ocr -> parsed.
+QUEUED = "queued"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job(NamedTuple):
+    """Un trabajo de la cola, tal y como está guardado."""
+    job_id: str
+    status: str
+    stage: str
+    filename: Optional[str]
+    engine: Optional[str]
+    callback_url: Optional[str]
+    attempts: int
+    created_at: float
+    updated_at: float
+    error: Optional[str]
+    result: Optional[Dict[str, Any]]
+    image: Optional[bytes] = None
+
+
+_COLUMNS = (
+    "job_id, status, stage, filename, engine, callback_url, attempts, created_at, updated_at, error, result"
+)
+
+
+class JobStore:
+    """
+    Cola de trabajos OCR persistida en SQLite.
+
+    - La imagen se guarda con el trabajo, así que la cola sobrevive a reinicios.
+    - `claim` entrega cada trabajo con un plazo de posesión (lease): si el proceso que lo
+      tenía muere, el trabajo vuelve a entregarse cuando vence (al menos una vez), hasta
+      agotar sus intentos; entonces se marca como fallido.
+    - `complete` solo escribe el primer resultado: si un trabajo se procesa dos veces,
+      la segunda escritura no cambia nada (escrituras idempotentes).
+
+    Con `path` None o ":memory:" la cola vive en memoria (no sobrevive a reinicios); es
+    lo que usan los tests.
+    """
+
+    def __init__(self, path: Optional[str] = None, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        in_memory = path in (None, "", ":memory:")
+        if not in_memory:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(":memory:" if in_memory else path, check_same_thread=False)
+        if not in_memory:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT NOT NULL,"
+            " filename TEXT, engine TEXT, callback_url TEXT, image BLOB,"
+            " attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, lease_until REAL,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL, error TEXT, result TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, available_at)")
+        self._db.commit()
+
+    def _write(self, sql: str, params: tuple) -> int:
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            self._db.commit()
+            return cursor.rowcount
+
+    @staticmethod
+    def _toJob(row: tuple, image: Optional[bytes] = None) -> Job:
+        *fields, result = row
+        return Job(*fields, json.loads(result) if result is not None else None, image)
+
+    def enqueue(
+        self,
+        image_bytes: bytes,
+        filename: Optional[str] = None,
+        engine: Optional[str] = None,
+        callback_url: Optional[str] = None,
+    ) -> str:
+        """Guarda un trabajo nuevo y devuelve su ID."""
+        job_id = str(uuid.uuid4())
+        now = self._clock()
+        self._write(
+            "INSERT INTO jobs (job_id, status, stage, filename, engine, callback_url, image,"
+            " available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, QUEUED, filename, engine, callback_url, image_bytes, now, now, now),
+        )
+        return job_id
+
+    def _failExhausted(self, now: float, max_attempts: Optional[int]) -> int:
+        """
+        Marca como fallidos los trabajos cuyo último intento permitido venció sin terminar
+        (el proceso murió con él o lo tumba cada vez): no se vuelven a entregar.
+        Se llama con el lock tomado; el commit lo hace quien llama.
+        """
+        if max_attempts is None:
+            return 0
+        return self._db.execute(
+            "UPDATE jobs SET status = ?, error = ?, image = NULL, lease_until = NULL, updated_at = ?"
+            " WHERE status = ? AND lease_until < ? AND attempts >= ?",
+            (FAILED, f"El intento {max_attempts} de {max_attempts} venció sin terminar", now,
+             PROCESSING, now, max_attempts),
+        ).rowcount
+
+    def claim(self, lease_seconds: float, max_attempts: Optional[int] = None) -> Optional[Job]:
+        """
+        Toma el trabajo pendiente más antiguo (o uno cuyo lease ha vencido) para procesarlo.
+
+        Es una sola sentencia, así que dos procesos que comparten el fichero no pueden
+        tomar el mismo trabajo a la vez. Antes, los trabajos con el lease vencido que ya
+        han gastado `max_attempts` intentos se marcan como fallidos en lugar de entregarse.
+
+        Returns:
+            Optional[Job]: El trabajo (con la imagen y `attempts` ya incrementado), o None.
+        """
+        now = self._clock()
+        with self._lock:
+            self._failExhausted(now, max_attempts)
+            row = self._db.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ?"
+                " WHERE job_id = (SELECT job_id FROM jobs"
+                "   WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_until < ?)"
+                "   ORDER BY created_at LIMIT 1)"
+                f" RETURNING {_COLUMNS}, image",
+                (PROCESSING, now + lease_seconds, now, QUEUED, now, PROCESSING, now),
+            ).fetchone()
+            self._db.commit()
+        if row is None:
+            return None
+        *fields, image = row
+        return self._toJob(tuple(fields), image)
+
+    def setStage(self, job_id: str, stage: str) -> None:
+        self._write(
+            "UPDATE jobs SET stage = ?, updated_at = ? WHERE job_id = ? AND status = ?",
+            (stage, self._clock(), job_id, PROCESSING),
+        )
+
+    def complete(self, job_id: str, result: Dict[str, Any]) -> bool:
+        """
+        Guarda el resultado de un trabajo. Idempotente: solo cuenta la primera escritura.
+
+        Returns:
+            bool: True si el resultado se ha guardado ahora; False si ya estaba terminado.
+        """
+        written = self._write(
+            "UPDATE jobs SET status = ?, stage = 'parsed', result = ?, error = NULL, image = NULL,"
+            " lease_until = NULL, updated_at = ? WHERE job_id = ? AND status NOT IN (?, ?)",
+            (DONE, json.dumps(result, ensure_ascii=False), self._clock(), job_id, DONE, FAILED),
+        )
+        return written == 1
+
+    def retry(self, job_id: str, error: str, delay: float) -> None:
+        """Devuelve a la cola un trabajo que ha fallado, para volver a intentarlo dentro de `delay` s."""
+        now = self._clock()
+        self._write(
+            "UPDATE jobs SET status = ?, stage = ?, error = ?, lease_until = NULL, available_at = ?,"
+            " updated_at = ? WHERE job_id = ? AND status = ?",
+            (QUEUED, QUEUED, error, now + delay, now, job_id, PROCESSING),
+        )
+
+    def fail(self, job_id: str, error: str) -> bool:
+        """Marca un trabajo como fallido definitivamente (si no había terminado ya)."""
+        written = self._write(
+            "UPDATE jobs SET status = ?, error = ?, image = NULL, lease_until = NULL, updated_at = ?"
+            " WHERE job_id = ? AND status NOT IN (?, ?)",
+            (FAILED, error, self._clock(), job_id, DONE, FAILED),
+        )
+        return written == 1
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Estado de un trabajo (sin la imagen), o None si no existe."""
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._toJob(row) if row is not None else None
+
+    def recover(self, max_attempts: Optional[int] = None) -> int:
+        """
+        Devuelve a la cola los trabajos en proceso cuyo lease ha vencido (al arrancar, los
+        de un proceso anterior que se paró a medias). Los que tienen el lease en vigor
+        siguen siendo de quien los tiene (otro proceso que comparte el fichero), y los que
+        ya han gastado `max_attempts` intentos se marcan como fallidos. Devuelve cuántos
+        se han devuelto a la cola.
+        """
+        now = self._clock()
+        with self._lock:
+            self._failExhausted(now, max_attempts)
+            requeued = self._db.execute(
+                "UPDATE jobs SET status = ?, stage = ?, lease_until = NULL, updated_at = ?"
+                " WHERE status = ? AND lease_until < ?",
+                (QUEUED, QUEUED, now, PROCESSING, now),
+            ).rowcount
+            self._db.commit()
+        return requeued
+
+    def purge(self, older_than_seconds: float) -> int:
+        """Borra los trabajos terminados hace más de `older_than_seconds`. Devuelve cuántos."""
+        return self._write(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (DONE, FAILED, self._clock() - older_than_seconds),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        """Número de trabajos por estado."""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {QUEUED: 0, PROCESSING: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class JobWorkerPool:
+    """
+    Trabajadores asíncronos que procesan la cola de `JobStore`.
+
+    Cada trabajador toma un trabajo, llama a `handler(job, report)` (que hace el OCR y
+    el parsing y devuelve el resultado como JSON) y guarda el resultado. `report(stage)`
+    anota el progreso y despierta a quien espera en `waitForUpdate` (los eventos SSE).
+
+    - Los errores se reintentan hasta `max_attempts` veces, con backoff exponencial
+      (o el `retry_after` del error, si lo trae); los `ValueError` (imagen inválida) no.
+    - Cada intento tiene como plazo `lease_seconds`: se abandona antes de que el trabajo
+      pueda entregarse a otro trabajador.
+    - Al terminar, si el trabajo tiene `callback_url`, se le envía su estado por POST
+      con las comprobaciones de `callback_policy` (ver `CallbackPolicy`).
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: Callable[[Job, Callable[[str], None]], Awaitable[Dict[str, Any]]],
+        workers: int = 2,
+        max_attempts: int = 3,
+        lease_seconds: float = 300.0,
+        retry_base_seconds: float = 2.0,
+        retention_seconds: float = 86400.0,
+        poll_interval: float = 1.0,
+        callback_timeout: float = 10.0,
+        callback_attempts: int = 3,
+        describe: Optional[Callable[[Job], Dict[str, Any]]] = None,
+        callback_policy: Optional[CallbackPolicy] = None,
+        sendCallback: Optional[Callable[[str, Dict[str, Any], float], None]] = None,
+    ):
+        """
+        Args:
+            store: Cola persistida.
+            handler: Procesa un trabajo y devuelve su resultado (serializable a JSON).
+            workers: Trabajos que se procesan a la vez.
+            max_attempts: Intentos por trabajo antes de marcarlo como fallido.
+            lease_seconds: Plazo de cada intento; pasado este tiempo el trabajo puede
+                entregarse de nuevo.
+            retry_base_seconds: Espera antes del primer reintento (se dobla en cada uno).
+            retention_seconds: Tiempo que se guardan los trabajos terminados; 0 = siempre.
+            poll_interval: Cada cuánto se mira la cola si nadie avisa de trabajo nuevo.
+            callback_timeout: Tiempo máximo de cada POST a `callback_url`.
+            callback_attempts: Intentos de entrega del callback.
+            describe: Convierte un trabajo en el JSON que se envía al callback.
+            callback_policy: Qué `callback_url` se aceptan; por defecto, cualquier host
+                con direcciones públicas.
+            sendCallback: Función que hace el POST; por defecto, `callback_policy.post`
+                (sustituible en los tests).
+        """
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.lease_seconds = lease_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self.callback_timeout = callback_timeout
+        self.callback_attempts = max(1, callback_attempts)
+        self.describe = describe or (lambda job: job._asdict())
+        self.callback_policy = callback_policy or CallbackPolicy()
+        self._sendCallback = sendCallback or self.callback_policy.post
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._callbacks: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._listeners: Dict[str, asyncio.Event] = {}
+        self._recovered = False
+        self._stats = {
+            "submitted": 0, "completed": 0, "duplicate_results": 0, "retried": 0, "failed": 0,
+            "recovered": 0, "callbacks_sent": 0, "callbacks_failed": 0, "worker_errors": 0,
+        }
+
+    @classmethod
+    def fromSettings(
+        cls, settings: Settings, handler: Callable[[Job, Callable[[str], None]], Awaitable[Dict[str, Any]]], **kwargs
+    ) -> Optional["JobWorkerPool"]:
+        if not settings.jobs_enabled:
+            return None
+        return cls(
+            JobStore(settings.jobs_db_path),
+            handler,
+            workers=settings.jobs_workers,
+            max_attempts=settings.jobs_max_attempts,
+            lease_seconds=settings.jobs_lease_seconds,
+            retention_seconds=settings.jobs_retention_hours * 3600,
+            callback_policy=CallbackPolicy.fromSettings(settings),
+            **kwargs,
+        )
+
+    def start(self) -> None:
+        """
+        Arranca los trabajadores en el event loop actual (si no lo estaban ya) y
+        sustituye a los que hayan terminado.
+
+        La primera vez, además, devuelve a la cola los trabajos que un proceso anterior
+        dejó a medias (los de lease vencido) y borra los terminados antiguos.
+        """
+        loop = asyncio.get_running_loop()
+        self._tasks = {task for task in self._tasks if not task.done()}
+        if self._loop is not loop:
+            if not self._recovered:
+                self._recovered = True
+                self._stats["recovered"] += self.store.recover(self.max_attempts)
+                if self.retention_seconds > 0:
+                    self.store.purge(self.retention_seconds)
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._listeners = {}
+            self._tasks = set()
+        self._tasks |= {loop.create_task(self._work()) for _ in range(self.workers - len(self._tasks))}
+
+    async def stop(self) -> None:
+        """Para los trabajadores. Los trabajos a medias se retoman en el siguiente arranque."""
+        tasks = self._tasks | self._callbacks
+        self._tasks, self._callbacks = set(), set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(
+        self,
+        image_bytes: bytes,
+        filename: Optional[str] = None,
+        engine: Optional[str] = None,
+        callback_url: Optional[str] = None,
+    ) -> str:
+        """Encola un trabajo (lo guarda antes de devolver) y devuelve su ID."""
+        job_id = await asyncio.to_thread(self.store.enqueue, image_bytes, filename, engine, callback_url)
+        self._stats["submitted"] += 1
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def waitForUpdate(self, job_id: str, timeout: float) -> None:
+        """Espera (como mucho `timeout` s) a que cambie el estado o la etapa de un trabajo."""
+        event = self._listeners.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _notify(self, job_id: str) -> None:
+        event = self._listeners.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                job = await self._claimNext()
+                if job is not None:
+                    await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Un fallo del almacén (ej. `sqlite3.OperationalError` con la base bloqueada)
+                # no debe matar al trabajador: el trabajo reclamado se retoma cuando venza
+                # su lease.
+                logger.exception("Error en un trabajador de la cola de trabajos")
+                self._stats["worker_errors"] += 1
+                await asyncio.sleep(self.poll_interval)
+
+    async def _claimNext(self) -> Optional[Job]:
+        """Reclama el siguiente trabajo; si no hay ninguno, espera un aviso o `poll_interval`."""
+        self._wakeup.clear()
+        job = await asyncio.to_thread(self.store.claim, self.lease_seconds, self.max_attempts)
+        if job is None:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def _process(self, job: Job) -> None:
+        self._notify(job.job_id)
+
+        def report(stage: str) -> None:
+            self.store.setStage(job.job_id, stage)
+            self._notify(job.job_id)
+
+        try:
+            with deadlineScope(self.lease_seconds):
+                result = await self.handler(job, report)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            finished = isinstance(e, ValueError) or job.attempts >= self.max_attempts
+            if finished:
+                await asyncio.to_thread(self.store.fail, job.job_id, str(e))
+                self._stats["failed"] += 1
+            else:
+                delay = getattr(e, "retry_after", None) or self.retry_base_seconds * 2 ** (job.attempts - 1)
+                await asyncio.to_thread(self.store.retry, job.job_id, str(e), delay)
+                self._stats["retried"] += 1
+        else:
+            written = await asyncio.to_thread(self.store.complete, job.job_id, result)
+            self._stats["completed" if written else "duplicate_results"] += 1
+            finished = True
+        self._notify(job.job_id)
+
+        if finished and job.callback_url:
+            task = asyncio.create_task(self._deliverCallback(job.job_id, job.callback_url))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+    async def _deliverCallback(self, job_id: str, url: str) -> None:
+        payload = self.describe(await self.get(job_id))
+        for attempt in range(1, self.callback_attempts + 1):
+            try:
+                await asyncio.to_thread(self._sendCallback, url, payload, self.callback_timeout)
+                self._stats["callbacks_sent"] += 1
+                return
+            except Exception:
+                if attempt < self.callback_attempts:
+                    await asyncio.sleep(self.retry_base_seconds * 2 ** (attempt - 1))
+        self._stats["callbacks_failed"] += 1
+
+    def getStats(self) -> Dict[str, Any]:
+        """Trabajos por estado, resultados, reintentos y callbacks."""
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["workers"] = self.workers
+        stats["running"] = bool(self._tasks)
+        stats["jobs"] = self.store.counts()
+        return stats
+
+    def close(self) -> None:
+        self.store.close()
@@ -0,0 +1,35 @@
+"""
+Codificación y decodificación JSON de las respuestas del modelo.
+
+Usa `orjson` (bastante más rápido que el módulo `json` de la biblioteca estándar con
+respuestas de muchos ítems) y, si no está instalado, recurre a `json`. En ambos casos
+los errores de sintaxis son `json.JSONDecodeError` (orjson lo usa como clase base).
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es una dependencia de requirements.txt
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(text: Union[str, bytes]) -> Any:
+    """
+    Decodifica un documento JSON.
+
+    Raises:
+        JSONDecodeError: Si el texto no es JSON válido.
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def dumps(value: Any) -> str:
+    """Codifica `value` como JSON (UTF-8 sin escapar, como `ensure_ascii=False`)."""
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False)
@@ -0,0 +1,194 @@
+"""
+Recuperación de respuestas JSON mal formadas del modelo.
+
+Gemini a veces devuelve un JSON casi correcto: con comas finales, con los comentarios
+`//` de la plantilla del prompt, con texto antes o después del objeto o cortado a mitad
+de la lista de ítems. En lugar de descartar la respuesta (y repetir la llamada al
+modelo), `repairJson` la corrige y conserva todo lo que esté completo.
+"""
+import re
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+from app.services import json_codec
+
+
+# Nombres de las reparaciones (aparecen en las métricas y en `OCRExtraction.repairs`).
+SURROUNDING_TEXT = "surrounding_text"
+COMMENTS = "comments"
+TRAILING_COMMAS = "trailing_commas"
+TRUNCATED = "truncated"
+
+_CLOSERS = {"{": "}", "[": "]"}
+_STRUCTURAL = re.compile(r'["{}\[\],/]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class JSONRepairError(ValueError):
+    """No se ha podido recuperar ningún objeto JSON del texto."""
+
+
+class RepairResult(NamedTuple):
+    """Documento recuperado y reparaciones aplicadas (en orden de aparición)."""
+    data: Any
+    repairs: Tuple[str, ...]
+
+
+def hasReceiptData(data: Any) -> bool:
+    """Indica si un documento recuperado tiene algo aprovechable para el parser."""
+    if not isinstance(data, dict):
+        return False
+    if data.get("is_ticket") is False:
+        return True
+    if data.get("items"):
+        return True
+    return any(data.get(field) is not None for field in ("total", "subtotal", "tax"))
+
+
+def _dropTrailingComma(out: List[str], note: Callable[[str], None]) -> None:
+    """Elimina la coma (seguida solo de espacios) al final de lo ya copiado."""
+    index = len(out) - 1
+    while index >= 0 and not out[index].strip():
+        index -= 1
+    if index < 0:
+        return
+    stripped = out[index].rstrip()
+    if stripped.endswith(","):
+        out[index] = stripped[:-1]
+        del out[index + 1:]
+        note(TRAILING_COMMAS)
+
+
+def repairJson(text: str) -> RepairResult:
+    """
+    Decodifica `text`, reparándolo si no es JSON válido.
+
+    Reparaciones (fuera de las cadenas):
+    - `surrounding_text`: se ignora lo que haya antes de la primera `{` y después de
+      la llave que la cierra (explicaciones, marcadores ```json...).
+    - `comments`: se eliminan comentarios `//` y `/* */`.
+    - `trailing_commas`: se eliminan las comas antes de `}` o `]`.
+    - `truncated`: si el texto acaba antes de cerrar el objeto, se corta en el último
+      punto en que todo lo anterior está completo y se cierran los corchetes abiertos.
+      Los objetos anidados (los ítems) son atómicos: uno a medias se descarta entero,
+      para no inventar cantidades o precios con dígitos cortados.
+
+    Raises:
+        JSONRepairError: Si no hay ningún objeto JSON recuperable.
+    """
+    try:
+        return RepairResult(json_codec.loads(text), ())
+    except json_codec.JSONDecodeError:
+        pass
+
+    repairs: List[str] = []
+    start = text.find("{")
+    if start == -1:
+        raise JSONRepairError("La respuesta no contiene ningún objeto JSON")
+    if text[:start].strip():
+        repairs.append(SURROUNDING_TEXT)
+
+    out: List[str] = []
+    stack: List[str] = []
+    nested_objects = 0           # Objetos abiertos por debajo del raíz (atómicos)
+    safe_point: Optional[Tuple[int, str]] = None  # (longitud de `out`, cierres pendientes)
+    in_string = False
+    index, length = start, len(text)
+
+    def markSafe(position: int) -> None:
+        nonlocal safe_point
+        if nested_objects == 0 and stack:
+            safe_point = (position, "".join(_CLOSERS[opener] for opener in reversed(stack)))
+
+    def note(repair: str) -> None:
+        if repair not in repairs:
+            repairs.append(repair)
+
+    while index < length:
+        if in_string:
+            # Se copia de golpe hasta la siguiente comilla o barra invertida.
+            match = _STRING_SPECIAL.search(text, index)
+            if match is None:
+                out.append(text[index:])
+                index = length
+                break
+            position = match.start()
+            out.append(text[index:position + 1])
+            index = position + 1
+            if text[position] == "\\":
+                if index < length:
+                    out.append(text[index])
+                    index += 1
+            else:
+                in_string = False
+            continue
+
+        # Fuera de las cadenas solo interesan los caracteres estructurales.
+        match = _STRUCTURAL.search(text, index)
+        if match is None:
+            out.append(text[index:])
+            index = length
+            break
+        position = match.start()
+        if position > index:
+            out.append(text[index:position])
+        index = position
+        char = text[index]
+
+        if char == "/":
+            if text.startswith("//", index):
+                end = text.find("\n", index)
+                index = length if end == -1 else end
+                note(COMMENTS)
+                continue
+            if text.startswith("/*", index):
+                end = text.find("*/", index + 2)
+                index = length if end == -1 else end + 2
+                note(COMMENTS)
+                continue
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            if char == "{" and stack:
+                nested_objects += 1
+            stack.append(char)
+        elif char in "}]":
+            if not stack:
+                break
+            _dropTrailingComma(out, note)
+            stack.pop()
+            if char == "}" and stack:
+                nested_objects -= 1
+            out.append(char)
+            index += 1
+            if not stack:
+                break  # Fin del objeto raíz
+            markSafe(len(out))
+            continue
+        elif char == ",":
+            markSafe(len(out))
+        out.append(char)
+        index += 1
+
+    if not stack:
+        if text[index:].strip():
+            note(SURROUNDING_TEXT)
+        candidates = ["".join(out)]
+    else:
+        note(TRUNCATED)
+        candidates = []
+        body = "".join(out).rstrip()
+        # Si el corte cae justo tras un valor cerrado del objeto raíz (ej. `"total": "9,10"`
+        # o `"items": [...]`), basta con cerrar; si cae en un número, podría faltarle dígitos.
+        if not in_string and nested_objects == 0 and body and body[-1] in '"]}el':
+            candidates.append(body + "".join(_CLOSERS[opener] for opener in reversed(stack)))
+        if safe_point is not None:
+            position, closers = safe_point
+            candidates.append("".join(out[:position]).rstrip().rstrip(",") + closers)
+
+    for candidate in candidates:
+        try:
+            data = json_codec.loads(candidate)
+        except json_codec.JSONDecodeError:
+            continue
+        return RepairResult(data, tuple(repairs))
+    raise JSONRepairError(f"No se ha podido reparar la respuesta ({', '.join(repairs) or 'sin cambios'})")
@@ -0,0 +1,385 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Pattern, Tuple
+
+from app.core.config import Settings
+from app.services.ocr_engine import OCREngine
+from app.services.parser_service import ParserService
+
+
+_AMOUNT = re.compile(r"-?\d+[,.]\d{2}\b")
+_WORD = re.compile(r"[A-Z]{3,}")
+_NEVER = re.compile(r"(?!)")  # Patrón de ítem que no casa nunca: solo se leen los totales
+
+
+def _normalize(line: str) -> str:
+    """Mayúsculas y sin tildes, para comparar texto leído por OCR."""
+    decomposed = unicodedata.normalize("NFKD", line.upper())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+class MerchantTemplate(NamedTuple):
+    """
+    Formato de los tickets de un comercio, aprendido de una extracción del modelo.
+
+    Attributes:
+        merchant: Nombre legible (primera línea de la cabecera).
+        header_tokens: Palabras de la cabecera que identifican al comercio.
+        item_pattern: Índice, en `ParserService.item_patterns`, del formato de sus líneas de ítem.
+        skip_labels: Primeras palabras de líneas con importe que no son artículos
+            (ej. "PROPINA", "DESCUENTO SOCIO") en los tickets de este comercio.
+        learned_at: Momento del último aprendizaje (epoch).
+    """
+    merchant: str
+    header_tokens: FrozenSet[str]
+    item_pattern: int
+    skip_labels: Tuple[str, ...]
+    learned_at: float
+
+
+class TemplateMatch(NamedTuple):
+    """Resultado de leer un ticket con la plantilla de su comercio."""
+    template: MerchantTemplate
+    parsed: Dict[str, Any]
+    confidence: float
+
+
+class MerchantTemplateStore:
+    """
+    Plantillas de los comercios habituales, para leer sus tickets sin llamar al modelo.
+
+    La mayoría de los tickets vienen de unas pocas cadenas con un formato fijo. Cuando
+    el modelo extrae bien un ticket, se compara su resultado con el texto del OCR
+    local (Tesseract) de la misma imagen y se aprende qué patrón de
+    `ParserService.item_patterns` reproduce sus ítems y qué líneas con importe hay
+    que ignorar. Los siguientes tickets cuya cabecera coincide con la de una
+    plantilla se parsean en local con esas expresiones regulares.
+
+    Cada lectura con plantilla recibe una confianza (fracción de líneas con importe
+    que se han reconocido, penalizada si la suma de los ítems no cuadra con el total).
+    Por debajo de `min_confidence` se llama al modelo igualmente, y su resultado
+    vuelve a entrenar la plantilla.
+
+    Las plantillas se guardan en memoria (LRU) y, opcionalmente, en un fichero SQLite.
+    """
+
+    HEADER_LINES = 4
+
+    def __init__(
+        self,
+        reader: Optional[OCREngine] = None,
+        parser_service: Optional[ParserService] = None,
+        min_similarity: float = 0.6,
+        min_confidence: float = 0.9,
+        max_entries: int = 1000,
+        disk_path: Optional[str] = None,
+    ):
+        """
+        Args:
+            reader: Motor OCR local (texto plano) con el que se leen los tickets.
+            parser_service: Parser cuyos patrones se usan para aprender y aplicar plantillas.
+            min_similarity: Similitud (Jaccard, 0-1) mínima entre cabeceras del mismo comercio.
+            min_confidence: Confianza (0-1) mínima para devolver la lectura local sin llamar al modelo.
+            max_entries: Número máximo de plantillas (se descartan las menos usadas).
+            disk_path: Fichero SQLite donde se guardan las plantillas. None = solo en memoria.
+        """
+        self.reader = reader
+        self.parser_service = parser_service or ParserService()
+        self.min_similarity = min_similarity
+        self.min_confidence = min_confidence
+        self.max_entries = max(1, max_entries)
+        self._templates: "OrderedDict[str, MerchantTemplate]" = OrderedDict()
+        self._compiled: Dict[str, Optional[Pattern]] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "lookups": 0, "hits": 0, "low_confidence": 0, "no_template": 0,
+            "learned": 0, "learn_rejected": 0, "reader_errors": 0,
+        }
+        self._disk: Optional[sqlite3.Connection] = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS merchant_templates ("
+                " merchant TEXT PRIMARY KEY, learned_at REAL NOT NULL, payload TEXT NOT NULL)"
+            )
+            self._disk.commit()
+            rows = self._disk.execute(
+                "SELECT payload FROM merchant_templates ORDER BY learned_at DESC LIMIT ?", (self.max_entries,)
+            ).fetchall()
+            for (payload,) in reversed(rows):
+                template = self._deserialize(payload)
+                self._templates[template.merchant] = template
+
+    @classmethod
+    def fromSettings(cls, settings: Settings, reader: Optional[OCREngine]) -> "MerchantTemplateStore":
+        return cls(
+            reader=reader,
+            min_similarity=settings.merchant_templates_min_similarity,
+            min_confidence=settings.merchant_templates_min_confidence,
+            max_entries=settings.merchant_templates_max_entries,
+            disk_path=settings.merchant_templates_path,
+        )
+
+    # --- Lectura local ---
+
+    async def readText(self, image_bytes: bytes, language: str = 'spa') -> Optional[str]:
+        """Texto del ticket según el motor local, o None si no está disponible o falla."""
+        if self.reader is None:
+            return None
+        try:
+            extraction = await self.reader.extractAsync(image_bytes, language)
+        except (ValueError, RuntimeError):
+            self._count("reader_errors")
+            return None
+        return extraction.text or None
+
+    @classmethod
+    def headerTokens(cls, text: str) -> Tuple[str, FrozenSet[str]]:
+        """
+        Nombre legible y palabras de la cabecera (las primeras líneas con texto y sin importes).
+
+        Returns:
+            (primera línea de la cabecera, conjunto de palabras de 3 o más letras).
+        """
+        lines: List[str] = []
+        for raw_line in text.splitlines():
+            line = " ".join(_normalize(raw_line).split())
+            if _AMOUNT.search(line):
+                break
+            if len(_WORD.findall(line)) > 0:
+                lines.append(line)
+            if len(lines) == cls.HEADER_LINES:
+                break
+        tokens = frozenset(word for line in lines for word in _WORD.findall(line))
+        return (lines[0] if lines else ""), tokens
+
+    def findTemplate(self, text: str) -> Optional[MerchantTemplate]:
+        """Plantilla cuya cabecera más se parece a la del texto, si supera `min_similarity`."""
+        _, tokens = self.headerTokens(text)
+        if not tokens:
+            return None
+        best, best_similarity = None, 0.0
+        with self._lock:
+            for template in self._templates.values():
+                union = len(tokens | template.header_tokens)
+                similarity = len(tokens & template.header_tokens) / union if union else 0.0
+                if similarity > best_similarity:
+                    best, best_similarity = template, similarity
+            if best is None or best_similarity < self.min_similarity:
+                return None
+            self._templates.move_to_end(best.merchant)
+        return best
+
+    def match(self, text: str) -> Optional[TemplateMatch]:
+        """
+        Lee el texto con la plantilla de su comercio.
+
+        Returns:
+            Optional[TemplateMatch]: La lectura y su confianza, o None si no hay plantilla.
+            Cuenta como acierto solo si la confianza alcanza `min_confidence`.
+        """
+        self._count("lookups")
+        template = self.findTemplate(text)
+        if template is None:
+            self._count("no_template")
+            return None
+        parsed, confidence = self._apply(template, text)
+        self._count("hits" if confidence >= self.min_confidence else "low_confidence")
+        return TemplateMatch(template, parsed, confidence)
+
+    def _apply(self, template: MerchantTemplate, text: str) -> Tuple[Dict[str, Any], float]:
+        """Parsea el texto con la plantilla y calcula la confianza de la lectura."""
+        parser = self.parser_service
+        skip_pattern = self._skipPattern(template)
+        parsed = parser.parseReceiptText(
+            text, item_patterns=[parser.item_patterns[template.item_pattern]], skip_pattern=skip_pattern
+        )
+        return parsed, self._confidence(parsed, text, skip_pattern)
+
+    def _confidence(self, parsed: Dict[str, Any], text: str, skip_pattern: Optional[Pattern]) -> float:
+        """
+        Fracción de líneas con importe (que no son totales ni se ignoran) leídas como
+        ítems, a la mitad si la suma de los ítems no cuadra con el subtotal, el total o
+        el total sin impuestos impresos en el ticket.
+        """
+        if not parsed["is_ticket"] or not parsed["items"] or parsed["total"] is None:
+            return 0.0
+        candidates = len(self._candidateLines(text, skip_pattern))
+        # Se compara con los importes impresos en el ticket, no con los que el parser
+        # completa a partir de los propios ítems.
+        printed = self.parser_service.parseReceiptText(text, item_patterns=[_NEVER])
+        references = [value for value in (printed["subtotal"], printed["total"]) if value is not None]
+        if printed["total"] is not None and printed["tax"] is not None:
+            references.append(printed["total"] - printed["tax"])
+        coverage = min(1.0, len(parsed["items"]) / candidates) if candidates else 0.0
+        items_sum = sum(item.total_price for item in parsed["items"])
+        if not any(abs(items_sum - value) <= max(0.02, value * 0.005) for value in references):
+            coverage /= 2
+        return round(coverage, 3)
+
+    def _candidateLines(self, text: str, skip_pattern: Optional[Pattern] = None) -> List[str]:
+        """Líneas con importe que podrían ser artículos (ni totales, ni pagos, ni ignoradas)."""
+        parser = self.parser_service
+        lines = []
+        for raw_line in text.splitlines():
+            line = " ".join(raw_line.split())
+            if not _AMOUNT.search(line) or any(pattern.match(line) for pattern in parser.total_patterns):
+                continue
+            if parser.non_item_pattern.search(line) or (skip_pattern is not None and skip_pattern.search(line)):
+                continue
+            lines.append(line)
+        return lines
+
+    # --- Aprendizaje ---
+
+    def learn(self, text: str, model_parsed: Dict[str, Any]) -> Optional[MerchantTemplate]:
+        """
+        Aprende (o actualiza) la plantilla del comercio a partir de un resultado del modelo.
+
+        Solo se guarda si, con el patrón elegido, la lectura local reproduce los ítems y el
+        total del modelo con al menos `min_confidence`.
+
+        Args:
+            text: Texto del OCR local de la misma imagen.
+            model_parsed: Resultado del parser sobre la respuesta del modelo.
+        """
+        merchant, tokens = self.headerTokens(text)
+        model_items = model_parsed.get("items") or []
+        if not model_parsed.get("is_ticket", True) or not model_items or not tokens or not merchant:
+            return None
+
+        parser = self.parser_service
+        model_totals = [round(item.total_price, 2) for item in model_items]
+
+        def unmatched(items: List[Any]) -> Tuple[List[float], List[Any]]:
+            """Importes del modelo sin línea local equivalente, e ítems locales sobrantes."""
+            remaining, extra = list(model_totals), []
+            for item in items:
+                if round(item.total_price, 2) in remaining:
+                    remaining.remove(round(item.total_price, 2))
+                else:
+                    extra.append(item)
+            return remaining, extra
+
+        # Patrón de ítem (el más específico en caso de empate) que reproduce más importes.
+        scores = [
+            len(unmatched(parser.parseReceiptText(text, item_patterns=[pattern])["items"])[0])
+            for pattern in parser.item_patterns
+        ]
+        index = scores.index(min(scores))
+        score = 1 - scores[index] / len(model_totals)
+
+        # Las líneas con importe que el patrón no lee como un artículo del modelo (propinas,
+        # descuentos, puntos...) se ignoran en este comercio, por su primera palabra.
+        pattern = parser.item_patterns[index]
+        skip_labels: List[str] = []
+        remaining = list(model_totals)
+        for line in self._candidateLines(text):
+            items = parser.parseReceiptText(line, item_patterns=[pattern])["items"]
+            if items and round(items[0].total_price, 2) in remaining:
+                remaining.remove(round(items[0].total_price, 2))
+                continue
+            label = _WORD.findall(_normalize(line))
+            if label and label[0] not in skip_labels:
+                skip_labels.append(label[0])
+
+        existing = self.findTemplate(text)
+        name = existing.merchant if existing is not None else merchant
+        template = MerchantTemplate(name, tokens, index, tuple(skip_labels), time.time())
+        parsed, confidence = self._apply(template, text)
+        model_total = model_parsed.get("total")
+        if (
+            score < self.min_confidence
+            or confidence < self.min_confidence
+            or model_total is None
+            or parsed["total"] is None
+            or abs(parsed["total"] - model_total) > 0.01
+        ):
+            self._count("learn_rejected")
+            return None
+        self._store(template)
+        self._count("learned")
+        return template
+
+    def _store(self, template: MerchantTemplate) -> None:
+        with self._lock:
+            self._templates[template.merchant] = template
+            self._templates.move_to_end(template.merchant)
+            self._compiled.pop(template.merchant, None)
+            while len(self._templates) > self.max_entries:
+                evicted, _ = self._templates.popitem(last=False)
+                self._compiled.pop(evicted, None)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO merchant_templates (merchant, learned_at, payload) VALUES (?, ?, ?)",
+                    (template.merchant, template.learned_at, self._serialize(template)),
+                )
+                self._disk.execute(
+                    "DELETE FROM merchant_templates WHERE merchant IN ("
+                    " SELECT merchant FROM merchant_templates ORDER BY learned_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._disk.commit()
+
+    def _skipPattern(self, template: MerchantTemplate) -> Optional[Pattern]:
+        """Regex (compilada una vez por plantilla) de las líneas que no son artículos."""
+        with self._lock:
+            if template.merchant not in self._compiled:
+                self._compiled[template.merchant] = (
+                    re.compile(r"^(?:" + "|".join(map(re.escape, template.skip_labels)) + r")\b", re.IGNORECASE)
+                    if template.skip_labels else None
+                )
+            return self._compiled[template.merchant]
+
+    # --- Serialización ---
+
+    @staticmethod
+    def _serialize(template: MerchantTemplate) -> str:
+        payload = template._asdict()
+        payload["header_tokens"] = sorted(template.header_tokens)
+        return json.dumps(payload, ensure_ascii=False)
+
+    @staticmethod
+    def _deserialize(serialized: str) -> MerchantTemplate:
+        payload = json.loads(serialized)
+        return MerchantTemplate(
+            merchant=payload["merchant"],
+            header_tokens=frozenset(payload["header_tokens"]),
+            item_pattern=payload["item_pattern"],
+            skip_labels=tuple(payload["skip_labels"]),
+            learned_at=payload["learned_at"],
+        )
+
+    # --- Métricas y ciclo de vida ---
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+
+    def clear(self) -> None:
+        """Olvida todas las plantillas (los contadores se mantienen)."""
+        with self._lock:
+            self._templates.clear()
+            self._compiled.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM merchant_templates")
+                self._disk.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+    def getStats(self) -> Dict[str, Any]:
+        """Consultas, aciertos (tickets leídos sin el modelo), plantillas aprendidas y tasa de acierto."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["templates"] = len(self._templates)
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        return stats
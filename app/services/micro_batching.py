@@ -0,0 +1,196 @@
+import asyncio
+import contextvars
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Union
+
+from app.core.config import Settings
+from app.services.deadlines import DeadlineExceededError, deadlineScope, remainingTime
+from app.services.ocr_engine import OCREngine, OCRExtraction
+from app.services.ocr_service import BatchDemultiplexError
+
+
+class _Waiter(NamedTuple):
+    image_bytes: bytes
+    future: "asyncio.Future[OCRExtraction]"
+    deadline: Optional[float]  # time.monotonic() en que vence su petición; None = sin plazo
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+
+class MicroBatchingOCREngine(OCREngine):
+    """
+    Agrupa las extracciones que llegan casi a la vez en una sola llamada al modelo.
+
+    Cada llamada a Gemini tiene un coste fijo (conexión, preparación de la petición,
+    tokens del prompt) que, con tickets pequeños, pesa tanto como el trabajo útil. Las
+    peticiones que llegan dentro de una ventana de `max_wait` segundos (y con el mismo
+    idioma) se envían juntas con `extractBatchAsync`, hasta `max_batch_size` imágenes
+    por llamada; la respuesta se separa por imagen y cada petición recibe la suya.
+
+    Las imágenes cuya respuesta no se puede separar (o todo el lote, si falla la
+    separación o alguna imagen no es válida) se repiten con una llamada individual.
+    Los demás errores del lote (cuota, red...) se propagan a todas sus peticiones, para
+    que la capa de resiliencia las reintente.
+
+    Cada petición espera su resultado solo hasta su propio plazo (ver
+    `app.services.deadlines`). El lote se envía con el plazo más largo de sus peticiones,
+    no con el de la que lo cerró: una petición con poco plazo no hace fallar a las demás.
+
+    No tiene pool de hilos propio: delega en el del motor envuelto. Las subidas en
+    streaming no se agrupan.
+    """
+
+    def __init__(self, engine: OCREngine, max_batch_size: int = 4, max_wait: float = 0.05):
+        """
+        Args:
+            engine: Motor envuelto (normalmente Gemini) con `extractBatchAsync`.
+            max_batch_size: Imágenes máximas por llamada.
+            max_wait: Segundos que la primera petición de un lote espera a las siguientes.
+        """
+        self.engine = engine
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.name = engine.name
+        self.output_format = engine.output_format
+        self.max_concurrency = engine.max_concurrency
+        self._pending: Dict[str, List[_Waiter]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0, "batches": 0, "batched_images": 0, "single_calls": 0,
+            "flushed_full": 0, "flushed_timeout": 0,
+            "demultiplex_failures": 0, "fallback_calls": 0,
+        }
+
+    @classmethod
+    def fromSettings(cls, engine: OCREngine, settings: Settings) -> "MicroBatchingOCREngine":
+        return cls(engine, max_batch_size=settings.ocr_batch_max_size, max_wait=settings.ocr_batch_max_wait_seconds)
+
+    def extractTextFromImage(self, image_bytes: bytes, language: str = 'spa') -> str:
+        """Llamada síncrona directa al motor envuelto (sin agrupar)."""
+        return self.engine.extractTextFromImage(image_bytes, language)
+
+    async def extractTextFromImageAsync(self, image_bytes: bytes, language: str = 'spa') -> str:
+        return (await self.extractAsync(image_bytes, language)).text
+
+    async def extractAsync(self, image_bytes: bytes, language: str = 'spa') -> OCRExtraction:
+        """
+        Añade la imagen al lote abierto de su idioma y espera su resultado.
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            RuntimeError: Si falla la llamada al modelo.
+            DeadlineExceededError: Si vence el plazo de la petición antes del resultado.
+        """
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[OCRExtraction]" = loop.create_future()
+        self._count("requests")
+        remaining = remainingTime()
+        deadline = None if remaining is None else time.monotonic() + remaining
+        batch = self._pending.setdefault(language, [])
+        batch.append(_Waiter(image_bytes, future, deadline))
+        if len(batch) >= self.max_batch_size:
+            self._flush(language, "flushed_full")
+        elif len(batch) == 1:
+            # Sin el contexto de esta petición: su plazo no debe ser el del lote.
+            self._timers[language] = loop.call_later(
+                self.max_wait, self._flush, language, "flushed_timeout", context=contextvars.Context()
+            )
+        if remaining is None:
+            return await future
+        try:
+            # Si vence, `wait_for` cancela el futuro y el lote deja de contar con esta imagen.
+            return await asyncio.wait_for(future, max(0.0, remaining))
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError("El plazo de la petición ha vencido") from None
+
+    def _flush(self, language: str, reason: str) -> None:
+        """Cierra el lote abierto de `language` y lo envía en segundo plano."""
+        timer = self._timers.pop(language, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(language, [])
+        # Las peticiones canceladas mientras esperaban (ej. por timeout) no se envían.
+        batch = [waiter for waiter in batch if not waiter.future.done()]
+        if not batch:
+            return
+        self._count(reason)
+        # La tarea se crea en un contexto vacío: si no, heredaría el plazo de la petición
+        # que ha cerrado el lote. `_run` fija el del lote.
+        task = contextvars.Context().run(asyncio.ensure_future, self._run(batch, language))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[_Waiter], language: str) -> None:
+        remaining = [waiter.remaining() for waiter in batch]
+        # El lote vale mientras alguna de sus peticiones lo espere: el plazo más largo.
+        with deadlineScope(None if None in remaining else max(remaining)):
+            await self._runBatch(batch, language)
+
+    async def _runBatch(self, batch: List[_Waiter], language: str) -> None:
+        if len(batch) == 1:
+            self._count("single_calls")
+            await self._runSingle(batch[0], language)
+            return
+        self._count("batches")
+        self._count("batched_images", len(batch))
+        try:
+            results = await self.engine.extractBatchAsync([waiter.image_bytes for waiter in batch], language)
+        except (BatchDemultiplexError, ValueError):
+            # Respuesta inseparable o alguna imagen no válida: cada una por su cuenta.
+            self._count("demultiplex_failures")
+            results = [None] * len(batch)
+        except Exception as e:
+            for waiter in batch:
+                if not waiter.future.done():
+                    waiter.future.set_exception(e)
+            return
+
+        retries = []
+        for waiter, result in zip(batch, results):
+            if result is None:
+                retries.append(waiter)
+            elif not waiter.future.done():
+                waiter.future.set_result(result)
+        if retries:
+            self._count("fallback_calls", len(retries))
+            await asyncio.gather(*(self._runSingle(waiter, language) for waiter in retries))
+
+    async def _runSingle(self, waiter: _Waiter, language: str) -> None:
+        try:
+            with deadlineScope(waiter.remaining()):
+                result = await self.engine.extractAsync(waiter.image_bytes, language)
+        except Exception as e:
+            if not waiter.future.done():
+                waiter.future.set_exception(e)
+            return
+        if not waiter.future.done():
+            waiter.future.set_result(result)
+
+    async def streamAsync(
+        self, image_bytes: bytes, language: str = 'spa'
+    ) -> AsyncIterator[Union[str, OCRExtraction]]:
+        async for piece in self.engine.streamAsync(image_bytes, language):
+            yield piece
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[counter] += amount
+
+    def getStats(self) -> Dict[str, Any]:
+        """Lotes enviados, imágenes por lote y llamadas individuales de respaldo."""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["avg_batch_size"] = round(stats["batched_images"] / stats["batches"], 2) if stats["batches"] else None
+        calls = stats["batches"] + stats["single_calls"] + stats["fallback_calls"]
+        stats["model_calls_saved"] = stats["requests"] - calls if calls else 0
+        return stats
+
+    def warmUp(self) -> None:
+        self.engine.warmUp()
+
+    def close(self) -> None:
+        self.engine.close()
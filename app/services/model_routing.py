@@ -0,0 +1,287 @@
+import threading
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from app.core.config import Settings
+from app.services.admission import AdmissionRejectedError
+from app.services.api_key_pool import KeyPoolExhaustedError
+from app.services.deadlines import DeadlineExceededError
+from app.services.ocr_engine import OCREngine, OCRExtraction
+
+
+# Nombres de las comprobaciones de coherencia (aparecen en las métricas).
+HAS_CONTENT = "has_content"
+DESCRIPTIONS = "descriptions"
+PRICES = "prices"
+ITEMS_SUM_SUBTOTAL = "items_sum_subtotal"
+SUBTOTAL_TAX_TOTAL = "subtotal_tax_total"
+ITEMS_SUM_TOTAL = "items_sum_total"
+
+ROUTING_POLICIES = ("escalate", "primary", "strong")
+
+# Errores que no vienen del modelo sino de límites del propio servicio (plazo de la
+# petición, cola de admisión, cupo de las claves): otro nivel fallaría igual.
+LOCAL_LIMIT_ERRORS = (DeadlineExceededError, AdmissionRejectedError, KeyPoolExhaustedError)
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.replace(",", "."))
+        except ValueError:
+            return None
+    return None
+
+
+def isLocalLimitError(error: BaseException) -> bool:
+    """Indica si el error (o alguna de sus causas) es uno de `LOCAL_LIMIT_ERRORS`."""
+    cause: Optional[BaseException] = error
+    while cause is not None:
+        if isinstance(cause, LOCAL_LIMIT_ERRORS):
+            return True
+        cause = cause.__cause__
+    return False
+
+
+class ConfidenceScore(NamedTuple):
+    """Confianza (0-1) en una extracción y comprobaciones que no ha superado."""
+    confidence: float
+    failed: Tuple[str, ...]
+
+
+def scoreExtraction(data: Any, tolerance: float = 0.05) -> Optional[ConfidenceScore]:
+    """
+    Puntúa la coherencia interna de la respuesta JSON del modelo.
+
+    Comprobaciones (solo cuentan las que se pueden aplicar):
+    - `has_content`: hay ítems o un total (si falla, la confianza es 0).
+    - `descriptions`: ningún ítem sin descripción.
+    - `prices`: todos los ítems tienen un precio unitario numérico.
+    - `items_sum_subtotal`: la suma de los ítems coincide con el subtotal.
+    - `subtotal_tax_total`: subtotal + impuestos coincide con el total.
+    - `items_sum_total`: sin subtotal, la suma de los ítems (más impuestos) coincide con el total.
+
+    Args:
+        data: Respuesta del modelo ya decodificada.
+        tolerance: Diferencia (en la moneda del ticket) admitida, además de un 1 %.
+
+    Returns:
+        Optional[ConfidenceScore]: None si la respuesta no se puede puntuar (no es un
+        objeto JSON) y confianza 1 para las imágenes que el modelo dice que no son tickets.
+    """
+    if not isinstance(data, dict):
+        return None
+    if data.get("is_ticket") is False:
+        return ConfidenceScore(1.0, ())
+
+    items = [item for item in (data.get("items") or []) if isinstance(item, dict)]
+    subtotal, tax, total = (_number(data.get(field)) for field in ("subtotal", "tax", "total"))
+    if not items and total is None:
+        return ConfidenceScore(0.0, (HAS_CONTENT,))
+
+    def close(a: float, b: float) -> bool:
+        return abs(a - b) <= tolerance + abs(b) * 0.01
+
+    checks: List[Tuple[str, bool]] = []
+    if items:
+        checks.append((DESCRIPTIONS, all(str(item.get("description") or "").strip() for item in items)))
+        prices = [_number(item.get("unit_price")) for item in items]
+        checks.append((PRICES, all(price is not None for price in prices)))
+        items_sum = sum(
+            (_number(item.get("quantity")) or 1.0) * (price or 0.0) for item, price in zip(items, prices)
+        )
+        if subtotal is not None:
+            checks.append((ITEMS_SUM_SUBTOTAL, close(items_sum, subtotal)))
+        elif total is not None:
+            checks.append((ITEMS_SUM_TOTAL, close(items_sum, total) or (tax is not None and close(items_sum + tax, total))))
+    if subtotal is not None and tax is not None and total is not None:
+        checks.append((SUBTOTAL_TAX_TOTAL, close(subtotal + tax, total)))
+
+    if not checks:
+        return ConfidenceScore(1.0, ())
+    failed = tuple(name for name, passed in checks if not passed)
+    return ConfidenceScore(round(1 - len(failed) / len(checks), 4), failed)
+
+
+class TieredOCREngine(OCREngine):
+    """
+    Enruta cada extracción por niveles de modelo, del más barato al más capaz.
+
+    Con la política "escalate" se llama primero al nivel barato (ej. gemini-1.5-flash) y
+    solo se repite la extracción con el siguiente nivel (ej. gemini-1.5-pro) si la
+    confianza de la respuesta (`scoreExtraction`) no llega a `min_confidence` o si el
+    nivel barato falla. De las dos respuestas se devuelve la de mayor confianza (la del
+    nivel superior en caso de empate). "primary" usa siempre el primer nivel y
+    "strong" siempre el último.
+
+    Las subidas en streaming van al primer nivel sin escalar (en "strong", al último):
+    los ítems ya enviados al cliente no se pueden retirar.
+
+    No tiene pool de hilos propio: delega en los de los motores de cada nivel.
+    """
+
+    def __init__(
+        self,
+        tiers: Sequence[Tuple[str, OCREngine]],
+        policy: str = "escalate",
+        min_confidence: float = 0.75,
+        tolerance: float = 0.05,
+    ):
+        """
+        Args:
+            tiers: Pares (nombre del modelo, motor), del más barato al más capaz.
+            policy: "escalate", "primary" o "strong".
+            min_confidence: Confianza (0-1) por debajo de la cual se escala al siguiente nivel.
+            tolerance: Diferencia admitida al comparar importes (ver `scoreExtraction`).
+
+        Raises:
+            ValueError: Si no hay niveles o la política no es válida.
+        """
+        if not tiers:
+            raise ValueError("El enrutado de modelos necesita al menos un nivel")
+        if policy not in ROUTING_POLICIES:
+            raise ValueError(f"Política de enrutado '{policy}' no soportada. Usa una de: {list(ROUTING_POLICIES)}")
+        self.tiers = list(tiers)
+        self.policy = policy
+        self.min_confidence = min_confidence
+        self.tolerance = tolerance
+        # Los envoltorios exponen `engine`: las métricas por capa siguen el primer nivel.
+        self.engine = self.tiers[0][1]
+        self.name = self.engine.name
+        self.output_format = self.engine.output_format
+        self.max_concurrency = self.engine.max_concurrency
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "requests": 0, "escalations": 0, "escalated_on_error": 0, "streams": 0,
+            "served_by": {name: 0 for name, _ in self.tiers},
+            "failed_checks": {},
+            "confidence_sum": {name: 0.0 for name, _ in self.tiers},
+            "scored": {name: 0 for name, _ in self.tiers},
+        }
+
+    @classmethod
+    def fromSettings(cls, tiers: Sequence[Tuple[str, OCREngine]], settings: Settings) -> "TieredOCREngine":
+        return cls(
+            tiers,
+            policy=settings.ocr_routing_policy,
+            min_confidence=settings.ocr_escalation_min_confidence,
+            tolerance=settings.ocr_escalation_tolerance,
+        )
+
+    def _startTier(self) -> int:
+        return len(self.tiers) - 1 if self.policy == "strong" else 0
+
+    def _score(self, tier: int, extraction: OCRExtraction) -> Optional[ConfidenceScore]:
+        score = scoreExtraction(extraction.data, self.tolerance) if extraction.output_format == "json" else None
+        if score is not None:
+            name = self.tiers[tier][0]
+            with self._lock:
+                self._stats["scored"][name] += 1
+                self._stats["confidence_sum"][name] += score.confidence
+        return score
+
+    def _shouldEscalate(self, tier: int, score: Optional[ConfidenceScore]) -> bool:
+        # Sin puntuación (ej. respuesta de un motor de respaldo en texto plano) no se escala.
+        return (
+            self.policy == "escalate"
+            and tier + 1 < len(self.tiers)
+            and score is not None
+            and score.confidence < self.min_confidence
+        )
+
+    def _recordEscalation(self, score: Optional[ConfidenceScore], error: bool = False) -> None:
+        with self._lock:
+            self._stats["escalations"] += 1
+            if error:
+                self._stats["escalated_on_error"] += 1
+            for check in score.failed if score is not None else ():
+                self._stats["failed_checks"][check] = self._stats["failed_checks"].get(check, 0) + 1
+
+    def _recordServed(self, tier: int) -> None:
+        with self._lock:
+            self._stats["served_by"][self.tiers[tier][0]] += 1
+
+    async def extractAsync(self, image_bytes: bytes, language: str = 'spa') -> OCRExtraction:
+        """
+        Extrae con el nivel que indique la política, escalando si hace falta.
+
+        Solo se escala ante fallos del modelo: los de `LOCAL_LIMIT_ERRORS` (plazo vencido,
+        admisión rechazada, claves sin cupo) se propagan sin probar otro nivel.
+
+        Raises:
+            ValueError, RuntimeError: Los errores del último nivel intentado.
+        """
+        with self._lock:
+            self._stats["requests"] += 1
+        tier = self._startTier()
+        best: Optional[Tuple[int, OCRExtraction, Optional[ConfidenceScore]]] = None
+        while True:
+            try:
+                extraction = await self.tiers[tier][1].extractAsync(image_bytes, language)
+            except ValueError:
+                raise  # Imagen no válida: ningún modelo la va a leer mejor
+            except RuntimeError as e:
+                if isLocalLimitError(e):
+                    raise  # Sin plazo o sin capacidad: escalar no lo arregla
+                if self.policy != "escalate" or tier + 1 >= len(self.tiers):
+                    if best is not None:
+                        break
+                    raise
+                self._recordEscalation(None, error=True)
+                tier += 1
+                continue
+            score = self._score(tier, extraction)
+            if best is None or best[2] is None or (score is not None and score.confidence >= best[2].confidence):
+                best = (tier, extraction, score)
+            if not self._shouldEscalate(tier, score):
+                break
+            self._recordEscalation(score)
+            tier += 1
+        self._recordServed(best[0])
+        return best[1]
+
+    async def extractTextFromImageAsync(self, image_bytes: bytes, language: str = 'spa') -> str:
+        return (await self.extractAsync(image_bytes, language)).text
+
+    def extractTextFromImage(self, image_bytes: bytes, language: str = 'spa') -> str:
+        """Llamada síncrona directa al nivel inicial de la política (sin escalado)."""
+        return self.tiers[self._startTier()][1].extractTextFromImage(image_bytes, language)
+
+    async def streamAsync(
+        self, image_bytes: bytes, language: str = 'spa'
+    ) -> AsyncIterator[Union[str, OCRExtraction]]:
+        tier = self._startTier()
+        with self._lock:
+            self._stats["streams"] += 1
+        async for piece in self.tiers[tier][1].streamAsync(image_bytes, language):
+            if isinstance(piece, OCRExtraction):
+                self._score(tier, piece)
+                self._recordServed(tier)
+            yield piece
+
+    def getStats(self) -> Dict[str, Any]:
+        """Peticiones, escalados (y su tasa), comprobaciones fallidas y confianza media por nivel."""
+        with self._lock:
+            stats = {
+                key: dict(value) if isinstance(value, dict) else value
+                for key, value in self._stats.items()
+            }
+        confidence_sum, scored = stats.pop("confidence_sum"), stats.pop("scored")
+        stats["policy"] = self.policy
+        stats["tiers"] = [name for name, _ in self.tiers]
+        stats["escalation_rate"] = round(stats["escalations"] / stats["requests"], 4) if stats["requests"] else 0.0
+        stats["avg_confidence"] = {
+            name: round(confidence_sum[name] / scored[name], 4) if scored[name] else None for name in scored
+        }
+        return stats
+
+    def warmUp(self) -> None:
+        for _, engine in self.tiers:
+            engine.warmUp()
+
+    def close(self) -> None:
+        for _, engine in self.tiers:
+            engine.close()
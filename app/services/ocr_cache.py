@@ -0,0 +1,219 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from app.models.item import Item
+
+
+class OcrResultCache:
+    """
+    Caché de resultados de OCR direccionada por contenido.
+
+    La clave es un hash SHA-256 de los bytes de la imagen, de modo que volver a subir
+    exactamente la misma foto devuelve el resultado anterior sin llamar al modelo.
+
+    Tiene dos niveles:
+    - Memoria: LRU acotado por número de entradas.
+    - Disco (opcional): fichero SQLite que sobrevive a reinicios, también acotado.
+
+    Ambos niveles respetan un TTL. Cada entrada guarda el texto devuelto por el OCR y,
+    opcionalmente, el resultado ya parseado por `ParserService`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: float = 86400.0,
+        disk_path: Optional[str] = None,
+        disk_max_entries: int = 10000,
+    ):
+        """
+        Args:
+            max_entries: Número máximo de entradas en memoria.
+            ttl_seconds: Tiempo de vida de cada entrada (en segundos). 0 o negativo = sin caducidad.
+            disk_path: Ruta del fichero SQLite del nivel en disco. None lo desactiva.
+            disk_max_entries: Número máximo de entradas en disco.
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_entries = max(1, disk_max_entries)
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+        self._disk: Optional[sqlite3.Connection] = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                " key TEXT PRIMARY KEY, stored_at REAL NOT NULL, payload TEXT NOT NULL)"
+            )
+            self._disk.execute("CREATE INDEX IF NOT EXISTS ocr_cache_stored_at ON ocr_cache (stored_at)")
+            self._disk.commit()
+
+    @staticmethod
+    def makeKey(image_bytes: bytes, variant: str = "") -> str:
+        """
+        Calcula la clave de caché de una imagen.
+
+        Args:
+            image_bytes: Bytes de la imagen subida.
+            variant: Texto opcional que distingue resultados de la misma imagen obtenidos
+                con opciones distintas (idioma, motor OCR...).
+        """
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return f"{digest}:{variant}" if variant else digest
+
+    def _isExpired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - stored_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca una entrada en memoria y, si no está, en disco.
+
+        Returns:
+            Optional[Dict[str, Any]]: Diccionario con `raw_text`, `output_format` y, si se guardó, `parsed`
+            (con copias de los ítems, para que el llamante pueda modificarlos), o None.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, payload = entry
+                if self._isExpired(stored_at, now):
+                    del self._memory[key]
+                    self._stats["expirations"] += 1
+                else:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return self._copyPayload(payload)
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT stored_at, payload FROM ocr_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    stored_at, serialized = row
+                    if self._isExpired(stored_at, now):
+                        self._disk.execute("DELETE FROM ocr_cache WHERE key = ?", (key,))
+                        self._disk.commit()
+                        self._stats["expirations"] += 1
+                    else:
+                        payload = self._deserialize(serialized)
+                        self._storeInMemory(key, stored_at, payload)
+                        self._stats["disk_hits"] += 1
+                        return self._copyPayload(payload)
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(
+        self,
+        key: str,
+        raw_text: str,
+        parsed: Optional[Dict[str, Any]] = None,
+        output_format: str = "json",
+    ) -> None:
+        """
+        Guarda el resultado de una extracción.
+
+        Args:
+            key: Clave obtenida con `makeKey`.
+            raw_text: Texto devuelto por el motor OCR.
+            parsed: Resultado opcional de `ParserService.parseEngineOutput`.
+            output_format: Formato de `raw_text` ("json" o "text"), para poder volver a parsearlo.
+        """
+        payload: Dict[str, Any] = {"raw_text": raw_text, "parsed": parsed, "output_format": output_format}
+        stored_at = time.time()
+        with self._lock:
+            self._storeInMemory(key, stored_at, payload)
+            self._stats["stores"] += 1
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO ocr_cache (key, stored_at, payload) VALUES (?, ?, ?)",
+                    (key, stored_at, self._serialize(payload)),
+                )
+                self._disk.execute(
+                    "DELETE FROM ocr_cache WHERE key IN ("
+                    " SELECT key FROM ocr_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_max_entries,),
+                )
+                self._disk.commit()
+
+    def _storeInMemory(self, key: str, stored_at: float, payload: Dict[str, Any]) -> None:
+        self._memory[key] = (stored_at, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        """Vacía ambos niveles de la caché (los contadores se mantienen)."""
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM ocr_cache")
+                self._disk.commit()
+
+    def close(self) -> None:
+        """Cierra el fichero del nivel en disco, si existe."""
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+    def getStats(self) -> Dict[str, Any]:
+        """Devuelve los contadores de aciertos/fallos y el tamaño actual de la caché."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            if self._disk is not None:
+                stats["disk_entries"] = self._disk.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+    # --- Serialización ---
+
+    @staticmethod
+    def _copyPayload(payload: Dict[str, Any]) -> Dict[str, Any]:
+        parsed = payload.get("parsed")
+        if parsed is not None:
+            parsed = dict(parsed)
+            parsed["items"] = [item.model_copy() for item in parsed.get("items", [])]
+        return {
+            "raw_text": payload["raw_text"],
+            "parsed": parsed,
+            "output_format": payload.get("output_format", "json"),
+        }
+
+    @staticmethod
+    def _serialize(payload: Dict[str, Any]) -> str:
+        parsed = payload.get("parsed")
+        if parsed is not None:
+            parsed = dict(parsed)
+            parsed["items"] = [item.model_dump() for item in parsed.get("items", [])]
+        return json.dumps({
+            "raw_text": payload["raw_text"],
+            "parsed": parsed,
+            "output_format": payload.get("output_format", "json"),
+        })
+
+    @staticmethod
+    def _deserialize(serialized: str) -> Dict[str, Any]:
+        payload = json.loads(serialized)
+        parsed = payload.get("parsed")
+        if parsed is not None:
+            parsed["items"] = [Item(**item) for item in parsed.get("items", [])]
+        return payload
@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from app.core.config import getSettings
+
+
+class OCRExtraction(NamedTuple):
+    """
+    Texto devuelto por un motor OCR junto con el motor que lo produjo y su formato.
+
+    `data` es la respuesta ya decodificada cuando el motor produce JSON: el motor la
+    decodifica una vez al validarla y el parser la reutiliza en lugar de volver a
+    parsear `text`. None si no se ha decodificado (texto plano, dobles de test...).
+    `repairs` enumera las correcciones que hubo que aplicar a una respuesta JSON mal
+    formada (ver `app.services.json_repair`).
+    """
+    text: str
+    engine: str
+    output_format: str
+    data: Any = None
+    repairs: Tuple[str, ...] = ()
+
+
+class OCREngine(ABC):
+    """
+    Interfaz común de los motores OCR (Gemini, Tesseract...).
+
+    Cada motor implementa `extractTextFromImage` (bloqueante) y declara el formato de
+    su salida en `output_format`:
+    - "json": JSON con la estructura del prompt de Gemini (`ParserService.parseTextToItems`).
+    - "text": texto plano línea a línea (`ParserService.parseReceiptText`).
+
+    La versión asíncrona ejecuta la llamada en un pool de hilos propio del motor, cuyo
+    tamaño limita cuántas extracciones simultáneas hace el proceso.
+    """
+
+    name: str = "base"
+    output_format: str = "json"
+
+    def __init__(self, max_concurrency: Optional[int] = None):
+        """
+        Args:
+            max_concurrency: Extracciones simultáneas máximas desde `extractTextFromImageAsync`.
+                Si no se proporciona, se usa `OCR_MAX_CONCURRENCY`.
+        """
+        self.max_concurrency = max(1, max_concurrency or getSettings().ocr_max_concurrency)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @abstractmethod
+    def extractTextFromImage(self, image_bytes: bytes, language: str = 'spa') -> str:
+        """
+        Extrae el texto de una imagen de ticket.
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            RuntimeError: Si hay un error al procesar la imagen.
+        """
+
+    def _getExecutor(self) -> ThreadPoolExecutor:
+        """Devuelve (creándolo la primera vez) el pool de hilos de las extracciones."""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_concurrency, thread_name_prefix=f"ocr-{self.name}"
+                    )
+        return self._executor
+
+    def _runInExecutor(self, function: Callable[..., Any], *args: Any) -> "asyncio.Future[Any]":
+        """
+        Ejecuta `function` en el pool de hilos del motor con una copia del contexto actual,
+        para que el plazo de la petición (ver `app.services.deadlines`) llegue a la llamada.
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, function, *args)
+        return loop.run_in_executor(self._getExecutor(), call)
+
+    async def extractTextFromImageAsync(self, image_bytes: bytes, language: str = 'spa') -> str:
+        """
+        Versión awaitable de `extractTextFromImage`.
+
+        La extracción es bloqueante, así que se ejecuta en el pool de hilos acotado del
+        motor. Mientras tanto el event loop sigue atendiendo otras peticiones
+        (health, consultas, divisiones...).
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            RuntimeError: Si hay un error al procesar la imagen.
+        """
+        return await self._runInExecutor(self.extractTextFromImage, image_bytes, language)
+
+    def streamTextFromImage(self, image_bytes: bytes, language: str = 'spa') -> Iterator[str]:
+        """
+        Versión en streaming de `extractTextFromImage`: devuelve el texto por trozos a
+        medida que se genera. Por defecto, un único trozo con el texto completo.
+        """
+        yield self.extractTextFromImage(image_bytes, language)
+
+    def finishStreamedText(self, text: str) -> str:
+        """
+        Convierte la concatenación de los trozos de `streamTextFromImage` en el mismo
+        texto que habría devuelto `extractTextFromImage`.
+        """
+        return text
+
+    def decodeOutput(self, text: str) -> OCRExtraction:
+        """
+        Convierte la respuesta completa del motor en un `OCRExtraction`.
+
+        Por defecto solo aplica `finishStreamedText`; los motores JSON la sobrescriben
+        para devolver también la respuesta decodificada en `data`.
+        """
+        return OCRExtraction(self.finishStreamedText(text), self.name, self.output_format)
+
+    def extractFromImage(self, image_bytes: bytes, language: str = 'spa') -> OCRExtraction:
+        """
+        Como `extractTextFromImage`, pero devolviendo un `OCRExtraction`.
+
+        Los motores JSON lo sobrescriben para decodificar la respuesta una sola vez.
+        """
+        return OCRExtraction(self.extractTextFromImage(image_bytes, language), self.name, self.output_format)
+
+    def extractBatchFromImages(self, images: Sequence[bytes], language: str = 'spa') -> List[Optional[OCRExtraction]]:
+        """
+        Extrae varias imágenes. Por defecto, una llamada por imagen; los motores que
+        pueden leer varias en una sola petición (ver `OCRService`) lo sobrescriben.
+
+        Returns:
+            List[Optional[OCRExtraction]]: Un resultado por imagen, en el mismo orden. None
+            para las imágenes cuyo resultado no se ha podido separar del resto.
+
+        Raises:
+            ValueError, RuntimeError: Si falla la petición.
+        """
+        return [self.extractFromImage(image_bytes, language) for image_bytes in images]
+
+    async def extractBatchAsync(self, images: Sequence[bytes], language: str = 'spa') -> List[Optional[OCRExtraction]]:
+        """Versión awaitable de `extractBatchFromImages`, en el pool de hilos del motor."""
+        return await self._runInExecutor(self.extractBatchFromImages, list(images), language)
+
+    async def streamAsync(
+        self, image_bytes: bytes, language: str = 'spa'
+    ) -> AsyncIterator[Union[str, OCRExtraction]]:
+        """
+        Extracción en streaming sin bloquear el event loop.
+
+        Produce los trozos de texto (`str`) según llegan y, al final, un `OCRExtraction`
+        con el texto completo ya limpio (idéntico al de `extractAsync`).
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            RuntimeError: Si hay un error al procesar la imagen.
+        """
+        chunks = []
+        async for chunk in self._iterateInExecutor(self.streamTextFromImage, image_bytes, language):
+            chunks.append(chunk)
+            yield chunk
+        yield self.decodeOutput("".join(chunks))
+
+    async def _iterateInExecutor(self, factory: Callable[..., Iterator[str]], *args: Any) -> AsyncIterator[str]:
+        """
+        Recorre un iterador bloqueante en el pool de hilos del motor y entrega sus
+        elementos al event loop. Si el consumidor deja de leer, el hilo se detiene en
+        el siguiente elemento.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def put(item: Any) -> None:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # El event loop ya se cerró: nadie va a leer el resultado.
+                stop.set()
+
+        def produce() -> None:
+            try:
+                for element in factory(*args):
+                    if stop.is_set():
+                        return
+                    put((element, None))
+            except Exception as e:
+                put((done, e))
+                return
+            put((done, None))
+
+        self._runInExecutor(produce)
+        try:
+            while True:
+                element, error = await queue.get()
+                if element is done:
+                    if error is not None:
+                        raise error
+                    return
+                yield element
+        finally:
+            stop.set()
+
+    async def extractAsync(self, image_bytes: bytes, language: str = 'spa') -> OCRExtraction:
+        """
+        Como `extractTextFromImageAsync`, pero indicando qué motor produjo el texto.
+
+        Se ejecuta `extractFromImage` en el pool de hilos del motor, así que la respuesta
+        llega ya decodificada si el motor produce JSON. Los motores que pueden delegar en
+        otro (ver `ResilientOCREngine`) lo sobrescriben para que el pipeline parsee la
+        respuesta con el formato correcto.
+        """
+        return await self._runInExecutor(self.extractFromImage, image_bytes, language)
+
+    def getStats(self) -> Optional[Dict[str, Any]]:
+        """Métricas propias del motor, si las tiene."""
+        return None
+
+    def warmUp(self) -> None:
+        """Arranca los hilos del pool para que la primera petición no pague ese coste."""
+        executor = self._getExecutor()
+        for future in [executor.submit(lambda: None) for _ in range(self.max_concurrency)]:
+            future.result()
+
+    def close(self) -> None:
+        """Libera el pool de hilos. Las extracciones en curso terminan antes de cerrar."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -1,30 +1,89 @@
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
 from PIL import Image
 import io
 # import cv2 # Ya no es necesario para el preprocesamiento si Gemini lo maneja bien
 # import numpy as np # Ya no es necesario
 import os
-import json
-from typing import Optional, Dict, Any
+import threading
+from typing import Optional, Dict, Any, Iterator, List, Sequence, Tuple
+
+from app.services import json_codec
+from app.services.api_key_pool import ApiKeyPool, KeyLease
+from app.services.deadlines import boundedTimeout
+from app.services.image_preprocessor import ImagePreprocessor
+from app.services.preprocess_pool import PreprocessPool
+from app.services.json_repair import JSONRepairError, hasReceiptData, repairJson
+from app.services.ocr_engine import OCREngine, OCRExtraction
 
 # ¡¡¡ADVERTENCIA DE SEGURIDAD!!!
 # Es MUY RECOMENDABLE cargar la API key desde una variable de entorno en producción.
 # Ejemplo: API_KEY = os.getenv("GEMINI_API_KEY")
 # No la dejes hardcodeada así, especialmente si el código es compartido o público.
 
-class OCRService:
-    def __init__(self, api_key: Optional[str] = None):
+class BatchDemultiplexError(RuntimeError):
+    """La respuesta de una petición con varias imágenes no se puede separar por imagen."""
+
+
+class OCRService(OCREngine):
+    # Motor OCR basado en Gemini. Pensado para crearse una sola vez por proceso (ver
+    # `app.core.lifecycle`): el modelo y su conexión se reutilizan entre peticiones y las
+    # llamadas bloqueantes se ejecutan en el pool de hilos acotado de `OCREngine`.
+    name = "gemini"
+    output_format = "json"
+
+    DEFAULT_MODEL = "gemini-1.5-flash-latest"
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        image_preprocessor: Optional[ImagePreprocessor] = None,
+        max_concurrency: Optional[int] = None,
+        request_timeout: Optional[float] = None,
+        repair_json: bool = True,
+        model_name: Optional[str] = None,
+        key_pool: Optional[ApiKeyPool] = None,
+        preprocess_pool: Optional[PreprocessPool] = None,
+    ):
         """
         Inicializa el servicio OCR usando la API de Gemini.
         
         Args:
             api_key: Clave API opcional. Si no se proporciona, se intentará obtener de GEMINI_API_KEY.
+            image_preprocessor: Preprocesador que reduce y recomprime la imagen antes de enviarla.
+                Si no se proporciona, la imagen se envía sin reducir.
+            max_concurrency: Llamadas simultáneas máximas al modelo desde `extractTextFromImageAsync`.
+                Si no se proporciona, se usa `OCR_MAX_CONCURRENCY`.
+            request_timeout: Tiempo máximo (segundos) de cada llamada HTTP al modelo. Si no se
+                proporciona, se usa el del SDK.
+            repair_json: Si es True, una respuesta con JSON mal formado se repara (ver
+                `app.services.json_repair`) en lugar de descartarse.
+            model_name: Modelo de Gemini a usar. Por defecto, `DEFAULT_MODEL`.
+            key_pool: Pool de claves API. Con él no se toca la configuración global de
+                `genai`: cada clave tiene su propio cliente y cada llamada usa la que
+                indique el pool (ver `app.services.api_key_pool`).
+            preprocess_pool: Pool de procesos en el que se prepara la imagen (con la
+                configuración de su preprocesador) en lugar de en el hilo de la llamada.
         
         Raises:
             ValueError: Si no se puede encontrar una API key válida.
             RuntimeError: Si hay un error al configurar la API de Gemini.
         """
-        self._configure_api(api_key)
+        super().__init__(max_concurrency)
+        self.image_preprocessor = image_preprocessor
+        self.request_timeout = request_timeout
+        self.repair_json = repair_json
+        self.model_name = model_name or self.DEFAULT_MODEL
+        self.key_pool = key_pool
+        self.preprocess_pool = preprocess_pool
+        self._models: Dict[str, Any] = {}
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "responses": 0, "repaired": 0, "unrecoverable": 0, "repairs": {},
+            "batch_calls": 0, "batch_images": 0, "batch_unmatched": 0,
+        }
+        if key_pool is None:
+            self._configure_api(api_key)
         self._initialize_model()
 
     def _configure_api(self, api_key: Optional[str]) -> None:
@@ -41,16 +100,70 @@ class OCRService:
             raise RuntimeError(f"Error al configurar Gemini API: {e}") from e
 
     def _initialize_model(self) -> None:
-        """Inicializa el modelo de Gemini."""
+        """Inicializa el modelo de Gemini (uno por clave si hay pool)."""
         try:
-            self.model = genai.GenerativeModel('gemini-1.5-flash-latest')
+            if self.key_pool is None:
+                self.model = genai.GenerativeModel(self.model_name)
+                return
+            for key_id, api_key in self.key_pool.api_keys.items():
+                self._models[key_id] = self._modelForKey(api_key)
+            self.model = next(iter(self._models.values()))
         except Exception as e:
             raise RuntimeError(f"Error al inicializar el modelo de Gemini: {e}") from e
 
+    def _modelForKey(self, api_key: str) -> Any:
+        """
+        Modelo con un cliente propio para `api_key`, sin `genai.configure`.
+
+        `GenerativeModel` no admite un cliente en el constructor: solo crea el de la
+        configuración global si su atributo `_client` sigue vacío. Se le asigna el de la
+        clave al crearlo; si una versión del SDK deja de tener ese atributo se falla aquí,
+        al arrancar, en lugar de usar en silencio la clave global
+        (ver `test_modelForKey_sdkUsesInjectedClient`).
+        """
+        model = genai.GenerativeModel(self.model_name)
+        if not hasattr(model, "_client"):
+            raise RuntimeError(
+                "Esta versión de google-generativeai no permite un cliente por clave; "
+                "usa GEMINI_API_KEY en lugar de GEMINI_API_KEYS"
+            )
+        model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        return model
+
+    def _generateContent(self, contents: List[Any], **kwargs: Any) -> Any:
+        """Llama a `generate_content` con la clave que asigne el pool (si lo hay)."""
+        if self.key_pool is None:
+            return self.model.generate_content(contents, **kwargs, **self._requestKwargs())
+        request_kwargs = self._requestKwargs()
+        lease = self.key_pool.acquire()
+        try:
+            response = self._models[lease.key_id].generate_content(contents, **kwargs, **request_kwargs)
+        except Exception as e:
+            self.key_pool.release(lease, error=e)
+            raise
+        self.key_pool.release(lease)
+        return response
+
+    def warmUp(self) -> None:
+        """
+        Prepara el servicio para que la primera petición no pague costes de arranque:
+        arranca los hilos del pool y ejercita una vez el preprocesado (carga de los
+        codificadores de Pillow).
+        """
+        super().warmUp()
+        if self.image_preprocessor is not None:
+            buffer = io.BytesIO()
+            Image.new('RGB', (32, 32), color='white').save(buffer, format='JPEG')
+            image = self.image_preprocessor.decode(buffer.getvalue())
+            image.save(io.BytesIO(), format=self.image_preprocessor.output_format)
+
     def _preprocessImageForOcr(self, image_bytes: bytes) -> Image.Image:
         """
         Preprocesa la imagen para OCR.
         
+        Con preprocesador, además de convertir a RGB aplica la orientación EXIF y
+        limita la resolución (ver `ImagePreprocessor.decode`).
+        
         Args:
             image_bytes: Bytes de la imagen a procesar.
             
@@ -60,6 +173,8 @@ class OCRService:
         Raises:
             ValueError: Si los bytes de la imagen no son válidos.
         """
+        if self.image_preprocessor is not None:
+            return self.image_preprocessor.decode(image_bytes)
         try:
             image = Image.open(io.BytesIO(image_bytes))
             if image.mode != 'RGB':
@@ -68,6 +183,17 @@ class OCRService:
         except Exception as e:
             raise ValueError(f"Los bytes de la imagen no son válidos: {e}") from e
 
+    def _encodeImageForModel(self, image: Image.Image, original_size_bytes: int) -> Any:
+        """
+        Convierte la imagen preprocesada en la parte que se envía a `generate_content`.
+        
+        Sin preprocesador se envía el objeto PIL, que el SDK codifica como WebP sin pérdida
+        a resolución completa; con él, un blob JPEG/WebP comprimido.
+        """
+        if self.image_preprocessor is None:
+            return image
+        return self.image_preprocessor.encode(image, original_size_bytes).asBlob()
+
     def _clean_json_response(self, text: str) -> str:
         """
         Limpia la respuesta JSON del modelo.
@@ -93,6 +219,185 @@ class OCRService:
         
         return cleaned_text.strip()
 
+    def _buildContents(self, image_bytes: bytes, language: str) -> List[Any]:
+        """Prepara el prompt y la imagen que se envían a `generate_content`."""
+        if self.preprocess_pool is not None:
+            return [self._generate_prompt(language), self.preprocess_pool.prepare(image_bytes).asBlob()]
+        pil_image = self._preprocessImageForOcr(image_bytes)
+        image_part = self._encodeImageForModel(pil_image, len(image_bytes))
+        return [self._generate_prompt(language), image_part]
+
+    def _buildBatchContents(self, images: Sequence[bytes], language: str) -> List[Any]:
+        """Prompt de lote seguido de cada imagen, precedida de su número ("Imagen 1:", ...)."""
+        contents: List[Any] = [self._generate_batch_prompt(language, len(images))]
+        if self.preprocess_pool is not None:
+            # Las imágenes del lote se preparan a la vez, cada una en un proceso.
+            image_parts = [prepared.asBlob() for prepared in self.preprocess_pool.prepareMany(images)]
+        else:
+            image_parts = [
+                self._encodeImageForModel(self._preprocessImageForOcr(image_bytes), len(image_bytes))
+                for image_bytes in images
+            ]
+        for number, image_part in enumerate(image_parts, start=1):
+            contents.append(f"Imagen {number}:")
+            contents.append(image_part)
+        return contents
+
+    def _requestKwargs(self) -> Dict[str, Any]:
+        # Con timeout, el SDK aborta la llamada HTTP y el hilo del pool queda libre. Nunca
+        # más allá del plazo de la petición (lanza DeadlineExceededError si ya ha vencido).
+        timeout = boundedTimeout(self.request_timeout)
+        return {"request_options": {"timeout": timeout}} if timeout else {}
+
+    def finishStreamedText(self, text: str) -> str:
+        """
+        Limpia la respuesta completa del modelo y comprueba que es un JSON válido.
+
+        Raises:
+            RuntimeError: Si la respuesta no es un JSON válido.
+        """
+        return self.decodeOutput(text).text
+
+    def decodeOutput(self, text: str) -> OCRExtraction:
+        """
+        Limpia la respuesta completa del modelo y la decodifica (una sola vez).
+
+        Si no es JSON válido se intenta repararla; solo se descarta (y el error hace
+        que la capa de resiliencia repita la llamada) si no se recupera nada útil.
+
+        Raises:
+            RuntimeError: Si la respuesta no es un JSON válido ni se puede reparar.
+        """
+        if not text:
+            return OCRExtraction("", self.name, self.output_format)
+        cleaned_text = self._clean_json_response(text)
+
+        try:
+            data = json_codec.loads(cleaned_text)
+        except json_codec.JSONDecodeError as e:
+            if not self.repair_json:
+                self._recordResponse(None)
+                raise RuntimeError(f"La respuesta del modelo no es un JSON válido: {e}")
+            try:
+                repaired = repairJson(cleaned_text)
+            except JSONRepairError:
+                repaired = None
+            if repaired is None or not hasReceiptData(repaired.data):
+                self._recordResponse(None)
+                raise RuntimeError(f"La respuesta del modelo no es un JSON válido: {e}")
+            self._recordResponse(repaired.repairs)
+            return OCRExtraction(
+                json_codec.dumps(repaired.data), self.name, self.output_format, repaired.data, repaired.repairs
+            )
+
+        self._recordResponse(())
+        return OCRExtraction(cleaned_text, self.name, self.output_format, data)
+
+    def decodeBatchOutput(self, text: str, count: int) -> List[Optional[OCRExtraction]]:
+        """
+        Separa la respuesta de una petición con `count` imágenes en un resultado por imagen.
+
+        Se espera `{"receipts": [{"image": 1, ...}, ...]}` (o directamente la lista). Cada
+        elemento se asigna a su imagen por el campo `image` o, si ninguno lo trae y hay
+        tantos elementos como imágenes, por su posición. Las imágenes sin un elemento
+        aprovechable (ausente, repetido o vacío) quedan a None.
+
+        Raises:
+            BatchDemultiplexError: Si no se puede asignar ningún resultado.
+        """
+        # Sin `_clean_json_response`: la respuesta puede ser una lista, no un objeto.
+        cleaned_text = (text or "").strip()
+        if cleaned_text.startswith("```"):
+            cleaned_text = cleaned_text.split("\n", 1)[1] if "\n" in cleaned_text else ""
+        if cleaned_text.endswith("```"):
+            cleaned_text = cleaned_text[:-3].strip()
+        try:
+            data = json_codec.loads(cleaned_text)
+            repairs: Tuple[str, ...] = ()
+        except json_codec.JSONDecodeError:
+            try:
+                repaired = repairJson(cleaned_text) if self.repair_json else None
+            except JSONRepairError:
+                repaired = None
+            if repaired is None:
+                self._recordResponse(None)
+                raise BatchDemultiplexError("La respuesta del lote no es un JSON válido")
+            data, repairs = repaired.data, repaired.repairs
+        documents = data.get("receipts") if isinstance(data, dict) else data
+        if not isinstance(documents, list):
+            self._recordResponse(None)
+            raise BatchDemultiplexError("La respuesta del lote no contiene la lista 'receipts'")
+
+        documents = [document for document in documents if isinstance(document, dict)]
+        numbers = [document.get("image") for document in documents]
+        by_position = all(number is None for number in numbers) and len(documents) == count
+        results: List[Optional[OCRExtraction]] = [None] * count
+        seen: Dict[int, int] = {}
+        for position, document in enumerate(documents):
+            number = position + 1 if by_position else numbers[position]
+            if isinstance(number, bool) or not isinstance(number, int) or not 1 <= number <= count:
+                continue
+            seen[number] = seen.get(number, 0) + 1
+            payload = {key: value for key, value in document.items() if key != "image"}
+            if hasReceiptData(payload):
+                results[number - 1] = OCRExtraction(
+                    json_codec.dumps(payload), self.name, self.output_format, payload, repairs
+                )
+        for number, times in seen.items():
+            if times > 1:
+                results[number - 1] = None  # Dos respuestas para la misma imagen: ambigua
+        matched = sum(result is not None for result in results)
+        self._recordResponse(None if matched == 0 else repairs)
+        with self._stats_lock:
+            self._stats["batch_calls"] += 1
+            self._stats["batch_images"] += count
+            self._stats["batch_unmatched"] += count - matched
+        if matched == 0:
+            raise BatchDemultiplexError("No se ha podido asignar ninguna respuesta del lote a su imagen")
+        return results
+
+    def _recordResponse(self, repairs: Optional[Tuple[str, ...]]) -> None:
+        """Cuenta una respuesta: válida (`()`), reparada o irrecuperable (None)."""
+        with self._stats_lock:
+            self._stats["responses"] += 1
+            if repairs is None:
+                self._stats["unrecoverable"] += 1
+            elif repairs:
+                self._stats["repaired"] += 1
+                for repair in repairs:
+                    self._stats["repairs"][repair] = self._stats["repairs"].get(repair, 0) + 1
+
+    def getStats(self) -> Dict[str, Any]:
+        """Respuestas del modelo decodificadas, reparadas y descartadas (y uso de las claves)."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["repairs"] = dict(self._stats["repairs"])
+        if self.key_pool is not None:
+            stats["api_keys"] = self.key_pool.getStats()
+        return stats
+
+    def _generateText(self, image_bytes: bytes, language: str) -> str:
+        """
+        Envía la imagen al modelo y devuelve su respuesta sin limpiar ("" si está vacía).
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            RuntimeError: Si hay un error al llamar al modelo.
+        """
+        try:
+            contents = self._buildContents(image_bytes, language)
+            response = self._generateContent(contents)
+            
+            if not response.parts or not response.parts[0].text:
+                return ""
+            
+            return response.parts[0].text
+            
+        except Exception as e:
+            if isinstance(e, (ValueError, RuntimeError)):
+                raise
+            raise RuntimeError(f"Error al procesar imagen con Gemini: {e}") from e
+
     def extractTextFromImage(self, image_bytes: bytes, language: str = 'spa') -> str:
         """
         Extrae texto de una imagen usando la API de Gemini.
@@ -108,30 +413,74 @@ class OCRService:
             ValueError: Si los bytes de la imagen no son válidos.
             RuntimeError: Si hay un error al procesar la imagen.
         """
+        return self.extractFromImage(image_bytes, language).text
+
+    def extractFromImage(self, image_bytes: bytes, language: str = 'spa') -> OCRExtraction:
+        """
+        Como `extractTextFromImage`, pero devolviendo también el JSON decodificado.
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            RuntimeError: Si hay un error al procesar la imagen.
+        """
+        return self.decodeOutput(self._generateText(image_bytes, language))
+
+    def extractBatchFromImages(self, images: Sequence[bytes], language: str = 'spa') -> List[Optional[OCRExtraction]]:
+        """
+        Lee varias imágenes de ticket con una sola llamada a `generate_content`.
+
+        Returns:
+            List[Optional[OCRExtraction]]: Un resultado por imagen (ver `decodeBatchOutput`).
+
+        Raises:
+            ValueError: Si los bytes de alguna imagen no son válidos.
+            BatchDemultiplexError: Si la respuesta no se puede separar por imagen.
+            RuntimeError: Si hay un error al llamar al modelo.
+        """
+        if len(images) == 1:
+            return [self.extractFromImage(images[0], language)]
         try:
-            pil_image = self._preprocessImageForOcr(image_bytes)
-            
-            prompt = self._generate_prompt(language)
-            response = self.model.generate_content([prompt, pil_image])
-            
-            if not response.parts or not response.parts[0].text:
-                return ""
-            
-            extracted_text = response.parts[0].text
-            cleaned_text = self._clean_json_response(extracted_text)
-            
-            # Validar que el texto limpio es un JSON válido
-            try:
-                json.loads(cleaned_text)
-            except json.JSONDecodeError as e:
-                raise RuntimeError(f"La respuesta del modelo no es un JSON válido: {e}")
-            
-            return cleaned_text
-            
+            contents = self._buildBatchContents(images, language)
+            response = self._generateContent(contents)
+            text = response.parts[0].text if response.parts and response.parts[0].text else ""
+        except Exception as e:
+            if isinstance(e, (ValueError, RuntimeError)):
+                raise
+            raise RuntimeError(f"Error al procesar el lote de imágenes con Gemini: {e}") from e
+        return self.decodeBatchOutput(text, len(images))
+
+    def streamTextFromImage(self, image_bytes: bytes, language: str = 'spa') -> Iterator[str]:
+        """
+        Como `extractTextFromImage`, pero usando la API de streaming del modelo: devuelve
+        los trozos de la respuesta (sin limpiar) a medida que se generan.
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            RuntimeError: Si hay un error al procesar la imagen.
+        """
+        lease: Optional[KeyLease] = None
+        error: Optional[BaseException] = None
+        try:
+            contents = self._buildContents(image_bytes, language)
+            model = self.model
+            if self.key_pool is not None:
+                # La clave queda ocupada hasta que termina el streaming (los errores de
+                # cuota pueden llegar con el primer trozo).
+                lease = self.key_pool.acquire()
+                model = self._models[lease.key_id]
+            response = model.generate_content(contents, stream=True, **self._requestKwargs())
+            for chunk in response:
+                text = "".join(part.text for part in chunk.parts if getattr(part, "text", None))
+                if text:
+                    yield text
         except Exception as e:
+            error = e
             if isinstance(e, (ValueError, RuntimeError)):
                 raise
             raise RuntimeError(f"Error al procesar imagen con Gemini: {e}") from e
+        finally:
+            if lease is not None:
+                self.key_pool.release(lease, error=error)
 
     def _generate_prompt(self, language: str) -> str:
         """Genera el prompt para el modelo."""
@@ -167,6 +516,18 @@ INSTRUCCIONES IMPORTANTES:
 - Si el subtotal o los impuestos no se pueden determinar claramente, usa null para sus valores
 - No incluyas ningún texto explicativo adicional fuera del objeto JSON
 - Siempre incluye el campo "is_ticket" para indicar si la imagen es un ticket válido
+"""
+
+    def _generate_batch_prompt(self, language: str, count: int) -> str:
+        """Prompt para leer `count` imágenes en una sola llamada."""
+        return f"""
+Vas a recibir {count} imágenes, cada una precedida por su número ("Imagen 1:", "Imagen 2:", ...).
+Aplica a CADA imagen, por separado, las instrucciones siguientes.
+{self._generate_prompt(language)}
+FORMATO DE RESPUESTA PARA VARIAS IMÁGENES (tiene prioridad sobre lo anterior):
+- Devuelve un único objeto JSON: {{"receipts": [ ... ]}} con exactamente {count} elementos, uno por imagen y en el mismo orden.
+- Cada elemento es el JSON que corresponda a esa imagen según las instrucciones anteriores, con un campo adicional "image" con su número.
+- No mezcles artículos de imágenes distintas.
 """
 
 # Ejemplo de uso (no se ejecutará directamente aquí):
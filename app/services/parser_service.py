@@ -1,19 +1,43 @@
 import re
-import json # Para parsear la respuesta JSON de Gemini
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Pattern, Sequence
 from app.models.item import Item, ItemCreate # Asumiendo que ItemCreate y Item están definidos
+from app.services.json_repair import JSONRepairError, repairJson # Para parsear la respuesta JSON de Gemini
+from app.services.ocr_engine import OCRExtraction
 
 class ParserService:
+    # El servicio no guarda estado entre llamadas (los IDs de ítems se numeran en cada
+    # parseo), así que una misma instancia se puede compartir entre peticiones concurrentes.
     def __init__(self):
-        # Las regex para extraer totales podrían seguir siendo útiles como fallback 
-        # o si Gemini no los proporciona de forma consistente en el JSON principal.
-        # Por ahora, las mantenemos por si son necesarias para complementar el JSON.
+        # Regex para extraer totales de texto plano (motores OCR locales como Tesseract).
+        # El importe es siempre el último grupo de cada patrón; `total_fields` indica a qué
+        # campo del resultado corresponde cada uno.
         self.total_patterns = [
-            re.compile(r"^(TOTAL\s*(?:NETO|BRUTO|A PAGAR)?):?\s*€?(\d+[,.]\d{1,2})\s*€?$", re.IGNORECASE),
-            re.compile(r"^(SUBTOTAL|BASE IMPONIBLE):?\s*€?(\d+[,.]\d{1,2})\s*€?$", re.IGNORECASE),
-            re.compile(r"^(?:IVA|VAT|IMPUESTOS)\s*(?:\(\s*\d{1,2}\s*%\s*\))?:?\s*€?(\d+[,.]\d{1,2})\s*€?$", re.IGNORECASE),
+            re.compile(r"^(TOTAL\s*(?:NETO|BRUTO|A PAGAR)?):?\s*(?:EUR(?:OS)?)?\s*€?\s*(\d+[,.]\d{1,2})\s*€?$", re.IGNORECASE),
+            re.compile(r"^(SUBTOTAL|BASE IMPONIBLE):?\s*€?\s*(\d+[,.]\d{1,2})\s*€?$", re.IGNORECASE),
+            re.compile(r"^(?:IVA|I\.V\.A\.?|VAT|IMPUESTOS)\s*(?:\(?\s*\d{1,2}(?:[,.]\d+)?\s*%\s*\)?)?:?\s*€?\s*(\d+[,.]\d{1,2})\s*€?$", re.IGNORECASE),
         ]
-        self.next_item_id = 1
+        self.total_fields = ["total", "subtotal", "tax"]
+        # Líneas de ítem, de la forma más específica a la más general. Los importes llevan
+        # siempre dos decimales para no confundirlos con cantidades o códigos.
+        amount = r"(-?\d+[,.]\d{2})\s*€?"
+        quantity = r"(?P<qty>\d+(?:[,.]\d+)?)"
+        self.item_patterns = [
+            # "2 x CAÑA 1,30 2,60"
+            re.compile(rf"^{quantity}\s*[xX*]?\s+(?P<desc>.+?)\s+(?P<unit>{amount})\s+(?P<total>{amount})$"),
+            # "CAÑA 2 x 1,30 2,60"
+            re.compile(rf"^(?P<desc>.+?)\s+{quantity}\s*[xX*]\s*(?P<unit>{amount})\s+(?P<total>{amount})$"),
+            # "2 x CAÑA 2,60"
+            re.compile(rf"^{quantity}\s*[xX*]?\s+(?P<desc>.+?)\s+(?P<total>{amount})$"),
+            # "CAÑA 2,60"
+            re.compile(rf"^(?P<desc>.+?)\s+(?P<total>{amount})$"),
+        ]
+        # Líneas con importe que no son artículos (pagos, cambio, datos fiscales...)
+        self.non_item_pattern = re.compile(
+            r"\b(?:TOTAL|SUBTOTAL|BASE|IVA|I\.V\.A|IMPUESTOS?|CAMBIO|EFECTIVO|ENTREGADO|TARJETA|VISA|"
+            r"MASTERCARD|PAGADO|PAGO|DEVOLUCI[OÓ]N|CIF|NIF|TEL[EÉ]FONO|TELF?|FECHA|HORA|MESA|FACTURA)\b",
+            re.IGNORECASE,
+        )
+        self.letter_pattern = re.compile(r"[A-Za-zÁÉÍÓÚÜÑáéíóúüñ]")
 
     def _parsePrice(self, price_val: Any) -> Optional[float]:
         if price_val is None: return None
@@ -42,29 +66,35 @@ class ParserService:
         """
         Analiza el texto (que se espera sea JSON) de un ticket y extrae los artículos y totales.
         """
-        parsed_items: List[Item] = []
-        extracted_data = {
-            "items": [],
-            "subtotal": None,
-            "tax": None,
-            "total": None,
-            "raw_text": raw_text_json, # Guardamos el JSON original por si acaso
-            "is_ticket": True,  # Por defecto asumimos que es un ticket
-            "error_message": None,
-            "detected_content": None
-        }
-        self.next_item_id = 1
+        extracted_data = self._emptyResult(raw_text_json) # Guardamos el JSON original por si acaso
 
         try:
-            # Intentar parsear el texto de entrada como JSON
-            data_from_gemini = json.loads(raw_text_json)
-        except json.JSONDecodeError as e:
+            # Intentar parsear el texto de entrada como JSON; si está mal formado (comas
+            # finales, comentarios, texto alrededor, cortado...) se recupera lo que se pueda.
+            repaired = repairJson(raw_text_json)
+        except JSONRepairError as e:
             print(f"Error al decodificar JSON de Gemini: {e}. Raw text: {raw_text_json[:500]}...")
-            # Si falla el parseo de JSON, podríamos intentar un fallback a regex sobre el texto original,
-            # pero por ahora simplemente devolveremos los datos vacíos y un error.
-            # Opcional: Podríamos re-lanzar un error aquí o manejarlo de otra forma.
-            # raise ValueError(f"El texto de OCR no es un JSON válido: {e}") from e
-            return extracted_data # Devuelve datos vacíos si el JSON es inválido
+            return extracted_data # Devuelve datos vacíos si el JSON es irrecuperable
+
+        extracted_data = self.parseJsonData(repaired.data, raw_text_json)
+        extracted_data["json_repairs"] = list(repaired.repairs)
+        return extracted_data
+
+    def parseJsonData(self, data_from_gemini: Any, raw_text: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Como `parseTextToItems`, pero a partir de la respuesta ya decodificada.
+
+        Args:
+            data_from_gemini: JSON decodificado de la respuesta del modelo.
+            raw_text: Texto original, que se guarda en `raw_text` del resultado.
+        """
+        parsed_items: List[Item] = []
+        extracted_data = self._emptyResult(raw_text)
+        next_item_id = 1
+
+        if not isinstance(data_from_gemini, dict):
+            print(f"La respuesta de Gemini no es un objeto JSON: {type(data_from_gemini).__name__}")
+            return extracted_data
 
         # Verificar si la imagen es un ticket válido
         is_ticket = data_from_gemini.get("is_ticket", True)
@@ -76,27 +106,175 @@ class ParserService:
             extracted_data["detected_content"] = data_from_gemini.get("detected_content")
             return extracted_data
 
-        gemini_items = data_from_gemini.get("items", [])
+        gemini_items = data_from_gemini.get("items") or []
         for g_item in gemini_items:
-            desc = g_item.get("description")
-            qty = self._parseQuantity(g_item.get("quantity"))
-            unit_price = self._parsePrice(g_item.get("unit_price"))
-
-            if desc and unit_price is not None: # unit_price puede ser 0.0
-                parsed_items.append(Item(
-                    id=self.next_item_id,
-                    name=str(desc).strip(),
-                    quantity=qty,
-                    price=unit_price,
-                    total_price=round(qty * unit_price, 2)
-                ))
-                self.next_item_id += 1
+            if not isinstance(g_item, dict):
+                continue
+            item = self.parseJsonItem(g_item, next_item_id)
+            if item is not None:
+                parsed_items.append(item)
+                next_item_id += 1
         
         extracted_data["items"] = parsed_items
         extracted_data["subtotal"] = self._parsePrice(data_from_gemini.get("subtotal"))
         extracted_data["tax"] = self._parsePrice(data_from_gemini.get("tax"))
         extracted_data["total"] = self._parsePrice(data_from_gemini.get("total"))
 
+        self._completeTotals(extracted_data, parsed_items)
+        return extracted_data
+
+    def parseJsonItem(self, g_item: Dict[str, Any], item_id: int) -> Optional[Item]:
+        """
+        Convierte un elemento de `items` del JSON de Gemini en un `Item`.
+
+        Devuelve None si le falta la descripción o el precio. Lo usan tanto
+        `parseTextToItems` como la extracción en streaming, para que ambas produzcan
+        exactamente los mismos ítems.
+        """
+        desc = g_item.get("description")
+        qty = self._parseQuantity(g_item.get("quantity"))
+        unit_price = self._parsePrice(g_item.get("unit_price"))
+
+        if desc and unit_price is not None: # unit_price puede ser 0.0
+            return Item(
+                id=item_id,
+                name=str(desc).strip(),
+                quantity=qty,
+                price=unit_price,
+                total_price=round(qty * unit_price, 2)
+            )
+        return None
+
+    def parseReceiptText(
+        self,
+        raw_text: str,
+        item_patterns: Optional[Sequence[Pattern]] = None,
+        skip_pattern: Optional[Pattern] = None,
+    ) -> Dict[str, Any]:
+        """
+        Analiza el texto plano de un ticket (ej. salida de Tesseract) línea a línea.
+
+        Las líneas de totales se reconocen con `total_patterns` y las de artículos con
+        `item_patterns` (cantidad opcional, descripción, precio unitario opcional e
+        importe). Devuelve la misma estructura que `parseTextToItems`.
+
+        Args:
+            raw_text: Texto del ticket.
+            item_patterns: Patrones de ítem a usar en lugar de `self.item_patterns` (ej. el
+                formato aprendido de un comercio, ver `merchant_templates`).
+            skip_pattern: Líneas que, además de `non_item_pattern`, no son artículos.
+        """
+        extracted_data = self._emptyResult(raw_text)
+        parsed_items: List[Item] = []
+
+        for raw_line in raw_text.splitlines():
+            line = " ".join(raw_line.split())
+            if not line or self._matchTotalLine(line, extracted_data):
+                continue
+            if self.non_item_pattern.search(line):
+                continue
+            if skip_pattern is not None and skip_pattern.search(line):
+                continue
+            item = self._parseItemLine(line, len(parsed_items) + 1, item_patterns)
+            if item is not None:
+                parsed_items.append(item)
+
+        if not parsed_items and extracted_data["total"] is None:
+            extracted_data["is_ticket"] = False
+            extracted_data["error_message"] = (
+                "No se ha podido leer ningún artículo ni total en la imagen. "
+                "Por favor, sube una imagen de un ticket de compra o factura válido."
+            )
+            first_line = next((line.strip() for line in raw_text.splitlines() if line.strip()), None)
+            extracted_data["detected_content"] = first_line[:80] if first_line else None
+            return extracted_data
+
+        extracted_data["items"] = parsed_items
+        self._completeTotals(extracted_data, parsed_items)
+        return extracted_data
+
+    def parseEngineOutput(self, raw_text: str, output_format: str = "json") -> Dict[str, Any]:
+        """
+        Parsea la salida de un motor OCR según su formato (ver `OCREngine.output_format`).
+
+        Args:
+            raw_text: Texto devuelto por el motor.
+            output_format: "text" para texto plano; cualquier otro valor se trata como JSON.
+        """
+        if output_format == "text":
+            return self.parseReceiptText(raw_text)
+        return self.parseTextToItems(raw_text)
+
+    def parseExtraction(self, extraction: OCRExtraction, keep_raw_text: bool = True) -> Dict[str, Any]:
+        """
+        Parsea un `OCRExtraction`, reutilizando su JSON ya decodificado si lo trae.
+
+        Args:
+            extraction: Resultado del motor OCR.
+            keep_raw_text: Si es False, el resultado no guarda el texto original en `raw_text`.
+        """
+        if extraction.data is not None:
+            parsed = self.parseJsonData(extraction.data, extraction.text)
+            parsed["json_repairs"] = list(extraction.repairs)
+        else:
+            parsed = self.parseEngineOutput(extraction.text, extraction.output_format)
+        if not keep_raw_text:
+            parsed["raw_text"] = None
+        return parsed
+
+    def _emptyResult(self, raw_text: Optional[str]) -> Dict[str, Any]:
+        return {
+            "items": [],
+            "subtotal": None,
+            "tax": None,
+            "total": None,
+            "raw_text": raw_text,
+            "is_ticket": True,  # Por defecto asumimos que es un ticket
+            "error_message": None,
+            "detected_content": None,
+            "json_repairs": [],  # Correcciones aplicadas a un JSON mal formado (ver json_repair)
+        }
+
+    def _matchTotalLine(self, line: str, extracted_data: Dict[str, Any]) -> bool:
+        """Si la línea es un total/subtotal/impuesto, guarda el importe y devuelve True."""
+        for pattern, field in zip(self.total_patterns, self.total_fields):
+            match = pattern.match(line)
+            if match:
+                if extracted_data[field] is None:
+                    extracted_data[field] = self._parsePrice(match.group(match.lastindex))
+                return True
+        return False
+
+    def _parseItemLine(
+        self, line: str, item_id: int, item_patterns: Optional[Sequence[Pattern]] = None
+    ) -> Optional[Item]:
+        """Intenta interpretar una línea como artículo."""
+        for pattern in item_patterns or self.item_patterns:
+            match = pattern.match(line)
+            if not match:
+                continue
+            groups = match.groupdict()
+            desc = groups["desc"].strip(" .:-")
+            if not self.letter_pattern.search(desc):
+                continue
+            qty = self._parseQuantity(groups.get("qty"))
+            line_total = self._parsePrice(groups["total"].rstrip(" €"))
+            unit_price = self._parsePrice(groups["unit"].rstrip(" €")) if groups.get("unit") else None
+            if line_total is None:
+                continue
+            if unit_price is None:
+                unit_price = round(line_total / qty, 2) if qty else line_total
+            return Item(
+                id=item_id,
+                name=desc,
+                quantity=qty,
+                price=unit_price,
+                total_price=round(line_total, 2)
+            )
+        return None
+
+    def _completeTotals(self, extracted_data: Dict[str, Any], parsed_items: List[Item]) -> None:
+        """Completa total y subtotal a partir de los ítems cuando el ticket no los indica."""
         # Lógica de post-procesamiento (similar a la anterior, puede ser útil si faltan datos del JSON)
         if not parsed_items and extracted_data["total"] is None:
              print("No se encontraron ítems ni total en el JSON de Gemini.")
@@ -119,7 +297,6 @@ class ParserService:
             calculated_subtotal_from_items = sum(item.total_price for item in parsed_items)
             extracted_data["subtotal"] = round(calculated_subtotal_from_items, 2)
 
-        return extracted_data
 
 # Ejemplo de uso (actualizado para esperar JSON):
 # if __name__ == '__main__':
@@ -0,0 +1,176 @@
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import Settings
+from app.services.image_preprocessor import ImagePreprocessor, PreparedImage
+
+
+# Preprocesador de cada proceso del pool (lo crea `_initWorker` al arrancar el proceso).
+_worker_preprocessor: Optional[ImagePreprocessor] = None
+
+
+def _initWorker(options: Dict[str, Any]) -> None:
+    global _worker_preprocessor
+    _worker_preprocessor = ImagePreprocessor(**options)
+
+
+def _attachShared(name: str) -> shared_memory.SharedMemory:
+    """Abre un segmento creado por el proceso principal, que es quien lo libera."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 no tiene `track` y registra el segmento en el resource tracker.
+        # Con "spawn" el tracker es el del proceso principal, donde ya estaba registrado:
+        # no hay nada que deshacer (hacerlo borraría su registro).
+        return shared_memory.SharedMemory(name=name)
+
+
+def _prepareShared(name: str, size: int) -> PreparedImage:
+    """Prepara (en un proceso del pool) la imagen que está en el segmento compartido `name`."""
+    segment = _attachShared(name)
+    try:
+        image_bytes = bytes(segment.buf[:size])
+    finally:
+        segment.close()
+    return _worker_preprocessor.prepare(image_bytes)
+
+
+def _ping() -> bool:
+    return _worker_preprocessor is not None
+
+
+class PreprocessPool:
+    """
+    Pool de procesos para el preprocesado de imágenes (decodificar, enderezar según
+    EXIF, reducir y recomprimir).
+
+    Es trabajo de CPU que en hilos se serializa en el GIL: con varias subidas a la vez,
+    los hilos del pool OCR se turnan en lugar de usar varios núcleos. Aquí cada imagen
+    se prepara en un proceso aparte.
+
+    Los bytes subidos no se copian por la tubería del pool: se escriben en un segmento
+    de memoria compartida y el proceso solo recibe su nombre y tamaño. El resultado (la
+    imagen ya reducida y comprimida, mucho más pequeña) vuelve serializado.
+
+    Los procesos se crean con "spawn": hacer fork de un proceso con hilos (los del pool
+    OCR, los de gRPC) puede dejar bloqueos heredados a medias.
+    """
+
+    def __init__(self, preprocessor: ImagePreprocessor, workers: int = 2):
+        """
+        Args:
+            preprocessor: Preprocesador cuya configuración usan los procesos; también
+                acumula las métricas de las imágenes preparadas.
+            workers: Número de procesos.
+        """
+        self.preprocessor = preprocessor
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._executor = self._newExecutor()
+        self._stats = {"images": 0, "shared_bytes": 0, "worker_crashes": 0}
+
+    @classmethod
+    def fromSettings(cls, settings: Settings, preprocessor: Optional[ImagePreprocessor]) -> Optional["PreprocessPool"]:
+        if preprocessor is None or settings.image_preprocessing_workers <= 0:
+            return None
+        return cls(preprocessor, workers=settings.image_preprocessing_workers)
+
+    def _newExecutor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initWorker,
+            initargs=(self.preprocessor.getOptions(),),
+        )
+
+    def _submit(self, image_bytes: bytes) -> Tuple[shared_memory.SharedMemory, Future]:
+        segment = shared_memory.SharedMemory(create=True, size=max(1, len(image_bytes)))
+        try:
+            segment.buf[:len(image_bytes)] = image_bytes
+            with self._lock:
+                future = self._executor.submit(_prepareShared, segment.name, len(image_bytes))
+        except BaseException:
+            self._release(segment)
+            raise
+        return segment, future
+
+    @staticmethod
+    def _release(segment: shared_memory.SharedMemory) -> None:
+        segment.close()
+        segment.unlink()
+
+    def _collect(self, segment: shared_memory.SharedMemory, future: Future) -> PreparedImage:
+        try:
+            prepared = future.result()
+        except BrokenProcessPool as e:
+            # Un proceso murió (ej. sin memoria con una imagen enorme): el pool entero
+            # queda inservible, así que se crea otro para las siguientes imágenes.
+            self._restart()
+            raise RuntimeError(f"El proceso de preprocesado de imágenes terminó inesperadamente: {e}") from e
+        finally:
+            self._release(segment)
+        self.preprocessor.recordStats(prepared)
+        with self._lock:
+            self._stats["images"] += 1
+            self._stats["shared_bytes"] += prepared.original_size_bytes
+        return prepared
+
+    def _restart(self) -> None:
+        with self._lock:
+            self._stats["worker_crashes"] += 1
+            broken, self._executor = self._executor, self._newExecutor()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def prepare(self, image_bytes: bytes) -> PreparedImage:
+        """
+        Igual que `ImagePreprocessor.prepare`, pero en un proceso del pool (bloquea al
+        llamante, normalmente un hilo del pool OCR, hasta tener el resultado).
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            RuntimeError: Si el proceso que preparaba la imagen murió.
+        """
+        return self._collect(*self._submit(image_bytes))
+
+    def prepareMany(self, images: Sequence[bytes]) -> List[PreparedImage]:
+        """Prepara varias imágenes en paralelo (en procesos distintos) y las devuelve en orden."""
+        submitted = []
+        try:
+            for image_bytes in images:
+                submitted.append(self._submit(image_bytes))
+        except BaseException:
+            for segment, future in submitted:
+                future.cancel()
+                self._release(segment)
+            raise
+        results = []
+        for index, (segment, future) in enumerate(submitted):
+            try:
+                results.append(self._collect(segment, future))
+            except BaseException:
+                for pending_segment, _ in submitted[index + 1:]:
+                    self._release(pending_segment)
+                raise
+        return results
+
+    def warmUp(self) -> None:
+        """Arranca los procesos (crearlos con "spawn" cuesta del orden de un segundo)."""
+        with self._lock:
+            executor = self._executor
+        for future in [executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def getStats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["workers"] = self.workers
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            executor = self._executor
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,195 @@
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import Settings
+
+
+# Clases de ruta: cada una tiene su propio cubo por cliente.
+UPLOAD = "upload"
+READ = "read"
+
+
+class TokenBucketStore:
+    """
+    Cubos de fichas por cliente, acotados en memoria.
+
+    Guarda como mucho `max_clients` cubos; al llegar al límite se descarta el que lleva
+    más tiempo sin usarse (LRU). Un cliente descartado vuelve con el cubo lleno, lo que
+    solo ocurre con clientes que llevan un rato sin hacer peticiones.
+
+    No es seguro entre hilos: lo usa el middleware desde el event loop.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        burst: int,
+        max_clients: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = max(requests_per_minute, 0.001) / 60.0
+        self.capacity = float(max(1, burst))
+        self.max_clients = max(1, max_clients)
+        self._clock = clock
+        # cliente -> [fichas, instante de la última recarga]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, client: str) -> float:
+        """
+        Gasta una ficha del cubo de `client`.
+
+        Returns:
+            float: 0 si la petición se admite; si no, segundos hasta que haya una ficha.
+        """
+        now = self._clock()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+            bucket = self._buckets[client] = [self.capacity, now]
+        else:
+            self._buckets.move_to_end(client)
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return 0.0
+        return (1.0 - bucket[0]) / self.rate
+
+
+class RateLimiter:
+    """
+    Limitador de peticiones por cliente y clase de ruta.
+
+    - `upload`: los POST de subida (`/upload`, `/upload/stream`, `/upload/batch`), que
+      cuestan una llamada al modelo.
+    - `read`: los GET de la API y `/split`, baratos.
+    El resto de rutas (`/health`, `/metrics`, documentación, preflight CORS) no se limita.
+
+    El cliente se identifica por la cabecera `client_header` (API key) solo si trae una
+    de las claves válidas (`api_keys`); si no, por su IP. Una clave que el servidor no
+    conoce no cuenta: si contara, bastaría con cambiarla en cada petición para tener
+    siempre un cubo nuevo.
+    """
+
+    def __init__(
+        self,
+        upload_per_minute: float = 20.0,
+        upload_burst: int = 5,
+        read_per_minute: float = 300.0,
+        read_burst: int = 60,
+        max_clients: int = 10000,
+        client_header: str = "x-api-key",
+        api_keys: Sequence[str] = (),
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.client_header = client_header.lower().encode("latin-1")
+        self.api_keys = frozenset(key.strip().encode("latin-1") for key in api_keys if key and key.strip())
+        self._stores: Dict[str, TokenBucketStore] = {
+            UPLOAD: TokenBucketStore(upload_per_minute, upload_burst, max_clients, clock),
+            READ: TokenBucketStore(read_per_minute, read_burst, max_clients, clock),
+        }
+        self._stats = {route_class: {"allowed": 0, "limited": 0} for route_class in self._stores}
+
+    @classmethod
+    def fromSettings(cls, settings: Settings) -> Optional["RateLimiter"]:
+        if not settings.rate_limit_enabled:
+            return None
+        return cls(
+            upload_per_minute=settings.rate_limit_upload_per_minute,
+            upload_burst=settings.rate_limit_upload_burst,
+            read_per_minute=settings.rate_limit_read_per_minute,
+            read_burst=settings.rate_limit_read_burst,
+            max_clients=settings.rate_limit_max_clients,
+            client_header=settings.rate_limit_client_header,
+            api_keys=(settings.rate_limit_api_keys or "").split(","),
+        )
+
+    @staticmethod
+    def classify(method: str, path: str) -> Optional[str]:
+        """Clase de ruta de la petición, o None si no se limita."""
+        if not path.startswith("/api/"):
+            return None
+        if method == "POST":
+            if "/upload" in path:
+                return UPLOAD
+            return READ if path.endswith("/split") else None
+        return READ if method == "GET" else None
+
+    def clientFor(self, headers: List[Tuple[bytes, bytes]], client: Optional[Tuple[str, int]]) -> str:
+        """Identidad del cliente: su API key si es una de las válidas o, si no, su IP."""
+        if self.api_keys:
+            for name, value in headers:
+                if name == self.client_header and value in self.api_keys:
+                    return "key:" + value.decode("latin-1")
+        return "ip:" + (client[0] if client else "unknown")
+
+    def check(self, route_class: str, client: str) -> float:
+        """0 si se admite la petición; si no, segundos hasta que el cliente pueda repetirla."""
+        retry_after = self._stores[route_class].take(client)
+        self._stats[route_class]["limited" if retry_after else "allowed"] += 1
+        return retry_after
+
+    def getStats(self) -> Dict[str, Any]:
+        """Peticiones admitidas y limitadas por clase de ruta, clientes seguidos y descartados."""
+        return {
+            route_class: dict(
+                self._stats[route_class],
+                clients=len(store),
+                evictions=store.evictions,
+                per_minute=round(store.rate * 60, 2),
+                burst=int(store.capacity),
+            )
+            for route_class, store in self._stores.items()
+        }
+
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI que aplica `RateLimiter` antes de llegar a los endpoints.
+
+    Es ASGI puro (sin `BaseHTTPMiddleware`) para que su coste por petición sea de unos
+    pocos microsegundos. El limitador se lee de `getLimiter(app)` en cada petición, de
+    modo que se crea con el resto de servicios y se puede sustituir en los tests.
+    """
+
+    def __init__(self, app: Any, getLimiter: Callable[[Any], Optional[RateLimiter]]):
+        self.app = app
+        self.getLimiter = getLimiter
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] == "http":
+            route_class = RateLimiter.classify(scope["method"], scope["path"])
+            if route_class is not None:
+                limiter = self.getLimiter(scope["app"])
+                if limiter is not None:
+                    client = limiter.clientFor(scope["headers"], scope.get("client"))
+                    retry_after = limiter.check(route_class, client)
+                    if retry_after:
+                        await self._reject(send, retry_after)
+                        return
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(send: Callable, retry_after: float) -> None:
+        body = json.dumps(
+            {"detail": "Demasiadas peticiones; espera antes de volver a intentarlo."}, ensure_ascii=False
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
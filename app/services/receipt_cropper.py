@@ -0,0 +1,172 @@
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.core.config import Settings
+
+
+class CropDetection(NamedTuple):
+    """
+    Ticket detectado en una foto.
+
+    Attributes:
+        corners: Esquinas del ticket en la imagen original (arriba-izq., arriba-der.,
+            abajo-der., abajo-izq.), en píxeles.
+        confidence: Confianza (0-1) en que las esquinas son las del ticket.
+        area_ratio: Fracción de la foto que ocupa el ticket.
+        method: "edges" (contorno de cuatro lados) o "paper" (mayor región de papel claro).
+    """
+    corners: np.ndarray
+    confidence: float
+    area_ratio: float
+    method: str
+
+
+class ReceiptCropper:
+    """
+    Recorta y endereza el ticket dentro de una foto.
+
+    Las fotos de móvil incluyen mesa, manos y fondo: píxeles que se envían al modelo (y
+    que confunden a Tesseract) sin aportar nada. Se buscan las esquinas del ticket:
+    - por bordes: el mayor contorno convexo de cuatro lados (ticket entero en la foto),
+    - por papel: la mayor región clara, con su rectángulo de área mínima (ticket con
+      esquinas tapadas o arrugadas),
+    y se aplica una transformación de perspectiva que deja el ticket recto y sin fondo.
+
+    La confianza combina cuánto rellena la región su cuadrilátero y el contraste entre
+    el papel y el fondo. Si no llega a `min_confidence` (o el ticket ya ocupa casi toda
+    la foto) se devuelve la imagen sin recortar.
+
+    No guarda estado: se puede usar desde varios hilos y enviar a otros procesos.
+    """
+
+    def __init__(
+        self,
+        min_confidence: float = 0.7,
+        min_area_ratio: float = 0.15,
+        max_area_ratio: float = 0.9,
+        margin: float = 0.02,
+        detection_side: int = 800,
+    ):
+        """
+        Args:
+            min_confidence: Confianza (0-1) mínima para recortar.
+            min_area_ratio: Fracción mínima de la foto que debe ocupar el ticket detectado.
+            max_area_ratio: Si el ticket ocupa más que esto, no merece la pena recortar.
+            margin: Margen (fracción del lado) que se deja alrededor del ticket.
+            detection_side: Lado más largo de la copia reducida en la que se buscan las esquinas.
+        """
+        self.min_confidence = min_confidence
+        self.min_area_ratio = min_area_ratio
+        self.max_area_ratio = max_area_ratio
+        self.margin = margin
+        self.detection_side = detection_side
+
+    @classmethod
+    def fromSettings(cls, settings: Settings) -> "ReceiptCropper":
+        return cls(
+            min_confidence=settings.image_crop_min_confidence,
+            min_area_ratio=settings.image_crop_min_area_ratio,
+        )
+
+    def detect(self, image: Image.Image) -> Optional[CropDetection]:
+        """Busca el ticket en la imagen (RGB). Devuelve la mejor detección, o None si no hay ninguna."""
+        rgb = np.asarray(image)
+        scale = min(1.0, self.detection_side / max(rgb.shape[:2]))
+        if scale < 1.0:
+            rgb = cv2.resize(rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY), (5, 5), 0)
+
+        candidates = self._edgeCandidates(gray) + self._paperCandidates(gray)
+        best: Optional[CropDetection] = None
+        image_area = float(gray.shape[0] * gray.shape[1])
+        for corners, region_area, method in candidates:
+            quad_area = cv2.contourArea(corners.astype(np.float32))
+            if quad_area <= 0:
+                continue
+            area_ratio = quad_area / image_area
+            if area_ratio < self.min_area_ratio:
+                continue
+            fill = min(1.0, region_area / quad_area)
+            confidence = 0.5 * fill + 0.5 * self._contrast(gray, corners)
+            if best is None or confidence > best.confidence:
+                best = CropDetection(_orderCorners(corners) / scale, round(confidence, 3), round(area_ratio, 3), method)
+        return best
+
+    def crop(self, image: Image.Image) -> Tuple[Image.Image, Optional[CropDetection]]:
+        """
+        Recorta y endereza el ticket si se detecta con confianza suficiente.
+
+        Returns:
+            Tuple[Image.Image, Optional[CropDetection]]: La imagen recortada (o la original)
+            y la detección usada para recortar (None si no se ha recortado).
+        """
+        detection = self.detect(image)
+        if (
+            detection is None
+            or detection.confidence < self.min_confidence
+            or detection.area_ratio > self.max_area_ratio
+        ):
+            return image, None
+        return self._warp(image, detection.corners), detection
+
+    @staticmethod
+    def _edgeCandidates(gray: np.ndarray) -> List[Tuple[np.ndarray, float, str]]:
+        edges = cv2.Canny(gray, 50, 150)
+        edges = cv2.dilate(edges, np.ones((3, 3), np.uint8), iterations=2)
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        candidates = []
+        for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+            approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+            if len(approx) == 4 and cv2.isContourConvex(approx):
+                candidates.append((approx.reshape(4, 2).astype(np.float32), cv2.contourArea(contour), "edges"))
+        return candidates
+
+    @staticmethod
+    def _paperCandidates(gray: np.ndarray) -> List[Tuple[np.ndarray, float, str]]:
+        _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # Cerrar los huecos que dejan las líneas de texto dentro del papel.
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return []
+        contour = max(contours, key=cv2.contourArea)
+        corners = cv2.boxPoints(cv2.minAreaRect(contour)).astype(np.float32)
+        return [(corners, cv2.contourArea(contour), "paper")]
+
+    @staticmethod
+    def _contrast(gray: np.ndarray, corners: np.ndarray) -> float:
+        """Contraste (0-1) entre el interior del cuadrilátero y el resto de la imagen."""
+        mask = np.zeros(gray.shape, np.uint8)
+        cv2.fillConvexPoly(mask, corners.astype(np.int32), 255)
+        inside = mask > 0
+        if inside.all() or not inside.any():
+            return 0.0
+        difference = float(gray[inside].mean()) - float(gray[~inside].mean())
+        return float(np.clip(difference / 64.0, 0.0, 1.0))
+
+    def _warp(self, image: Image.Image, corners: np.ndarray) -> Image.Image:
+        """Transformación de perspectiva que lleva el cuadrilátero (con margen) a un rectángulo."""
+        center = corners.mean(axis=0)
+        corners = center + (corners - center) * (1 + 2 * self.margin)
+        top_left, top_right, bottom_right, bottom_left = corners
+        width = int(round(max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left))))
+        height = int(round(max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right))))
+        target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], np.float32)
+        matrix = cv2.getPerspectiveTransform(corners.astype(np.float32), target)
+        warped = cv2.warpPerspective(
+            np.asarray(image), matrix, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE
+        )
+        return Image.fromarray(warped)
+
+
+def _orderCorners(corners: np.ndarray) -> np.ndarray:
+    """Ordena cuatro esquinas como arriba-izq., arriba-der., abajo-der., abajo-izq."""
+    corners = corners.reshape(4, 2).astype(np.float32)
+    center = corners.mean(axis=0)
+    # Con el eje y hacia abajo, ordenar por ángulo alrededor del centro recorre las
+    # esquinas en el sentido de las agujas del reloj; se empieza por la de arriba a la izq.
+    clockwise = corners[np.argsort(np.arctan2(corners[:, 1] - center[1], corners[:, 0] - center[0]))]
+    return np.roll(clockwise, -int(np.argmin(clockwise.sum(axis=1))), axis=0)
@@ -0,0 +1,408 @@
+import asyncio
+from typing import Optional, Dict, Any, AsyncIterator, Callable, NamedTuple, Tuple
+
+from app.core.config import Settings
+from app.services.duplicate_detector import DuplicateDetector
+from app.services.incremental_json import IncrementalItemsParser
+from app.services.merchant_templates import MerchantTemplateStore
+from app.services.ocr_cache import OcrResultCache
+from app.services.ocr_engine import OCREngine, OCRExtraction
+from app.services.parser_service import ParserService
+from app.services.receipt_prefilter import ReceiptPrefilter
+from app.services.single_flight import SingleFlight
+
+
+class _Lookup(NamedTuple):
+    cache_key: str
+    image_hash: Optional[int]
+    duplicate_of: Optional[str]
+    cached: Optional[Dict[str, Any]]
+
+
+class ReceiptPipeline:
+    """
+    Orquesta el procesamiento de una imagen de ticket: OCR + parsing.
+
+    Centraliza las optimizaciones que se aplican alrededor de la llamada al modelo
+    (caché por hash exacto de la imagen, detección de casi duplicados, agrupación de
+    subidas idénticas simultáneas, descarte local de lo que claramente no es un
+    ticket, lectura local de los comercios con plantilla) para que los endpoints solo
+    tengan que pedir "el resultado parseado de estos bytes".
+
+    Los servicios de OCR y parsing se reciben en cada llamada para que sigan
+    siendo inyectables con `Depends` (y sustituibles en los tests).
+    """
+
+    def __init__(
+        self,
+        cache: Optional[OcrResultCache] = None,
+        cache_parsed: bool = True,
+        duplicate_detector: Optional[DuplicateDetector] = None,
+        single_flight: Optional[SingleFlight] = None,
+        keep_raw_text: bool = True,
+        prefilter: Optional[ReceiptPrefilter] = None,
+        templates: Optional[MerchantTemplateStore] = None,
+    ):
+        """
+        Args:
+            cache: Caché de resultados de OCR. None desactiva la caché.
+            cache_parsed: Si es True, se guarda también el resultado del parser y un
+                acierto de caché no vuelve a parsear el texto.
+            duplicate_detector: Detector de casi duplicados. None lo desactiva.
+            single_flight: Agrupador de subidas idénticas concurrentes. None lo desactiva.
+            keep_raw_text: Si es False, el resultado no incluye la respuesta original del
+                motor en `raw_text` (la caché sigue guardándola para poder re-parsearla).
+            prefilter: Filtro local que descarta, sin llamar al motor OCR, las imágenes
+                que claramente no son tickets. None lo desactiva.
+            templates: Plantillas de comercios: los tickets de un comercio conocido se leen
+                con el OCR local sin llamar al modelo. None lo desactiva.
+        """
+        self.cache = cache
+        self.cache_parsed = cache_parsed
+        self.duplicate_detector = duplicate_detector
+        self.single_flight = single_flight
+        self.keep_raw_text = keep_raw_text
+        self.prefilter = prefilter
+        self.templates = templates
+
+    @classmethod
+    def fromSettings(cls, settings: Settings, local_reader: Optional[OCREngine] = None) -> "ReceiptPipeline":
+        """
+        Construye el pipeline con los componentes activados en la configuración.
+
+        Args:
+            settings: Configuración.
+            local_reader: Motor OCR local (texto plano) para las plantillas de comercios.
+                Sin él no se usan plantillas.
+        """
+        cache = None
+        if settings.ocr_cache_enabled:
+            cache = OcrResultCache(
+                max_entries=settings.ocr_cache_max_entries,
+                ttl_seconds=settings.ocr_cache_ttl_seconds,
+                disk_path=settings.ocr_cache_disk_path,
+                disk_max_entries=settings.ocr_cache_disk_max_entries,
+            )
+        duplicate_detector = None
+        if settings.duplicate_detection_enabled:
+            duplicate_detector = DuplicateDetector(
+                max_distance=settings.duplicate_max_distance,
+                max_entries=settings.duplicate_index_max_entries,
+                mode=settings.duplicate_mode,
+            )
+        return cls(
+            cache=cache,
+            cache_parsed=settings.ocr_cache_store_parsed,
+            duplicate_detector=duplicate_detector,
+            single_flight=SingleFlight() if settings.single_flight_enabled else None,
+            keep_raw_text=settings.ocr_keep_raw_text,
+            prefilter=ReceiptPrefilter.fromSettings(settings) if settings.receipt_prefilter_enabled else None,
+            templates=(
+                MerchantTemplateStore.fromSettings(settings, local_reader)
+                if settings.merchant_templates_enabled and local_reader is not None else None
+            ),
+        )
+
+    async def extractAndParse(
+        self,
+        image_bytes: bytes,
+        ocr_service: OCREngine,
+        parser_service: ParserService,
+        language: str = 'spa',
+        receipt_id: Optional[str] = None,
+        on_stage: Optional[Callable[[str], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Obtiene los datos parseados de una imagen, evitando el OCR cuando es posible.
+
+        Args:
+            image_bytes: Bytes de la imagen subida.
+            ocr_service: Motor OCR a usar si no hay resultado reutilizable. Su nombre forma
+                parte de la clave de caché: cada motor tiene sus propios resultados.
+            parser_service: Servicio de parsing del texto devuelto por el OCR.
+            language: Idioma del ticket.
+            receipt_id: ID que tendrá el ticket; se recuerda para señalar futuros duplicados.
+            on_stage: Se llama con "decoded" cuando la imagen ya se ha leído y no hay
+                resultado reutilizable, y con "ocr" justo antes de llamar al motor.
+
+        Returns:
+            Dict[str, Any]: El diccionario de `ParserService.parseExtraction` (`raw_text`
+            solo se rellena con `keep_raw_text`) con dos claves adicionales: `from_cache`
+            (se evitó el OCR) y `duplicate_of` (receipt_id de un ticket anterior casi
+            idéntico, o None).
+
+        Raises:
+            ValueError, RuntimeError: Los mismos errores que el servicio OCR.
+        """
+        engine_name, _ = self._describeEngine(ocr_service)
+        lookup = await self._lookup(image_bytes, engine_name, language, parser_service)
+        if lookup.cached is not None:
+            return lookup.cached
+        if on_stage is not None:
+            on_stage("decoded")
+        rejected = await self._prefilter(image_bytes, parser_service, lookup)
+        if rejected is not None:
+            return rejected
+        local_text, templated = await self._readWithTemplate(image_bytes, ocr_service, language, lookup)
+        if templated is not None:
+            return templated
+        if on_stage is not None:
+            on_stage("ocr")
+
+        async def runOcr() -> Dict[str, Any]:
+            extraction = await self._extract(ocr_service, image_bytes, language)
+            parsed = parser_service.parseExtraction(extraction, self.keep_raw_text)
+            await self._remember(lookup, engine_name, extraction, parsed, receipt_id)
+            if local_text is not None:
+                await asyncio.to_thread(self.templates.learn, local_text, parsed)
+            return parsed
+
+        if self.single_flight is not None:
+            # Subidas idénticas simultáneas comparten una sola llamada al modelo.
+            shared_result = await self.single_flight.do(lookup.cache_key, runOcr)
+        else:
+            shared_result = await runOcr()
+        # Cada llamante recibe su propia copia: el resultado también está en la caché
+        # (y, con single-flight, en manos de las otras peticiones agrupadas).
+        parsed_data = self._copyParsed(shared_result)
+
+        parsed_data["from_cache"] = False
+        parsed_data["duplicate_of"] = lookup.duplicate_of
+        return parsed_data
+
+    async def streamAndParse(
+        self,
+        image_bytes: bytes,
+        ocr_service: OCREngine,
+        parser_service: ParserService,
+        language: str = 'spa',
+        receipt_id: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Versión en streaming de `extractAndParse`.
+
+        Produce eventos `("item", Item)` en cuanto el modelo termina de generar cada
+        elemento de `items` y, al final, `("result", parsed_data)` con exactamente el
+        mismo diccionario que habría devuelto `extractAndParse`. Los ítems adelantados
+        son los mismos (mismos IDs) que los del resultado final; si el motor no devuelve
+        JSON (o el resultado sale de la caché) los ítems se emiten todos al final.
+
+        Las subidas en streaming no se agrupan con single-flight: cada una necesita su
+        propio stream del modelo. Sí usan y alimentan la caché y el índice de duplicados.
+
+        Raises:
+            ValueError, RuntimeError: Los mismos errores que el servicio OCR.
+        """
+        engine_name, _ = self._describeEngine(ocr_service)
+        lookup = await self._lookup(image_bytes, engine_name, language, parser_service)
+        if lookup.cached is not None:
+            for item in lookup.cached["items"]:
+                yield "item", item.model_copy()
+            yield "result", lookup.cached
+            return
+        rejected = await self._prefilter(image_bytes, parser_service, lookup)
+        if rejected is not None:
+            yield "result", rejected
+            return
+        local_text, templated = await self._readWithTemplate(image_bytes, ocr_service, language, lookup)
+        if templated is not None:
+            for item in templated["items"]:
+                yield "item", item.model_copy()
+            yield "result", templated
+            return
+
+        emitted = 0
+        if not isinstance(ocr_service, OCREngine):
+            # Servicios sin API de streaming (ej. dobles de test): una sola extracción.
+            extraction = await self._extract(ocr_service, image_bytes, language)
+        else:
+            item_parser = IncrementalItemsParser()
+            extraction = None
+            async for piece in ocr_service.streamAsync(image_bytes, language):
+                if isinstance(piece, OCRExtraction):
+                    extraction = piece
+                    continue
+                for g_item in item_parser.feed(piece):
+                    item = parser_service.parseJsonItem(g_item, emitted + 1)
+                    if item is not None:
+                        emitted += 1
+                        yield "item", item
+
+        parsed = parser_service.parseExtraction(extraction, self.keep_raw_text)
+        await self._remember(lookup, engine_name, extraction, parsed, receipt_id)
+        if local_text is not None:
+            await asyncio.to_thread(self.templates.learn, local_text, parsed)
+        parsed_data = self._copyParsed(parsed)
+        for item in parsed_data["items"][emitted:]:
+            yield "item", item.model_copy()
+        parsed_data["from_cache"] = False
+        parsed_data["duplicate_of"] = lookup.duplicate_of
+        yield "result", parsed_data
+
+    async def _lookup(
+        self, image_bytes: bytes, engine_name: str, language: str, parser_service: ParserService
+    ) -> "_Lookup":
+        """Calcula la clave de caché y el hash perceptual, y busca un resultado reutilizable."""
+        # El SHA-256 de una foto de varios MB y la lectura del nivel en disco (SQLite)
+        # bloquean: fuera del event loop, igual que el hash perceptual.
+        cache_key = await asyncio.to_thread(
+            OcrResultCache.makeKey, image_bytes, variant=f"{engine_name}:{language}"
+        )
+
+        image_hash = None
+        match = None
+        if self.duplicate_detector is not None:
+            # Decodificar y reducir la imagen es trabajo de CPU: fuera del event loop.
+            image_hash = await asyncio.to_thread(self.duplicate_detector.computeHash, image_bytes)
+            if image_hash is not None:
+                match = self.duplicate_detector.findMatch(image_hash)
+        duplicate_of = match.receipt_id if match is not None else None
+
+        cached = None
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self._getCached, cache_key, parser_service)
+            if cached is None and match is not None and self.duplicate_detector.mode == "reuse":
+                cached = await asyncio.to_thread(self._getCached, match.cache_key, parser_service)
+                if cached is not None:
+                    self.duplicate_detector.recordReuse()
+            if cached is not None:
+                cached["duplicate_of"] = duplicate_of
+        return _Lookup(cache_key, image_hash, duplicate_of, cached)
+
+    async def _prefilter(
+        self, image_bytes: bytes, parser_service: ParserService, lookup: "_Lookup"
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Resultado de "no es un ticket" si el filtro local descarta la imagen, o None.
+
+        El descarte no se guarda en la caché ni en el índice de duplicados: si el filtro
+        se equivoca, basta con cambiar su configuración para que la imagen llegue al modelo.
+        """
+        if self.prefilter is None:
+            return None
+        verdict = await asyncio.to_thread(self.prefilter.classify, image_bytes)
+        if verdict is None or verdict.is_ticket:
+            return None
+        parsed_data = parser_service.parseJsonData(verdict.asModelResponse())
+        parsed_data["from_cache"] = False
+        parsed_data["duplicate_of"] = lookup.duplicate_of
+        return parsed_data
+
+    async def _readWithTemplate(
+        self, image_bytes: bytes, ocr_service: OCREngine, language: str, lookup: "_Lookup"
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Lee la imagen con el OCR local y, si es de un comercio con plantilla, la parsea.
+
+        Solo se aplica cuando el motor pedido es el modelo (salida JSON): leer en local
+        lo que ya va a leer un motor local no ahorra nada.
+
+        Returns:
+            (texto local o None, resultado parseado si la plantilla es fiable o None). Con
+            el texto local, el resultado del modelo sirve después para aprender la plantilla.
+        """
+        if self.templates is None or ocr_service is self.templates.reader:
+            return None, None
+        if self._describeEngine(ocr_service)[1] != "json":
+            return None, None
+        local_text = await self.templates.readText(image_bytes, language)
+        if local_text is None:
+            return None, None
+        # Parsear con regex es trabajo de CPU (poco, pero por cada línea del ticket).
+        match = await asyncio.to_thread(self.templates.match, local_text)
+        if match is None or match.confidence < self.templates.min_confidence:
+            return local_text, None
+        parsed_data = match.parsed
+        if not self.keep_raw_text:
+            parsed_data["raw_text"] = None
+        parsed_data["merchant_template"] = match.template.merchant
+        parsed_data["from_cache"] = False
+        parsed_data["duplicate_of"] = lookup.duplicate_of
+        return local_text, parsed_data
+
+    async def _remember(
+        self,
+        lookup: "_Lookup",
+        engine_name: str,
+        extraction: OCRExtraction,
+        parsed: Dict[str, Any],
+        receipt_id: Optional[str],
+    ) -> None:
+        """Guarda el resultado en la caché y en el índice de duplicados."""
+        # Solo se recuerdan respuestas no vacías: una respuesta vacía suele ser un fallo
+        # puntual del modelo y merece un nuevo intento. Tampoco las de un motor de
+        # respaldo: cuando el motor pedido se recupere, su resultado será mejor.
+        if not extraction.text or extraction.engine != engine_name:
+            return
+        if self.cache is not None:
+            # La escritura en el nivel en disco (SQLite) bloquea: fuera del event loop.
+            await asyncio.to_thread(
+                self.cache.set,
+                lookup.cache_key, extraction.text, parsed if self.cache_parsed else None, extraction.output_format,
+            )
+        if lookup.image_hash is not None:
+            self.duplicate_detector.add(lookup.image_hash, lookup.cache_key, receipt_id)
+
+    @classmethod
+    async def _extract(cls, ocr_service: OCREngine, image_bytes: bytes, language: str) -> OCRExtraction:
+        """Ejecuta el OCR y devuelve el texto junto con el motor que lo produjo."""
+        if isinstance(ocr_service, OCREngine):
+            return await ocr_service.extractAsync(image_bytes, language)
+        # Servicios que solo implementan la interfaz mínima (ej. dobles de test).
+        engine_name, output_format = cls._describeEngine(ocr_service)
+        text = await ocr_service.extractTextFromImageAsync(image_bytes, language)
+        return OCRExtraction(text, engine_name, output_format)
+
+    @staticmethod
+    def _describeEngine(ocr_service: OCREngine) -> Tuple[str, str]:
+        """Nombre y formato de salida del motor (Gemini/JSON si no los declara)."""
+        name = getattr(ocr_service, "name", None)
+        output_format = getattr(ocr_service, "output_format", None)
+        return (
+            name if isinstance(name, str) else "gemini",
+            output_format if isinstance(output_format, str) else "json",
+        )
+
+    @staticmethod
+    def _copyParsed(parsed_data: Dict[str, Any]) -> Dict[str, Any]:
+        copied = dict(parsed_data)
+        copied["items"] = [item.model_copy() for item in parsed_data.get("items", [])]
+        return copied
+
+    def _getCached(self, cache_key: str, parser_service: ParserService) -> Optional[Dict[str, Any]]:
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return None
+        parsed_data = cached["parsed"]
+        if parsed_data is None:
+            parsed_data = parser_service.parseEngineOutput(cached["raw_text"], cached["output_format"])
+            if not self.keep_raw_text:
+                parsed_data["raw_text"] = None
+        parsed_data["from_cache"] = True
+        return parsed_data
+
+    def reset(self) -> None:
+        """Vacía la caché, el índice de duplicados y las plantillas (útil en tests)."""
+        if self.cache is not None:
+            self.cache.clear()
+        if self.templates is not None:
+            self.templates.clear()
+        if self.duplicate_detector is not None:
+            self.duplicate_detector.clear()
+
+    def getStats(self) -> Dict[str, Any]:
+        """Devuelve las métricas de los componentes del pipeline."""
+        return {
+            "ocr_cache": self.cache.getStats() if self.cache is not None else None,
+            "duplicates": self.duplicate_detector.getStats() if self.duplicate_detector is not None else None,
+            "single_flight": self.single_flight.getStats() if self.single_flight is not None else None,
+            "prefilter": self.prefilter.getStats() if self.prefilter is not None else None,
+            "merchant_templates": self.templates.getStats() if self.templates is not None else None,
+        }
+
+    def close(self) -> None:
+        """Libera los recursos de los componentes del pipeline."""
+        if self.cache is not None:
+            self.cache.close()
+        if self.templates is not None:
+            self.templates.close()
@@ -0,0 +1,265 @@
+import io
+import re
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+from app.core.config import Settings
+
+
+_AMOUNT_PATTERN = re.compile(r"\d+[,.]\d{2}\b")
+
+
+class PrefilterVerdict(NamedTuple):
+    """
+    Resultado del filtro previo para una imagen.
+
+    Attributes:
+        is_ticket: False si la imagen se descarta sin llamar al motor OCR.
+        reason: Motivo del descarte ("no_text", "no_paper", "wide_aspect"), o None.
+        aspect_ratio: Alto/ancho de la imagen (tras aplicar la orientación EXIF).
+        paper_fraction: Fracción (0-1) de píxeles claros y sin color (papel).
+        text_lines: Líneas de texto horizontales detectadas.
+        elapsed_ms: Tiempo que tardó la clasificación.
+        detected_content: Descripción breve de la imagen descartada.
+    """
+    is_ticket: bool
+    reason: Optional[str]
+    aspect_ratio: float
+    paper_fraction: float
+    text_lines: int
+    elapsed_ms: float
+    detected_content: Optional[str] = None
+
+    def asModelResponse(self) -> Dict[str, Any]:
+        """La misma respuesta JSON que da el modelo cuando la imagen no es un ticket."""
+        return {
+            "is_ticket": False,
+            "error_message": ReceiptPrefilter.ERROR_MESSAGES.get(self.reason, ReceiptPrefilter.ERROR_MESSAGES[None]),
+            "detected_content": self.detected_content,
+        }
+
+
+class ReceiptPrefilter:
+    """
+    Descarta en local, en unas decenas de milisegundos, las imágenes que claramente no son tickets.
+
+    Una llamada completa al modelo solo para que responda `is_ticket: false` a un
+    selfie, un paisaje o una captura de pantalla es cara. Antes de llamar al motor OCR
+    se calculan unas estadísticas baratas sobre la imagen reducida:
+
+    - líneas de texto: con OpenCV se resalta el texto oscuro sobre fondo claro
+      (black-hat), se une cada línea con un cierre horizontal y se cuentan los
+      contornos con forma de línea;
+    - papel: fracción de píxeles claros y sin saturación;
+    - relación de aspecto: las panorámicas anchas con poco texto no son tickets.
+
+    Es deliberadamente conservador: ante la duda (imagen muy pequeña, que no se puede
+    decodificar o con texto suficiente) la imagen pasa al modelo. Opcionalmente, antes
+    de descartar, una pasada rápida de Tesseract puede rescatar la imagen si encuentra
+    importes o suficientes palabras.
+    """
+
+    ERROR_MESSAGES = {
+        "no_text": (
+            "La imagen que has subido no parece contener texto impreso (por ejemplo, una foto personal "
+            "o un paisaje). Por favor, sube una imagen de un ticket de compra o factura válido."
+        ),
+        "no_paper": (
+            "La imagen que has subido no parece mostrar un ticket en papel. "
+            "Por favor, sube una imagen de un ticket de compra o factura válido."
+        ),
+        "wide_aspect": (
+            "La imagen que has subido parece ser una panorámica o un banner. "
+            "Por favor, sube una imagen de un ticket de compra o factura válido."
+        ),
+        None: "La imagen proporcionada no parece ser un ticket de compra o factura válido.",
+    }
+    DETECTED_CONTENT = {
+        "no_text": "Imagen sin líneas de texto impreso",
+        "no_paper": "Imagen sin zonas de papel claro",
+        "wide_aspect": "Imagen panorámica con poco texto",
+    }
+
+    def __init__(
+        self,
+        min_side: int = 256,
+        analysis_side: int = 800,
+        min_text_lines: int = 3,
+        min_paper_fraction: float = 0.08,
+        max_width_ratio: float = 2.5,
+        paper_min_brightness: int = 150,
+        paper_max_saturation: int = 60,
+        tesseract_enabled: bool = False,
+        tesseract_min_words: int = 6,
+    ):
+        """
+        Args:
+            min_side: Las imágenes con el lado menor por debajo de esto no se juzgan (pasan).
+            analysis_side: Lado mayor (píxeles) al que se reduce la imagen para analizarla.
+            min_text_lines: Líneas de texto mínimas de un ticket.
+            min_paper_fraction: Fracción mínima de papel claro.
+            max_width_ratio: Ancho/alto máximo de una imagen con poco texto.
+            paper_min_brightness: Brillo (0-255) mínimo de un píxel de papel.
+            paper_max_saturation: Saturación (0-255) máxima de un píxel de papel.
+            tesseract_enabled: Confirma cada descarte con una pasada rápida de Tesseract.
+            tesseract_min_words: Palabras que, según Tesseract, bastan para no descartar.
+        """
+        self.min_side = min_side
+        self.analysis_side = analysis_side
+        self.min_text_lines = min_text_lines
+        self.min_paper_fraction = min_paper_fraction
+        self.max_width_ratio = max_width_ratio
+        self.paper_min_brightness = paper_min_brightness
+        self.paper_max_saturation = paper_max_saturation
+        self.tesseract_enabled = tesseract_enabled
+        self.tesseract_min_words = tesseract_min_words
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "checked": 0, "passed": 0, "rejected": 0, "skipped": 0, "rescued_by_tesseract": 0,
+            "rejections": {}, "total_ms": 0.0,
+        }
+
+    @classmethod
+    def fromSettings(cls, settings: Settings) -> "ReceiptPrefilter":
+        return cls(
+            min_side=settings.receipt_prefilter_min_side,
+            min_text_lines=settings.receipt_prefilter_min_text_lines,
+            min_paper_fraction=settings.receipt_prefilter_min_paper_fraction,
+            max_width_ratio=settings.receipt_prefilter_max_width_ratio,
+            tesseract_enabled=settings.receipt_prefilter_tesseract,
+        )
+
+    def _load(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        """Decodifica y reduce la imagen (RGB). None si no se puede o es demasiado pequeña."""
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            if min(image.size) < self.min_side:
+                return None
+            # Con JPEG, el decodificador reduce directamente a 1/2, 1/4 o 1/8: mucho más rápido.
+            image.draft("RGB", (self.analysis_side, self.analysis_side))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+        except Exception:
+            return None
+        image.thumbnail((self.analysis_side, self.analysis_side))
+        return np.asarray(image)
+
+    def countTextLines(self, gray: np.ndarray) -> int:
+        """Cuenta las líneas de texto oscuro sobre fondo claro de una imagen en grises."""
+        height, width = gray.shape
+        glyph_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))
+        # Black-hat: resalta los trazos oscuros más finos que el kernel (letras) sobre fondo claro.
+        blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, glyph_kernel)
+        _, binary = cv2.threshold(blackhat, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        if blackhat.max() < 40:
+            return 0  # Sin trazos con contraste: Otsu solo estaría separando ruido
+        line_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, width // 40), 1))
+        lines = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, line_kernel)
+        contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        count = 0
+        for contour in contours:
+            _, _, w, h = cv2.boundingRect(contour)
+            if 4 <= h <= height * 0.08 and w >= 3 * h and w >= width * 0.08:
+                count += 1
+        return count
+
+    def paperFraction(self, rgb: np.ndarray) -> float:
+        """Fracción de píxeles claros y sin color."""
+        hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
+        paper = (hsv[:, :, 2] >= self.paper_min_brightness) & (hsv[:, :, 1] <= self.paper_max_saturation)
+        return float(paper.mean())
+
+    def classify(self, image_bytes: bytes) -> Optional[PrefilterVerdict]:
+        """
+        Clasifica la imagen.
+
+        Returns:
+            Optional[PrefilterVerdict]: El veredicto, o None si la imagen no se puede
+            juzgar (no se decodifica o es demasiado pequeña) y debe pasar al motor OCR.
+        """
+        started_at = time.perf_counter()
+        rgb = self._load(image_bytes)
+        if rgb is None:
+            self._record(None, 0.0)
+            return None
+
+        height, width = rgb.shape[:2]
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        text_lines = self.countTextLines(gray)
+        paper_fraction = self.paperFraction(rgb)
+        aspect_ratio = height / width
+
+        reason = None
+        if text_lines < self.min_text_lines:
+            reason = "no_text"
+        elif paper_fraction < self.min_paper_fraction:
+            reason = "no_paper"
+        elif width / height > self.max_width_ratio and text_lines < 2 * self.min_text_lines:
+            reason = "wide_aspect"
+
+        detected_content = self.DETECTED_CONTENT.get(reason)
+        rescued = False
+        if reason is not None and self.tesseract_enabled:
+            rescued, first_line = self._confirmWithTesseract(gray)
+            if rescued:
+                reason = None
+            elif first_line:
+                detected_content = f"{detected_content}: «{first_line[:60]}»"
+
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        verdict = PrefilterVerdict(
+            is_ticket=reason is None,
+            reason=reason,
+            aspect_ratio=round(aspect_ratio, 3),
+            paper_fraction=round(paper_fraction, 3),
+            text_lines=text_lines,
+            elapsed_ms=round(elapsed_ms, 2),
+            detected_content=detected_content if reason is not None else None,
+        )
+        self._record(verdict, elapsed_ms, rescued)
+        return verdict
+
+    def _confirmWithTesseract(self, gray: np.ndarray):
+        """
+        Pasada rápida de Tesseract antes de descartar.
+
+        Returns:
+            (rescatar, primera línea leída). Si Tesseract no está disponible, no rescata.
+        """
+        try:
+            import pytesseract
+            text = pytesseract.image_to_string(gray, config="--psm 6", timeout=2)
+        except Exception:
+            return False, None
+        words = [word for word in text.split() if len(word) > 2]
+        first_line = next((line.strip() for line in text.splitlines() if line.strip()), None)
+        return (len(words) >= self.tesseract_min_words or bool(_AMOUNT_PATTERN.search(text))), first_line
+
+    def _record(self, verdict: Optional[PrefilterVerdict], elapsed_ms: float, rescued: bool = False) -> None:
+        with self._lock:
+            if verdict is None:
+                self._stats["skipped"] += 1
+                return
+            self._stats["checked"] += 1
+            self._stats["total_ms"] += elapsed_ms
+            if rescued:
+                self._stats["rescued_by_tesseract"] += 1
+            if verdict.is_ticket:
+                self._stats["passed"] += 1
+            else:
+                self._stats["rejected"] += 1
+                rejections = self._stats["rejections"]
+                rejections[verdict.reason] = rejections.get(verdict.reason, 0) + 1
+
+    def getStats(self) -> Dict[str, Any]:
+        """Imágenes analizadas, descartadas (llamadas al modelo ahorradas) y latencia media."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["rejections"] = dict(self._stats["rejections"])
+        total_ms = stats.pop("total_ms")
+        stats["avg_ms"] = round(total_ms / stats["checked"], 2) if stats["checked"] else None
+        return stats
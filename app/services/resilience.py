@@ -0,0 +1,539 @@
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Union
+
+from google.api_core import exceptions as google_exceptions
+
+from app.core.config import Settings
+from app.services.api_key_pool import isPoolExhausted
+from app.services.deadlines import DeadlineExceededError, boundedTimeout, remainingTime
+from app.services.ocr_engine import OCREngine, OCRExtraction
+
+
+class OCRTimeoutError(RuntimeError):
+    """Un intento de extracción superó su tiempo máximo."""
+
+
+class CircuitOpenError(RuntimeError):
+    """El circuito está abierto: el motor está fallando y no se le envían peticiones."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Errores del modelo que merecen otro intento: sobrecarga, cuota y fallos del servidor.
+# El resto de errores 4xx (petición inválida, permisos...) fallarían igual al repetirlos.
+RETRYABLE_GOOGLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.Aborted,
+)
+
+
+def isRetryableError(error: BaseException) -> bool:
+    """
+    Indica si un error de extracción es transitorio.
+
+    - `ValueError` (bytes de imagen inválidos) nunca lo es.
+    - Tampoco el plazo vencido de la petición (`DeadlineExceededError`) ni el pool de
+      claves sin cupo (`KeyPoolExhaustedError`): son límites locales, no fallos del motor.
+    - Los timeouts siempre lo son.
+    - Para los `RuntimeError` que envuelven una excepción del SDK de Google se mira la
+      causa: solo se reintentan cuota, sobrecarga y errores 5xx. Los demás
+      `RuntimeError` (conexión caída, JSON inválido...) se consideran transitorios.
+    """
+    if isinstance(error, (ValueError, DeadlineExceededError)):
+        return False
+    if isinstance(error, (OCRTimeoutError, asyncio.TimeoutError, TimeoutError)):
+        return True
+    if isinstance(error, CircuitOpenError) or isPoolExhausted(error):
+        return False
+    cause = error
+    while cause is not None:
+        if isinstance(cause, RETRYABLE_GOOGLE_ERRORS):
+            return True
+        if isinstance(cause, google_exceptions.GoogleAPICallError):
+            return False
+        cause = cause.__cause__
+    return isinstance(error, RuntimeError)
+
+
+class LatencyTracker:
+    """Latencias de las últimas extracciones correctas, para calcular percentiles."""
+
+    def __init__(self, window_size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Percentil (0-1) de las muestras recientes, o None si no hay ninguna."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(fraction * len(samples)) - 1))
+        return samples[index]
+
+
+class CircuitBreaker:
+    """
+    Disyuntor por tasa de error sobre una ventana deslizante de intentos.
+
+    - closed: las peticiones pasan; si en los últimos `window_size` intentos (con al menos
+      `min_calls`) la tasa de fallos alcanza `failure_rate_threshold`, se abre.
+    - open: se rechazan las peticiones durante `open_seconds`.
+    - half_open: pasado ese tiempo se deja pasar una única petición de prueba; si va bien
+      el circuito se cierra y, si falla, vuelve a abrirse.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_rate_threshold: float = 0.5,
+        window_size: int = 20,
+        min_calls: int = 10,
+        open_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.window_size = max(1, window_size)
+        self.min_calls = max(1, min(min_calls, self.window_size))
+        self.open_seconds = open_seconds
+        self._clock = clock
+        self._outcomes: Deque[bool] = deque(maxlen=self.window_size)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refreshState()
+            return self._state
+
+    def _refreshState(self) -> None:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+    def retryAfter(self) -> float:
+        """Segundos que faltan para que el circuito admita una petición de prueba."""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (self._clock() - self._opened_at))
+
+    def allowRequest(self) -> bool:
+        """Indica si se puede enviar una petición (y reserva la de prueba en half_open)."""
+        with self._lock:
+            self._refreshState()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def recordSuccess(self) -> None:
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+                self._probe_in_flight = False
+            self._outcomes.append(True)
+
+    def recordFailure(self) -> None:
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            if self._state == self.CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_rate_threshold:
+                    self._open()
+
+    def recordIgnored(self) -> None:
+        """Un intento que no dice nada de la salud del motor (ej. imagen inválida)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _open(self) -> None:
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+        self._probe_in_flight = False
+        self._stats["opened"] += 1
+
+    def getStats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refreshState()
+            outcomes = list(self._outcomes)
+            return {
+                "state": self._state,
+                "failure_rate": round(outcomes.count(False) / len(outcomes), 4) if outcomes else 0.0,
+                **self._stats,
+            }
+
+
+class ResilientOCREngine(OCREngine):
+    """
+    Envuelve un motor OCR remoto con timeouts, reintentos, peticiones cubiertas y disyuntor.
+
+    - Cada intento tiene un tiempo máximo (`attempt_timeout`).
+    - Los errores transitorios (ver `isRetryableError`) se reintentan hasta `max_attempts`
+      veces, esperando un backoff exponencial con jitter completo entre intentos.
+    - Con `hedging_enabled`, si un intento tarda más que el percentil `hedge_percentile`
+      de las latencias recientes se lanza un segundo intento en paralelo y se usa la
+      primera respuesta correcta.
+    - El `circuit_breaker` corta las llamadas cuando la tasa de error se dispara. Con el
+      circuito abierto, o agotados los reintentos, la petición se envía al motor
+      `fallback` si lo hay; si no, falla de inmediato con `CircuitOpenError`.
+    - Si el pool de claves no tiene cupo (`KeyPoolExhaustedError`) no se reintenta ni se
+      cuenta como fallo del motor: se pasa al `fallback` o se propaga tal cual.
+
+    No tiene pool de hilos propio: delega en el del motor envuelto.
+    """
+
+    def __init__(
+        self,
+        engine: OCREngine,
+        fallback: Optional[OCREngine] = None,
+        attempt_timeout: Optional[float] = None,
+        max_attempts: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 4.0,
+        hedging_enabled: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 20,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        rng: Optional[random.Random] = None,
+    ):
+        """
+        Args:
+            engine: Motor envuelto (normalmente Gemini).
+            fallback: Motor alternativo cuando el principal no está disponible.
+            attempt_timeout: Segundos máximos por intento; None = sin límite.
+            max_attempts: Intentos totales (1 = sin reintentos).
+            backoff_base: Espera base (segundos) antes del primer reintento.
+            backoff_max: Espera máxima entre intentos.
+            hedging_enabled: Lanza un intento paralelo cuando el primero tarda demasiado.
+            hedge_percentile: Percentil de latencia (0-1) a partir del cual se cubre.
+            hedge_min_samples: Latencias necesarias antes de empezar a cubrir.
+            circuit_breaker: Disyuntor; None lo desactiva.
+            rng: Generador aleatorio del jitter (inyectable en tests).
+        """
+        self.engine = engine
+        self.fallback = fallback
+        self.name = engine.name
+        self.output_format = engine.output_format
+        self.max_concurrency = engine.max_concurrency
+        self.attempt_timeout = attempt_timeout or None
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedging_enabled = hedging_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = max(1, hedge_min_samples)
+        self.circuit_breaker = circuit_breaker
+        self.latencies = LatencyTracker()
+        self._rng = rng or random.Random()
+        self._stats = {
+            "calls": 0,
+            "attempts": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "fallbacks": 0,
+            "short_circuited": 0,
+            "deadline_exceeded": 0,
+        }
+
+    @classmethod
+    def fromSettings(
+        cls, engine: OCREngine, settings: Settings, fallback: Optional[OCREngine] = None
+    ) -> "ResilientOCREngine":
+        """Envuelve `engine` con la política de resiliencia de la configuración."""
+        circuit_breaker = None
+        if settings.circuit_breaker_enabled:
+            circuit_breaker = CircuitBreaker(
+                failure_rate_threshold=settings.circuit_breaker_failure_rate,
+                window_size=settings.circuit_breaker_window,
+                min_calls=settings.circuit_breaker_min_calls,
+                open_seconds=settings.circuit_breaker_open_seconds,
+            )
+        return cls(
+            engine,
+            fallback=fallback,
+            attempt_timeout=settings.ocr_attempt_timeout_seconds,
+            max_attempts=settings.ocr_max_attempts,
+            backoff_base=settings.ocr_backoff_base_seconds,
+            backoff_max=settings.ocr_backoff_max_seconds,
+            hedging_enabled=settings.ocr_hedging_enabled,
+            hedge_percentile=settings.ocr_hedge_percentile,
+            hedge_min_samples=settings.ocr_hedge_min_samples,
+            circuit_breaker=circuit_breaker,
+        )
+
+    def extractTextFromImage(self, image_bytes: bytes, language: str = 'spa') -> str:
+        """Llamada síncrona directa al motor envuelto (sin la política de resiliencia)."""
+        return self.engine.extractTextFromImage(image_bytes, language)
+
+    async def extractTextFromImageAsync(self, image_bytes: bytes, language: str = 'spa') -> str:
+        return (await self.extractAsync(image_bytes, language)).text
+
+    async def extractAsync(self, image_bytes: bytes, language: str = 'spa') -> OCRExtraction:
+        """
+        Extrae el texto aplicando la política de resiliencia.
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            CircuitOpenError: Si el circuito está abierto y no hay motor alternativo.
+            RuntimeError: Si todos los intentos fallan y no hay motor alternativo.
+        """
+        self._stats["calls"] += 1
+        if self.circuit_breaker is not None and not self.circuit_breaker.allowRequest():
+            self._stats["short_circuited"] += 1
+            return await self._useFallback(image_bytes, language, self._circuitOpenError())
+
+        try:
+            extraction = await self._callWithRetries(image_bytes, language)
+        except Exception as e:
+            if isinstance(e, CircuitOpenError) or isPoolExhausted(e) or isRetryableError(e):
+                return await self._useFallback(image_bytes, language, e)
+            self._stats["failures"] += 1
+            raise
+        self._stats["successes"] += 1
+        return extraction
+
+    async def streamAsync(
+        self, image_bytes: bytes, language: str = 'spa'
+    ) -> AsyncIterator[Union[str, OCRExtraction]]:
+        """
+        Extracción en streaming con la política de resiliencia.
+
+        El timeout por intento se aplica hasta el primer trozo y solo se reintenta si el
+        intento falla antes de haber entregado nada (lo ya enviado al cliente no se puede
+        deshacer). No se cubren peticiones en streaming.
+        """
+        self._stats["calls"] += 1
+        if self.circuit_breaker is not None and not self.circuit_breaker.allowRequest():
+            self._stats["short_circuited"] += 1
+            async for piece in self._streamFallback(image_bytes, language, self._circuitOpenError()):
+                yield piece
+            return
+
+        last_error: Optional[Exception] = None
+        for attempt in range(1, self.max_attempts + 1):
+            if attempt > 1:
+                if self.circuit_breaker is not None and not self.circuit_breaker.allowRequest():
+                    last_error = self._circuitOpenError()
+                    break
+                if not await self._waitBeforeRetry(attempt - 1):
+                    break
+            self._stats["attempts"] += 1
+            started_at = time.perf_counter()
+            stream = self.engine.streamAsync(image_bytes, language).__aiter__()
+            delivered = False
+            try:
+                timeout = self._attemptTimeout()
+                try:
+                    first = await asyncio.wait_for(stream.__anext__(), timeout)
+                except asyncio.TimeoutError as e:
+                    raise self._timeoutError(timeout) from e
+                delivered = True
+                yield first
+                async for piece in stream:
+                    yield piece
+            except StopAsyncIteration:
+                pass
+            except Exception as e:
+                if delivered or not isRetryableError(e):
+                    if self.circuit_breaker is not None:
+                        if isRetryableError(e):
+                            self.circuit_breaker.recordFailure()
+                        else:
+                            self.circuit_breaker.recordIgnored()
+                    self._stats["failures"] += 1
+                    raise
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.recordFailure()
+                last_error = e
+                continue
+            finally:
+                await stream.aclose()
+            self.latencies.add(time.perf_counter() - started_at)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.recordSuccess()
+            self._stats["successes"] += 1
+            return
+
+        async for piece in self._streamFallback(image_bytes, language, last_error):
+            yield piece
+
+    async def _streamFallback(
+        self, image_bytes: bytes, language: str, error: Exception
+    ) -> AsyncIterator[Union[str, OCRExtraction]]:
+        if self.fallback is None:
+            self._stats["failures"] += 1
+            raise error
+        self._stats["fallbacks"] += 1
+        async for piece in self.fallback.streamAsync(image_bytes, language):
+            yield piece
+
+    def _circuitOpenError(self) -> CircuitOpenError:
+        retry_after = self.circuit_breaker.retryAfter() if self.circuit_breaker is not None else 0.0
+        return CircuitOpenError(
+            f"El motor OCR '{self.name}' no está disponible temporalmente (circuito abierto).",
+            retry_after=retry_after,
+        )
+
+    async def _useFallback(self, image_bytes: bytes, language: str, error: Exception) -> OCRExtraction:
+        if self.fallback is None:
+            self._stats["failures"] += 1
+            raise error
+        self._stats["fallbacks"] += 1
+        return await self.fallback.extractAsync(image_bytes, language)
+
+    def _backoffDelay(self, retry_number: int) -> float:
+        """Espera antes del reintento `retry_number` (1, 2...): backoff exponencial con jitter completo."""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (retry_number - 1)))
+        return self._rng.uniform(0, ceiling)
+
+    async def _waitBeforeRetry(self, retry_number: int) -> bool:
+        """Espera el backoff antes de un reintento; False si no queda plazo para repetir."""
+        delay = self._backoffDelay(retry_number)
+        remaining = remainingTime()
+        if remaining is not None and remaining <= delay:
+            return False
+        self._stats["retries"] += 1
+        await asyncio.sleep(delay)
+        return True
+
+    def _attemptTimeout(self) -> Optional[float]:
+        """Tiempo máximo del intento: `attempt_timeout`, sin pasar del plazo de la petición."""
+        try:
+            return boundedTimeout(self.attempt_timeout)
+        except DeadlineExceededError:
+            self._stats["deadline_exceeded"] += 1
+            raise
+
+    def _timeoutError(self, timeout: Optional[float]) -> RuntimeError:
+        """Error de un intento que agotó `timeout`: el suyo propio o el plazo de la petición."""
+        if timeout != self.attempt_timeout:
+            self._stats["deadline_exceeded"] += 1
+            return DeadlineExceededError(
+                f"El motor OCR '{self.name}' no respondió dentro del plazo de la petición"
+            )
+        self._stats["timeouts"] += 1
+        return OCRTimeoutError(f"El motor OCR '{self.name}' no respondió en {self.attempt_timeout} s")
+
+    async def _callWithRetries(self, image_bytes: bytes, language: str) -> OCRExtraction:
+        last_error: Optional[Exception] = None
+        for attempt in range(1, self.max_attempts + 1):
+            if attempt > 1:
+                if self.circuit_breaker is not None and not self.circuit_breaker.allowRequest():
+                    raise self._circuitOpenError()
+                if not await self._waitBeforeRetry(attempt - 1):
+                    break
+            try:
+                extraction = await self._attemptWithHedge(image_bytes, language)
+            except Exception as e:
+                if not isRetryableError(e):
+                    if self.circuit_breaker is not None:
+                        self.circuit_breaker.recordIgnored()
+                    raise
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.recordFailure()
+                last_error = e
+                continue
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.recordSuccess()
+            return extraction
+        raise last_error
+
+    def _hedgeDelay(self) -> Optional[float]:
+        if not self.hedging_enabled or len(self.latencies) < self.hedge_min_samples:
+            return None
+        return self.latencies.percentile(self.hedge_percentile)
+
+    async def _attempt(self, image_bytes: bytes, language: str) -> OCRExtraction:
+        self._stats["attempts"] += 1
+        started_at = time.perf_counter()
+        timeout = self._attemptTimeout()
+        try:
+            extraction = await asyncio.wait_for(self.engine.extractAsync(image_bytes, language), timeout)
+        except asyncio.TimeoutError as e:
+            raise self._timeoutError(timeout) from e
+        self.latencies.add(time.perf_counter() - started_at)
+        return extraction
+
+    async def _attemptWithHedge(self, image_bytes: bytes, language: str) -> OCRExtraction:
+        hedge_delay = self._hedgeDelay()
+        if hedge_delay is None:
+            return await self._attempt(image_bytes, language)
+
+        primary = asyncio.ensure_future(self._attempt(image_bytes, language))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            # El intento va más lento que el percentil objetivo: se lanza otro en paralelo.
+            self._stats["hedges"] += 1
+            hedge = asyncio.ensure_future(self._attempt(image_bytes, language))
+            pending = {primary, hedge}
+            first_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._stats["hedge_wins"] += 1
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def getStats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self._stats)
+        p50 = self.latencies.percentile(0.5)
+        p95 = self.latencies.percentile(0.95)
+        stats["latency_p50_ms"] = round(p50 * 1000, 1) if p50 is not None else None
+        stats["latency_p95_ms"] = round(p95 * 1000, 1) if p95 is not None else None
+        stats["fallback_engine"] = self.fallback.name if self.fallback is not None else None
+        stats["circuit_breaker"] = (
+            self.circuit_breaker.getStats() if self.circuit_breaker is not None else None
+        )
+        return stats
+
+    def warmUp(self) -> None:
+        self.engine.warmUp()
+
+    def close(self) -> None:
+        self.engine.close()
@@ -0,0 +1,74 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes idénticas en una sola ejecución ("single-flight").
+
+    Si llega una llamada con una clave que ya se está procesando, no se lanza otra:
+    la nueva espera al mismo resultado (o recibe la misma excepción). La clave deja
+    de estar "en vuelo" en cuanto la ejecución termina, así que las llamadas
+    posteriores vuelven a ejecutarse (la caché de resultados es otra capa).
+
+    La ejecución compartida solo se cancela si se cancelan todos los que la esperan:
+    que un cliente se desconecte no deja sin resultado a los demás.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._stats = {"calls": 0, "executions": 0, "coalesced": 0, "failures": 0}
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecuta `factory()` para la clave, o se une a la ejecución en curso.
+
+        Args:
+            key: Identificador de la operación (ej. hash de la imagen).
+            factory: Función sin argumentos que devuelve la corrutina a ejecutar.
+
+        Returns:
+            Any: El resultado de la ejecución compartida.
+
+        Raises:
+            Exception: La excepción lanzada por la ejecución compartida.
+        """
+        self._stats["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self._stats["executions"] += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda finished, key=key: self._onDone(key, finished))
+        else:
+            self._stats["coalesced"] += 1
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(key) == 1 and self._inflight.get(key) is task:
+                task.cancel()
+            raise
+        finally:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _onDone(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._stats["failures"] += 1
+
+    def inFlight(self) -> int:
+        """Número de claves que se están procesando ahora mismo."""
+        return len(self._inflight)
+
+    def getStats(self) -> Dict[str, Any]:
+        """Devuelve los contadores de llamadas, ejecuciones reales y llamadas agrupadas."""
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._inflight)
+        return stats
@@ -0,0 +1,125 @@
+import io
+import shutil
+import threading
+from typing import Optional
+
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image
+
+from app.services.image_preprocessor import ImagePreprocessor
+from app.services.ocr_engine import OCREngine
+
+
+class TesseractOCRService(OCREngine):
+    # Motor OCR totalmente local: binariza la imagen con OpenCV y la lee con Tesseract.
+    # No hace llamadas de red, así que sirve como alternativa rápida (o de respaldo)
+    # a Gemini. Devuelve texto plano, que se parsea con `ParserService.parseReceiptText`.
+    name = "tesseract"
+    output_format = "text"
+
+    # Por debajo de este ancho Tesseract pierde caracteres; se amplía la imagen antes de leerla.
+    MIN_WIDTH = 1000
+
+    def __init__(
+        self,
+        tesseract_cmd: Optional[str] = None,
+        page_segmentation_mode: int = 6,
+        image_preprocessor: Optional[ImagePreprocessor] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        """
+        Inicializa el motor Tesseract.
+
+        Args:
+            tesseract_cmd: Ruta al ejecutable de Tesseract. Si no se proporciona, se busca en el PATH.
+            page_segmentation_mode: Modo de segmentación (`--psm`) de Tesseract. El 6 (bloque
+                de texto uniforme) funciona bien con tickets.
+            image_preprocessor: Preprocesador usado para decodificar y reducir la imagen.
+            max_concurrency: Extracciones simultáneas máximas desde `extractTextFromImageAsync`.
+        """
+        super().__init__(max_concurrency)
+        self.tesseract_cmd = tesseract_cmd
+        self.page_segmentation_mode = page_segmentation_mode
+        self.image_preprocessor = image_preprocessor
+        self._binary_checked = False
+        self._binary_lock = threading.Lock()
+
+    def _ensureBinary(self) -> None:
+        """
+        Comprueba (una sola vez) que el ejecutable de Tesseract está disponible.
+
+        Raises:
+            RuntimeError: Si no se encuentra el ejecutable.
+        """
+        if self._binary_checked:
+            return
+        with self._binary_lock:
+            if self._binary_checked:
+                return
+            if self.tesseract_cmd:
+                pytesseract.pytesseract.tesseract_cmd = self.tesseract_cmd
+            command = pytesseract.pytesseract.tesseract_cmd
+            if shutil.which(command) is None:
+                raise RuntimeError(
+                    f"Tesseract no encontrado: no se ha podido ejecutar '{command}'. "
+                    "Instálalo o configura TESSERACT_CMD."
+                )
+            self._binary_checked = True
+
+    def _preprocessImageForOcr(self, image_bytes: bytes) -> np.ndarray:
+        """
+        Decodifica la imagen y la binariza para Tesseract.
+
+        Pasa a escala de grises, amplía las imágenes pequeñas, elimina ruido con un
+        filtro de mediana y aplica un umbral adaptativo (robusto a sombras e
+        iluminación desigual, habituales en fotos de tickets).
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+        """
+        if self.image_preprocessor is not None:
+            image = self.image_preprocessor.decode(image_bytes)
+        else:
+            try:
+                image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            except Exception as e:
+                raise ValueError(f"Los bytes de la imagen no son válidos: {e}") from e
+
+        gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
+        height, width = gray.shape
+        if width < self.MIN_WIDTH:
+            scale = self.MIN_WIDTH / width
+            gray = cv2.resize(gray, (self.MIN_WIDTH, int(height * scale)), interpolation=cv2.INTER_CUBIC)
+        gray = cv2.medianBlur(gray, 3)
+        return cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15
+        )
+
+    def extractTextFromImage(self, image_bytes: bytes, language: str = 'spa') -> str:
+        """
+        Extrae el texto plano de una imagen de ticket con Tesseract.
+
+        Args:
+            image_bytes: Bytes de la imagen.
+            language: Idioma(s) de Tesseract (ej. 'spa', 'spa+eng').
+
+        Returns:
+            str: Texto reconocido, una línea del ticket por línea.
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            RuntimeError: Si Tesseract no está instalado o falla.
+        """
+        self._ensureBinary()
+        binary = self._preprocessImageForOcr(image_bytes)
+        try:
+            text = pytesseract.image_to_string(
+                binary, lang=language, config=f"--psm {self.page_segmentation_mode}"
+            )
+        except pytesseract.TesseractNotFoundError as e:
+            raise RuntimeError(f"Tesseract no encontrado: {e}") from e
+        except Exception as e:
+            raise RuntimeError(f"Error al procesar imagen con Tesseract: {e}") from e
+        return text.strip()
@@ -0,0 +1,343 @@
+import asyncio
+import io
+import math
+import re
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from app.core.config import Settings
+from app.services import json_codec
+from app.services.image_preprocessor import ImageTooLargeError, openImage
+from app.services.ocr_engine import OCREngine, OCRExtraction
+
+
+# Orientaciones EXIF que giran la imagen 90/270 grados (intercambian ancho y alto).
+_ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+class TileSplitter:
+    """
+    Decide si una imagen es un ticket "largo" y la corta en franjas horizontales solapadas.
+
+    Los cortes no se hacen a una altura fija: cerca de cada corte nominal se busca la
+    fila más clara (un hueco entre líneas de texto), de modo que ninguna línea quede
+    partida entre dos franjas. La banda de solape contiene así líneas completas que
+    aparecen en las dos franjas y que se eliminan al unir los resultados.
+    """
+
+    def __init__(
+        self,
+        min_aspect_ratio: float = 3.0,
+        tile_aspect_ratio: float = 1.5,
+        overlap: float = 0.15,
+        max_width: int = 1200,
+        max_tiles: int = 12,
+    ):
+        """
+        Args:
+            min_aspect_ratio: Relación alto/ancho a partir de la cual se corta la imagen.
+            tile_aspect_ratio: Relación alto/ancho de cada franja.
+            overlap: Fracción de la altura de la franja que se solapa con la siguiente.
+            max_width: Ancho máximo (píxeles); las imágenes más anchas se reducen antes de cortar.
+            max_tiles: Número máximo de franjas; si hicieran falta más, se hacen más altas.
+        """
+        self.min_aspect_ratio = min_aspect_ratio
+        self.tile_aspect_ratio = tile_aspect_ratio
+        self.overlap = min(max(overlap, 0.0), 0.5)
+        self.max_width = max_width
+        self.max_tiles = max(2, max_tiles)
+
+    @classmethod
+    def fromSettings(cls, settings: Settings) -> "TileSplitter":
+        return cls(
+            min_aspect_ratio=settings.ocr_tiling_min_aspect_ratio,
+            tile_aspect_ratio=settings.ocr_tile_aspect_ratio,
+            overlap=settings.ocr_tile_overlap,
+            max_width=settings.ocr_tile_max_width,
+            max_tiles=settings.ocr_max_tiles,
+        )
+
+    def isTall(self, width: int, height: int) -> bool:
+        """Indica si una imagen de estas dimensiones debe procesarse por franjas."""
+        return width > 0 and height / width >= self.min_aspect_ratio
+
+    def isTallImage(self, image_bytes: bytes) -> bool:
+        """Como `isTall`, leyendo solo la cabecera de la imagen (sin decodificarla)."""
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            width, height = image.size
+            if image.getexif().get(0x0112) in _ROTATED_ORIENTATIONS:
+                width, height = height, width
+        except Exception:
+            return False
+        return self.isTall(width, height)
+
+    def planTiles(self, gray: np.ndarray) -> List[Tuple[int, int]]:
+        """
+        Calcula las franjas (fila inicial, fila final exclusiva) de una imagen en grises.
+        """
+        height, width = gray.shape
+        tile_height = max(1, round(width * self.tile_aspect_ratio))
+        if tile_height >= height:
+            return [(0, height)]
+        count = math.ceil((height / tile_height - self.overlap) / (1 - self.overlap))
+        if count > self.max_tiles:
+            count = self.max_tiles
+            tile_height = math.ceil(height / (count - (count - 1) * self.overlap))
+        overlap_px = round(tile_height * self.overlap)
+        stride = tile_height - overlap_px
+        search = max(1, overlap_px // 2)
+
+        # Oscuridad de cada fila: las filas sin texto tienen valores cercanos a cero.
+        darkness = (255 - gray.astype(np.int32)).sum(axis=1)
+
+        def clearestRow(target: int, low: int, high: int) -> int:
+            low, high = max(low, target - search), min(high, target + search)
+            if high <= low:
+                return min(max(target, low), high)
+            return low + int(np.argmin(darkness[low:high + 1]))
+
+        tiles: List[Tuple[int, int]] = []
+        start = 0
+        for index in range(count):
+            if index == count - 1:
+                tiles.append((start, height))
+                break
+            # La fila clara se incluye en la franja: la última línea no toca el borde.
+            end = min(height, clearestRow(start + tile_height, start + stride, height - 1) + 1)
+            tiles.append((start, end))
+            if end >= height:
+                break
+            next_start = clearestRow(end - overlap_px, start + 1, end - 1)
+            start = next_start
+        return tiles
+
+    def split(self, image: Image.Image) -> List[Image.Image]:
+        """Corta una imagen RGB en franjas (reduciéndola antes a `max_width` si es más ancha)."""
+        if self.max_width > 0 and image.width > self.max_width:
+            scale = self.max_width / image.width
+            image = image.resize((self.max_width, max(1, round(image.height * scale))), Image.Resampling.LANCZOS)
+        gray = np.asarray(image.convert("L"))
+        return [image.crop((0, top, image.width, bottom)) for top, bottom in self.planTiles(gray)]
+
+
+def _normalizeText(value: Any) -> str:
+    return re.sub(r"\s+", " ", str(value or "")).strip().casefold()
+
+
+def _itemKey(item: Any) -> Any:
+    if not isinstance(item, dict):
+        return repr(item)
+    return (_normalizeText(item.get("description")), str(item.get("quantity")), str(item.get("unit_price")))
+
+
+def mergeOverlapping(sequences: Sequence[Sequence[Any]], key: Callable[[Any], Any]) -> Tuple[List[Any], int]:
+    """
+    Une las listas de las franjas eliminando los elementos repetidos en las bandas de solape.
+
+    Entre dos franjas consecutivas se busca el sufijo más largo de la lista acumulada que
+    coincide con un prefijo de la siguiente; esos elementos se leyeron dos veces.
+
+    Returns:
+        Tuple[List[Any], int]: La lista unida y el número de duplicados eliminados.
+    """
+    merged: List[Any] = []
+    removed = 0
+    for sequence in sequences:
+        keys = [key(element) for element in sequence]
+        merged_keys = [key(element) for element in merged]
+        shared = 0
+        for size in range(min(len(merged_keys), len(keys)), 0, -1):
+            if merged_keys[-size:] == keys[:size]:
+                shared = size
+                break
+        merged.extend(sequence[shared:])
+        removed += shared
+    return merged, removed
+
+
+def mergeTileDocuments(documents: Sequence[Any]) -> Tuple[Optional[Dict[str, Any]], int]:
+    """
+    Combina las respuestas JSON (ya decodificadas) de las franjas.
+
+    Une los `items`; los totales se toman de la última franja que los indica (están al
+    final del ticket).
+
+    Returns:
+        Tuple[Optional[Dict[str, Any]], int]: El documento combinado (None si ninguna
+        franja es un ticket) y el número de duplicados eliminados.
+    """
+    tickets = [
+        document for document in documents
+        if isinstance(document, dict) and document.get("is_ticket", True)
+    ]
+    if not tickets:
+        return None, 0
+
+    items, removed = mergeOverlapping([ticket.get("items") or [] for ticket in tickets], _itemKey)
+    merged: Dict[str, Any] = {"is_ticket": True, "items": items}
+    for field in ("subtotal", "tax", "total"):
+        merged[field] = next((ticket[field] for ticket in reversed(tickets) if ticket.get(field) is not None), None)
+    return merged, removed
+
+
+def _decodeTile(text: str) -> Any:
+    if not text:
+        return None
+    try:
+        return json_codec.loads(text)
+    except json_codec.JSONDecodeError:
+        return None
+
+
+def mergeTileOutputs(texts: Sequence[str], output_format: str) -> Tuple[str, int]:
+    """
+    Combina la salida del motor OCR para cada franja en una sola respuesta.
+
+    - "json": ver `mergeTileDocuments`. Si ninguna franja es un ticket, se devuelve la
+      respuesta de la primera.
+    - "text": une las líneas.
+
+    Returns:
+        Tuple[str, int]: El texto combinado y el número de duplicados eliminados.
+    """
+    if output_format == "text":
+        lines = [[line for line in text.splitlines() if line.strip()] for text in texts]
+        merged_lines, removed = mergeOverlapping(lines, _normalizeText)
+        return "\n".join(merged_lines), removed
+
+    merged, removed = mergeTileDocuments([_decodeTile(text) for text in texts])
+    if merged is None:
+        return (texts[0] if texts else ""), 0
+    return json_codec.dumps(merged), removed
+
+
+class TiledOCREngine(OCREngine):
+    """
+    Procesa los tickets muy largos por franjas en paralelo.
+
+    Si la imagen no es alta (ver `TileSplitter.isTall`) se pasa tal cual al motor
+    envuelto. Si lo es, se corta en franjas solapadas que se envían a la vez al motor
+    (limitadas por su pool de hilos) y sus resultados se unen con `mergeTileOutputs`.
+    El texto combinado tiene el mismo formato que el del motor, así que el parser
+    numera los ítems de forma correlativa como si el ticket se hubiera leído entero,
+    y el tiempo total depende de lo que tarda una franja, no de la longitud del ticket.
+    """
+
+    TILE_FORMAT = "JPEG"
+    TILE_QUALITY = 95
+
+    def __init__(self, engine: OCREngine, splitter: Optional[TileSplitter] = None, max_pixels: int = 0):
+        """
+        Args:
+            engine: Motor que lee cada franja.
+            splitter: Decide qué imágenes se cortan y dónde.
+            max_pixels: Píxeles máximos que se decodifican (ver `openImage`). 0 = sin límite.
+        """
+        self.engine = engine
+        self.splitter = splitter or TileSplitter()
+        self.max_pixels = max_pixels
+        self.name = engine.name
+        self.output_format = engine.output_format
+        self.max_concurrency = engine.max_concurrency
+        self._lock = threading.Lock()
+        self._stats = {"tiled_images": 0, "tiles": 0, "duplicates_removed": 0}
+
+    def _cutTiles(self, image_bytes: bytes) -> List[bytes]:
+        """
+        Decodifica la imagen a resolución completa (reducida solo si supera `max_pixels`),
+        la corta en franjas y las codifica.
+
+        Raises:
+            ImageTooLargeError: Si la imagen supera `max_pixels` y no se puede decodificar reducida.
+            ValueError: Si los bytes de la imagen no son válidos.
+        """
+        try:
+            image = ImageOps.exif_transpose(openImage(image_bytes, max_pixels=self.max_pixels))
+            image = image.convert("RGB")
+        except ImageTooLargeError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Los bytes de la imagen no son válidos: {e}") from e
+        tiles = []
+        for tile in self.splitter.split(image):
+            buffer = io.BytesIO()
+            tile.save(buffer, format=self.TILE_FORMAT, quality=self.TILE_QUALITY)
+            tiles.append(buffer.getvalue())
+        return tiles
+
+    def _merge(self, extractions: Sequence[OCRExtraction]) -> OCRExtraction:
+        first = extractions[0]
+        if first.output_format == "text":
+            merged_text, removed = mergeTileOutputs([e.text for e in extractions], "text")
+            merged = OCRExtraction(merged_text, first.engine, first.output_format)
+        else:
+            # Se reutiliza el JSON que cada franja ya trae decodificado.
+            documents = [e.data if e.data is not None else _decodeTile(e.text) for e in extractions]
+            data, removed = mergeTileDocuments(documents)
+            if data is None:
+                merged = first
+            else:
+                merged = OCRExtraction(json_codec.dumps(data), first.engine, first.output_format, data)
+        with self._lock:
+            self._stats["tiled_images"] += 1
+            self._stats["tiles"] += len(extractions)
+            self._stats["duplicates_removed"] += removed
+        return merged
+
+    def extractTextFromImage(self, image_bytes: bytes, language: str = 'spa') -> str:
+        """Versión bloqueante: las franjas se procesan una tras otra."""
+        if not self.splitter.isTallImage(image_bytes):
+            return self.engine.extractTextFromImage(image_bytes, language)
+        tiles = self._cutTiles(image_bytes)
+        extractions = [self.engine.extractFromImage(tile, language) for tile in tiles]
+        return self._merge(extractions).text
+
+    async def extractTextFromImageAsync(self, image_bytes: bytes, language: str = 'spa') -> str:
+        return (await self.extractAsync(image_bytes, language)).text
+
+    async def extractAsync(self, image_bytes: bytes, language: str = 'spa') -> OCRExtraction:
+        """
+        Extrae el texto, por franjas en paralelo si la imagen es un ticket largo.
+
+        Raises:
+            ValueError: Si los bytes de la imagen no son válidos.
+            RuntimeError: Si falla la extracción de alguna franja.
+        """
+        if not self.splitter.isTallImage(image_bytes):
+            return await self.engine.extractAsync(image_bytes, language)
+        # Decodificar y cortar una imagen grande es trabajo de CPU: fuera del event loop.
+        tiles = await asyncio.to_thread(self._cutTiles, image_bytes)
+        if len(tiles) == 1:
+            return await self.engine.extractAsync(tiles[0], language)
+        extractions = await asyncio.gather(*(self.engine.extractAsync(tile, language) for tile in tiles))
+        if len({(e.engine, e.output_format) for e in extractions}) > 1:
+            # Algunas franjas las resolvió el motor de respaldo: sus formatos no se pueden
+            # unir, así que se lee la imagen entera con el motor disponible.
+            return await self.engine.extractAsync(image_bytes, language)
+        return self._merge(extractions)
+
+    async def streamAsync(
+        self, image_bytes: bytes, language: str = 'spa'
+    ) -> AsyncIterator[Union[str, OCRExtraction]]:
+        """Los tickets largos no se emiten por trozos: el resultado unido llega de una vez."""
+        if not self.splitter.isTallImage(image_bytes):
+            async for piece in self.engine.streamAsync(image_bytes, language):
+                yield piece
+            return
+        extraction = await self.extractAsync(image_bytes, language)
+        yield extraction.text
+        yield extraction
+
+    def getStats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+    def warmUp(self) -> None:
+        self.engine.warmUp()
+
+    def close(self) -> None:
+        self.engine.close()
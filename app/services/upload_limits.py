@@ -0,0 +1,263 @@
+import io
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+from starlette.exceptions import HTTPException
+
+from app.core.config import Settings
+
+
+# Firmas (magic bytes) de los formatos que Pillow decodifica sin plugins.
+_SIGNATURES: List[Tuple[bytes, str]] = [
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+]
+
+# Reducción máxima del modo draft de JPEG (1/8 por lado).
+_JPEG_DRAFT_PIXEL_FACTOR = 64
+
+
+def sniffImageFormat(head: bytes) -> Optional[str]:
+    """Formato de imagen según los primeros bytes del archivo, o None si no es uno soportado."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, image_format in _SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+class UploadRejectedError(Exception):
+    """Subida rechazada antes de procesarla: demasiado grande (413) o no es una imagen (415)."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadLimits:
+    """
+    Límites de las imágenes subidas, aplicados antes de decodificar nada.
+
+    - Tamaño: el cuerpo de las peticiones de subida se corta en cuanto pasa del máximo
+      (ver `UploadLimitMiddleware`) y cada imagen se rechaza con 413 si pasa de
+      `max_bytes`, sin leerla entera.
+    - Tipo: los primeros bytes deben ser la firma de un formato soportado (JPEG, PNG,
+      WebP, GIF, BMP o TIFF), sea cual sea el `Content-Type` que declare el cliente (415).
+    - Píxeles: se lee la cabecera de la imagen y se rechazan las que tienen más de
+      `max_pixels` píxeles (bombas de descompresión: pocos bytes que ocupan gigas al
+      decodificar), salvo los JPEG que el modo draft puede decodificar ya reducidos
+      hasta caber en el límite (ver `openImage`).
+
+    Con esto la memoria de cada subida queda acotada: una copia de como mucho
+    `max_bytes` bytes y una imagen decodificada de como mucho `max_pixels` píxeles.
+    """
+
+    SNIFF_BYTES = 16
+
+    def __init__(
+        self,
+        max_bytes: int = 20 * 1024 * 1024,
+        max_pixels: int = 40_000_000,
+        batch_max_files: int = 50,
+        multipart_overhead: int = 64 * 1024,
+        chunk_size: int = 1024 * 1024,
+    ):
+        """
+        Args:
+            max_bytes: Tamaño máximo de cada imagen.
+            max_pixels: Píxeles máximos de la imagen decodificada. 0 = sin límite.
+            batch_max_files: Archivos por subida por lotes (acota el cuerpo de `/upload/batch`).
+            multipart_overhead: Margen por archivo para las cabeceras multipart y los campos.
+            chunk_size: Tamaño de los trozos en que se lee una subida de tamaño desconocido.
+        """
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.batch_max_files = max(1, batch_max_files)
+        self.multipart_overhead = multipart_overhead
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._stats = {"accepted": 0, "rejected_size": 0, "rejected_type": 0, "rejected_pixels": 0}
+
+    @classmethod
+    def fromSettings(cls, settings: Settings) -> "UploadLimits":
+        return cls(
+            max_bytes=settings.upload_max_bytes,
+            max_pixels=settings.image_max_pixels,
+            batch_max_files=settings.batch_max_files,
+        )
+
+    def bodyLimit(self, method: str, path: str) -> Optional[int]:
+        """Bytes máximos del cuerpo de la petición, o None si la ruta no es de subida."""
+        if method != "POST" or not path.startswith("/api/") or "/upload" not in path:
+            return None
+        files = self.batch_max_files if path.endswith("/batch") else 1
+        return files * (self.max_bytes + self.multipart_overhead)
+
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def _reject(self, outcome: str, status_code: int, detail: str) -> UploadRejectedError:
+        self.record(outcome)
+        return UploadRejectedError(status_code, detail)
+
+    def tooLargeDetail(self) -> str:
+        return f"La imagen supera el tamaño máximo permitido ({self.max_bytes // (1024 * 1024)} MB)."
+
+    async def check(self, file: Any) -> str:
+        """
+        Comprueba el tamaño declarado y la firma de un `UploadFile` sin leerlo entero.
+
+        Returns:
+            str: El formato detectado (ej. "JPEG").
+
+        Raises:
+            UploadRejectedError: 413 si es demasiado grande; 415 si no es una imagen soportada.
+        """
+        if file.size is not None and file.size > self.max_bytes:
+            raise self._reject("rejected_size", 413, self.tooLargeDetail())
+        head = await file.read(self.SNIFF_BYTES)
+        await file.seek(0)
+        image_format = sniffImageFormat(head)
+        if image_format is None:
+            raise self._reject(
+                "rejected_type", 415,
+                "El contenido del archivo no es una imagen soportada (JPEG, PNG, WebP, GIF, BMP o TIFF).",
+            )
+        return image_format
+
+    async def read(self, file: Any) -> bytes:
+        """
+        Lee un `UploadFile` ya comprobado con `check`, sin pasar de `max_bytes`, y
+        comprueba los píxeles de la imagen por su cabecera.
+
+        Raises:
+            UploadRejectedError: 413 si la imagen es demasiado grande (en bytes o en píxeles).
+        """
+        if file.size is not None:
+            # Tamaño conocido (y ya comprobado): una sola lectura, una sola copia.
+            image_bytes = await file.read()
+        else:
+            chunks = []
+            total = 0
+            while chunk := await file.read(self.chunk_size):
+                total += len(chunk)
+                if total > self.max_bytes:
+                    raise self._reject("rejected_size", 413, self.tooLargeDetail())
+                chunks.append(chunk)
+            image_bytes = b"".join(chunks)
+        if len(image_bytes) > self.max_bytes:
+            raise self._reject("rejected_size", 413, self.tooLargeDetail())
+        self.checkPixels(image_bytes)
+        self.record("accepted")
+        return image_bytes
+
+    def checkPixels(self, image_bytes: bytes) -> None:
+        """
+        Rechaza, leyendo solo la cabecera, las imágenes con demasiados píxeles para decodificarlas.
+
+        Los bytes que Pillow no reconoce se dejan pasar: el motor OCR dará el error habitual.
+
+        Raises:
+            UploadRejectedError: 413 si la imagen tiene demasiados píxeles.
+        """
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                width, height = image.size
+                image_format = image.format
+        except Image.DecompressionBombError as e:
+            raise self._reject("rejected_pixels", 413, f"La imagen tiene demasiados píxeles: {e}")
+        except Exception:
+            return
+        if self.max_pixels <= 0:
+            return
+        limit = self.max_pixels * (_JPEG_DRAFT_PIXEL_FACTOR if image_format == "JPEG" else 1)
+        if width * height > limit:
+            raise self._reject(
+                "rejected_pixels", 413,
+                f"La imagen tiene demasiados píxeles ({width}x{height}); el máximo es {self.max_pixels}.",
+            )
+
+    def getStats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["max_bytes"] = self.max_bytes
+        stats["max_pixels"] = self.max_pixels
+        return stats
+
+
+class UploadLimitMiddleware:
+    """
+    Middleware ASGI que corta las subidas demasiado grandes antes de que se lean.
+
+    Si la petición declara un `Content-Length` mayor que el permitido se responde 413 sin
+    leer el cuerpo. Si no lo declara (o miente), se cuentan los bytes según llegan y se
+    responde 413 en cuanto se pasa del límite, sin esperar al resto del cuerpo.
+    """
+
+    def __init__(self, app: Any, getLimits: Callable[[Any], Optional[UploadLimits]]):
+        self.app = app
+        self.getLimits = getLimits
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] == "http":
+            limits = self.getLimits(scope["app"])
+            limit = limits.bodyLimit(scope["method"], scope["path"]) if limits is not None else None
+            if limit is not None:
+                content_length = self._contentLength(scope["headers"])
+                if content_length is not None and content_length > limit:
+                    limits.record("rejected_size")
+                    await self._reject(send, limits.tooLargeDetail())
+                    return
+                receive = self._boundedReceive(receive, limit, limits)
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _contentLength(headers: List[Tuple[bytes, bytes]]) -> Optional[int]:
+        for name, value in headers:
+            if name == b"content-length":
+                try:
+                    return int(value)
+                except ValueError:
+                    return None
+        return None
+
+    @staticmethod
+    def _boundedReceive(receive: Callable, limit: int, limits: UploadLimits) -> Callable:
+        received = 0
+
+        async def boundedReceive() -> Dict[str, Any]:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    limits.record("rejected_size")
+                    # FastAPI deja pasar las HTTPException de Starlette que ocurren al leer el cuerpo.
+                    raise HTTPException(status_code=413, detail=limits.tooLargeDetail())
+            return message
+
+        return boundedReceive
+
+    @staticmethod
+    async def _reject(send: Callable, detail: str) -> None:
+        body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
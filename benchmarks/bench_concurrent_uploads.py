@@ -0,0 +1,71 @@
+"""
+Benchmark: peticiones por segundo con N subidas concurrentes.
+
+Lanza N subidas simultáneas contra la app (transporte ASGI en memoria, sin red) con un
+modelo falso que tarda `--latency` segundos, y mide a la vez la latencia de `/health`.
+Con el OCR bloqueando el event loop el throughput sería ~1/latency y `/health`
+esperaría a todas las subidas; con el camino asíncrono escala hasta
+`OCR_MAX_CONCURRENCY` llamadas en paralelo y `/health` responde en milisegundos.
+
+Uso:
+    python -m benchmarks.bench_concurrent_uploads --uploads 1 4 8 16 --latency 0.2
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from app.main import app
+from app.api.endpoints.receipts import getOcrService
+from benchmarks.common import buildOcrService, makeReceiptImage
+
+
+async def _runRound(concurrent_uploads: int, image_bytes: bytes) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def upload():
+            response = await client.post(
+                "/api/v1/receipts/upload",
+                files={"file": ("bench.jpg", image_bytes, "image/jpeg")},
+            )
+            response.raise_for_status()
+
+        inicio = time.perf_counter()
+        uploads = [asyncio.create_task(upload()) for _ in range(concurrent_uploads)]
+        await asyncio.sleep(0)
+        health_inicio = time.perf_counter()
+        await client.get("/health")
+        health_ms = (time.perf_counter() - health_inicio) * 1000
+        await asyncio.gather(*uploads)
+        elapsed = time.perf_counter() - inicio
+    return {
+        "uploads": concurrent_uploads,
+        "elapsed_s": elapsed,
+        "req_per_s": concurrent_uploads / elapsed,
+        "health_ms": health_ms,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--latency", type=float, default=0.2, help="Latencia simulada del modelo (s)")
+    args = parser.parse_args()
+
+    ocr_service = buildOcrService(latency_s=args.latency)
+    app.dependency_overrides[getOcrService] = lambda: ocr_service
+    image_bytes = makeReceiptImage()
+
+    print(f"Latencia simulada del modelo: {args.latency * 1000:.0f} ms "
+          f"(serie: {1 / args.latency:.1f} req/s)")
+    print(f"{'subidas':>8} {'tiempo (s)':>11} {'req/s':>8} {'/health (ms)':>13}")
+    for concurrent_uploads in args.uploads:
+        result = asyncio.run(_runRound(concurrent_uploads, image_bytes))
+        print(f"{result['uploads']:>8} {result['elapsed_s']:>11.2f} "
+              f"{result['req_per_s']:>8.1f} {result['health_ms']:>13.1f}")
+    app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    main()
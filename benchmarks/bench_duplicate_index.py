@@ -0,0 +1,61 @@
+"""
+Benchmark: búsqueda de casi duplicados en el índice de hashes perceptuales.
+
+Compara el índice multi-index hashing de `DuplicateDetector` con una búsqueda lineal
+sobre el mismo conjunto de hashes de 256 bits, para varios tamaños de índice.
+
+Uso:
+    python -m benchmarks.bench_duplicate_index --sizes 10000 100000 300000 --queries 200
+"""
+import argparse
+import random
+import time
+
+from app.services.duplicate_detector import MultiIndexHashIndex, hammingDistance
+
+HASH_BITS = 256
+
+
+def _perturb(rng: random.Random, value: int, flips: int) -> int:
+    for bit in rng.sample(range(HASH_BITS), flips):
+        value ^= 1 << bit
+    return value
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 300000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--max-distance", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'hashes':>8} {'índice (µs/consulta)':>21} {'lineal (µs/consulta)':>21} {'aciertos':>9}")
+    for size in args.sizes:
+        rng = random.Random(size)
+        hashes = [rng.getrandbits(HASH_BITS) for _ in range(size)]
+        index = MultiIndexHashIndex(HASH_BITS, args.max_distance, max_entries=size)
+        for position, value in enumerate(hashes):
+            index.add(value, position)
+
+        # Mitad de consultas son duplicados cercanos, mitad imágenes nuevas
+        queries = [
+            _perturb(rng, rng.choice(hashes), rng.randint(0, args.max_distance)) if i % 2 == 0
+            else rng.getrandbits(HASH_BITS)
+            for i in range(args.queries)
+        ]
+
+        inicio = time.perf_counter()
+        hits = sum(index.findNearest(query) is not None for query in queries)
+        index_us = (time.perf_counter() - inicio) / len(queries) * 1e6
+
+        linear_queries = queries[: max(1, min(len(queries), 20))]
+        inicio = time.perf_counter()
+        for query in linear_queries:
+            min(hammingDistance(query, value) for value in hashes)
+        linear_us = (time.perf_counter() - inicio) / len(linear_queries) * 1e6
+
+        print(f"{size:>8} {index_us:>21.1f} {linear_us:>21.1f} {hits:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark: reducción de payload y latencia del preprocesado de imágenes.
+
+Compara, para un conjunto de tickets de ejemplo, lo que se envía al modelo:
+- Sin preprocesado: el SDK codifica la imagen completa como WebP sin pérdida.
+- Con preprocesado: imagen orientada, limitada a `--max-side`, en grises si es seguro
+  y recomprimida (JPEG/WebP con `--quality`).
+
+Informa de bytes enviados, tiempo de preparación y tiempo estimado de subida con el
+ancho de banda indicado. Para la paridad de precisión:
+- Por defecto (offline) se informa del PSNR entre ambas versiones a la resolución
+  enviada, como medida de la pérdida introducida solo por la compresión.
+- Con `--live` (requiere GEMINI_API_KEY) se extrae cada ticket por ambos caminos con
+  el modelo real y se comparan los ítems y el total obtenidos.
+
+Uso:
+    python -m benchmarks.bench_image_preprocessing [--images a.jpg b.jpg] [--live]
+"""
+import argparse
+import io
+import math
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from PIL import Image, ImageChops, ImageStat
+
+from app.services.image_preprocessor import ImagePreprocessor
+from benchmarks.common import makeReceiptImage
+
+SAMPLE_DIR = Path(__file__).resolve().parent.parent / "tests" / "images"
+
+
+def _sampleImages(paths: List[str]) -> List[Tuple[str, bytes]]:
+    if paths:
+        return [(Path(p).name, Path(p).read_bytes()) for p in paths]
+    samples = [(p.name, p.read_bytes()) for p in sorted(SAMPLE_DIR.glob("*.jpg"))]
+    samples.append(("sintetico_12mp.jpg", makeReceiptImage(3000, 4000, lines=40, seed=1)))
+    samples.append(("sintetico_largo.jpg", makeReceiptImage(1200, 4800, lines=80, seed=2)))
+    rotated = Image.open(io.BytesIO(makeReceiptImage(3000, 4000, lines=40, seed=3))).rotate(90, expand=True)
+    exif = Image.Exif()
+    exif[0x0112] = 8
+    buffer = io.BytesIO()
+    rotated.save(buffer, format="JPEG", quality=92, exif=exif.tobytes())
+    samples.append(("sintetico_exif_rotado.jpg", buffer.getvalue()))
+    return samples
+
+
+def _unprocessedPayload(image_bytes: bytes) -> Tuple[bytes, float]:
+    inicio = time.perf_counter()
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="webp", lossless=True)
+    return buffer.getvalue(), time.perf_counter() - inicio
+
+
+def _psnr(reference: Image.Image, candidate: Image.Image) -> float:
+    diff = ImageChops.difference(reference.convert("L"), candidate.convert("L"))
+    mse = ImageStat.Stat(diff).rms[0] ** 2
+    return float("inf") if mse == 0 else 20 * math.log10(255 / math.sqrt(mse))
+
+
+def _liveParity(samples, preprocessor: ImagePreprocessor) -> None:
+    from app.services.ocr_service import OCRService
+    from app.services.parser_service import ParserService
+
+    parser = ParserService()
+    raw_service = OCRService()
+    raw_service.image_preprocessor = None
+    processed_service = OCRService(image_preprocessor=preprocessor)
+    print("\nParidad con el modelo real (ítems coincidentes / total igual / latencia):")
+    for name, image_bytes in samples:
+        results = []
+        for service in (raw_service, processed_service):
+            inicio = time.perf_counter()
+            parsed = parser.parseTextToItems(service.extractTextFromImage(image_bytes))
+            results.append((parsed, time.perf_counter() - inicio))
+        (raw, raw_s), (processed, processed_s) = results
+        raw_items = {(i.name.lower(), i.quantity, i.price) for i in raw["items"]}
+        processed_items = {(i.name.lower(), i.quantity, i.price) for i in processed["items"]}
+        matched = len(raw_items & processed_items)
+        print(f"  {name:<28} {matched}/{len(raw_items)} ítems, total igual: {raw['total'] == processed['total']}, "
+              f"{raw_s * 1000:.0f} ms -> {processed_s * 1000:.0f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="*", default=[])
+    parser.add_argument("--max-side", type=int, default=2048)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--format", default="JPEG")
+    parser.add_argument("--bandwidth-mbps", type=float, default=10.0, help="Ancho de banda de subida supuesto")
+    parser.add_argument("--live", action="store_true", help="Comparar con el modelo real (usa GEMINI_API_KEY)")
+    args = parser.parse_args()
+
+    preprocessor = ImagePreprocessor(max_side=args.max_side, output_format=args.format, quality=args.quality)
+    samples = _sampleImages(args.images)
+    bytes_per_s = args.bandwidth_mbps * 1e6 / 8
+
+    print(f"{'imagen':<28} {'original':>10} {'sin prep.':>10} {'con prep.':>10} {'reducción':>10} "
+          f"{'prep (ms)':>10} {'subida (ms)':>16} {'PSNR':>7}")
+    total_raw = total_processed = 0
+    for name, image_bytes in samples:
+        raw_payload, _ = _unprocessedPayload(image_bytes)
+        inicio = time.perf_counter()
+        prepared = preprocessor.prepare(image_bytes)
+        prep_s = time.perf_counter() - inicio
+
+        psnr = _psnr(preprocessor.decode(image_bytes).resize((prepared.width, prepared.height)),
+                     Image.open(io.BytesIO(prepared.data)))
+
+        total_raw += len(raw_payload)
+        total_processed += prepared.encoded_size_bytes
+        upload_before = len(raw_payload) / bytes_per_s * 1000
+        upload_after = prepared.encoded_size_bytes / bytes_per_s * 1000
+        print(f"{name:<28} {len(image_bytes) / 1024:>8.0f}KB {len(raw_payload) / 1024:>8.0f}KB "
+              f"{prepared.encoded_size_bytes / 1024:>8.0f}KB {1 - prepared.encoded_size_bytes / len(raw_payload):>10.1%} "
+              f"{prep_s * 1000:>10.1f} {upload_before:>7.0f} -> {upload_after:>5.0f} {psnr:>7.1f}")
+    print(f"\nTotal enviado: {total_raw / 1024:.0f}KB -> {total_processed / 1024:.0f}KB "
+          f"({1 - total_processed / total_raw:.1%} menos)")
+
+    if args.live:
+        _liveParity(samples, preprocessor)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark: tasa de recuperación y velocidad del reparador de JSON.
+
+Genera `--responses` respuestas del modelo con entre 1 y `--max-items` artículos y les
+aplica uno de los defectos habituales (coma final, comentarios `//`, texto alrededor
+o corte en un punto aleatorio). Para cada defecto muestra:
+
+- respuestas aprovechables sin reparar (decodificación estricta) y con `repairJson`;
+- ítems recuperados frente a los ítems completos que contenía la respuesta;
+- tiempo medio de decodificación (µs).
+
+Uso:
+    python -m benchmarks.bench_json_repair --responses 2000
+"""
+import argparse
+import json
+import random
+import re
+import time
+
+from app.services import json_codec
+from app.services.json_repair import JSONRepairError, hasReceiptData, repairJson
+
+
+def _response(rng: random.Random, max_items: int) -> dict:
+    items = [
+        {"description": f"Artículo {i}", "quantity": rng.randint(1, 4), "unit_price": round(rng.uniform(0.5, 20), 2)}
+        for i in range(rng.randint(1, max_items))
+    ]
+    total = round(sum(item["quantity"] * item["unit_price"] for item in items), 2)
+    return {"is_ticket": True, "items": items, "subtotal": total, "tax": 0.0, "total": total}
+
+
+def _trailingCommas(text: str, rng: random.Random) -> str:
+    text = re.sub(r"\}(\s*)\]", r"},\1]", text)
+    return text[:text.rfind("}")].rstrip() + ",\n}"
+
+
+def _comments(text: str, rng: random.Random) -> str:
+    return text.replace('"items": [', '"items": [ // lista de artículos', 1).replace(
+        '"total"', '// total final\n  "total"', 1)
+
+
+def _prose(text: str, rng: random.Random) -> str:
+    return "Aquí tienes el resultado:\n```json\n" + text + "\n```\nAvísame si necesitas algo más."
+
+
+def _truncate(text: str, rng: random.Random) -> str:
+    return text[:rng.randint(len(text) // 4, len(text) - 2)]
+
+
+DEFECTS = {
+    "coma final": _trailingCommas,
+    "comentarios": _comments,
+    "texto alrededor": _prose,
+    "truncado": _truncate,
+}
+
+
+def _completeItems(damaged: str) -> int:
+    """Ítems cuyo objeto aparece completo en la respuesta dañada."""
+    return len(re.findall(r'\{\s*"description": [^{}]*\}', damaged))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--responses", type=int, default=2000)
+    parser.add_argument("--max-items", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    documents = [_response(rng, args.max_items) for _ in range(args.responses)]
+    texts = [json.dumps(document, ensure_ascii=False, indent=2) for document in documents]
+
+    start = time.perf_counter()
+    for text in texts:
+        repairJson(text)
+    valid_us = (time.perf_counter() - start) / len(texts) * 1e6
+    print(f"{len(texts)} respuestas válidas: {valid_us:.1f} µs por respuesta (sin reparar)")
+
+    for label, damage in DEFECTS.items():
+        damaged = [damage(text, rng) for text in texts]
+        strict = recovered = items_found = 0
+        start = time.perf_counter()
+        for text in damaged:
+            try:
+                json_codec.loads(text)
+                strict += 1
+            except json_codec.JSONDecodeError:
+                pass
+            try:
+                data = repairJson(text).data
+            except JSONRepairError:
+                continue
+            if hasReceiptData(data):
+                recovered += 1
+                items_found += len(data.get("items") or [])
+        elapsed_us = (time.perf_counter() - start) / len(damaged) * 1e6
+        items_present = sum(_completeItems(text) for text in damaged)
+        print(f"  {label:<16} estricto {strict / len(damaged):6.1%}   reparado {recovered / len(damaged):6.1%}   "
+              f"ítems {items_found}/{items_present} ({items_found / max(1, items_present):6.1%})   "
+              f"{elapsed_us:7.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
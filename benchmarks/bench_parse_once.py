@@ -0,0 +1,80 @@
+"""
+Benchmark: CPU por subida al decodificar la respuesta del modelo una sola vez.
+
+Simula la parte de CPU de una subida (limpiar la respuesta del modelo, validarla,
+parsearla) con respuestas de `--items` artículos:
+
+- antes: `json.loads` para validar en el OCR y otro `json.loads` en el parser.
+- después: una sola decodificación con `json_codec` (orjson) en el OCR; el parser
+  reutiliza `OCRExtraction.data`.
+
+Se mide el tiempo de CPU del proceso (`time.process_time`), no el de pared.
+
+Uso:
+    python -m benchmarks.bench_parse_once --items 10 100 1000 --repeat 200
+"""
+import argparse
+import json
+import time
+from typing import Callable
+
+from app.services import json_codec
+from app.services.ocr_engine import OCRExtraction
+from app.services.parser_service import ParserService
+
+
+def makeResponse(item_count: int) -> str:
+    """Respuesta del modelo (con el marcador ```json) con `item_count` artículos."""
+    items = [
+        {"description": f"Artículo de prueba número {i}", "quantity": 1 + i % 3, "unit_price": round(1.25 + i * 0.1, 2)}
+        for i in range(item_count)
+    ]
+    total = round(sum(item["quantity"] * item["unit_price"] for item in items), 2)
+    document = {"is_ticket": True, "items": items, "subtotal": total, "tax": 0.0, "total": total}
+    return "```json\n" + json.dumps(document, ensure_ascii=False, indent=2) + "\n```"
+
+
+def _cleanJson(text: str) -> str:
+    cleaned = text.strip()
+    return cleaned[cleaned.find("{"):cleaned.rfind("}") + 1]
+
+
+def before(response: str, parser: ParserService) -> None:
+    cleaned = _cleanJson(response)
+    json.loads(cleaned)                                   # Validación en OCRService
+    data = json.loads(cleaned)                            # Segundo parseo en ParserService
+    parser.parseJsonData(data, cleaned)
+
+
+def after(response: str, parser: ParserService) -> None:
+    cleaned = _cleanJson(response)
+    extraction = OCRExtraction(cleaned, "gemini", "json", json_codec.loads(cleaned))
+    parser.parseExtraction(extraction, keep_raw_text=False)
+
+
+def _cpuPerCall(function: Callable[[str, ParserService], None], response: str, repeat: int) -> float:
+    parser = ParserService()
+    function(response, parser)  # Calentamiento
+    start = time.process_time()
+    for _ in range(repeat):
+        function(response, parser)
+    return (time.process_time() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    for item_count in args.items:
+        response = makeResponse(item_count)
+        cpu_before = _cpuPerCall(before, response, args.repeat)
+        cpu_after = _cpuPerCall(after, response, args.repeat)
+        print(f"{item_count:>5} ítems ({len(response) / 1024:7.1f} KiB)   "
+              f"antes {cpu_before * 1e6:9.1f} µs   después {cpu_after * 1e6:9.1f} µs   "
+              f"ahorro {1 - cpu_after / cpu_before:6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: rendimiento del preprocesado de imágenes en hilos frente a un pool de procesos.
+
+Prepara (decodificar, enderezar, reducir y recomprimir) un conjunto de fotos sintéticas
+de tickets de 12MP desde `--threads` hilos a la vez, como harían los hilos del pool OCR
+con varias subidas simultáneas, y mide imágenes por segundo:
+
+- en los propios hilos (el comportamiento sin `IMAGE_PREPROCESSING_WORKERS`), donde el
+  trabajo se serializa en buena parte en el GIL;
+- en un `PreprocessPool` de 1 a `--max-workers` procesos, con los bytes en memoria
+  compartida;
+- con el mismo pool pasando los bytes serializados por la tubería (sin memoria
+  compartida), para ver lo que ahorra la memoria compartida.
+
+El aumento con el número de procesos está limitado por los núcleos de la máquina
+(se muestran al principio).
+
+Uso:
+    python -m benchmarks.bench_preprocess_pool --images 24 --max-workers 4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from app.services import preprocess_pool as pool_module
+from app.services.image_preprocessor import ImagePreprocessor
+from app.services.preprocess_pool import PreprocessPool
+from benchmarks.common import makeReceiptImage
+
+
+def _preparePickled(image_bytes: bytes):
+    """Preparación en un proceso del pool recibiendo los bytes serializados (sin memoria compartida)."""
+    return pool_module._worker_preprocessor.prepare(image_bytes)
+
+
+def _throughput(prepare: Callable[[bytes], object], images: List[bytes], threads: int) -> float:
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        inicio = time.perf_counter()
+        list(executor.map(prepare, images))
+        return len(images) / (time.perf_counter() - inicio)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=24)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=8, help="Hilos que piden imágenes a la vez")
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=4000)
+    args = parser.parse_args()
+
+    images = [makeReceiptImage(args.width, args.height, lines=40, seed=seed) for seed in range(args.images)]
+    megabytes = sum(len(image) for image in images) / 1e6
+    print(f"{args.images} imágenes de {args.width}x{args.height} ({megabytes:.1f} MB), "
+          f"{args.threads} hilos, {os.cpu_count()} núcleos\n")
+
+    preprocessor = ImagePreprocessor()
+    preprocessor.prepare(images[0])  # Carga los codificadores de Pillow
+    baseline = _throughput(preprocessor.prepare, images, args.threads)
+    print(f"{'en hilos (sin pool)':<28} {baseline:6.1f} img/s")
+
+    for workers in range(1, args.max_workers + 1):
+        pool = PreprocessPool(ImagePreprocessor(), workers=workers)
+        try:
+            pool.warmUp()
+            shared = _throughput(pool.prepare, images, args.threads)
+            pickled = _throughput(lambda image: pool._executor.submit(_preparePickled, image).result(),
+                                  images, args.threads)
+        finally:
+            pool.close()
+        print(f"{f'pool de {workers} proceso(s)':<28} {shared:6.1f} img/s  (x{shared / baseline:.2f})   "
+              f"sin memoria compartida {pickled:6.1f} img/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: coste por petición del middleware de límite de peticiones.
+
+Llama directamente al middleware ASGI con una aplicación vacía (sin servidor ni
+cliente HTTP) y compara el tiempo por petición con y sin limitador, para:
+
+- una ruta no limitada (`/health`);
+- subidas de un mismo cliente (cubo caliente);
+- subidas de `--clients` clientes distintos, con más clientes que `max_clients` para
+  que cada petición cree un cubo y descarte otro.
+
+Uso:
+    python -m benchmarks.bench_rate_limit --requests 200000 --clients 50000
+"""
+import argparse
+import asyncio
+import time
+
+from app.services.rate_limiter import RateLimiter, RateLimitMiddleware
+
+
+async def _emptyApp(scope, receive, send):
+    return None
+
+
+async def _send(message):
+    return None
+
+
+def _scope(path: str, method: str, ip: str) -> dict:
+    return {
+        "type": "http", "method": method, "path": path, "app": None, "client": (ip, 40000),
+        "headers": [(b"host", b"api.local"), (b"user-agent", b"bench"), (b"accept", b"*/*")],
+    }
+
+
+async def _perRequestMicroseconds(middleware, scopes) -> float:
+    start = time.perf_counter()
+    for scope in scopes:
+        await middleware(scope, None, _send)
+    return (time.perf_counter() - start) / len(scopes) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--clients", type=int, default=50000)
+    parser.add_argument("--max-clients", type=int, default=10000)
+    args = parser.parse_args()
+
+    # Cupo enorme: se mide el camino de las peticiones admitidas (el caso normal).
+    limiter = RateLimiter(upload_per_minute=1e9, upload_burst=10**9, max_clients=args.max_clients)
+    baseline = RateLimitMiddleware(_emptyApp, getLimiter=lambda app: None)
+    limited = RateLimitMiddleware(_emptyApp, getLimiter=lambda app: limiter)
+
+    scenarios = {
+        "/health (no limitada)": [_scope("/health", "GET", "10.0.0.1")] * args.requests,
+        "subida, 1 cliente": [_scope("/api/v1/receipts/upload", "POST", "10.0.0.1")] * args.requests,
+        f"subida, {args.clients} clientes": [
+            _scope("/api/v1/receipts/upload", "POST", f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}")
+            for i in range(args.clients)
+        ] * max(1, args.requests // args.clients),
+    }
+
+    async def run():
+        for label, scopes in scenarios.items():
+            without = await _perRequestMicroseconds(baseline, scopes)
+            with_limit = await _perRequestMicroseconds(limited, scopes)
+            print(f"{label:<28} sin limitador {without:6.2f} µs   con limitador {with_limit:6.2f} µs   "
+                  f"coste {with_limit - without:5.2f} µs/petición")
+
+    asyncio.run(run())
+    stats = limiter.getStats()["upload"]
+    print(f"cubos en memoria: {stats['clients']} (máximo {args.max_clients}), descartados: {stats['evictions']}")
+
+
+if __name__ == "__main__":
+    main()
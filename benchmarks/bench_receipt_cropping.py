@@ -0,0 +1,218 @@
+"""
+Benchmark: recorte y enderezado automático del ticket antes de enviarlo al modelo.
+
+Genera fotos sintéticas de 12MP con un ticket girado sobre una mesa con textura (las
+esquinas reales se conocen) y prepara cada una con y sin `ReceiptCropper`. Informa de:
+- bytes enviados y tokens de imagen estimados (Gemini cuenta 258 tokens por tesela de
+  768x768) con y sin recorte,
+- tiempo de preparación y tiempo estimado de subida con el ancho de banda indicado,
+- precisión del recorte: IoU entre el ticket detectado y el real, y cuántas fotos se
+  quedan sin recortar (por falta de confianza).
+
+Las fotos de `tests/images` (o las de `--images`) se añaden sin verdad de referencia:
+solo se muestra si se recortan y cuánto cambia el payload.
+
+Para la precisión de la extracción:
+- Si está instalado el binario de Tesseract, se lee cada foto sintética por el camino
+  local con y sin recorte y se cuenta qué fracción de los códigos de producto aparecen.
+- Con `--live` (requiere GEMINI_API_KEY) se extrae cada foto con el modelo real por
+  ambos caminos y se comparan ítems, total y latencia.
+
+Uso:
+    python -m benchmarks.bench_receipt_cropping [--photos 8] [--images a.jpg b.jpg] [--live]
+"""
+import argparse
+import io
+import math
+import random
+import shutil
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.services.image_preprocessor import ImagePreprocessor
+from app.services.receipt_cropper import ReceiptCropper
+from benchmarks.common import makeReceiptImage
+
+SAMPLE_DIR = Path(__file__).resolve().parent.parent / "tests" / "images"
+ANGLES = [0, 6, -9, 14, -22, 30]
+BACKGROUNDS = [(92, 70, 52), (40, 44, 48), (120, 110, 95), (60, 90, 70)]
+
+
+class Photo:
+    """Foto sintética con la máscara real del ticket y los códigos de producto que contiene."""
+
+    def __init__(self, name: str, data: bytes, truth: Optional[np.ndarray] = None, codes: Optional[List[str]] = None):
+        self.name = name
+        self.data = data
+        self.truth = truth
+        self.codes = codes or []
+
+
+def _productCodes(seed: int, lines: int) -> List[str]:
+    """Reproduce los códigos de producto que escribe `makeReceiptImage` con la misma semilla."""
+    rng = random.Random(seed)
+    codes = []
+    for _ in range(lines):
+        codes.append(str(rng.randint(100, 999)))
+        rng.randint(1, 4), rng.randint(1, 50), rng.randint(0, 99)
+    return codes
+
+
+def _syntheticPhoto(seed: int, size=(3000, 4000), lines: int = 30) -> Photo:
+    angle = ANGLES[seed % len(ANGLES)]
+    background = BACKGROUNDS[seed % len(BACKGROUNDS)]
+    receipt = Image.open(io.BytesIO(makeReceiptImage(1100, 2800, lines=lines, seed=seed)))
+    noise = np.random.default_rng(seed).normal(0, 14, (size[1], size[0], 3))
+    table = Image.fromarray(np.clip(np.array(background) + noise, 0, 255).astype(np.uint8))
+    rotated = receipt.rotate(angle, expand=True, resample=Image.Resampling.BICUBIC)
+    mask = Image.new("L", receipt.size, 255).rotate(angle, expand=True)
+    offset = ((size[0] - rotated.width) // 2 + (seed % 3 - 1) * 200, (size[1] - rotated.height) // 2)
+    table.paste(rotated, offset, mask)
+    truth = Image.new("L", size, 0)
+    truth.paste(mask, offset)
+    buffer = io.BytesIO()
+    table.save(buffer, format="JPEG", quality=92)
+    return Photo(f"sintetico_{seed}_{angle:+d}grados", buffer.getvalue(), np.asarray(truth) > 0,
+                 _productCodes(seed, lines))
+
+
+def _samplePhotos(paths: List[str], photos: int) -> List[Photo]:
+    samples = [_syntheticPhoto(seed) for seed in range(photos)]
+    files = [Path(p) for p in paths] if paths else sorted(SAMPLE_DIR.glob("*.jpg"))
+    samples.extend(Photo(path.name, path.read_bytes()) for path in files)
+    return samples
+
+
+def _imageTokens(width: int, height: int) -> int:
+    """Tokens de imagen estimados: 258 si cabe en 384x384; si no, 258 por tesela de 768x768."""
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+
+def _iou(photo: Photo, cropper: ReceiptCropper) -> Optional[float]:
+    """IoU entre el cuadrilátero recortado y el ticket real (None si no se recortaría)."""
+    image = Image.open(io.BytesIO(photo.data)).convert("RGB")
+    detection = cropper.detect(image)
+    if detection is None or detection.confidence < cropper.min_confidence or detection.area_ratio > cropper.max_area_ratio:
+        return None
+    detected = np.zeros(photo.truth.shape, np.uint8)
+    cv2.fillConvexPoly(detected, np.round(detection.corners).astype(np.int32), 1)
+    detected = detected > 0
+    return float((detected & photo.truth).sum() / (detected | photo.truth).sum())
+
+
+def _tesseractRecall(photos: List[Photo], plain: ImagePreprocessor, cropping: ImagePreprocessor) -> None:
+    from app.services.tesseract_ocr_service import TesseractOCRService
+
+    print("\nTesseract (fracción de códigos de producto leídos / latencia):")
+    services = [TesseractOCRService(image_preprocessor=plain), TesseractOCRService(image_preprocessor=cropping)]
+    try:
+        for photo in photos:
+            results = []
+            for service in services:
+                inicio = time.perf_counter()
+                text = service.extractTextFromImage(photo.data)
+                results.append((sum(code in text for code in photo.codes) / len(photo.codes),
+                                time.perf_counter() - inicio))
+            (before, before_s), (after, after_s) = results
+            print(f"  {photo.name:<28} {before:>6.0%} -> {after:>4.0%}   "
+                  f"{before_s * 1000:.0f} ms -> {after_s * 1000:.0f} ms")
+    finally:
+        for service in services:
+            service.close()
+
+
+def _liveParity(photos: List[Photo], plain: ImagePreprocessor, cropping: ImagePreprocessor) -> None:
+    from app.services.ocr_service import OCRService
+    from app.services.parser_service import ParserService
+
+    parser = ParserService()
+    services = [OCRService(image_preprocessor=plain), OCRService(image_preprocessor=cropping)]
+    print("\nModelo real (ítems sin/con recorte, total igual, latencia):")
+    for photo in photos:
+        results = []
+        for service in services:
+            inicio = time.perf_counter()
+            parsed = parser.parseTextToItems(service.extractTextFromImage(photo.data))
+            results.append((parsed, time.perf_counter() - inicio))
+        (before, before_s), (after, after_s) = results
+        print(f"  {photo.name:<28} {len(before['items'])} -> {len(after['items'])} ítems, "
+              f"total igual: {before['total'] == after['total']}, "
+              f"{before_s * 1000:.0f} ms -> {after_s * 1000:.0f} ms")
+
+
+def _prepare(preprocessor: ImagePreprocessor, data: bytes) -> Tuple[object, float]:
+    inicio = time.perf_counter()
+    prepared = preprocessor.prepare(data)
+    return prepared, time.perf_counter() - inicio
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=8, help="Fotos sintéticas con verdad de referencia")
+    parser.add_argument("--images", nargs="*", default=[], help="Fotos reales adicionales (sin verdad de referencia)")
+    parser.add_argument("--min-confidence", type=float, default=0.7)
+    parser.add_argument("--bandwidth-mbps", type=float, default=10.0, help="Ancho de banda de subida supuesto")
+    parser.add_argument("--live", action="store_true", help="Comparar con el modelo real (usa GEMINI_API_KEY)")
+    args = parser.parse_args()
+
+    cropper = ReceiptCropper(min_confidence=args.min_confidence)
+    plain = ImagePreprocessor()
+    cropping = ImagePreprocessor(cropper=cropper)
+    photos = _samplePhotos(args.images, args.photos)
+    bytes_per_s = args.bandwidth_mbps * 1e6 / 8
+
+    print(f"{'imagen':<28} {'sin recorte':>12} {'con recorte':>12} {'tokens':>12} "
+          f"{'prep (ms)':>14} {'subida (ms)':>12} {'IoU':>6}")
+    totals = {"before": 0, "after": 0, "tokens_before": 0, "tokens_after": 0, "prep_before": 0.0, "prep_after": 0.0}
+    ious: List[float] = []
+    missed = 0
+    for photo in photos:
+        before, before_s = _prepare(plain, photo.data)
+        after, after_s = _prepare(cropping, photo.data)
+        tokens_before = _imageTokens(before.width, before.height)
+        tokens_after = _imageTokens(after.width, after.height)
+        iou = _iou(photo, cropper) if photo.truth is not None else None
+        if photo.truth is not None:
+            if iou is None:
+                missed += 1
+            else:
+                ious.append(iou)
+        totals["before"] += before.encoded_size_bytes
+        totals["after"] += after.encoded_size_bytes
+        totals["tokens_before"] += tokens_before
+        totals["tokens_after"] += tokens_after
+        totals["prep_before"] += before_s
+        totals["prep_after"] += after_s
+        iou_text = f"{iou:.3f}" if iou is not None else ("-" if photo.truth is None else "no")
+        print(f"{photo.name:<28} {before.encoded_size_bytes / 1024:>10.0f}KB {after.encoded_size_bytes / 1024:>10.0f}KB "
+              f"{tokens_before:>5} -> {tokens_after:<4} {before_s * 1000:>6.0f} -> {after_s * 1000:<5.0f} "
+              f"{before.encoded_size_bytes / bytes_per_s * 1000:>5.0f} -> {after.encoded_size_bytes / bytes_per_s * 1000:<4.0f} "
+              f"{iou_text:>6}")
+
+    count = len(photos)
+    print(f"\nMedia por foto: {totals['before'] / count / 1024:.0f}KB -> {totals['after'] / count / 1024:.0f}KB "
+          f"({1 - totals['after'] / totals['before']:.1%} menos), "
+          f"{totals['tokens_before'] / count:.0f} -> {totals['tokens_after'] / count:.0f} tokens de imagen, "
+          f"preparación {totals['prep_before'] / count * 1000:.0f} -> {totals['prep_after'] / count * 1000:.0f} ms")
+    if ious:
+        print(f"Recorte de las fotos sintéticas: IoU medio {sum(ious) / len(ious):.3f}, "
+              f"mínimo {min(ious):.3f}, {missed} sin recortar")
+
+    synthetic = [photo for photo in photos if photo.truth is not None]
+    if shutil.which("tesseract"):
+        _tesseractRecall(synthetic, plain, cropping)
+    else:
+        print("\n(Tesseract no está instalado: se omite la comparación de lectura local)")
+    if args.live:
+        _liveParity(photos, plain, cropping)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: latencia de cola y errores transitorios con la capa de resiliencia.
+
+El modelo falso responde casi siempre en `--latency` segundos, pero una fracción
+`--slow-rate` de las llamadas tarda `--slow-factor` veces más y otra fracción
+`--error-rate` falla con un 503. Se comparan p50/p95/p99 y el porcentaje de peticiones
+fallidas llamando al modelo directamente, con reintentos y con reintentos + hedging.
+
+Uso:
+    python -m benchmarks.bench_resilience --requests 400 --latency 0.05
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+from app.services.ocr_engine import OCREngine
+from app.services.resilience import ResilientOCREngine
+from benchmarks.common import SAMPLE_RECEIPT
+
+
+class FlakyModelEngine(OCREngine):
+    """Motor falso con latencias de cola y errores transitorios reproducibles."""
+    name = "gemini"
+
+    def __init__(self, latency_s: float, slow_rate: float, slow_factor: float, error_rate: float, seed: int = 0):
+        super().__init__(max_concurrency=64)
+        self.latency_s = latency_s
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.error_rate = error_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def extractTextFromImage(self, image_bytes: bytes, language: str = 'spa') -> str:
+        with self._lock:
+            self.calls += 1
+            roll = self._rng.random()
+        if roll < self.error_rate:
+            time.sleep(self.latency_s / 2)
+            raise RuntimeError("Error al procesar imagen con Gemini") from google_exceptions.ServiceUnavailable("503")
+        slow = roll < self.error_rate + self.slow_rate
+        time.sleep(self.latency_s * (self.slow_factor if slow else 1) * (0.8 + 0.4 * self._rng.random()))
+        return str(SAMPLE_RECEIPT)
+
+
+async def _run(engine: OCREngine, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            inicio = time.perf_counter()
+            try:
+                await engine.extractTextFromImageAsync(b"img")
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - inicio)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, errors
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-factor", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    scenarios = (
+        ("directo", lambda model: model),
+        ("reintentos", lambda model: ResilientOCREngine(model, max_attempts=3, backoff_base=args.latency)),
+        ("reintentos + hedging", lambda model: ResilientOCREngine(
+            model, max_attempts=3, backoff_base=args.latency, hedging_enabled=True, hedge_min_samples=20
+        )),
+    )
+    print(f"{args.requests} peticiones, {args.concurrency} en paralelo, "
+          f"{args.slow_rate:.0%} lentas (x{args.slow_factor:g}), {args.error_rate:.0%} con error 503")
+    for label, wrap in scenarios:
+        model = FlakyModelEngine(args.latency, args.slow_rate, args.slow_factor, args.error_rate)
+        engine = wrap(model)
+        latencies, errors = asyncio.run(_run(engine, args.requests, args.concurrency))
+        model.close()
+        print(f"  {label:<22} p50 {statistics.median(latencies) * 1000:7.1f} ms   "
+              f"p95 {_percentile(latencies, 0.95):7.1f} ms   p99 {_percentile(latencies, 0.99):7.1f} ms   "
+              f"errores {errors / args.requests:6.1%}   llamadas al modelo {model.calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: coste por petición de crear los servicios frente a compartirlos.
+
+Compara dos formas de resolver las dependencias de `/upload`:
+- Por petición (comportamiento anterior): `OCRService()` (que ejecuta `genai.configure`
+  y crea un `GenerativeModel`), `ParserService()` y `CalculationService()` nuevos.
+- Compartidos (lifespan): se leen del `ServiceContainer` creado al arrancar.
+
+Mide primero solo la resolución de dependencias y después una petición `/upload`
+completa con un modelo falso de latencia cero.
+
+Uso:
+    python -m benchmarks.bench_service_lifecycle --iterations 2000
+"""
+import argparse
+import os
+import time
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.api.endpoints.receipts import getOcrService, getParserService, getCalculationService
+from app.core.lifecycle import getServiceContainer
+from app.services.calculation_service import CalculationService
+from app.services.ocr_service import OCRService
+from app.services.parser_service import ParserService
+from benchmarks.common import FakeGeminiModel, makeReceiptImage
+
+
+def _perRequestServices():
+    return OCRService(api_key=os.environ["GEMINI_API_KEY"]), ParserService(), CalculationService()
+
+
+def _sharedServices(fake_request):
+    return getOcrService(fake_request), getParserService(fake_request), getCalculationService(fake_request)
+
+
+def _timeIt(function, iterations: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - inicio) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    fake_request = SimpleNamespace(app=app)
+    container = getServiceContainer(app)
+    container.ocr_service.model = FakeGeminiModel(latency_s=0)
+
+    per_request_us = _timeIt(_perRequestServices, args.iterations)
+    shared_us = _timeIt(lambda: _sharedServices(fake_request), args.iterations)
+    print("Resolución de dependencias (µs/petición):")
+    print(f"  por petición: {per_request_us:10.1f}")
+    print(f"  compartidos:  {shared_us:10.1f}")
+
+    image_bytes = makeReceiptImage(300, 500)
+    client = TestClient(app)
+    container.pipeline.cache = None  # Cada petición debe llegar al modelo
+    container.pipeline.duplicate_detector = None
+
+    def upload():
+        response = client.post("/api/v1/receipts/upload", files={"file": ("b.jpg", image_bytes, "image/jpeg")})
+        response.raise_for_status()
+
+    def perRequestOcr():
+        service = OCRService(api_key=os.environ["GEMINI_API_KEY"], image_preprocessor=container.image_preprocessor)
+        service.model = FakeGeminiModel(latency_s=0)
+        return service
+
+    results = {}
+    for label, override in (("por petición", perRequestOcr), ("compartidos", None)):
+        if override is not None:
+            app.dependency_overrides[getOcrService] = override
+        upload()  # Calentamiento
+        results[label] = _timeIt(upload, args.requests)
+        app.dependency_overrides.clear()
+    print("Petición /upload completa con modelo de latencia cero (µs/petición):")
+    for label, value in results.items():
+        print(f"  {label + ':':<14}{value:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
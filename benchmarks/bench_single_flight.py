@@ -0,0 +1,68 @@
+"""
+Benchmark: llamadas al modelo evitadas agrupando subidas idénticas simultáneas.
+
+Simula ráfagas de subidas en las que cada imagen llega `--copies` veces a la vez
+(doble toque, reintentos del frontend) y cuenta cuántas llamadas llegan al modelo
+con y sin single-flight. La caché de resultados se desactiva para aislar el efecto
+de la agrupación de peticiones concurrentes.
+
+Uso:
+    python -m benchmarks.bench_single_flight --images 20 --copies 3 --latency 0.2
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+
+from app.main import app
+from app.api.endpoints.receipts import getOcrService
+from app.core.lifecycle import getServiceContainer
+from app.services.single_flight import SingleFlight
+from benchmarks.common import buildOcrService, makeReceiptImage
+
+
+async def _burst(images, copies: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        requests = [image for image in images for _ in range(copies)]
+        random.Random(0).shuffle(requests)
+        inicio = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.post("/api/v1/receipts/upload", files={"file": ("b.jpg", image, "image/jpeg")})
+            for image in requests
+        ))
+        elapsed = time.perf_counter() - inicio
+    assert all(response.status_code == 200 for response in responses)
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--copies", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    images = [makeReceiptImage(300, 500, seed=seed) for seed in range(args.images)]
+    container = getServiceContainer(app)
+    container.pipeline.cache = None
+    container.pipeline.duplicate_detector = None
+
+    print(f"{args.images} imágenes x {args.copies} copias simultáneas = {args.images * args.copies} subidas")
+    for label, single_flight in (("sin single-flight", None), ("con single-flight", SingleFlight())):
+        ocr_service = buildOcrService(latency_s=args.latency)
+        ocr_service.max_concurrency = args.images * args.copies
+        app.dependency_overrides[getOcrService] = lambda: ocr_service
+        container.pipeline.single_flight = single_flight
+        elapsed = asyncio.run(_burst(images, args.copies))
+        coalesced = single_flight.getStats()["coalesced"] if single_flight else 0
+        print(f"  {label:<18} llamadas al modelo: {ocr_service.model.calls:>4}   "
+              f"agrupadas: {coalesced:>4}   tiempo: {elapsed:.2f}s")
+        ocr_service.close()
+    app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark: memoria de pico con varias subidas grandes a la vez.
+
+Lanza `--uploads` subidas simultáneas contra la app (transporte ASGI en memoria, modelo
+falso) y mide el pico de memoria residente (RSS) del proceso por encima de la memoria
+que ya tenía antes de las subidas. Cada escenario se ejecuta en un proceso nuevo para
+que el pico de uno no oculte el del siguiente (el pico se muestrea durante las subidas):
+
+- `foto_12mp`: fotos JPEG de 12MP de un móvil (el caso normal).
+- `jpeg_enorme`: JPEG con más píxeles que `--max-pixels`, que se decodifica ya reducido
+  con el modo draft.
+- `bomba_png`: PNG de pocos KB con cientos de millones de píxeles, que se rechaza (413)
+  por su cabecera, sin decodificarlo.
+- `demasiado_grande`: cuerpo mayor que `--max-mb`, que se rechaza (413) sin leerlo.
+- `sin_limites`: como referencia, el camino ingenuo (`await file.read()` y
+  `Image.open(...).convert("RGB")` a resolución completa) con el `jpeg_enorme`.
+
+Uso:
+    python -m benchmarks.bench_upload_memory --uploads 8 --max-mb 20
+"""
+import argparse
+import asyncio
+import io
+import json
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+from PIL import Image
+
+from benchmarks.common import makeReceiptImage
+
+SCENARIOS = ["foto_12mp", "jpeg_enorme", "bomba_png", "demasiado_grande", "sin_limites"]
+
+
+def _rssMb() -> float:
+    """Memoria residente actual del proceso (Linux), en MB."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() / 1e6
+
+
+class PeakSampler:
+    """Muestrea la memoria residente en un hilo y guarda el máximo (`ru_maxrss` no se puede reiniciar)."""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak = _rssMb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rssMb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "PeakSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rssMb())
+
+
+def _scenarioImage(scenario: str, max_bytes: int) -> bytes:
+    if scenario == "foto_12mp":
+        return makeReceiptImage(3000, 4000, lines=40, seed=1)
+    if scenario in ("jpeg_enorme", "sin_limites"):
+        return makeReceiptImage(8000, 10000, lines=60, seed=2)
+    if scenario == "bomba_png":
+        buffer = io.BytesIO()
+        Image.new("1", (20000, 20000), color=1).save(buffer, format="PNG")
+        return buffer.getvalue()
+    return b"\xff\xd8\xff" + bytes(max_bytes + 1024 * 1024)
+
+
+def _runScenario(scenario: str, uploads: int, max_bytes: int, max_pixels: int) -> dict:
+    """Ejecuta un escenario en este proceso y devuelve el pico de memoria y los códigos HTTP."""
+    import os
+    os.environ["UPLOAD_MAX_BYTES"] = str(max_bytes)
+    os.environ["IMAGE_MAX_PIXELS"] = str(max_pixels)
+    from fastapi import File, UploadFile
+
+    from app.main import app
+    from app.api.endpoints.receipts import getOcrService
+    from benchmarks.common import buildOcrService
+
+    ocr_service = buildOcrService(latency_s=0.05)
+    app.dependency_overrides[getOcrService] = lambda: ocr_service
+    path = "/api/v1/receipts/upload"
+    if scenario == "sin_limites":
+        @app.post("/bench/naive-upload")
+        async def naiveUpload(file: UploadFile = File(...)):
+            image_bytes = await file.read()
+            image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            await asyncio.sleep(0.05)
+            return {"size": image.size}
+        path = "/bench/naive-upload"
+
+    image_bytes = _scenarioImage(scenario, max_bytes)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            await client.get("/health")  # Construye los servicios antes de medir
+            baseline = _rssMb()
+            inicio = time.perf_counter()
+            with PeakSampler() as sampler:
+                responses = await asyncio.gather(*(
+                    client.post(path, files={"file": ("bench.jpg", image_bytes, "image/jpeg")})
+                    for _ in range(uploads)
+                ))
+            elapsed = time.perf_counter() - inicio
+            return baseline, sampler.peak, elapsed, [response.status_code for response in responses]
+
+    baseline, peak, elapsed, statuses = asyncio.run(run())
+    return {
+        "scenario": scenario,
+        "upload_mb": len(image_bytes) / 1e6,
+        "peak_mb": max(0.0, peak - baseline),
+        "elapsed_s": elapsed,
+        "statuses": sorted(set(statuses)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=8, help="Subidas simultáneas")
+    parser.add_argument("--max-mb", type=int, default=20, help="UPLOAD_MAX_BYTES, en MB")
+    parser.add_argument("--max-pixels", type=int, default=40_000_000, help="IMAGE_MAX_PIXELS")
+    parser.add_argument("--scenarios", nargs="*", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--run-scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    max_bytes = args.max_mb * 1024 * 1024
+
+    if args.run_scenario:
+        print(json.dumps(_runScenario(args.run_scenario, args.uploads, max_bytes, args.max_pixels)))
+        return
+
+    print(f"{args.uploads} subidas simultáneas, UPLOAD_MAX_BYTES={args.max_mb} MB, "
+          f"IMAGE_MAX_PIXELS={args.max_pixels}\n")
+    print(f"{'escenario':<18} {'subida':>9} {'pico RSS':>10} {'por subida':>11} {'tiempo':>8}  HTTP")
+    for scenario in args.scenarios:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_upload_memory", "--run-scenario", scenario,
+             "--uploads", str(args.uploads), "--max-mb", str(args.max_mb), "--max-pixels", str(args.max_pixels)],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        print(f"{scenario:<18} {result['upload_mb']:>7.1f}MB {result['peak_mb']:>8.0f}MB "
+              f"{result['peak_mb'] / args.uploads:>9.0f}MB {result['elapsed_s']:>7.2f}s  {result['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
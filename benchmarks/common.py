@@ -0,0 +1,91 @@
+"""
+Utilidades compartidas por los benchmarks.
+
+Los benchmarks no llaman a Gemini: sustituyen el modelo por `FakeGeminiModel`, que
+simula la latencia de red y devuelve un JSON de ticket fijo, para medir únicamente
+el coste de nuestro propio código.
+"""
+import io
+import json
+import random
+import statistics
+import time
+from typing import Dict, Any, List, Optional
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw, ImageFont
+
+SAMPLE_RECEIPT: Dict[str, Any] = {
+    "is_ticket": True,
+    "items": [
+        {"description": "Café", "quantity": 1, "unit_price": 2.50},
+        {"description": "Tostada", "quantity": 2, "unit_price": 3.00},
+    ],
+    "subtotal": 8.50,
+    "tax": 0.85,
+    "total": 9.35,
+}
+
+
+class _FakePart:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.parts = [_FakePart(text)]
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Modelo falso con la misma interfaz que `genai.GenerativeModel` usada por OCRService."""
+
+    def __init__(self, latency_s: float = 0.2, payload: Optional[Dict[str, Any]] = None):
+        self.latency_s = latency_s
+        self.payload = payload or SAMPLE_RECEIPT
+        self.calls = 0
+
+    def generate_content(self, contents, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency_s)
+        return _FakeResponse(json.dumps(self.payload))
+
+
+def buildOcrService(latency_s: float = 0.2, payload: Optional[Dict[str, Any]] = None):
+    """Crea un OCRService real cuyo modelo es un `FakeGeminiModel`."""
+    from app.services.ocr_service import OCRService
+
+    with patch("app.services.ocr_service.genai"):
+        service = OCRService(api_key="benchmark")
+    service.model = FakeGeminiModel(latency_s=latency_s, payload=payload)
+    return service
+
+
+def makeReceiptImage(width: int = 600, height: int = 1400, lines: int = 30,
+                     seed: int = 0, fmt: str = "JPEG") -> bytes:
+    """Genera una imagen sintética parecida a un ticket (papel blanco con líneas de texto)."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), color=(250, 250, 246))
+    draw = ImageDraw.Draw(image)
+    line_height = max(12, height // (lines + 4))
+    font = ImageFont.load_default(size=max(10, int(line_height * 0.6)))
+    for line in range(lines):
+        y = line_height * (line + 2)
+        text = f"PRODUCTO {rng.randint(100, 999)}   x{rng.randint(1, 4)}   {rng.randint(1, 50)},{rng.randint(0, 99):02d}"
+        draw.text((width // 30, y), text, fill=(20, 20, 20), font=font)
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, quality=95)
+    return buffer.getvalue()
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Resume una lista de tiempos (segundos) en milisegundos."""
+    ordered = sorted(samples)
+    p95_index = max(0, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        "n": len(samples),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[p95_index] * 1000,
+    }
@@ -0,0 +1,168 @@
+"""
+Evaluación del filtro local de imágenes que no son tickets.
+
+Clasifica un conjunto etiquetado de imágenes con `ReceiptPrefilter` y muestra:
+
+- tasa de falsos descartes: tickets que el filtro habría rechazado (deben ser 0);
+- llamadas al modelo ahorradas: no-tickets descartados sin llamar al modelo;
+- latencia del filtro (p50/p95) y motivos de descarte.
+
+Sin argumentos usa tickets sintéticos (papel con texto sobre un fondo, girados y con
+ruido; uno de cada cuatro, además, con la tinta desvaída), el ticket de `tests/images`
+y no-tickets sintéticos (paisajes, retratos, folios en blanco, fotos de texto sobre
+fondo de color). Con `--receipts` y `--non-receipts` se evalúa sobre directorios de
+fotos reales.
+
+Uso:
+    python -m benchmarks.eval_receipt_prefilter
+    python -m benchmarks.eval_receipt_prefilter --receipts fotos/tickets --non-receipts fotos/otras --min-text-lines 4
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+from typing import Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from app.services.receipt_prefilter import ReceiptPrefilter
+
+
+SAMPLE_RECEIPT = os.path.join(os.path.dirname(__file__), "..", "tests", "images", "restaurante.jpg")
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def _encode(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=88)
+    return buffer.getvalue()
+
+
+def _receipt(rng: random.Random, faded: bool = False) -> bytes:
+    width, height = rng.randint(350, 700), rng.randint(700, 2400)
+    background = tuple(rng.randint(20, 140) for _ in range(3))
+    canvas = Image.new("RGB", (width + 200, height + 200), background)
+    shade = rng.randint(225, 250)
+    paper = Image.new("RGB", (width, height), (shade, shade, shade))
+    # Papel térmico desvaído: la tinta apenas se distingue del papel.
+    ink = shade - rng.randint(25, 60) if faded else 25
+    draw = ImageDraw.Draw(paper)
+    step = rng.randint(18, 36)
+    for top in range(30, height - 30, step):
+        if rng.random() < 0.15:
+            continue
+        label = rng.choice(["CANA", "MENU DIA", "AGUA 1L", "PAN", "CAFE SOLO", "TOTAL", "IVA 10%"])
+        draw.text((20, top), f"{label:<14} {rng.randint(1, 4)} x {rng.uniform(0.5, 20):6.2f}", fill=(ink, ink, ink))
+    canvas.paste(paper, (100, 100))
+    canvas = canvas.rotate(rng.uniform(-10, 10), expand=True, fillcolor=background)
+    return _encode(canvas.filter(ImageFilter.GaussianBlur(rng.uniform(0, 1.2))))
+
+
+def _landscape(rng: random.Random) -> bytes:
+    width, height = rng.choice([(1200, 800), (1600, 900), (2400, 800)])
+    rows = np.linspace(0, 1, height)[:, None, None]
+    top = np.array([rng.randint(0, 255) for _ in range(3)])
+    bottom = np.array([rng.randint(0, 255) for _ in range(3)])
+    pixels = (top + (bottom - top) * rows) * np.ones((1, width, 1))
+    pixels += np.random.default_rng(rng.randint(0, 1 << 30)).normal(0, 8, pixels.shape)
+    return _encode(Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(2)))
+
+
+def _portrait(rng: random.Random) -> bytes:
+    image = Image.new("RGB", (900, 1200), tuple(rng.randint(60, 160) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((200, 200, 700, 850), fill=(225, 185, 155))
+    for x in (340, 520):
+        draw.ellipse((x, 430, x + 50, 480), fill=(40, 30, 30))
+    draw.rectangle((120, 850, 780, 1200), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    return _encode(image.filter(ImageFilter.GaussianBlur(3)))
+
+
+def _blankPage(rng: random.Random) -> bytes:
+    shade = rng.randint(200, 255)
+    return _encode(Image.new("RGB", (rng.randint(600, 1200), rng.randint(800, 1600)), (shade, shade, shade)))
+
+
+def _coloredSign(rng: random.Random) -> bytes:
+    background = (rng.randint(0, 80), rng.randint(60, 140), rng.randint(0, 80))
+    image = Image.new("RGB", (800, 1000), background)
+    draw = ImageDraw.Draw(image)
+    for top in range(60, 940, 40):
+        draw.text((40, top), "OFERTA DEL DIA  9,95", fill=(240, 220, 40))
+    return _encode(image)
+
+
+def syntheticSet(count: int, seed: int) -> Tuple[List[Tuple[str, bytes]], List[Tuple[str, bytes]]]:
+    """(tickets, no-tickets) sintéticos con su etiqueta."""
+    rng = random.Random(seed)
+    receipts = [(f"ticket_{i}", _receipt(rng)) for i in range(count)]
+    receipts += [(f"ticket_desvaido_{i}", _receipt(rng, faded=True)) for i in range(count // 4)]
+    if os.path.exists(SAMPLE_RECEIPT):
+        with open(SAMPLE_RECEIPT, "rb") as f:
+            receipts.append(("restaurante.jpg", f.read()))
+    generators = [_landscape, _portrait, _blankPage, _coloredSign]
+    others = [(f"{generators[i % 4].__name__.strip('_')}_{i}", generators[i % 4](rng)) for i in range(count)]
+    return receipts, others
+
+
+def _readDirectory(path: str) -> Iterator[Tuple[str, bytes]]:
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(EXTENSIONS):
+            with open(os.path.join(path, name), "rb") as f:
+                yield name, f.read()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", help="Directorio con fotos de tickets")
+    parser.add_argument("--non-receipts", help="Directorio con fotos que no son tickets")
+    parser.add_argument("--count", type=int, default=40, help="Imágenes sintéticas de cada clase")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-text-lines", type=int, default=3)
+    parser.add_argument("--min-paper-fraction", type=float, default=0.08)
+    parser.add_argument("--tesseract", action="store_true", help="Confirma los descartes con Tesseract")
+    args = parser.parse_args()
+
+    if args.receipts or args.non_receipts:
+        receipts = list(_readDirectory(args.receipts)) if args.receipts else []
+        others = list(_readDirectory(args.non_receipts)) if args.non_receipts else []
+    else:
+        receipts, others = syntheticSet(args.count, args.seed)
+
+    prefilter = ReceiptPrefilter(
+        min_text_lines=args.min_text_lines,
+        min_paper_fraction=args.min_paper_fraction,
+        tesseract_enabled=args.tesseract,
+    )
+    latencies: List[float] = []
+
+    def rejected(images: List[Tuple[str, bytes]]) -> List[Tuple[str, str]]:
+        result = []
+        for name, image_bytes in images:
+            verdict = prefilter.classify(image_bytes)
+            if verdict is None:
+                continue  # No se juzga: llega al modelo
+            latencies.append(verdict.elapsed_ms)
+            if not verdict.is_ticket:
+                result.append((name, verdict.reason))
+        return result
+
+    false_rejects = rejected(receipts)
+    true_rejects = rejected(others)
+
+    print(f"tickets:    {len(receipts):4d}   descartados por error {len(false_rejects):4d} "
+          f"(tasa de falsos descartes {len(false_rejects) / max(1, len(receipts)):6.1%})")
+    for name, reason in false_rejects:
+        print(f"    {name}: {reason}")
+    print(f"no-tickets: {len(others):4d}   descartados {len(true_rejects):4d} "
+          f"(llamadas al modelo ahorradas {len(true_rejects) / max(1, len(others)):6.1%})")
+    if latencies:
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        print(f"latencia del filtro: p50 {statistics.median(latencies):.1f} ms   p95 {p95:.1f} ms")
+    print(f"motivos: {prefilter.getStats()['rejections']}")
+
+
+if __name__ == "__main__":
+    main()
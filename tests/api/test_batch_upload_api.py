@@ -0,0 +1,252 @@
+import pytest
+import asyncio
+import json
+from unittest.mock import MagicMock
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.api.endpoints.receipts import getOcrService
+
+client = TestClient(app)
+
+# Firma de JPEG: las subidas se comprueban por su contenido, no por el Content-Type.
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+TICKET_JSON = json.dumps({
+    "is_ticket": True,
+    "items": [{"description": "Café", "quantity": 1, "unit_price": 2.50}],
+    "total": 2.50
+})
+NOT_TICKET_JSON = json.dumps({
+    "is_ticket": False,
+    "error_message": "La imagen parece ser un paisaje.",
+    "detected_content": "Paisaje"
+})
+
+
+@pytest.fixture
+def fake_ocr_service():
+    """
+    Servicio OCR falso: el tiempo y la respuesta dependen del contenido de la imagen
+    (b"slow..." tarda más, b"notticket..." no es un ticket, b"fail..." falla).
+    Registra cuántas llamadas hay en curso a la vez.
+    """
+    instance = MagicMock()
+    instance.state = {"active": 0, "max_active": 0, "calls": 0}
+
+    async def extract(image_bytes, language='spa'):
+        image_bytes = image_bytes.removeprefix(JPEG_MAGIC)
+        instance.state["calls"] += 1
+        instance.state["active"] += 1
+        instance.state["max_active"] = max(instance.state["max_active"], instance.state["active"])
+        try:
+            await asyncio.sleep(0.3 if image_bytes.startswith(b"slow") else 0.02)
+            if image_bytes.startswith(b"fail"):
+                raise RuntimeError("Fallo simulado del modelo")
+            return NOT_TICKET_JSON if image_bytes.startswith(b"notticket") else TICKET_JSON
+        finally:
+            instance.state["active"] -= 1
+
+    instance.extractTextFromImageAsync = extract
+    app.dependency_overrides[getOcrService] = lambda: instance
+    yield instance
+    app.dependency_overrides.pop(getOcrService, None)
+
+
+def _postBatch(files, headers=None, **params):
+    response = client.post(
+        "/api/v1/receipts/upload/batch",
+        files=[("files", (name, content, content_type)) for name, content, content_type in files],
+        params=params,
+        headers=headers,
+    )
+    lines = [json.loads(line) for line in response.text.splitlines() if line]
+    return response, lines
+
+
+def test_uploadBatch_mixedFiles_returnsOneLinePerFile(fake_ocr_service):
+    """
+    Prueba que el lote devuelve una línea NDJSON por archivo con su resultado o error,
+    y que los tickets quedan guardados igual que en una subida individual.
+    """
+    # Arrange
+    files = [
+        ("a.jpg", JPEG_MAGIC + b"ticket-a", "image/jpeg"),
+        ("notes.txt", b"texto", "text/plain"),
+        ("paisaje.jpg", JPEG_MAGIC + b"notticket-b", "image/jpeg"),
+        ("b.jpg", JPEG_MAGIC + b"ticket-b", "image/jpeg"),
+    ]
+
+    # Act
+    response, lines = _postBatch(files)
+
+    # Assert
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    by_index = {line["index"]: line for line in lines}
+    assert sorted(by_index) == [0, 1, 2, 3]
+    assert by_index[0]["status_code"] == 200
+    assert by_index[0]["receipt"]["filename"] == "a.jpg"
+    assert by_index[1]["status_code"] == 400
+    assert "debe ser una imagen" in by_index[1]["detail"]
+    assert by_index[2]["status_code"] == 400
+    assert by_index[2]["detail"] == "La imagen parece ser un paisaje."
+
+    receipt_id = by_index[3]["receipt"]["receipt_id"]
+    stored = client.get(f"/api/v1/receipts/{receipt_id}")
+    assert stored.status_code == 200
+    assert stored.json() == by_index[3]["receipt"]
+
+
+def test_uploadBatch_streamsResultsInCompletionOrder(fake_ocr_service):
+    """Prueba que los resultados se emiten según terminan, sin esperar al más lento."""
+    files = [
+        ("lento.jpg", JPEG_MAGIC + b"slow-ticket", "image/jpeg"),
+        ("rapido.jpg", JPEG_MAGIC + b"ticket-fast", "image/jpeg"),
+    ]
+
+    _, lines = _postBatch(files)
+
+    assert [line["filename"] for line in lines] == ["rapido.jpg", "lento.jpg"]
+
+
+def test_uploadBatch_respectsConcurrencyCap(fake_ocr_service):
+    """Prueba que nunca se procesan más imágenes a la vez que el máximo indicado."""
+    files = [(f"{i}.jpg", JPEG_MAGIC + f"ticket-{i}".encode(), "image/jpeg") for i in range(6)]
+
+    _, lines = _postBatch(files, max_concurrency=2)
+
+    assert len(lines) == 6
+    assert all(line["status_code"] == 200 for line in lines)
+    assert fake_ocr_service.state["max_active"] == 2
+
+
+def test_uploadBatch_oneFailure_doesNotAffectOthers(fake_ocr_service):
+    """Prueba que el fallo del OCR en un archivo se informa en su línea y los demás terminan bien."""
+    files = [
+        ("ok.jpg", JPEG_MAGIC + b"ticket-ok", "image/jpeg"),
+        ("roto.jpg", JPEG_MAGIC + b"fail-ticket", "image/jpeg"),
+    ]
+
+    _, lines = _postBatch(files)
+
+    by_name = {line["filename"]: line for line in lines}
+    assert by_name["ok.jpg"]["status_code"] == 200
+    assert by_name["roto.jpg"]["status_code"] == 500
+    assert "Fallo simulado del modelo" in by_name["roto.jpg"]["detail"]
+
+
+def test_uploadBatch_requestDeadline_expiresSlowImagesOnly(fake_ocr_service):
+    """Prueba que con `X-Request-Timeout` las imágenes que no terminan a tiempo tienen 504 y las demás, 200."""
+    files = [
+        ("lento.jpg", JPEG_MAGIC + b"slow-deadline", "image/jpeg"),
+        ("rapido.jpg", JPEG_MAGIC + b"ticket-deadline", "image/jpeg"),
+    ]
+
+    response, lines = _postBatch(files, headers={"X-Request-Timeout": "0.15"})
+
+    by_name = {line["filename"]: line for line in lines}
+    assert response.status_code == 200
+    assert by_name["rapido.jpg"]["status_code"] == 200
+    assert by_name["lento.jpg"]["status_code"] == 504
+    assert fake_ocr_service.state["active"] == 0
+
+
+def test_uploadBatch_clientDisconnects_cancelsPendingImages():
+    """Prueba que si el cliente se desconecta a mitad del lote se cancelan las llamadas al modelo."""
+    # Arrange
+    import time
+    import httpx
+    from app.core.lifecycle import getServiceContainer
+    deadlines = getServiceContainer(app).deadlines
+    cancelled_before = deadlines.getStats()["cancelled_disconnect"]
+    upload = httpx.Request(
+        "POST", "http://test/api/v1/receipts/upload/batch",
+        files=[("files", (f"{i}.jpg", JPEG_MAGIC + f"disconnect-{i}".encode(), "image/jpeg")) for i in range(2)],
+    )
+    body = upload.read()
+    # Con ASGI 2.4 Starlette no vigila la desconexión mientras genera el stream.
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/api/v1/receipts/upload/batch",
+        "raw_path": b"/api/v1/receipts/upload/batch", "query_string": b"", "root_path": "",
+        "client": ("10.0.0.10", 5000), "server": ("test", 80),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in upload.headers.items()],
+    }
+    ocr_service = MagicMock()
+    estado = {"running": 0, "cancelled": 0}
+
+    async def extract(image_bytes, language='spa'):
+        estado["running"] += 1
+        if estado["running"] == 2:
+            estado["started"].set()  # Las dos imágenes están en el modelo
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            estado["cancelled"] += 1
+            raise
+
+    ocr_service.extractTextFromImageAsync = extract
+
+    async def runScenario():
+        estado["started"] = asyncio.Event()
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if pending:
+                return pending.pop(0)
+            await estado["started"].wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            pass
+
+        await asyncio.wait_for(app(scope, receive, send), timeout=5)
+
+    app.dependency_overrides[getOcrService] = lambda: ocr_service
+    try:
+        # Act
+        inicio = time.perf_counter()
+        asyncio.run(runScenario())
+        duracion = time.perf_counter() - inicio
+    finally:
+        app.dependency_overrides.pop(getOcrService, None)
+
+    # Assert
+    assert duracion < 2
+    assert estado["cancelled"] == 2
+    assert deadlines.getStats()["cancelled_disconnect"] == cancelled_before + 1
+
+
+def test_uploadBatch_readsEachFileOnlyWhenItsTurnComes(fake_ocr_service):
+    """
+    Prueba que cada archivo se lee cuando tiene hueco para procesarse y no todos al
+    principio: con una imagen a la vez, nunca hay más de una leída en memoria.
+    """
+    from unittest.mock import patch
+    from app.core.lifecycle import getServiceContainer
+    limites = getServiceContainer(app).upload_limits
+    leer = limites.read
+    llamadas_al_leer = []
+
+    async def registrar(archivo):
+        llamadas_al_leer.append(fake_ocr_service.state["calls"])
+        return await leer(archivo)
+
+    files = [(f"{i}.jpg", JPEG_MAGIC + f"ticket-lazy-{i}".encode(), "image/jpeg") for i in range(3)]
+    with patch.object(limites, "read", side_effect=registrar):
+        _, lines = _postBatch(files, max_concurrency=1)
+
+    assert all(line["status_code"] == 200 for line in lines)
+    assert llamadas_al_leer == [0, 1, 2]
+
+
+def test_uploadBatch_tooManyFiles_returnsBadRequest(fake_ocr_service):
+    """Prueba que un lote por encima del máximo configurado se rechaza entero."""
+    files = [(f"{i}.jpg", JPEG_MAGIC + f"ticket-{i}".encode(), "image/jpeg") for i in range(51)]
+
+    response, _ = _postBatch(files)
+
+    assert response.status_code == 400
+    assert fake_ocr_service.state["calls"] == 0
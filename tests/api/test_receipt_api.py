@@ -1,13 +1,17 @@
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from app.main import app
+from app.api.endpoints.receipts import getOcrService
 from app.models.receipt import ReceiptParseResponse, Item
 from datetime import datetime
 import io
 import json
 from fastapi import status
 
+# Firma de JPEG: las subidas se comprueban por su contenido, no por el Content-Type.
+JPEG_MAGIC = b"\xff\xd8\xff"
+
 # Cliente de prueba de FastAPI que simula peticiones HTTP
 client = TestClient(app)
 
@@ -15,25 +19,32 @@ client = TestClient(app)
 def mock_ocr_service(request):
     """
     Fixture que simula el servicio OCR.
-    Reemplaza la clase OCRService real por un mock que devuelve datos predefinidos.
-    Esto evita hacer llamadas reales al servicio de OCR durante las pruebas.
+    Sustituye el servicio OCR compartido por un mock que devuelve datos predefinidos
+    (mediante dependency_overrides). Esto evita hacer llamadas reales al servicio de
+    OCR durante las pruebas.
     """
     is_ticket_response = getattr(request, "param", True)  # Valor por defecto True
 
-    with patch('app.api.endpoints.receipts.OCRService') as mock:
-        instance = mock.return_value
-        # Simula la respuesta del OCR con datos de un recibo de ejemplo
-        instance.extractTextFromImage.return_value = json.dumps({
-            "is_ticket": is_ticket_response,
-            "items": [
-                {"description": "Café", "quantity": 1, "unit_price": 2.50},
-                {"description": "Tostada", "quantity": 2, "unit_price": 3.00}
-            ] if is_ticket_response else [],
-            "subtotal": 8.50 if is_ticket_response else 0,
-            "tax": 0.85 if is_ticket_response else 0,
-            "total": 9.35 if is_ticket_response else 0
-        })
-        yield instance
+    instance = MagicMock()
+    # Simula la respuesta del OCR con datos de un recibo de ejemplo
+    instance.extractTextFromImage.return_value = json.dumps({
+        "is_ticket": is_ticket_response,
+        "items": [
+            {"description": "Café", "quantity": 1, "unit_price": 2.50},
+            {"description": "Tostada", "quantity": 2, "unit_price": 3.00}
+        ] if is_ticket_response else [],
+        "subtotal": 8.50 if is_ticket_response else 0,
+        "tax": 0.85 if is_ticket_response else 0,
+        "total": 9.35 if is_ticket_response else 0
+    })
+    # El endpoint usa la versión asíncrona; delega en el mock síncrono para que
+    # los tests puedan seguir configurando `extractTextFromImage` directamente.
+    instance.extractTextFromImageAsync = AsyncMock(
+        side_effect=lambda *args, **kwargs: instance.extractTextFromImage(*args, **kwargs)
+    )
+    app.dependency_overrides[getOcrService] = lambda: instance
+    yield instance
+    app.dependency_overrides.pop(getOcrService, None)
 
 @pytest.fixture
 def sample_receipt_data():
@@ -79,7 +90,7 @@ def test_uploadReceipt_validImage_returnsReceiptData(mock_ocr_service):
     Verifica que el endpoint /upload procesa correctamente la imagen y devuelve los datos del recibo.
     """
     # Arrange
-    test_image = b"fake image content"
+    test_image = JPEG_MAGIC + b"fake image content"
     
     # Act
     response = client.post(
@@ -137,7 +148,7 @@ def test_uploadReceipt_imageNotATicket_returnsAppropriateResponse(mock_ocr_servi
     Verifica que el endpoint /upload devuelve is_ticket como False.
     """
     # Arrange
-    test_image = b"fake image content that is not a ticket"
+    test_image = JPEG_MAGIC + b"fake image content that is not a ticket"
     
     # Act
     response = client.post(
@@ -157,7 +168,7 @@ def test_splitReceipt_validAssignments_returnsSplitData(mock_ocr_service):
     Verifica que el endpoint /split calcula correctamente las participaciones.
     """
     # Arrange
-    test_image = b"fake image content"
+    test_image = JPEG_MAGIC + b"fake image content"
     upload_response = client.post(
         "/api/v1/receipts/upload",
         files={"file": ("test.jpg", test_image, "image/jpeg")}
@@ -194,7 +205,7 @@ def test_splitReceipt_invalidItemId_returnsBadRequest(mock_ocr_service):
     Verifica que la API devuelve un error 400 con el mensaje apropiado.
     """
     # Arrange
-    test_image = b"fake image content"
+    test_image = JPEG_MAGIC + b"fake image content"
     upload_response = client.post(
         "/api/v1/receipts/upload",
         files={"file": ("test.jpg", test_image, "image/jpeg")}
@@ -242,7 +253,7 @@ def test_splitReceipt_nonTicketReceipt_returnsBadRequest(mock_ocr_service):
     esta prueba ahora verifica que la carga de un "no-ticket" falla.
     """
     # Arrange: Attempt to upload an image that is identified as not a ticket
-    test_image = b"fake image content that is not a ticket"
+    test_image = JPEG_MAGIC + b"fake image content that is not a ticket"
     upload_response = client.post(
         "/api/v1/receipts/upload",
         files={"file": ("test_not_ticket.jpg", test_image, "image/jpeg")}
@@ -261,7 +272,7 @@ def test_splitReceipt_missingAssignments_returnsUnprocessableEntity(mock_ocr_ser
     Verifica que la API devuelve un error 422.
     """
     # Arrange: Upload a valid receipt to get a receipt_id
-    test_image = b"fake image content"
+    test_image = JPEG_MAGIC + b"fake image content"
     upload_response = client.post(
         "/api/v1/receipts/upload",
         files={"file": ("test.jpg", test_image, "image/jpeg")}
@@ -281,7 +292,7 @@ def test_splitReceipt_emptyAssignments_returnsSplitDataWithNoShares(mock_ocr_ser
     Verifica que la API devuelve una respuesta exitosa con cero participaciones.
     """
     # Arrange: Upload a valid receipt to get a receipt_id
-    test_image = b"fake image content"
+    test_image = JPEG_MAGIC + b"fake image content"
     upload_response = client.post(
         "/api/v1/receipts/upload",
         files={"file": ("test.jpg", test_image, "image/jpeg")}
@@ -308,7 +319,7 @@ def test_splitReceipt_userWithEmptyItemList_returnsShareWithZeroAmount(mock_ocr_
     Verifica que el usuario aparece en las participaciones con monto cero.
     """
     # Arrange: Upload a valid receipt
-    test_image = b"fake image content"
+    test_image = JPEG_MAGIC + b"fake image content"
     upload_response = client.post(
         "/api/v1/receipts/upload",
         files={"file": ("test.jpg", test_image, "image/jpeg")}
@@ -339,7 +350,7 @@ def test_splitReceipt_withSharedItem_calculatesSharesCorrectly(mock_ocr_service)
     Verifica que los montos y las listas de items/shared_items son correctos.
     """
     # Arrange: Upload a valid receipt
-    test_image = b"fake image content"
+    test_image = JPEG_MAGIC + b"fake image content"
     upload_response = client.post(
         "/api/v1/receipts/upload",
         files={"file": ("test.jpg", test_image, "image/jpeg")}
@@ -374,7 +385,7 @@ def test_getReceipt_validId_returnsReceiptData(mock_ocr_service):
     Verifica que el endpoint GET devuelve los datos correctos del recibo.
     """
     # Arrange
-    test_image = b"fake image content"
+    test_image = JPEG_MAGIC + b"fake image content"
     upload_response = client.post(
         "/api/v1/receipts/upload",
         files={"file": ("test.jpg", test_image, "image/jpeg")}
@@ -413,7 +424,7 @@ def test_uploadReceipt_ocrServiceFailure_returnsInternalServerError(mock_ocr_ser
     """
     # Arrange
     mock_ocr_service.extractTextFromImage.side_effect = RuntimeError("Fallo simulado del servicio OCR")
-    test_image = b"fake image content"
+    test_image = JPEG_MAGIC + b"fake image content"
     
     # Act
     response = client.post(
@@ -432,7 +443,7 @@ def test_uploadReceipt_ocrServiceMalformedJsonResponse_returnsEmptyResponse(mock
     """
     # Arrange
     mock_ocr_service.extractTextFromImage.return_value = "{\"is_ticket\": true, \"items\": ["  # JSON incompleto
-    test_image = b"fake image content"
+    test_image = JPEG_MAGIC + b"fake image content"
     
     # Act
     response = client.post(
@@ -449,3 +460,513 @@ def test_uploadReceipt_ocrServiceMalformedJsonResponse_returnsEmptyResponse(mock
     assert response_data["tax"] is None
     assert response_data["total"] is None
     assert response_data["error_message"] is None
+
+
+def test_uploadReceipt_slowOcr_doesNotBlockOtherRequests(sample_receipt_json):
+    """
+    Prueba que una llamada lenta al modelo no bloquea el event loop.
+    Mientras una subida espera al OCR, /health y GET /{receipt_id} deben responder.
+    """
+    # Arrange
+    import asyncio
+    import time
+    import httpx
+    from PIL import Image
+
+    image_buffer = io.BytesIO()
+    Image.new("RGB", (50, 50), color="white").save(image_buffer, format="PNG")
+    image_bytes = image_buffer.getvalue()
+
+    def slowGenerateContent(*args, **kwargs):
+        time.sleep(0.5)
+        api_response = MagicMock()
+        api_response.parts = [MagicMock(text=sample_receipt_json)]
+        return api_response
+
+    async def runScenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            upload_task = asyncio.create_task(async_client.post(
+                "/api/v1/receipts/upload",
+                files={"file": ("test.png", image_bytes, "image/png")}
+            ))
+            await asyncio.sleep(0.1)
+            inicio = time.perf_counter()
+            health_response = await async_client.get("/health")
+            missing_response = await async_client.get("/api/v1/receipts/non-existent-id")
+            tiempo_otras = time.perf_counter() - inicio
+            upload_done_before_others = upload_task.done()
+            upload_response = await upload_task
+            return health_response, missing_response, tiempo_otras, upload_done_before_others, upload_response
+
+    # Act
+    from app.services.ocr_service import OCRService
+    with patch("app.services.ocr_service.genai") as mock_genai:
+        mock_genai.GenerativeModel.return_value.generate_content.side_effect = slowGenerateContent
+        ocr_service = OCRService(api_key="test_api_key")
+    app.dependency_overrides[getOcrService] = lambda: ocr_service
+    try:
+        health, missing, tiempo_otras, upload_done_first, upload = asyncio.run(runScenario())
+    finally:
+        app.dependency_overrides.pop(getOcrService, None)
+        ocr_service.close()
+
+    # Assert
+    assert health.status_code == 200
+    assert missing.status_code == 404
+    assert upload_done_first is False
+    assert tiempo_otras < 0.3
+    assert upload.status_code == 200
+    assert len(upload.json()["items"]) == 2
+
+
+def test_uploadReceipt_sameImageTwice_servesSecondFromCache(mock_ocr_service):
+    """
+    Prueba que volver a subir la misma imagen no llama de nuevo al modelo.
+    Cada subida recibe igualmente su propio receipt_id.
+    """
+    # Arrange
+    test_image = JPEG_MAGIC + b"fake image content for cache"
+
+    # Act
+    first = client.post("/api/v1/receipts/upload", files={"file": ("a.jpg", test_image, "image/jpeg")})
+    second = client.post("/api/v1/receipts/upload", files={"file": ("b.jpg", test_image, "image/jpeg")})
+    metrics = client.get("/metrics").json()
+
+    # Assert
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert first.json()["receipt_id"] != second.json()["receipt_id"]
+    assert second.json()["items"] == first.json()["items"]
+    assert mock_ocr_service.extractTextFromImageAsync.await_count == 1
+    assert metrics["ocr_cache"]["memory_hits"] >= 1
+
+
+def test_uploadReceipt_engineQuery_usesLocalTesseractEngine():
+    """Prueba que ?engine=tesseract procesa la imagen con el motor local y su parser de texto plano."""
+    # Arrange
+    from app.core.lifecycle import getServiceContainer
+    container = getServiceContainer(app)
+    tesseract = MagicMock()
+    tesseract.name = "tesseract"
+    tesseract.output_format = "text"
+    tesseract.extractTextFromImageAsync = AsyncMock(return_value="CAFE 2 x 1,50 3,00\nTOTAL 3,00")
+    original = container.ocr_engines.get("tesseract")
+    container.ocr_engines["tesseract"] = tesseract
+    try:
+        # Act
+        response = client.post(
+            "/api/v1/receipts/upload?engine=tesseract",
+            files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content tesseract", "image/jpeg")}
+        )
+    finally:
+        container.ocr_engines["tesseract"] = original
+
+    # Assert
+    assert response.status_code == 200
+    data = response.json()
+    assert data["items"][0]["name"] == "CAFE"
+    assert data["items"][0]["quantity"] == 2
+    assert data["total"] == 3.00
+    tesseract.extractTextFromImageAsync.assert_awaited_once()
+
+
+def test_uploadReceipt_unknownEngine_returnsBadRequest():
+    """Prueba que pedir un motor OCR inexistente devuelve 400."""
+    # Act
+    response = client.post(
+        "/api/v1/receipts/upload?engine=abbyy",
+        files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content", "image/jpeg")}
+    )
+
+    # Assert
+    assert response.status_code == 400
+    assert "Motor OCR 'abbyy' no soportado" in response.json()["detail"]
+
+
+def test_uploadReceipt_tesseractMissing_returnsConfigurationError():
+    """Prueba que si Tesseract no está instalado se devuelve un error de configuración claro."""
+    # Arrange
+    from app.services.tesseract_ocr_service import TesseractOCRService
+    app.dependency_overrides[getOcrService] = lambda: TesseractOCRService(tesseract_cmd="/nonexistent/tesseract")
+    try:
+        # Act
+        response = client.post(
+            "/api/v1/receipts/upload",
+            files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content no tesseract", "image/jpeg")}
+        )
+    finally:
+        app.dependency_overrides.pop(getOcrService, None)
+
+    # Assert
+    assert response.status_code == 500
+    assert "Error de configuración del servidor" in response.json()["detail"]
+
+
+def test_uploadReceipt_circuitOpen_returnsServiceUnavailableWithRetryAfter():
+    """Prueba que con el circuito del modelo abierto /upload falla rápido con 503 y Retry-After."""
+    # Arrange
+    from app.services.resilience import CircuitOpenError
+    ocr_service = MagicMock()
+    ocr_service.extractTextFromImageAsync = AsyncMock(
+        side_effect=CircuitOpenError("circuito abierto", retry_after=12.3)
+    )
+    app.dependency_overrides[getOcrService] = lambda: ocr_service
+    try:
+        # Act
+        response = client.post(
+            "/api/v1/receipts/upload",
+            files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content circuit", "image/jpeg")}
+        )
+    finally:
+        app.dependency_overrides.pop(getOcrService, None)
+
+    # Assert
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "13"
+    assert "circuito abierto" in response.json()["detail"]
+
+
+def test_uploadReceipt_keyPoolExhausted_returnsServiceUnavailableWithRetryAfter():
+    """Prueba que sin cupo en ninguna clave de Gemini /upload responde 503 con Retry-After (no 500)."""
+    # Arrange
+    from app.services.api_key_pool import KeyPoolExhaustedError
+    error = RuntimeError("Error al procesar imagen con Gemini")
+    error.__cause__ = KeyPoolExhaustedError("Todas las claves de Gemini han agotado su cupo", retry_after=4.2)
+    ocr_service = MagicMock()
+    ocr_service.extractTextFromImageAsync = AsyncMock(side_effect=error)
+    app.dependency_overrides[getOcrService] = lambda: ocr_service
+    try:
+        # Act
+        response = client.post(
+            "/api/v1/receipts/upload",
+            files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content key pool", "image/jpeg")}
+        )
+    finally:
+        app.dependency_overrides.pop(getOcrService, None)
+
+    # Assert
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert "agotado su cupo" in response.json()["detail"]
+
+
+def test_uploadReceipt_queueFull_returnsTooManyRequestsWithRetryAfter(mock_ocr_service):
+    """Prueba que con la cola de trabajo OCR llena /upload responde 429 sin llamar al modelo."""
+    # Arrange
+    import asyncio
+    from app.core.lifecycle import getServiceContainer
+    from app.services.admission import AdmissionController
+    container = getServiceContainer(app)
+    original = container.admission
+    container.admission = AdmissionController(max_concurrency=1, max_queue_depth=0)
+    ticket = asyncio.run(container.admission.acquire())  # Ocupa el único hueco
+    try:
+        # Act
+        response = client.post(
+            "/api/v1/receipts/upload",
+            files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content queue full", "image/jpeg")}
+        )
+        metrics = client.get("/metrics").json()
+    finally:
+        ticket.release()
+        container.admission = original
+
+    # Assert
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert mock_ocr_service.extractTextFromImageAsync.await_count == 0
+    assert metrics["admission"]["rejected"] == 1
+
+
+def test_uploadReceipt_clientOverRateLimit_returnsTooManyRequests(mock_ocr_service):
+    """Prueba que un cliente que supera su cupo de subidas recibe 429, sin afectar a otro cliente."""
+    # Arrange
+    from app.core.lifecycle import getServiceContainer
+    from app.services.rate_limiter import RateLimiter
+    container = getServiceContainer(app)
+    original = container.rate_limiter
+    container.rate_limiter = RateLimiter(upload_per_minute=1, upload_burst=1, api_keys=["cliente-a", "cliente-b"])
+    subida = lambda clave: client.post(
+        "/api/v1/receipts/upload",
+        files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content rate limit", "image/jpeg")},
+        headers={"X-API-Key": clave},
+    )
+    try:
+        # Act
+        primera, segunda, otro_cliente = subida("cliente-a"), subida("cliente-a"), subida("cliente-b")
+        consulta = client.get(f"/api/v1/receipts/{primera.json()['receipt_id']}", headers={"X-API-Key": "cliente-a"})
+    finally:
+        container.rate_limiter = original
+
+    # Assert
+    assert primera.status_code == 200
+    assert segunda.status_code == 429
+    assert int(segunda.headers["Retry-After"]) >= 1
+    assert otro_cliente.status_code == 200
+    assert consulta.status_code == 200
+
+
+
+def test_uploadReceipt_rotatingUnknownApiKeys_stillRateLimited(mock_ocr_service):
+    """Prueba que cambiar la cabecera X-API-Key en cada petición no evita el 429."""
+    # Arrange
+    from app.core.lifecycle import getServiceContainer
+    from app.services.rate_limiter import RateLimiter
+    container = getServiceContainer(app)
+    original = container.rate_limiter
+    container.rate_limiter = RateLimiter(upload_per_minute=1, upload_burst=1, api_keys=["cliente-a"])
+    try:
+        # Act
+        respuestas = [
+            client.post(
+                "/api/v1/receipts/upload",
+                files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content rotating key", "image/jpeg")},
+                headers={"X-API-Key": f"inventada-{i}"},
+            )
+            for i in range(3)
+        ]
+    finally:
+        container.rate_limiter = original
+
+    # Assert
+    assert [respuesta.status_code for respuesta in respuestas] == [200, 429, 429]
+
+def _slowOcrService(delay):
+    """Motor OCR falso que tarda `delay` segundos y anota si se ha cancelado la llamada."""
+    import asyncio
+    ocr_service = MagicMock()
+    ocr_service.started = asyncio.Event()
+    ocr_service.cancelled = False
+
+    async def slowExtract(*args, **kwargs):
+        ocr_service.started.set()
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            ocr_service.cancelled = True
+            raise
+        return json.dumps({"is_ticket": True, "items": [], "total": 1.0})
+
+    ocr_service.extractTextFromImageAsync = AsyncMock(side_effect=slowExtract)
+    return ocr_service
+
+
+def test_uploadReceipt_clientDisconnects_cancelsOcrWork():
+    """Prueba que si el cliente se desconecta a mitad de /upload se cancela la llamada al modelo."""
+    # Arrange
+    import asyncio
+    import time
+    import httpx
+    from app.core.lifecycle import getServiceContainer
+    deadlines = getServiceContainer(app).deadlines
+    cancelled_before = deadlines.getStats()["cancelled_disconnect"]
+    upload = httpx.Request(
+        "POST", "http://test/api/v1/receipts/upload",
+        files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content disconnect", "image/jpeg")}
+    )
+    body = upload.read()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/api/v1/receipts/upload", "raw_path": b"/api/v1/receipts/upload",
+        "query_string": b"", "root_path": "", "client": ("10.0.0.9", 5000), "server": ("test", 80),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in upload.headers.items()],
+    }
+    sent = []
+
+    async def runScenario(ocr_service):
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if pending:
+                return pending.pop(0)
+            # El cliente se va en cuanto el modelo ha empezado a trabajar.
+            await ocr_service.started.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        await asyncio.wait_for(app(scope, receive, send), timeout=5)
+
+    ocr_service = _slowOcrService(delay=10)
+    app.dependency_overrides[getOcrService] = lambda: ocr_service
+    try:
+        # Act
+        inicio = time.perf_counter()
+        asyncio.run(runScenario(ocr_service))
+        duracion = time.perf_counter() - inicio
+    finally:
+        app.dependency_overrides.pop(getOcrService, None)
+
+    # Assert
+    assert ocr_service.cancelled is True
+    assert duracion < 2
+    assert sent[0]["status"] == 499
+    assert deadlines.getStats()["cancelled_disconnect"] == cancelled_before + 1
+
+
+def test_uploadReceipt_clientDeadlineHeader_returnsGatewayTimeout():
+    """Prueba que con `X-Request-Timeout` una subida que tarda más responde 504 y cancela el OCR."""
+    # Arrange
+    from app.core.lifecycle import getServiceContainer
+    deadlines = getServiceContainer(app).deadlines
+    exceeded_before = deadlines.getStats()["deadline_exceeded"]
+    ocr_service = _slowOcrService(delay=10)
+    app.dependency_overrides[getOcrService] = lambda: ocr_service
+    try:
+        # Act
+        response = client.post(
+            "/api/v1/receipts/upload",
+            files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content deadline", "image/jpeg")},
+            headers={"X-Request-Timeout": "0.5"},
+        )
+    finally:
+        app.dependency_overrides.pop(getOcrService, None)
+
+    # Assert
+    assert response.status_code == 504
+    assert ocr_service.cancelled is True
+    assert deadlines.getStats()["deadline_exceeded"] == exceeded_before + 1
+
+
+def test_uploadReceipt_invalidDeadlineHeader_returnsBadRequest(mock_ocr_service):
+    """Prueba que un `X-Request-Timeout` que no es un número de segundos positivo da 400."""
+    # Act
+    response = client.post(
+        "/api/v1/receipts/upload",
+        files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content bad deadline", "image/jpeg")},
+        headers={"X-Request-Timeout": "pronto"},
+    )
+
+    # Assert
+    assert response.status_code == 400
+    assert "X-Request-Timeout" in response.json()["detail"]
+    assert mock_ocr_service.extractTextFromImageAsync.await_count == 0
+
+
+def test_uploadReceipt_asyncMode_returnsAcceptedAndJobCompletes(mock_ocr_service):
+    """
+    Prueba el modo asíncrono: /upload?mode=async responde 202 al momento, los eventos SSE
+    muestran el progreso y el resultado se puede consultar como cualquier ticket.
+    """
+    # Arrange
+    import asyncio
+    import httpx
+    from app.core.lifecycle import getServiceContainer
+    container = getServiceContainer(app)
+    original_engines = container.ocr_engines
+    container.ocr_engines = {container.default_engine: mock_ocr_service}
+
+    async def runScenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            accepted = await async_client.post(
+                "/api/v1/receipts/upload?mode=async",
+                files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content async job", "image/jpeg")}
+            )
+            events = await async_client.get(f"/api/v1/receipts/jobs/{accepted.json()['job_id']}/events")
+            status_response = await async_client.get(accepted.headers["Location"])
+            receipt = await async_client.get(f"/api/v1/receipts/{accepted.json()['job_id']}")
+        await container.jobs.stop()
+        return accepted, events, status_response, receipt
+
+    try:
+        # Act
+        accepted, events, status_response, receipt = asyncio.run(runScenario())
+    finally:
+        container.ocr_engines = original_engines
+
+    # Assert
+    assert accepted.status_code == 202
+    assert accepted.json()["status"] == "queued"
+    assert "event: done" in events.text
+    assert status_response.json()["status"] == "done"
+    assert status_response.json()["stage"] == "parsed"
+    assert status_response.json()["receipt"]["receipt_id"] == accepted.json()["job_id"]
+    assert receipt.status_code == 200
+    assert len(receipt.json()["items"]) == 2
+
+
+def test_uploadReceipt_asyncModeInvalidCallback_returnsBadRequest(mock_ocr_service):
+    """Prueba que una callback_url que no es http(s) se rechaza sin encolar nada."""
+    # Act
+    response = client.post(
+        "/api/v1/receipts/upload?mode=async&callback_url=file:///etc/passwd",
+        files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content bad callback", "image/jpeg")}
+    )
+
+    # Assert
+    assert response.status_code == 400
+
+
+
+@pytest.mark.parametrize("callback_url", [
+    "http://127.0.0.1/hook",
+    "http://169.254.169.254/latest/meta-data/",
+])
+def test_uploadReceipt_asyncModeInternalCallback_returnsBadRequest(mock_ocr_service, callback_url):
+    """Prueba que una callback_url a una dirección interna (SSRF) se rechaza sin encolar nada."""
+    # Arrange
+    from app.core.lifecycle import getServiceContainer
+    jobs = getServiceContainer(app).jobs
+    submitted_before = jobs.getStats()["submitted"]
+
+    # Act
+    response = client.post(
+        "/api/v1/receipts/upload",
+        params={"mode": "async", "callback_url": callback_url},
+        files={"file": ("test.jpg", JPEG_MAGIC + b"fake image content internal callback", "image/jpeg")}
+    )
+
+    # Assert
+    assert response.status_code == 400
+    assert "no pública" in response.json()["detail"]
+    assert jobs.getStats()["submitted"] == submitted_before
+
+def test_getJobStatus_unknownJob_returnsNotFound():
+    """Prueba que consultar un trabajo que no existe devuelve 404."""
+    response = client.get("/api/v1/receipts/jobs/no-existe")
+
+    assert response.status_code == 404
+
+
+def test_uploadReceipt_contentIsNotAnImage_returnsUnsupportedMediaType(mock_ocr_service):
+    """Prueba que se mira el contenido y no el Content-Type: un PDF declarado como JPEG da 415."""
+    response = client.post(
+        "/api/v1/receipts/upload",
+        files={"file": ("ticket.jpg", b"%PDF-1.7 no es una foto", "image/jpeg")}
+    )
+
+    assert response.status_code == 415
+    mock_ocr_service.extractTextFromImageAsync.assert_not_called()
+
+
+def test_uploadReceipt_tooLarge_returnsPayloadTooLarge(mock_ocr_service):
+    """Prueba que una subida mayor que UPLOAD_MAX_BYTES se rechaza con 413 sin llegar al OCR."""
+    # Arrange
+    from app.core.lifecycle import getServiceContainer
+    from app.services.upload_limits import UploadLimits
+    container = getServiceContainer(app)
+    original_limits = container.upload_limits
+    container.upload_limits = UploadLimits(max_bytes=1024 * 1024, multipart_overhead=1024)
+    try:
+        # Act
+        large = client.post(
+            "/api/v1/receipts/upload",
+            files={"file": ("grande.jpg", JPEG_MAGIC + bytes(2 * 1024 * 1024), "image/jpeg")}
+        )
+        stream = client.post(
+            "/api/v1/receipts/upload/stream",
+            files={"file": ("grande.jpg", JPEG_MAGIC + bytes(2 * 1024 * 1024), "image/jpeg")}
+        )
+        stats = container.upload_limits.getStats()
+    finally:
+        container.upload_limits = original_limits
+
+    # Assert
+    assert large.status_code == 413
+    assert stream.status_code == 413
+    assert "tamaño máximo" in large.json()["detail"]
+    assert stats["rejected_size"] == 2
+    mock_ocr_service.extractTextFromImageAsync.assert_not_called()
@@ -0,0 +1,164 @@
+import pytest
+import asyncio
+import io
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.main import app
+from app.api.endpoints.receipts import getOcrService, processed_receipts_db
+from app.services.parser_service import ParserService
+from app.services.receipt_pipeline import ReceiptPipeline
+
+client = TestClient(app)
+
+TICKET = {
+    "is_ticket": True,
+    "items": [
+        {"description": "Leche", "quantity": 2, "unit_price": 0.95},
+        {"description": "Pan", "quantity": 1, "unit_price": 1.10},
+        {"description": "Sin precio", "quantity": 1},
+        {"description": "Tomates", "quantity": 1.5, "unit_price": 2.20},
+    ],
+    "subtotal": 6.30,
+    "tax": 0.63,
+    "total": 6.93,
+}
+MODEL_OUTPUT = "```json\n" + json.dumps(TICKET, ensure_ascii=False, indent=2) + "\n```"
+
+
+def _chunk(text):
+    chunk = MagicMock()
+    chunk.parts = [MagicMock(text=text)]
+    return chunk
+
+
+def _imageBytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), color=color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def streaming_ocr_service():
+    """OCRService real con un modelo falso que responde en trozos de 20 caracteres si se pide streaming."""
+    from app.services.ocr_service import OCRService
+
+    def generateContent(contents, stream=False, **kwargs):
+        if stream:
+            return iter([_chunk(MODEL_OUTPUT[i:i + 20]) for i in range(0, len(MODEL_OUTPUT), 20)])
+        response = MagicMock()
+        response.parts = [MagicMock(text=MODEL_OUTPUT)]
+        return response
+
+    with patch("app.services.ocr_service.genai") as mock_genai:
+        mock_genai.GenerativeModel.return_value.generate_content.side_effect = generateContent
+        ocr_service = OCRService(api_key="test_api_key")
+    app.dependency_overrides[getOcrService] = lambda: ocr_service
+    yield ocr_service
+    app.dependency_overrides.pop(getOcrService, None)
+    ocr_service.close()
+
+
+def _parseSse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_uploadStream_emitsItemsThenReceiptMatchingNonStreamingResult(streaming_ocr_service):
+    """Prueba que el ticket final en streaming es idéntico al de /upload y que los ítems llegan antes."""
+    # Act
+    normal = client.post("/api/v1/receipts/upload", files={"file": ("a.png", _imageBytes("white"), "image/png")})
+    stream = client.post("/api/v1/receipts/upload/stream", files={"file": ("a.png", _imageBytes("gray"), "image/png")})
+    events = _parseSse(stream.text)
+
+    # Assert
+    assert stream.status_code == 200
+    assert stream.headers["content-type"].startswith("text/event-stream")
+    assert [event for event, _ in events] == ["item", "item", "item", "receipt"]
+    receipt = events[-1][1]
+    assert [data for _, data in events[:-1]] == receipt["items"]
+    assert [item["id"] for item in receipt["items"]] == [1, 2, 3]
+
+    esperado = normal.json()
+    for campo in ("receipt_id", "upload_timestamp", "duplicate_of"):
+        esperado.pop(campo)
+        receipt.pop(campo)
+    assert receipt == esperado
+
+
+def test_uploadStream_storesSameResponseAsReturned(streaming_ocr_service):
+    """Prueba que el ReceiptParseResponse guardado es el mismo que se envía al cliente."""
+    # Act
+    stream = client.post("/api/v1/receipts/upload/stream", files={"file": ("b.png", _imageBytes("blue"), "image/png")})
+    receipt = _parseSse(stream.text)[-1][1]
+
+    # Assert
+    guardado = processed_receipts_db[receipt["receipt_id"]]
+    assert guardado.model_dump(mode="json") == receipt
+    assert client.get(f"/api/v1/receipts/{receipt['receipt_id']}").json() == receipt
+
+
+def test_uploadStream_modelError_emitsErrorEvent():
+    """Prueba que un fallo del OCR durante el stream se notifica con un evento de error."""
+    # Arrange
+    ocr_service = MagicMock()
+    ocr_service.extractTextFromImageAsync.side_effect = RuntimeError("Fallo simulado del modelo")
+    app.dependency_overrides[getOcrService] = lambda: ocr_service
+    try:
+        # Act
+        stream = client.post("/api/v1/receipts/upload/stream", files={"file": ("c.jpg", b"\xff\xd8\xff fake stream fail", "image/jpeg")})
+    finally:
+        app.dependency_overrides.pop(getOcrService, None)
+
+    # Assert
+    assert stream.status_code == 200
+    assert _parseSse(stream.text) == [
+        ("error", {"status_code": 500, "detail": "Error procesando la imagen: Fallo simulado del modelo"})
+    ]
+
+
+def test_uploadStream_notImage_returnsBadRequest():
+    """Prueba que los errores de validación se devuelven antes de abrir el stream."""
+    response = client.post("/api/v1/receipts/upload/stream", files={"file": ("a.txt", b"hola", "text/plain")})
+
+    assert response.status_code == 400
+
+
+def test_streamAndParse_yieldsItemBeforeModelFinishes(streaming_ocr_service):
+    """Prueba que el primer ítem se entrega mientras el modelo sigue generando la respuesta."""
+    # Arrange
+    primer_item_recibido = threading.Event()
+    esperas = []
+    first_item_end = MODEL_OUTPUT.index("}") + 1
+
+    def generateContent(contents, stream=False, **kwargs):
+        yield _chunk(MODEL_OUTPUT[:first_item_end])
+        esperas.append(primer_item_recibido.wait(timeout=2))
+        yield _chunk(MODEL_OUTPUT[first_item_end:])
+
+    streaming_ocr_service.model.generate_content.side_effect = generateContent
+    pipeline = ReceiptPipeline()
+
+    async def consume():
+        events = []
+        async for event, payload in pipeline.streamAndParse(_imageBytes("red"), streaming_ocr_service, ParserService()):
+            if event == "item":
+                primer_item_recibido.set()
+            events.append((event, payload))
+        return events
+
+    # Act
+    events = asyncio.run(consume())
+
+    # Assert
+    assert esperas == [True]
+    assert events[0][1].name == "Leche"
+    assert events[-1][0] == "result"
+    assert events[-1][1]["total"] == 6.93
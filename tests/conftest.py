@@ -14,6 +14,8 @@ sys.path.insert(0, project_root)
 
 # Configuración de variables de entorno para testing
 os.environ["TESTING"] = "true"
+# La cola de trabajos asíncronos en memoria: sin fichero y sin trabajos de otras ejecuciones.
+os.environ.setdefault("JOBS_DB_PATH", ":memory:")
 
 # Importar la app principal de FastAPI
 # Asegúrate de que la estructura de tu proyecto permita esta importación.
@@ -21,6 +23,22 @@ os.environ["TESTING"] = "true"
 # o la forma en que se importa la app. Por ahora, asumimos que funciona.
 from app.main import app 
 
+
+class FakeClock:
+    """Reloj manual para los servicios con `clock` inyectable: `sleep` avanza el tiempo sin esperar."""
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
 # Fixture para el cliente de prueba de FastAPI
 @pytest.fixture(scope="module")
 def client() -> Generator[TestClient, None, None]:
@@ -32,6 +50,17 @@ def client() -> Generator[TestClient, None, None]:
     with TestClient(app) as test_client:
         yield test_client
 
+@pytest.fixture(autouse=True)
+def resetReceiptPipelineCache():
+    """
+    Vacía la caché de OCR y el índice de duplicados compartidos antes de cada test.
+    Muchos tests suben los mismos bytes con distintos mocks del OCR; sin esto, un test
+    recibiría el resultado cacheado por el anterior en lugar del de su propio mock.
+    """
+    from app.core.lifecycle import getServiceContainer
+    getServiceContainer(app).pipeline.reset()
+    yield
+
 # Fixture para los servicios (opcional, pero útil si quieres mockearlos)
 # Ejemplo de cómo podrías mockear el OCRService si fuera necesario.
 # from app.services.ocr_service import OCRService
@@ -43,7 +72,8 @@ def client() -> Generator[TestClient, None, None]:
 # mock.extractTextFromImage.return_value = "Texto de prueba del OCR mockeado"
 # return mock
 #
-# Si necesitas sobreescribir dependencias en tus tests, puedes hacerlo así:
+# Los servicios son compartidos (se crean en el lifespan de la app), así que para
+# sustituirlos en los tests se sobreescriben sus dependencias:
 # from app.api.endpoints.receipts import getOcrService
 # app.dependency_overrides[getOcrService] = lambda: mockOcrService
 
@@ -0,0 +1,68 @@
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.api.endpoints.receipts import getOcrService, getParserService, getCalculationService, getReceiptPipeline
+from app.core.config import Settings
+from app.core.lifecycle import ServiceContainer
+
+
+class TestServiceLifecycle:
+    """Pruebas del ciclo de vida de los servicios compartidos."""
+
+    def test_lifespan_buildsServicesOnceWarmsUpAndCloses(self):
+        """Prueba que los servicios se crean una vez al arrancar, se calientan y se cierran al apagar."""
+        # Arrange
+        with patch("app.core.lifecycle.OCRService") as mock_ocr_class:
+            ocr_instance = mock_ocr_class.return_value
+
+            # Act
+            with TestClient(app) as test_client:
+                test_client.get("/health")
+                test_client.get("/health")
+                fake_request = SimpleNamespace(app=app)
+                primero = getOcrService(fake_request, engine=None)
+                segundo = getOcrService(fake_request, engine=None)
+
+            # Assert
+            assert mock_ocr_class.call_count == 1
+            assert primero is segundo
+            assert primero.engine.engine is ocr_instance  # Tiled(Resilient(OCRService))
+            ocr_instance.warmUp.assert_called_once()
+            ocr_instance.close.assert_called_once()
+
+    def test_dependencies_returnSharedInstances(self):
+        """Prueba que todas las dependencias devuelven la misma instancia en cada llamada."""
+        fake_request = SimpleNamespace(app=app)
+
+        for dependency in (getParserService, getCalculationService, getReceiptPipeline):
+            assert dependency(fake_request) is dependency(fake_request)
+
+    def test_build_withoutApiKey_keepsErrorInsteadOfFailing(self):
+        """Prueba que la app puede arrancar sin API key y guarda el motivo."""
+        with patch("os.getenv", return_value=None):
+            container = ServiceContainer.build(Settings(jobs_db_path=":memory:"))
+
+        assert container.ocr_service is None
+        assert "API key de Gemini no encontrada" in container.ocr_error
+        container.close()
+
+    def test_uploadReceipt_ocrUnavailable_returnsServiceUnavailable(self):
+        """Prueba que /upload responde 503 si el servicio OCR no está disponible."""
+        # Arrange
+        app.dependency_overrides[getOcrService] = lambda: None
+        try:
+            # Act
+            response = TestClient(app).post(
+                "/api/v1/receipts/upload",
+                files={"file": ("test.jpg", b"\xff\xd8\xff fake image content", "image/jpeg")}
+            )
+        finally:
+            app.dependency_overrides.pop(getOcrService, None)
+
+        # Assert
+        assert response.status_code == 503
+        assert "Servicio OCR no disponible" in response.json()["detail"]
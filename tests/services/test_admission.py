@@ -0,0 +1,85 @@
+import pytest
+import asyncio
+
+from app.services.admission import AdmissionController, AdmissionRejectedError
+from tests.conftest import FakeClock
+
+
+class TestAdmissionController:
+    """Pruebas del control de admisión de la cola OCR."""
+
+    def test_withinConcurrency_admitsImmediately(self):
+        control = AdmissionController(max_concurrency=2, max_queue_depth=0)
+
+        async def escenario():
+            return await control.acquire(), await control.acquire()
+
+        asyncio.run(escenario())
+
+        stats = control.getStats()
+        assert (stats["running"], stats["admitted"], stats["queued"]) == (2, 2, 0)
+
+    def test_fullQueue_rejectsWithRetryAfterFromServiceTime(self):
+        reloj = FakeClock()
+        control = AdmissionController(max_concurrency=2, max_queue_depth=1, clock=reloj)
+
+        async def escenario():
+            # Dos peticiones que tardan 4 s dan la duración de referencia.
+            for _ in range(2):
+                ticket = await control.acquire()
+                reloj.now += 4
+                ticket.release()
+            await control.acquire()
+            await control.acquire()
+            esperando = asyncio.ensure_future(control.acquire())
+            await asyncio.sleep(0)
+            with pytest.raises(AdmissionRejectedError) as excinfo:
+                await control.acquire()
+            esperando.cancel()
+            return excinfo.value
+
+        error = asyncio.run(escenario())
+
+        # Una en cola + la nueva, a 4 s cada una, entre 2 huecos.
+        assert error.retry_after == pytest.approx(4.0)
+        assert control.getStats()["rejected"] == 1
+
+    def test_releasedSlot_goesToOldestWaiter(self):
+        control = AdmissionController(max_concurrency=1, max_queue_depth=5)
+        orden = []
+
+        async def peticion(nombre, duracion):
+            async with control.slot():
+                orden.append(nombre)
+                await asyncio.sleep(duracion)
+
+        async def escenario():
+            primera = asyncio.ensure_future(peticion("a", 0.01))
+            await asyncio.sleep(0)
+            resto = [asyncio.ensure_future(peticion(nombre, 0)) for nombre in "bcd"]
+            await asyncio.gather(primera, *resto)
+
+        asyncio.run(escenario())
+
+        assert orden == ["a", "b", "c", "d"]
+        stats = control.getStats()
+        assert (stats["running"], stats["queue_depth"]) == (0, 0)
+        assert stats["queued"] == 3
+        assert stats["max_queue_depth_seen"] == 3
+
+    def test_cancelledWaiter_leavesQueue(self):
+        control = AdmissionController(max_concurrency=1, max_queue_depth=1)
+
+        async def escenario():
+            ticket = await control.acquire()
+            esperando = asyncio.ensure_future(control.acquire())
+            await asyncio.sleep(0)
+            esperando.cancel()
+            await asyncio.gather(esperando, return_exceptions=True)
+            ticket.release()
+            ticket.release()  # idempotente
+
+        asyncio.run(escenario())
+
+        stats = control.getStats()
+        assert (stats["running"], stats["queue_depth"]) == (0, 0)
@@ -0,0 +1,157 @@
+import pytest
+from unittest.mock import MagicMock, patch
+
+from google.api_core import exceptions as google_exceptions
+
+from app.services.api_key_pool import ApiKeyPool, KeyPoolExhaustedError, isQuotaError
+from tests.conftest import FakeClock
+
+
+def _errorCuota():
+    error = RuntimeError("Error al procesar imagen con Gemini")
+    error.__cause__ = google_exceptions.ResourceExhausted("cuota agotada")
+    return error
+
+
+class TestApiKeyPool:
+    """Pruebas del reparto de llamadas entre claves."""
+
+    def _pool(self, claves=("clave-aaaa", "clave-bbbb"), **kwargs):
+        self.reloj = FakeClock()
+        kwargs.setdefault("requests_per_minute", 60)
+        kwargs.setdefault("burst", 2)
+        return ApiKeyPool(claves, clock=self.reloj, sleep=self.reloj.sleep, **kwargs)
+
+    def test_callsAreSpreadAcrossKeys(self):
+        pool = self._pool()
+
+        asignadas = [pool.acquire().key_id for _ in range(4)]
+
+        assert sorted(asignadas) == ["key-1...aaaa"] * 2 + ["key-2...bbbb"] * 2
+        assert all(clave["utilisation"] == 1.0 for clave in pool.getStats()["keys"].values())
+
+    def test_keyWithMostHeadroomIsChosen(self):
+        pool = self._pool()
+        pool.acquire()  # key-1 gasta una ficha
+
+        assert pool.acquire().key_id == "key-2...bbbb"
+
+    def test_noBudget_waitsForRefill(self):
+        pool = self._pool(claves=("clave-aaaa",), burst=1)
+        pool.acquire()
+
+        pool.acquire()
+
+        assert self.reloj.sleeps == [pytest.approx(1.0)]
+        assert pool.getStats()["waits"] == 1
+
+    def test_noBudgetWithinMaxWait_raisesWithRetryAfter(self):
+        pool = self._pool(claves=("clave-aaaa",), burst=1, requests_per_minute=6, max_wait=2)
+        pool.acquire()
+
+        with pytest.raises(KeyPoolExhaustedError) as excinfo:
+            pool.acquire()
+        assert excinfo.value.retry_after == pytest.approx(10.0)
+        assert pool.getStats()["exhausted"] == 1
+
+    def test_requestDeadline_capsWait(self):
+        """Prueba que no se espera cupo más allá del plazo de la petición."""
+        from app.services.deadlines import deadlineScope
+        pool = self._pool(claves=("clave-aaaa",), burst=1, max_wait=30)
+        pool.acquire()
+
+        with deadlineScope(0.5):
+            with pytest.raises(KeyPoolExhaustedError):
+                pool.acquire()
+        assert self.reloj.sleeps == []
+
+    def test_quotaError_setsKeyAsideWithGrowingBackoff(self):
+        pool = self._pool(cooldown_base=10, cooldown_max=15)
+
+        pool.release(pool.acquire(), error=_errorCuota())
+        assert all(pool.acquire().key_id == "key-2...bbbb" for _ in range(2))
+
+        stats = pool.getStats()["keys"]["key-1...aaaa"]
+        assert stats["throttled"] == 1
+        assert stats["cooling_down_seconds"] == 10
+
+        self.reloj.now += 10
+        lease = pool.acquire()
+        pool.release(lease, error=_errorCuota())
+        assert pool.getStats()["keys"][lease.key_id]["cooling_down_seconds"] == 15
+
+    def test_otherErrors_doNotSetKeyAside(self):
+        pool = self._pool()
+
+        pool.release(pool.acquire(), error=RuntimeError("conexión caída"))
+
+        stats = pool.getStats()["keys"]["key-1...aaaa"]
+        assert (stats["errors"], stats["throttled"], stats["cooling_down_seconds"]) == (1, 0, 0)
+
+    def test_isQuotaError_followsCauses(self):
+        assert isQuotaError(_errorCuota())
+        assert isQuotaError(google_exceptions.TooManyRequests("429"))
+        assert not isQuotaError(RuntimeError("otro"))
+
+    def test_noKeys_raises(self):
+        with pytest.raises(ValueError):
+            ApiKeyPool(["", " "])
+
+
+@patch('app.services.ocr_service.glm')
+@patch('app.services.ocr_service.genai')
+class TestOcrServiceKeyPool:
+    """Pruebas del servicio OCR con un pool de claves."""
+
+    def _service(self, mock_genai_module, mock_glm_module, pool):
+        from app.services.ocr_service import OCRService
+        mock_genai_module.GenerativeModel.side_effect = lambda nombre: MagicMock(name=nombre)
+        return OCRService(key_pool=pool)
+
+    def test_eachKeyHasItsOwnClient_withoutGlobalConfiguration(self, mock_genai_module, mock_glm_module):
+        pool = ApiKeyPool(["clave-aaaa", "clave-bbbb"], burst=1)
+
+        service = self._service(mock_genai_module, mock_glm_module, pool)
+
+        mock_genai_module.configure.assert_not_called()
+        opciones = [llamada.kwargs["client_options"] for llamada in mock_glm_module.GenerativeServiceClient.call_args_list]
+        assert opciones == [{"api_key": "clave-aaaa"}, {"api_key": "clave-bbbb"}]
+        assert len(set(id(modelo) for modelo in service._models.values())) == 2
+
+    def test_callsUseTheLeasedKeyAndReportQuotaErrors(self, mock_genai_module, mock_glm_module):
+        pool = ApiKeyPool(["clave-aaaa", "clave-bbbb"], burst=1, max_wait=0)
+        service = self._service(mock_genai_module, mock_glm_module, pool)
+        primero, segundo = service._models.values()
+        primero.generate_content.side_effect = google_exceptions.ResourceExhausted("cuota agotada")
+        segundo.generate_content.return_value = "respuesta"
+
+        with pytest.raises(google_exceptions.ResourceExhausted):
+            service._generateContent(["prompt"])
+        assert service._generateContent(["prompt"]) == "respuesta"
+
+        claves = service.getStats()["api_keys"]["keys"]
+        assert claves["key-1...aaaa"]["throttled"] == 1
+        assert claves["key-2...bbbb"]["calls"] == 1
+
+
+def test_modelForKey_sdkUsesInjectedClient():
+    """
+    Prueba, con el SDK real, que el modelo llama al cliente de su clave y no al de la
+    configuración global: falla si el SDK deja de usar el atributo que se le asigna.
+    """
+    from app.services.ocr_service import OCRService
+    cliente = MagicMock()
+    cliente.generate_content.return_value = MagicMock(candidates=[])
+
+    with patch('app.services.ocr_service.glm.GenerativeServiceClient', return_value=cliente) as constructor, \
+            patch('google.generativeai.client.get_default_generative_client') as cliente_global:
+        service = OCRService(key_pool=ApiKeyPool(["clave-aaaa"]))
+        modelo = service._models["key-1...aaaa"]
+        try:
+            modelo.generate_content("hola")
+        except Exception:
+            pass  # La respuesta falsa no se puede convertir; solo importa a quién se llamó
+
+    constructor.assert_called_once_with(client_options={"api_key": "clave-aaaa"})
+    cliente.generate_content.assert_called_once()
+    cliente_global.assert_not_called()
@@ -0,0 +1,103 @@
+import pytest
+import json
+import socket
+import threading
+import urllib.error
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from app.services.callback_policy import CallbackPolicy
+
+
+def _resolver(tabla):
+    """Resolución de nombres falsa: host -> lista de direcciones."""
+    def resolve(host, port, type=0):
+        if host not in tabla:
+            raise socket.gaierror(f"host desconocido: {host}")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (direccion, port)) for direccion in tabla[host]]
+    return resolve
+
+
+class TestCallbackPolicy:
+    """Pruebas de las comprobaciones de las URLs de callback (SSRF)."""
+
+    @pytest.mark.parametrize("url", [
+        "http://127.0.0.1/hook",
+        "http://169.254.169.254/latest/meta-data/",
+        "http://10.0.0.5/hook",
+        "http://192.168.1.1:8080/hook",
+        "http://[::1]/hook",
+        "http://[::ffff:127.0.0.1]/hook",
+        "http://0.0.0.0/hook",
+        "http://100.64.0.1/hook",
+        "http://224.0.0.1/hook",
+    ])
+    def test_check_internalAddress_isRejected(self, url):
+        with pytest.raises(ValueError, match="no pública"):
+            CallbackPolicy().check(url)
+
+    def test_check_nameResolvingToPrivateAddress_isRejected(self):
+        politica = CallbackPolicy(resolve=_resolver({"hook.example.com": ["93.184.216.34", "10.0.0.1"]}))
+
+        with pytest.raises(ValueError, match="10.0.0.1"):
+            politica.check("https://hook.example.com/resultado")
+
+    @pytest.mark.parametrize("url", ["file:///etc/passwd", "ftp://example.com/x", "/relativa", "http://"])
+    def test_check_notHttpUrl_isRejected(self, url):
+        with pytest.raises(ValueError, match="http"):
+            CallbackPolicy().check(url)
+
+    def test_check_allowlist(self):
+        politica = CallbackPolicy(
+            allowed_hosts=["hooks.example.com", "*.partner.io"],
+            resolve=_resolver({h: ["93.184.216.34"] for h in ("hooks.example.com", "a.partner.io", "partner.io", "evil.io")}),
+        )
+
+        politica.check("https://hooks.example.com/x")
+        politica.check("https://a.partner.io/x")
+        politica.check("https://partner.io/x")
+        with pytest.raises(ValueError, match="permitidos"):
+            politica.check("https://evil.io/x")
+
+    def test_post_hostNowResolvesToPrivateAddress_isNotSent(self):
+        """Prueba que la dirección se comprueba otra vez al enviar (DNS que cambia tras la subida)."""
+        tabla = {"hook.example.com": ["93.184.216.34"]}
+        politica = CallbackPolicy(resolve=_resolver(tabla))
+        politica.check("http://hook.example.com/x")
+        tabla["hook.example.com"] = ["169.254.169.254"]
+
+        with pytest.raises(ValueError, match="no pública"):
+            politica.post("http://hook.example.com/x", {"status": "done"}, timeout=1)
+
+
+class _LocalPolicy(CallbackPolicy):
+    """Política que deja conectar a localhost, para probar el envío con un servidor real."""
+
+    def publicAddress(self, host, port):
+        return "127.0.0.1"
+
+
+def test_post_doesNotFollowRedirects():
+    recibidas = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            recibidas.append((self.path, json.loads(self.rfile.read(int(self.headers["Content-Length"])))))
+            self.send_response(302)
+            self.send_header("Location", "http://169.254.169.254/latest/meta-data/")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    servidor = HTTPServer(("127.0.0.1", 0), Handler)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    try:
+        with pytest.raises(urllib.error.HTTPError) as exc_info:
+            _LocalPolicy().post(f"http://hook.local:{servidor.server_port}/resultado", {"status": "done"}, timeout=5)
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+    assert exc_info.value.code == 302
+    assert recibidas == [("/resultado", {"status": "done"})]
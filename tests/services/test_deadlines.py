@@ -0,0 +1,143 @@
+import pytest
+import asyncio
+import random
+import time
+
+from app.services.deadlines import (
+    DeadlineExceededError,
+    DeadlinePolicy,
+    boundedTimeout,
+    deadlineScope,
+    remainingTime,
+)
+from app.services.ocr_engine import OCREngine
+from app.services.resilience import ResilientOCREngine
+
+
+class SlowEngine(OCREngine):
+    """Motor OCR falso que tarda `delay` segundos y anota el plazo que ve su hilo."""
+    name = "gemini"
+    output_format = "json"
+
+    def __init__(self, delay=0.0, error=None):
+        super().__init__(max_concurrency=2)
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.remaining_seen = None
+
+    def extractTextFromImage(self, image_bytes, language='spa'):
+        self.calls += 1
+        self.remaining_seen = remainingTime()
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return '{"is_ticket": true, "items": []}'
+
+
+class TestDeadlinePolicy:
+    """Pruebas del plazo por petición a partir de la cabecera del cliente."""
+
+    def test_noHeader_usesDefault(self):
+        policy = DeadlinePolicy(default_seconds=30, max_seconds=60)
+
+        assert policy.timeoutFor(None) == 30
+        assert policy.timeoutFor("  ") == 30
+
+    def test_clientHeader_isCappedAtMaximum(self):
+        policy = DeadlinePolicy(default_seconds=30, max_seconds=60)
+
+        assert policy.timeoutFor("5.5") == 5.5
+        assert policy.timeoutFor("600") == 60
+        assert policy.getStats()["client_deadlines"] == 2
+
+    @pytest.mark.parametrize("valor", ["abc", "0", "-3", "nan", "inf"])
+    def test_invalidHeader_raisesValueError(self, valor):
+        policy = DeadlinePolicy()
+
+        with pytest.raises(ValueError):
+            policy.timeoutFor(valor)
+
+    def test_zeroDefault_meansNoDeadline(self):
+        assert DeadlinePolicy(default_seconds=0).timeoutFor(None) is None
+
+
+class TestDeadlineScope:
+    """Pruebas del plazo en el contexto de la petición."""
+
+    def test_boundedTimeout_takesShorterOfTimeoutAndDeadline(self):
+        assert boundedTimeout(10) == 10
+        with deadlineScope(1):
+            assert boundedTimeout(10) <= 1
+            assert boundedTimeout(0.5) == 0.5
+        assert remainingTime() is None
+
+    def test_nestedScope_keepsShorterDeadline(self):
+        with deadlineScope(1):
+            with deadlineScope(100):
+                assert remainingTime() <= 1
+
+    def test_expiredDeadline_raises(self):
+        with deadlineScope(0.01):
+            time.sleep(0.02)
+            with pytest.raises(DeadlineExceededError):
+                boundedTimeout(10)
+
+    def test_deadline_reachesExecutorThread(self):
+        """Prueba que el plazo llega al hilo donde se hace la llamada (bloqueante) al modelo."""
+        engine = SlowEngine()
+
+        async def escenario():
+            with deadlineScope(5):
+                await engine.extractAsync(b"img")
+
+        try:
+            asyncio.run(escenario())
+        finally:
+            engine.close()
+
+        assert engine.remaining_seen is not None
+        assert 0 < engine.remaining_seen <= 5
+
+
+class TestResilienceWithDeadline:
+    """Pruebas de que los reintentos respetan el plazo de la petición."""
+
+    def test_slowAttempt_failsAtDeadlineWithoutRetrying(self):
+        engine = SlowEngine(delay=0.3)
+        resilient = ResilientOCREngine(engine, max_attempts=3, backoff_base=0.001, rng=random.Random(0))
+
+        async def escenario():
+            with deadlineScope(0.05):
+                await resilient.extractAsync(b"img")
+
+        inicio = time.perf_counter()
+        try:
+            with pytest.raises(DeadlineExceededError):
+                asyncio.run(escenario())
+        finally:
+            engine.close()
+
+        assert time.perf_counter() - inicio < 0.5
+        assert engine.calls == 1
+        assert resilient.getStats()["deadline_exceeded"] == 1
+
+    def test_noTimeLeftForBackoff_stopsRetrying(self):
+        engine = SlowEngine(error=RuntimeError("Error al procesar imagen con Gemini: 503"))
+        resilient = ResilientOCREngine(
+            engine, max_attempts=3, backoff_base=10, backoff_max=10, rng=random.Random(1)
+        )
+
+        async def escenario():
+            with deadlineScope(0.05):
+                await resilient.extractAsync(b"img")
+
+        inicio = time.perf_counter()
+        try:
+            with pytest.raises(RuntimeError, match="503"):
+                asyncio.run(escenario())
+        finally:
+            engine.close()
+
+        assert time.perf_counter() - inicio < 0.5
+        assert engine.calls == 1
@@ -0,0 +1,167 @@
+import pytest
+import asyncio
+import io
+import json
+import random
+from unittest.mock import MagicMock, AsyncMock
+
+from PIL import Image, ImageDraw
+
+from app.services.duplicate_detector import (
+    computeDHashFromBytes, hammingDistance, MultiIndexHashIndex, DuplicateDetector
+)
+from app.services.ocr_cache import OcrResultCache
+from app.services.parser_service import ParserService
+from app.services.receipt_pipeline import ReceiptPipeline
+
+
+def _receiptImage(seed: int) -> Image.Image:
+    rng = random.Random(seed)
+    image = Image.new("RGB", (300, 700), color="white")
+    draw = ImageDraw.Draw(image)
+    # Bloques negros a modo de "palabras" en posiciones aleatorias de cada línea
+    for line in range(25):
+        x = 10
+        while x < 280:
+            width = rng.randint(15, 60)
+            if rng.random() < 0.7:
+                draw.rectangle([x, 20 + line * 26, min(x + width, 290), 32 + line * 26], fill="black")
+            x += width + rng.randint(5, 20)
+    return image
+
+
+def _encode(image: Image.Image, fmt: str = "JPEG", **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+class TestPerceptualHash:
+    """Pruebas del hash perceptual (dHash)."""
+
+    def test_computeDHash_reencodedImage_isNearlyIdentical(self):
+        """Prueba que la misma imagen re-encodada y reescalada da un hash casi igual."""
+        # Arrange
+        original = _receiptImage(seed=1)
+        png_bytes = _encode(original, "PNG")
+        jpeg_bytes = _encode(original.resize((240, 560)), "JPEG", quality=60)
+
+        # Act
+        distancia = hammingDistance(computeDHashFromBytes(png_bytes), computeDHashFromBytes(jpeg_bytes))
+
+        # Assert
+        assert distancia <= 10
+
+    def test_computeDHash_differentReceipts_areFarApart(self):
+        """Prueba que dos tickets distintos no se confunden."""
+        hash_a = computeDHashFromBytes(_encode(_receiptImage(seed=1)))
+        hash_b = computeDHashFromBytes(_encode(_receiptImage(seed=2)))
+
+        assert hammingDistance(hash_a, hash_b) > 30
+
+    def test_computeDHash_invalidBytes_raisesValueError(self):
+        """Prueba que unos bytes que no son imagen lanzan ValueError."""
+        with pytest.raises(ValueError):
+            computeDHashFromBytes(b"not an image")
+
+
+class TestMultiIndexHashIndex:
+    """Pruebas del índice multi-index hashing."""
+
+    def test_findNearest_matchesBruteForce(self):
+        """Prueba que el índice encuentra lo mismo que una búsqueda lineal."""
+        # Arrange
+        rng = random.Random(42)
+        index = MultiIndexHashIndex(hash_bits=64, max_distance=6)
+        hashes = [rng.getrandbits(64) for _ in range(2000)]
+        for position, value in enumerate(hashes):
+            index.add(value, position)
+
+        for _ in range(50):
+            base = rng.choice(hashes)
+            query = base
+            for bit in rng.sample(range(64), rng.randint(0, 8)):
+                query ^= 1 << bit
+
+            # Act
+            found = index.findNearest(query)
+
+            # Assert
+            best = min(hammingDistance(query, value) for value in hashes)
+            if best <= 6:
+                assert found is not None and found[0] == best
+            else:
+                assert found is None
+
+    def test_add_overCapacity_evictsOldest(self):
+        """Prueba que el índice olvida los hashes más antiguos al llenarse."""
+        index = MultiIndexHashIndex(hash_bits=64, max_distance=2, max_entries=2)
+        index.add(0b0001, "a")
+        index.add(1 << 40, "b")
+        index.add(1 << 63, "c")
+
+        assert len(index) == 2
+        assert index.findNearest(0b0001, 0) is None
+        assert index.findNearest(1 << 63, 0) == (0, "c")
+
+
+class TestDuplicateDetectionPipeline:
+    """Pruebas de la detección de duplicados dentro del pipeline."""
+
+    RAW_TEXT = json.dumps({"is_ticket": True, "items": [{"description": "Pan", "quantity": 1, "unit_price": 1.2}]})
+
+    def _ocrService(self):
+        ocr_service = MagicMock()
+        ocr_service.extractTextFromImageAsync = AsyncMock(return_value=self.RAW_TEXT)
+        return ocr_service
+
+    def test_reuseMode_reencodedUpload_skipsOcr(self):
+        """Prueba que en modo reuse una re-codificación de la misma foto no llama al modelo."""
+        # Arrange
+        pipeline = ReceiptPipeline(cache=OcrResultCache(), duplicate_detector=DuplicateDetector(mode="reuse"))
+        ocr_service = self._ocrService()
+        original = _receiptImage(seed=3)
+
+        # Act
+        asyncio.run(pipeline.extractAndParse(_encode(original, "PNG"), ocr_service, ParserService(), receipt_id="r1"))
+        segundo = asyncio.run(pipeline.extractAndParse(
+            _encode(original, "JPEG", quality=70), ocr_service, ParserService(), receipt_id="r2"
+        ))
+
+        # Assert
+        assert ocr_service.extractTextFromImageAsync.await_count == 1
+        assert segundo["from_cache"] is True
+        assert segundo["duplicate_of"] == "r1"
+        assert segundo["items"][0].name == "Pan"
+        assert pipeline.getStats()["duplicates"]["reused"] == 1
+
+    def test_flagMode_reencodedUpload_callsOcrAndFlags(self):
+        """Prueba que en modo flag se procesa la imagen pero se marca como duplicada."""
+        pipeline = ReceiptPipeline(cache=OcrResultCache(), duplicate_detector=DuplicateDetector(mode="flag"))
+        ocr_service = self._ocrService()
+        original = _receiptImage(seed=4)
+
+        asyncio.run(pipeline.extractAndParse(_encode(original, "PNG"), ocr_service, ParserService(), receipt_id="r1"))
+        segundo = asyncio.run(pipeline.extractAndParse(
+            _encode(original, "JPEG", quality=70), ocr_service, ParserService(), receipt_id="r2"
+        ))
+
+        assert ocr_service.extractTextFromImageAsync.await_count == 2
+        assert segundo["from_cache"] is False
+        assert segundo["duplicate_of"] == "r1"
+
+    def test_differentReceipt_isNotFlagged(self):
+        """Prueba que un ticket distinto no se marca como duplicado."""
+        pipeline = ReceiptPipeline(cache=OcrResultCache(), duplicate_detector=DuplicateDetector(mode="reuse"))
+        ocr_service = self._ocrService()
+
+        asyncio.run(pipeline.extractAndParse(_encode(_receiptImage(5)), ocr_service, ParserService(), receipt_id="r1"))
+        segundo = asyncio.run(pipeline.extractAndParse(_encode(_receiptImage(6)), ocr_service, ParserService(), receipt_id="r2"))
+
+        assert segundo["duplicate_of"] is None
+        assert ocr_service.extractTextFromImageAsync.await_count == 2
+
+    def test_invalidMode_raisesValueError(self):
+        """Prueba que un modo desconocido se rechaza."""
+        with pytest.raises(ValueError):
+            DuplicateDetector(mode="ignore")
@@ -0,0 +1,147 @@
+import pytest
+import io
+from unittest.mock import patch, MagicMock
+
+from PIL import Image
+
+from app.services.image_preprocessor import ImagePreprocessor, ImageTooLargeError
+
+
+def _encode(image: Image.Image, fmt: str = "JPEG", **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+class TestImagePreprocessor:
+    """Pruebas unitarias del preprocesado de imágenes previo al modelo."""
+
+    def test_decode_largeImage_capsLongestSide(self):
+        """Prueba que una foto grande se reduce al lado máximo manteniendo la proporción."""
+        # Arrange
+        preprocessor = ImagePreprocessor(max_side=1000)
+        image_bytes = _encode(Image.new("RGB", (3000, 4000), color="white"))
+
+        # Act
+        resultado = preprocessor.decode(image_bytes)
+
+        # Assert
+        assert max(resultado.size) == 1000
+        assert resultado.size == (750, 1000)
+        assert resultado.mode == "RGB"
+
+    def test_decode_smallImage_keepsSize(self):
+        """Prueba que una imagen ya pequeña no se amplía."""
+        preprocessor = ImagePreprocessor(max_side=1000)
+
+        resultado = preprocessor.decode(_encode(Image.new("RGB", (200, 300), color="white"), "PNG"))
+
+        assert resultado.size == (200, 300)
+
+    def test_prepare_exifOrientation_isAppliedAndStripped(self):
+        """Prueba que la orientación EXIF se aplica y los metadatos no se reenvían."""
+        # Arrange
+        preprocessor = ImagePreprocessor(max_side=0)
+        image = Image.new("RGB", (400, 200), color="white")
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotar 90º en sentido horario
+        image_bytes = _encode(image, "JPEG", exif=exif.tobytes())
+
+        # Act
+        resultado = preprocessor.prepare(image_bytes)
+
+        # Assert
+        enviado = Image.open(io.BytesIO(resultado.data))
+        assert enviado.size == (200, 400)
+        assert (resultado.width, resultado.height) == (200, 400)
+        assert 0x0112 not in enviado.getexif()
+
+    def test_prepare_colorlessReceipt_isSentInGrayscale(self):
+        """Prueba que una imagen sin color se envía en escala de grises."""
+        preprocessor = ImagePreprocessor()
+
+        resultado = preprocessor.prepare(_encode(Image.new("RGB", (300, 600), color=(240, 240, 235))))
+
+        assert resultado.grayscale is True
+        assert Image.open(io.BytesIO(resultado.data)).mode == "L"
+
+    def test_prepare_colorfulImage_keepsColor(self):
+        """Prueba que una imagen con color relevante no se convierte a grises."""
+        preprocessor = ImagePreprocessor()
+
+        resultado = preprocessor.prepare(_encode(Image.new("RGB", (300, 300), color=(200, 30, 30))))
+
+        assert resultado.grayscale is False
+        assert Image.open(io.BytesIO(resultado.data)).mode == "RGB"
+
+    def test_prepare_webpFormat_setsMimeType(self):
+        """Prueba que el formato de salida WebP se refleja en el blob enviado."""
+        preprocessor = ImagePreprocessor(output_format="webp")
+
+        resultado = preprocessor.prepare(_encode(Image.new("RGB", (100, 100), color="white")))
+
+        assert resultado.asBlob()["mime_type"] == "image/webp"
+        assert Image.open(io.BytesIO(resultado.data)).format == "WEBP"
+
+    def test_prepare_reportsSizesAndStats(self):
+        """Prueba que se informa del tamaño antes y después."""
+        preprocessor = ImagePreprocessor(max_side=400, quality=70)
+        image_bytes = _encode(Image.effect_noise((900, 1200), 40).convert("RGB"), "PNG")
+
+        resultado = preprocessor.prepare(image_bytes)
+        stats = preprocessor.getStats()
+
+        assert resultado.original_size_bytes == len(image_bytes)
+        assert resultado.encoded_size_bytes < resultado.original_size_bytes
+        assert stats["images"] == 1
+        assert stats["original_bytes"] == len(image_bytes)
+        assert stats["encoded_bytes"] == resultado.encoded_size_bytes
+        assert 0 < stats["reduction_ratio"] < 1
+
+    def test_decode_invalidBytes_raisesValueError(self):
+        """Prueba que unos bytes inválidos lanzan ValueError."""
+        with pytest.raises(ValueError) as exc_info:
+            ImagePreprocessor().decode(b"not an image")
+        assert "Los bytes de la imagen no son válidos" in str(exc_info.value)
+
+    def test_decode_jpegOverMaxPixels_isDecodedReduced(self):
+        """Prueba que un JPEG con más píxeles de los permitidos se decodifica ya reducido (modo draft)."""
+        preprocessor = ImagePreprocessor(max_side=0, max_pixels=10_000_000)
+        image_bytes = _encode(Image.new("RGB", (8000, 6000), color="white"))
+
+        resultado = preprocessor.decode(image_bytes)
+
+        assert resultado.size == (2000, 1500)
+
+    def test_decode_pngOverMaxPixels_isRejectedWithoutDecoding(self):
+        """Prueba que una imagen enorme que no se puede reducir al decodificar se rechaza."""
+        preprocessor = ImagePreprocessor(max_pixels=10_000_000)
+        bomba = _encode(Image.new("1", (8000, 6000), color=1), "PNG")
+
+        with patch.object(Image.Image, "load", side_effect=AssertionError("no debe decodificarse")):
+            with pytest.raises(ImageTooLargeError):
+                preprocessor.decode(bomba)
+
+    def test_init_unsupportedFormat_raisesValueError(self):
+        """Prueba que un formato de salida desconocido se rechaza."""
+        with pytest.raises(ValueError):
+            ImagePreprocessor(output_format="BMP")
+
+
+@patch('app.services.ocr_service.genai')
+def test_ocrService_withPreprocessor_sendsCompressedBlob(mock_genai_module):
+    """Prueba que OCRService envía al modelo el blob comprimido en lugar del objeto PIL."""
+    from app.services.ocr_service import OCRService
+    # Arrange
+    mock_model_instance = MagicMock()
+    mock_genai_module.GenerativeModel.return_value = mock_model_instance
+    mock_model_instance.generate_content.return_value.parts = [MagicMock(text='{"is_ticket": true, "items": []}')]
+    ocr_service = OCRService(api_key="test_api_key", image_preprocessor=ImagePreprocessor(max_side=500))
+
+    # Act
+    ocr_service.extractTextFromImage(_encode(Image.new("RGB", (1500, 2000), color="white")))
+
+    # Assert
+    _, image_part = mock_model_instance.generate_content.call_args[0][0]
+    assert image_part["mime_type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(image_part["data"])).size == (375, 500)
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from app.services.incremental_json import IncrementalItemsParser
+
+
+TICKET = {
+    "is_ticket": True,
+    "note": "items",
+    "items": [
+        {"description": "Café \"solo\" {doble}", "quantity": 1, "unit_price": 2.50},
+        {"description": "Pan", "quantity": 2, "unit_price": 1.00, "extra": {"tags": [1, 2]}},
+        {"description": "Agua", "quantity": 1, "unit_price": 0.90},
+    ],
+    "subtotal": 7.40,
+    "meta": {"items": [{"no": "es un ítem"}]},
+    "total": 7.40,
+}
+
+
+def _feedInChunks(text, size):
+    parser = IncrementalItemsParser()
+    completed = []
+    for start in range(0, len(text), size):
+        completed.extend(parser.feed(text[start:start + size]))
+    return parser, completed
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 17, 10000])
+def test_feed_anyChunkSize_returnsEachItemOnce(chunk_size):
+    """Prueba que los ítems se extraen igual sea cual sea el tamaño de los trozos."""
+    text = "```json\n" + json.dumps(TICKET, ensure_ascii=False, indent=2) + "\n```"
+
+    parser, completed = _feedInChunks(text, chunk_size)
+
+    assert completed == TICKET["items"]
+    assert parser.text == text
+
+
+def test_feed_itemIsReturnedAsSoonAsItCloses():
+    """Prueba que un ítem se devuelve en cuanto llega su llave de cierre, antes del resto del JSON."""
+    parser = IncrementalItemsParser()
+
+    primero = parser.feed('{"items": [{"description": "Café", "unit_price": 2.5}')
+    segundo = parser.feed(', {"description": "Pan"')
+    tercero = parser.feed(', "unit_price": 1}], "total": 3.5}')
+
+    assert primero == [{"description": "Café", "unit_price": 2.5}]
+    assert segundo == []
+    assert tercero == [{"description": "Pan", "unit_price": 1}]
+
+
+def test_feed_notTicketJson_returnsNoItems():
+    """Prueba que un JSON sin `items` (imagen que no es un ticket) no produce ítems."""
+    parser, completed = _feedInChunks(json.dumps({"is_ticket": False, "error_message": "items"}), 3)
+
+    assert completed == []
+
+
+def test_feed_invalidElement_isSkipped():
+    """Prueba que un elemento mal formado se descarta sin afectar a los siguientes."""
+    parser = IncrementalItemsParser()
+
+    completed = parser.feed('{"items": [{"description": bad}, {"description": "Pan", "unit_price": 1}]}')
+
+    assert completed == [{"description": "Pan", "unit_price": 1}]
@@ -0,0 +1,268 @@
+import pytest
+import asyncio
+import sqlite3
+
+from app.services.job_queue import DONE, FAILED, QUEUED, JobStore, JobWorkerPool
+from app.services.resilience import CircuitOpenError
+from tests.conftest import FakeClock
+
+
+def _runPool(pool, *uploads):
+    """Encola `uploads`, arranca los trabajadores y espera a que la cola se vacíe."""
+    async def escenario():
+        job_ids = [await pool.submit(image, filename) for image, filename in uploads]
+        for _ in range(500):
+            counts = pool.store.counts()
+            if counts["queued"] == counts["processing"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        await pool.stop()
+        return job_ids
+
+    return asyncio.run(escenario())
+
+
+class TestJobStore:
+    """Pruebas de la cola de trabajos persistida en SQLite."""
+
+    def test_claim_returnsOldestJobWithImage(self):
+        store = JobStore()
+        primero = store.enqueue(b"img-1", "a.jpg")
+        store.enqueue(b"img-2", "b.jpg")
+
+        job = store.claim(lease_seconds=60)
+
+        assert (job.job_id, job.image, job.attempts, job.status) == (primero, b"img-1", 1, "processing")
+        assert store.counts() == {"queued": 1, "processing": 1, "done": 0, "failed": 0}
+
+    def test_complete_isIdempotent(self):
+        store = JobStore()
+        job_id = store.enqueue(b"img")
+        store.claim(lease_seconds=60)
+
+        primera = store.complete(job_id, {"receipt_id": job_id, "total": 1.0})
+        segunda = store.complete(job_id, {"receipt_id": job_id, "total": 2.0})
+
+        job = store.get(job_id)
+        assert (primera, segunda) == (True, False)
+        assert (job.status, job.stage, job.result["total"]) == (DONE, "parsed", 1.0)
+        assert job.image is None
+
+    def test_expiredLease_redeliversJob(self):
+        reloj = FakeClock(1000.0)
+        store = JobStore(clock=reloj)
+        job_id = store.enqueue(b"img")
+        store.claim(lease_seconds=30)
+
+        assert store.claim(lease_seconds=30) is None
+        reloj.now += 31
+        job = store.claim(lease_seconds=30)
+
+        assert (job.job_id, job.attempts) == (job_id, 2)
+
+    def test_retry_waitsForDelay(self):
+        reloj = FakeClock(1000.0)
+        store = JobStore(clock=reloj)
+        job_id = store.enqueue(b"img")
+        store.claim(lease_seconds=30)
+
+        store.retry(job_id, "503", delay=5)
+
+        assert store.claim(lease_seconds=30) is None
+        reloj.now += 5
+        assert store.claim(lease_seconds=30).job_id == job_id
+
+    def test_jobs_surviveRestart(self, tmp_path):
+        """Prueba que un trabajo a medias al parar el proceso se retoma al arrancar de nuevo."""
+        path = str(tmp_path / "jobs.sqlite3")
+        reloj = FakeClock(1000.0)
+        store = JobStore(path, clock=reloj)
+        job_id = store.enqueue(b"img", "ticket.jpg")
+        store.claim(lease_seconds=300)
+        store.close()
+        reloj.now += 301
+
+        reiniciada = JobStore(path, clock=reloj)
+        recuperados = reiniciada.recover(max_attempts=3)
+        job = reiniciada.claim(lease_seconds=300)
+
+        assert recuperados == 1
+        assert (job.job_id, job.filename, job.image, job.attempts) == (job_id, "ticket.jpg", b"img", 2)
+
+    def test_recover_keepsJobsWithLiveLease(self, tmp_path):
+        """Prueba que al arrancar no se quita un trabajo a otro proceso que aún lo tiene (lease en vigor)."""
+        path = str(tmp_path / "jobs.sqlite3")
+        reloj = FakeClock(1000.0)
+        otro_proceso = JobStore(path, clock=reloj)
+        job_id = otro_proceso.enqueue(b"img")
+        otro_proceso.claim(lease_seconds=300)
+
+        nuevo = JobStore(path, clock=reloj)
+
+        assert nuevo.recover(max_attempts=3) == 0
+        assert nuevo.claim(lease_seconds=300) is None
+        assert nuevo.get(job_id).status == "processing"
+
+    def test_expiredLease_lastAttempt_failsInsteadOfRedelivering(self):
+        """Prueba que un trabajo que agota sus intentos por lease vencido (ej. tumba el proceso) se da por fallido."""
+        reloj = FakeClock(1000.0)
+        store = JobStore(clock=reloj)
+        job_id = store.enqueue(b"img")
+        for _ in range(2):
+            assert store.claim(lease_seconds=30, max_attempts=2).job_id == job_id
+            reloj.now += 31
+
+        assert store.claim(lease_seconds=30, max_attempts=2) is None
+        job = store.get(job_id)
+        assert (job.status, job.attempts) == (FAILED, 2)
+        assert "venció" in job.error
+
+    def test_recover_lastAttempt_failsJob(self):
+        reloj = FakeClock(1000.0)
+        store = JobStore(clock=reloj)
+        job_id = store.enqueue(b"img")
+        store.claim(lease_seconds=30)
+        reloj.now += 31
+
+        assert store.recover(max_attempts=1) == 0
+        assert store.get(job_id).status == FAILED
+
+    def test_defaultSettings_persistToFile(self, tmp_path, monkeypatch):
+        """Prueba que, sin configurar nada, la cola se guarda en un fichero (y crea su carpeta)."""
+        from app.core.config import Settings
+        monkeypatch.chdir(tmp_path)
+        path = Settings().jobs_db_path
+
+        store = JobStore(path)
+        store.enqueue(b"img")
+        store.close()
+
+        assert path != ":memory:"
+        assert (tmp_path / path).is_file()
+        assert JobStore(path).counts()["queued"] == 1
+
+    def test_purge_removesOldFinishedJobs(self):
+        reloj = FakeClock(1000.0)
+        store = JobStore(clock=reloj)
+        terminado = store.enqueue(b"img-1")
+        store.claim(lease_seconds=30)
+        store.complete(terminado, {})
+        pendiente = store.enqueue(b"img-2")
+        reloj.now += 100
+
+        assert store.purge(older_than_seconds=50) == 1
+        assert store.get(terminado) is None
+        assert store.get(pendiente).status == QUEUED
+
+
+class TestJobWorkerPool:
+    """Pruebas de los trabajadores de la cola asíncrona."""
+
+    def test_processesJob_reportingStages(self):
+        etapas = []
+
+        async def handler(job, report):
+            report("decoded")
+            report("ocr")
+            etapas.append(job.image)
+            return {"receipt_id": job.job_id}
+
+        pool = JobWorkerPool(JobStore(), handler, workers=2)
+        job_id, = _runPool(pool, (b"img", "t.jpg"))
+
+        job = pool.store.get(job_id)
+        assert (job.status, job.stage, job.result) == (DONE, "parsed", {"receipt_id": job_id})
+        assert etapas == [b"img"]
+        assert pool.getStats()["completed"] == 1
+
+    def test_transientError_isRetried(self):
+        llamadas = []
+
+        async def handler(job, report):
+            llamadas.append(job.attempts)
+            if job.attempts == 1:
+                raise CircuitOpenError("circuito abierto", retry_after=0.01)
+            return {"ok": True}
+
+        pool = JobWorkerPool(JobStore(), handler, poll_interval=0.01)
+        job_id, = _runPool(pool, (b"img", None))
+
+        assert llamadas == [1, 2]
+        assert pool.store.get(job_id).status == DONE
+        assert pool.getStats()["retried"] == 1
+
+    def test_invalidImage_failsWithoutRetry(self):
+        async def handler(job, report):
+            raise ValueError("Imagen inválida")
+
+        pool = JobWorkerPool(JobStore(), handler, max_attempts=3)
+        job_id, = _runPool(pool, (b"img", None))
+
+        job = pool.store.get(job_id)
+        assert (job.status, job.attempts, job.error) == (FAILED, 1, "Imagen inválida")
+
+    def test_storeError_doesNotKillWorker(self):
+        """Prueba que un error del almacén (base bloqueada) no deja al trabajador muerto."""
+        class FlakyStore(JobStore):
+            fallos = 1
+
+            def claim(self, lease_seconds, max_attempts=None):
+                if self.fallos:
+                    self.fallos -= 1
+                    raise sqlite3.OperationalError("database is locked")
+                return super().claim(lease_seconds, max_attempts)
+
+        async def handler(job, report):
+            return {"ok": True}
+
+        pool = JobWorkerPool(FlakyStore(), handler, workers=1, poll_interval=0.01)
+        job_id, = _runPool(pool, (b"img", None))
+
+        assert pool.store.get(job_id).status == DONE
+        assert pool.getStats()["worker_errors"] == 1
+
+    def test_start_replacesFinishedWorkers(self):
+        async def handler(job, report):
+            return {"ok": True}
+
+        pool = JobWorkerPool(JobStore(), handler, workers=2)
+
+        async def escenario():
+            pool.start()
+            muerto = next(iter(pool._tasks))
+            muerto.cancel()
+            await asyncio.sleep(0)
+            pool.start()
+            vivos = [task for task in pool._tasks if not task.done()]
+            await pool.stop()
+            return muerto, vivos
+
+        muerto, vivos = asyncio.run(escenario())
+
+        assert len(vivos) == 2 and muerto not in vivos
+
+    def test_finishedJob_isPostedToCallback(self):
+        enviados = []
+
+        async def handler(job, report):
+            return {"total": 9.35}
+
+        pool = JobWorkerPool(
+            JobStore(), handler,
+            describe=lambda job: {"job_id": job.job_id, "status": job.status, "result": job.result},
+            sendCallback=lambda url, payload, timeout: enviados.append((url, payload)),
+        )
+
+        async def escenario():
+            job_id = await pool.submit(b"img", "t.jpg", callback_url="https://cliente.test/hook")
+            for _ in range(500):
+                if enviados:
+                    break
+                await asyncio.sleep(0.01)
+            await pool.stop()
+            return job_id
+
+        job_id = asyncio.run(escenario())
+
+        assert enviados == [("https://cliente.test/hook", {"job_id": job_id, "status": DONE, "result": {"total": 9.35}})]
+        assert pool.getStats()["callbacks_sent"] == 1
@@ -0,0 +1,147 @@
+import pytest
+from unittest.mock import patch
+import json
+
+from app.services.json_repair import (
+    COMMENTS,
+    SURROUNDING_TEXT,
+    TRAILING_COMMAS,
+    TRUNCATED,
+    JSONRepairError,
+    hasReceiptData,
+    repairJson,
+)
+from app.services.parser_service import ParserService
+
+
+# Corpus de respuestas mal formadas vistas en el modelo:
+# (caso, respuesta, descripciones recuperadas, total, reparaciones esperadas)
+CORPUS = [
+    (
+        "coma final en items y en el objeto",
+        '{"is_ticket": true, "items": [{"description": "Pan", "quantity": 1, "unit_price": 1.2},], "total": 1.2,}',
+        ["Pan"], 1.2, {TRAILING_COMMAS},
+    ),
+    (
+        "comentarios de la plantilla del prompt",
+        '{\n  "is_ticket": true, // true si es un ticket\n  "items": [\n'
+        '    {"description": "Café", "quantity": 2, "unit_price": 1.5} /* precio unitario */\n  ],\n'
+        '  "total": 3.0 // total final\n}',
+        ["Café"], 3.0, {COMMENTS},
+    ),
+    (
+        "texto antes y después del objeto",
+        'Aquí tienes el JSON del ticket:\n```json\n{"items": [{"description": "Agua", "quantity": 1, "unit_price": 1}], '
+        '"total": 1}\n```\nEspero que te sirva.',
+        ["Agua"], 1.0, {SURROUNDING_TEXT},
+    ),
+    (
+        "cortado a mitad de un ítem",
+        '{"is_ticket": true, "items": [{"description": "Pan", "quantity": 1, "unit_price": 1.2}, '
+        '{"description": "Leche", "quantity": 2, "unit_price": 0.9}, {"description": "Hue',
+        ["Pan", "Leche"], 3.0, {TRUNCATED},
+    ),
+    (
+        "cortado a mitad de un número del ítem",
+        '{"items": [{"description": "Pan", "quantity": 1, "unit_price": 1.2}, {"description": "Vino", "quantity": 1, "unit_price": 12',
+        ["Pan"], 1.2, {TRUNCATED},
+    ),
+    (
+        "cortado tras cerrar items",
+        '{"items": [{"description": "Pan", "quantity": 1, "unit_price": 1.2}], "subtotal": 1.2, "tax": 0.',
+        ["Pan"], 1.2, {TRUNCATED},
+    ),
+    (
+        "cortado justo después del último ítem",
+        '{"items": [{"description": "Pan", "quantity": 3, "unit_price": 1}]',
+        ["Pan"], 3.0, {TRUNCATED},
+    ),
+    (
+        "todo a la vez",
+        'Claro:\n{"items": [ // lista\n{"description": "Caña, grande", "quantity": 2, "unit_price": 2.5},\n'
+        '{"description": "Tapa // casera", "quantity": 1, "unit_price": 3,},\n{"description": "Pos',
+        ["Caña, grande", "Tapa // casera"], 8.0, {SURROUNDING_TEXT, COMMENTS, TRAILING_COMMAS, TRUNCATED},
+    ),
+]
+
+
+class TestRepairJson:
+    """Pruebas de la recuperación de JSON mal formado."""
+
+    @pytest.mark.parametrize(
+        "respuesta,descripciones,total,reparaciones",
+        [case[1:] for case in CORPUS],
+        ids=[case[0] for case in CORPUS],
+    )
+    def test_corpus_recoversEveryCompleteItem(self, respuesta, descripciones, total, reparaciones):
+        """Prueba que de cada respuesta del corpus se recuperan todos los ítems completos."""
+        resultado = repairJson(respuesta)
+        parsed = ParserService().parseJsonData(resultado.data)
+
+        assert [item.name for item in parsed["items"]] == descripciones
+        assert parsed["total"] == total
+        assert set(resultado.repairs) == reparaciones
+
+    def test_validJson_isNotRepaired(self):
+        documento = {"items": [], "total": 1.0}
+
+        resultado = repairJson(json.dumps(documento))
+
+        assert resultado.data == documento
+        assert resultado.repairs == ()
+
+    def test_stringsAreNotModified(self):
+        """Prueba que las comas, barras y llaves dentro de las cadenas se respetan."""
+        respuesta = '{"detected_content": "http://x.es/{a,}", "is_ticket": false,}'
+
+        resultado = repairJson(respuesta)
+
+        assert resultado.data == {"detected_content": "http://x.es/{a,}", "is_ticket": False}
+
+    @pytest.mark.parametrize("respuesta", ["Lo siento, no puedo leer la imagen.", '{"items": [{"desc', ""])
+    def test_nothingRecoverable_raises(self, respuesta):
+        with pytest.raises(JSONRepairError):
+            repairJson(respuesta)
+
+    def test_hasReceiptData(self):
+        assert hasReceiptData({"items": [{"description": "Pan"}]})
+        assert hasReceiptData({"is_ticket": False})
+        assert hasReceiptData({"items": [], "total": 2.0})
+        assert not hasReceiptData({"items": []})
+        assert not hasReceiptData([1, 2])
+
+
+@patch('app.services.ocr_service.genai')
+class TestOcrServiceRepair:
+    """Pruebas de la reparación desde el servicio OCR."""
+
+    def _service(self, mock_genai_module, **kwargs):
+        from app.services.ocr_service import OCRService
+        return OCRService(api_key="test_api_key", **kwargs)
+
+    def test_malformedResponse_isRepairedAndRecorded(self, mock_genai_module):
+        service = self._service(mock_genai_module)
+
+        extraccion = service.decodeOutput(CORPUS[-1][1])
+
+        assert set(extraccion.repairs) == CORPUS[-1][4]
+        assert len(extraccion.data["items"]) == 2
+        assert json.loads(extraccion.text) == extraccion.data
+        parsed = ParserService().parseExtraction(extraccion)
+        assert parsed["json_repairs"] == list(extraccion.repairs)
+        stats = service.getStats()
+        assert stats["repaired"] == 1
+        assert stats["repairs"][TRUNCATED] == 1
+
+    def test_unrecoverableResponse_raisesSoItIsRequestedAgain(self, mock_genai_module):
+        service = self._service(mock_genai_module)
+
+        with pytest.raises(RuntimeError, match="no es un JSON válido"):
+            service.decodeOutput('{"items": [{"description": "Pa')
+        assert service.getStats()["unrecoverable"] == 1
+
+    def test_repairDisabled_raises(self, mock_genai_module):
+        service = self._service(mock_genai_module, repair_json=False)
+
+        with pytest.raises(RuntimeError, match="no es un JSON válido"):
+            service.decodeOutput(CORPUS[0][1])
@@ -0,0 +1,188 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+import asyncio
+import json
+
+from app.services.merchant_templates import MerchantTemplateStore
+from app.services.ocr_engine import OCREngine
+from app.services.parser_service import ParserService
+from app.services.receipt_pipeline import ReceiptPipeline
+
+
+def _ticketTexto(items, cabecera=("BAR EL RINCON DE PEPE", "C/ Mayor 12 - Madrid"), propina=True):
+    """Texto de Tesseract de un ticket con líneas "CAÑA 2 x 1,30 2,60"."""
+    lineas = list(cabecera) + ["CIF B12345678", "Mesa 4   Fecha 12/03/2024"]
+    for nombre, cantidad, precio in items:
+        lineas.append(f"{nombre} {cantidad} x {precio:.2f} {cantidad * precio:.2f}".replace(".", ","))
+    total = sum(cantidad * precio for _, cantidad, precio in items)
+    if propina:
+        lineas.append(f"PROPINA SUGERIDA {total * 0.1:.2f}".replace(".", ","))
+    lineas.append(f"TOTAL {total:.2f}".replace(".", ","))
+    lineas.append("Gracias por su visita")
+    return "\n".join(lineas)
+
+
+def _respuestaModelo(items):
+    total = round(sum(cantidad * precio for _, cantidad, precio in items), 2)
+    return json.dumps({
+        "is_ticket": True,
+        "items": [{"description": n, "quantity": c, "unit_price": p} for n, c, p in items],
+        "subtotal": total, "tax": 0.0, "total": total,
+    })
+
+
+PRIMERO = [("CAÑA", 2, 1.30), ("TOSTA JAMON", 1, 4.50), ("AGUA", 1, 1.20)]
+SEGUNDO = [("VERMUT", 3, 2.20), ("CAÑA", 1, 1.30), ("BRAVAS", 2, 3.80), ("CAFE", 2, 1.10)]
+
+
+class FakeLocalReader(OCREngine):
+    """Motor local falso: devuelve el texto que se le indique para cada imagen."""
+    name = "tesseract"
+    output_format = "text"
+
+    def __init__(self, textos):
+        super().__init__(max_concurrency=1)
+        self.textos = textos
+
+    def extractTextFromImage(self, image_bytes, language='spa'):
+        texto = self.textos[image_bytes]
+        if isinstance(texto, Exception):
+            raise texto
+        return texto
+
+
+class TestMerchantTemplateStore:
+    """Pruebas del aprendizaje y la aplicación de plantillas."""
+
+    def _aprender(self, store):
+        parsed = ParserService().parseTextToItems(_respuestaModelo(PRIMERO))
+        return store.learn(_ticketTexto(PRIMERO), parsed)
+
+    def test_learn_thenMatchOtherReceipt_parsesLocally(self):
+        store = MerchantTemplateStore()
+
+        plantilla = self._aprender(store)
+        lectura = store.match(_ticketTexto(SEGUNDO))
+
+        assert plantilla.merchant == "BAR EL RINCON DE PEPE"
+        assert plantilla.skip_labels == ("PROPINA",)
+        assert lectura.confidence == 1.0
+        assert [item.name for item in lectura.parsed["items"]] == ["VERMUT", "CAÑA", "BRAVAS", "CAFE"]
+        assert lectura.parsed["total"] == pytest.approx(17.7)
+        assert store.getStats()["hits"] == 1
+
+    def test_match_noisyHeader_stillFindsMerchant(self):
+        store = MerchantTemplateStore()
+        self._aprender(store)
+
+        lectura = store.match(_ticketTexto(SEGUNDO, cabecera=("BAR EL RINCON DE PEPF", "C/ Mayor 12 - Madrid")))
+
+        assert lectura is not None
+
+    def test_match_unknownMerchant_returnsNone(self):
+        store = MerchantTemplateStore()
+        self._aprender(store)
+
+        assert store.match(_ticketTexto(SEGUNDO, cabecera=("SUPERMERCADOS LA ESQUINA", "Avda. Sol 3"))) is None
+        assert store.getStats()["no_template"] == 1
+
+    def test_match_itemsDoNotAddUp_isLowConfidence(self):
+        store = MerchantTemplateStore()
+        self._aprender(store)
+        texto = _ticketTexto(SEGUNDO).replace("TOTAL 17,70", "TOTAL 25,00")
+
+        lectura = store.match(texto)
+
+        assert lectura.confidence < store.min_confidence
+        assert store.getStats()["low_confidence"] == 1
+
+    def test_learn_localTextDisagreesWithModel_isRejected(self):
+        store = MerchantTemplateStore()
+        parsed = ParserService().parseTextToItems(_respuestaModelo(SEGUNDO))
+
+        assert store.learn(_ticketTexto(PRIMERO), parsed) is None
+        assert store.getStats()["learn_rejected"] == 1
+        assert store.getStats()["templates"] == 0
+
+    def test_diskTier_survivesNewInstance(self, tmp_path):
+        ruta = str(tmp_path / "plantillas.sqlite")
+        store = MerchantTemplateStore(disk_path=ruta)
+        self._aprender(store)
+        store.close()
+
+        nuevo = MerchantTemplateStore(disk_path=ruta)
+
+        assert nuevo.match(_ticketTexto(SEGUNDO)).confidence == 1.0
+        nuevo.close()
+
+
+class TestReceiptPipelineTemplates:
+    """Pruebas de las plantillas desde el pipeline."""
+
+    def _pipeline(self, textos):
+        return ReceiptPipeline(templates=MerchantTemplateStore(reader=FakeLocalReader(textos)))
+
+    def _modelo(self):
+        ocr_service = MagicMock()
+        ocr_service.extractTextFromImageAsync = AsyncMock(
+            side_effect=[_respuestaModelo(PRIMERO), _respuestaModelo(SEGUNDO)]
+        )
+        return ocr_service
+
+    def test_knownMerchant_skipsModelCall(self):
+        pipeline = self._pipeline({b"uno": _ticketTexto(PRIMERO), b"dos": _ticketTexto(SEGUNDO)})
+        ocr_service = self._modelo()
+
+        primero = asyncio.run(pipeline.extractAndParse(b"uno", ocr_service, ParserService()))
+        segundo = asyncio.run(pipeline.extractAndParse(b"dos", ocr_service, ParserService()))
+
+        assert ocr_service.extractTextFromImageAsync.await_count == 1
+        assert "merchant_template" not in primero
+        assert segundo["merchant_template"] == "BAR EL RINCON DE PEPE"
+        assert len(segundo["items"]) == 4
+        assert segundo["from_cache"] is False
+        stats = pipeline.getStats()["merchant_templates"]
+        assert stats["learned"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_streamAndParse_knownMerchant_yieldsLocalItems(self):
+        pipeline = self._pipeline({b"uno": _ticketTexto(PRIMERO), b"dos": _ticketTexto(SEGUNDO)})
+        ocr_service = self._modelo()
+        asyncio.run(pipeline.extractAndParse(b"uno", ocr_service, ParserService()))
+
+        async def recoger():
+            return [evento async for evento in pipeline.streamAndParse(b"dos", ocr_service, ParserService())]
+
+        eventos = asyncio.run(recoger())
+
+        assert [tipo for tipo, _ in eventos] == ["item"] * 4 + ["result"]
+        assert ocr_service.extractTextFromImageAsync.await_count == 1
+
+    def test_readerError_fallsBackToModel(self):
+        pipeline = self._pipeline({b"uno": RuntimeError("Tesseract no encontrado")})
+        ocr_service = self._modelo()
+
+        resultado = asyncio.run(pipeline.extractAndParse(b"uno", ocr_service, ParserService()))
+
+        assert len(resultado["items"]) == 3
+        assert pipeline.getStats()["merchant_templates"]["reader_errors"] == 1
+
+    def test_learn_runsOffEventLoop(self):
+        """Prueba que aprender la plantilla (regex y escritura en disco) no bloquea el event loop."""
+        import threading
+        from unittest.mock import patch
+        pipeline = self._pipeline({b"uno": _ticketTexto(PRIMERO)})
+        hilo_loop = threading.get_ident()
+        hilos = []
+        aprender = pipeline.templates.learn
+
+        def registrar(*args):
+            hilos.append(threading.get_ident())
+            return aprender(*args)
+
+        with patch.object(pipeline.templates, "learn", side_effect=registrar):
+            asyncio.run(pipeline.extractAndParse(b"uno", self._modelo(), ParserService()))
+
+        assert len(hilos) == 1
+        assert hilos[0] != hilo_loop
+        assert pipeline.getStats()["merchant_templates"]["learned"] == 1
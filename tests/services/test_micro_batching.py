@@ -0,0 +1,216 @@
+import pytest
+from unittest.mock import patch
+import asyncio
+import json
+
+from app.core.config import Settings
+from app.core.lifecycle import ServiceContainer
+from app.services.micro_batching import MicroBatchingOCREngine
+from app.services.ocr_engine import OCREngine, OCRExtraction
+from app.services.ocr_service import BatchDemultiplexError
+from app.services.resilience import ResilientOCREngine
+
+
+def _ticket(nombre):
+    return {"is_ticket": True, "items": [{"description": nombre, "quantity": 1, "unit_price": 1.0}], "total": 1.0}
+
+
+class FakeBatchModel(OCREngine):
+    """Modelo falso que lee el nombre del ticket de los propios bytes y admite lotes."""
+    name = "gemini"
+    output_format = "json"
+
+    def __init__(self, lote=None):
+        super().__init__(max_concurrency=4)
+        self.lote = lote  # Función que sustituye la respuesta de cada lote
+        self.lotes = []
+        self.individuales = []
+
+    def extractTextFromImage(self, image_bytes, language='spa'):
+        return json.dumps(_ticket(image_bytes.decode()))
+
+    def extractFromImage(self, image_bytes, language='spa'):
+        self.individuales.append(image_bytes)
+        data = _ticket(image_bytes.decode())
+        return OCRExtraction(json.dumps(data), self.name, self.output_format, data)
+
+    def extractBatchFromImages(self, images, language='spa'):
+        self.lotes.append(list(images))
+        if self.lote is not None:
+            return self.lote(images)
+        return [OCRExtraction("", self.name, self.output_format, _ticket(imagen.decode())) for imagen in images]
+
+
+async def _extraer(motor, imagenes):
+    return await asyncio.gather(*(motor.extractAsync(imagen) for imagen in imagenes))
+
+
+class TestMicroBatchingOCREngine:
+    """Pruebas del agrupado de extracciones concurrentes."""
+
+    def test_concurrentRequests_shareOneCall(self):
+        modelo = FakeBatchModel()
+        motor = MicroBatchingOCREngine(modelo, max_batch_size=4, max_wait=0.01)
+
+        extracciones = asyncio.run(_extraer(motor, [b"uno", b"dos", b"tres"]))
+
+        assert [e.data["items"][0]["description"] for e in extracciones] == ["uno", "dos", "tres"]
+        assert modelo.lotes == [[b"uno", b"dos", b"tres"]]
+        stats = motor.getStats()
+        assert stats["batches"] == 1
+        assert stats["flushed_timeout"] == 1
+        assert stats["model_calls_saved"] == 2
+
+    def test_fullBatch_isSentWithoutWaiting(self):
+        modelo = FakeBatchModel()
+        motor = MicroBatchingOCREngine(modelo, max_batch_size=2, max_wait=60)
+
+        extracciones = asyncio.run(asyncio.wait_for(_extraer(motor, [b"a", b"b", b"c", b"d"]), timeout=5))
+
+        assert len(extracciones) == 4
+        assert modelo.lotes == [[b"a", b"b"], [b"c", b"d"]]
+        assert motor.getStats()["flushed_full"] == 2
+
+    def test_singleRequest_usesSingleCall(self):
+        modelo = FakeBatchModel()
+        motor = MicroBatchingOCREngine(modelo, max_wait=0.01)
+
+        asyncio.run(motor.extractAsync(b"solo"))
+
+        assert modelo.lotes == []
+        assert modelo.individuales == [b"solo"]
+
+    def test_unmatchedImages_fallBackToSingleCalls(self):
+        modelo = FakeBatchModel(lote=lambda imagenes: [
+            OCRExtraction("", "gemini", "json", _ticket(imagenes[0].decode())), None,
+        ])
+        motor = MicroBatchingOCREngine(modelo, max_wait=0.01)
+
+        extracciones = asyncio.run(_extraer(motor, [b"uno", b"dos"]))
+
+        assert [e.data["items"][0]["description"] for e in extracciones] == ["uno", "dos"]
+        assert modelo.individuales == [b"dos"]
+        assert motor.getStats()["fallback_calls"] == 1
+
+    def test_demultiplexError_retriesEveryImage(self):
+        def falla(imagenes):
+            raise BatchDemultiplexError("respuesta inseparable")
+        modelo = FakeBatchModel(lote=falla)
+        motor = MicroBatchingOCREngine(modelo, max_wait=0.01)
+
+        extracciones = asyncio.run(_extraer(motor, [b"uno", b"dos"]))
+
+        assert [e.data["items"][0]["description"] for e in extracciones] == ["uno", "dos"]
+        assert sorted(modelo.individuales) == [b"dos", b"uno"]
+        assert motor.getStats()["demultiplex_failures"] == 1
+
+    def test_modelError_reachesEveryRequest(self):
+        def falla(imagenes):
+            raise RuntimeError("cuota agotada")
+        motor = MicroBatchingOCREngine(FakeBatchModel(lote=falla), max_wait=0.01)
+
+        async def extraer():
+            return await asyncio.gather(*(motor.extractAsync(i) for i in [b"uno", b"dos"]), return_exceptions=True)
+
+        resultados = asyncio.run(extraer())
+
+        assert all(isinstance(r, RuntimeError) for r in resultados)
+
+    def test_requestsWithDifferentDeadlines_eachUsesItsOwn(self):
+        """
+        Prueba que el lote no hereda el plazo corto de la petición que lo cierra: la de
+        30 s recibe su resultado y solo la de 0,1 s vence.
+        """
+        import time
+        from app.services.deadlines import DeadlineExceededError, boundedTimeout, deadlineScope
+
+        def lento(imagenes):
+            time.sleep(0.3)
+            boundedTimeout(None)  # Como el servicio real: falla si el plazo del lote ha vencido
+            return [OCRExtraction("", "gemini", "json", _ticket(imagen.decode())) for imagen in imagenes]
+        motor = MicroBatchingOCREngine(FakeBatchModel(lote=lento), max_batch_size=2, max_wait=1.0)
+
+        async def conPlazo(segundos, imagen):
+            with deadlineScope(segundos):
+                return await motor.extractAsync(imagen)
+
+        async def extraer():
+            largo = asyncio.ensure_future(conPlazo(30, b"largo"))
+            await asyncio.sleep(0)  # La de 30 s abre el lote; la de 0,1 s lo llena y lo envía
+            return await asyncio.gather(largo, conPlazo(0.1, b"corto"), return_exceptions=True)
+
+        largo, corto = asyncio.run(extraer())
+
+        assert largo.data["items"][0]["description"] == "largo"
+        assert isinstance(corto, DeadlineExceededError)
+        assert motor.getStats()["batches"] == 1
+
+
+@patch('app.services.ocr_service.genai')
+class TestOcrServiceBatchOutput:
+    """Pruebas de la separación de la respuesta de un lote por imagen."""
+
+    def _service(self, mock_genai_module):
+        from app.services.ocr_service import OCRService
+        return OCRService(api_key="test_api_key")
+
+    def test_entriesAreMatchedByImageNumber(self, mock_genai_module):
+        service = self._service(mock_genai_module)
+        texto = "```json\n" + json.dumps({"receipts": [dict(_ticket("dos"), image=2), dict(_ticket("uno"), image=1)]}) + "\n```"
+
+        extracciones = service.decodeBatchOutput(texto, 2)
+
+        assert [e.data["items"][0]["description"] for e in extracciones] == ["uno", "dos"]
+        assert "image" not in extracciones[0].data
+        assert service.getStats()["batch_images"] == 2
+
+    def test_bareListWithoutNumbers_isMatchedByPosition(self, mock_genai_module):
+        service = self._service(mock_genai_module)
+
+        extracciones = service.decodeBatchOutput(json.dumps([_ticket("uno"), _ticket("dos")]), 2)
+
+        assert extracciones[1].data["items"][0]["description"] == "dos"
+
+    def test_missingOrRepeatedEntries_areLeftUnmatched(self, mock_genai_module):
+        service = self._service(mock_genai_module)
+        texto = json.dumps({"receipts": [
+            dict(_ticket("uno"), image=1), dict(_ticket("dos"), image=2), dict(_ticket("otra"), image=2),
+        ]})
+
+        extracciones = service.decodeBatchOutput(texto, 3)
+
+        assert extracciones[0] is not None
+        assert extracciones[1:] == [None, None]
+        assert service.getStats()["batch_unmatched"] == 2
+
+    def test_unusableResponse_raises(self, mock_genai_module):
+        service = self._service(mock_genai_module)
+
+        with pytest.raises(BatchDemultiplexError):
+            service.decodeBatchOutput('{"receipts": "no"}', 2)
+
+    def test_extractBatch_sendsOneRequestWithNumberedImages(self, mock_genai_module):
+        service = self._service(mock_genai_module)
+        service._buildBatchContents = lambda images, language: ["prompt"] + [f"Imagen {n}:" for n in range(1, len(images) + 1)]
+        respuesta = json.dumps({"receipts": [dict(_ticket("uno"), image=1), dict(_ticket("dos"), image=2)]})
+        service.model.generate_content.return_value.parts = [type("Part", (), {"text": respuesta})()]
+
+        extracciones = service.extractBatchFromImages([b"a", b"b"])
+
+        assert service.model.generate_content.call_count == 1
+        assert [e.data["items"][0]["description"] for e in extracciones] == ["uno", "dos"]
+
+
+@patch("app.core.lifecycle.OCRService")
+def test_build_withBatching_wrapsModelInsideResilience(mock_ocr_class):
+    settings = Settings(ocr_batching_enabled=True, tesseract_enabled=False, jobs_db_path=":memory:")
+
+    container = ServiceContainer.build(settings)
+
+    motor = container.getOcrEngine("gemini")
+    capas = [type(motor)]
+    while not isinstance(motor, MicroBatchingOCREngine):
+        motor = motor.engine
+        capas.append(type(motor))
+    assert capas.index(ResilientOCREngine) < capas.index(MicroBatchingOCREngine)
+    container.close()
@@ -0,0 +1,177 @@
+import pytest
+from unittest.mock import patch
+import asyncio
+import json
+
+from app.core.config import Settings
+from app.core.lifecycle import ServiceContainer
+from app.services.admission import AdmissionRejectedError
+from app.services.api_key_pool import KeyPoolExhaustedError
+from app.services.deadlines import DeadlineExceededError
+from app.services.model_routing import (
+    DESCRIPTIONS,
+    HAS_CONTENT,
+    ITEMS_SUM_SUBTOTAL,
+    SUBTOTAL_TAX_TOTAL,
+    TieredOCREngine,
+    scoreExtraction,
+)
+from app.services.ocr_engine import OCREngine, OCRExtraction
+
+
+COHERENTE = {
+    "is_ticket": True,
+    "items": [{"description": "Caña", "quantity": 2, "unit_price": 1.3}, {"description": "Tapa", "quantity": 1, "unit_price": 3.0}],
+    "subtotal": 5.6, "tax": 0.56, "total": 6.16,
+}
+DESCUADRADO = {
+    "is_ticket": True,
+    "items": [{"description": "Caña", "quantity": 2, "unit_price": 1.3}, {"description": "", "quantity": 1, "unit_price": 3.0}],
+    "subtotal": 9.0, "tax": 0.56, "total": 6.16,
+}
+
+
+class FakeModel(OCREngine):
+    """Modelo falso que devuelve siempre la misma respuesta (o lanza un error)."""
+    name = "gemini"
+    output_format = "json"
+
+    def __init__(self, respuesta):
+        super().__init__(max_concurrency=1)
+        self.respuesta = respuesta
+        self.llamadas = 0
+
+    def extractTextFromImage(self, image_bytes, language='spa'):
+        return json.dumps(self.respuesta)
+
+    def extractFromImage(self, image_bytes, language='spa'):
+        self.llamadas += 1
+        if isinstance(self.respuesta, Exception):
+            raise self.respuesta
+        return OCRExtraction(json.dumps(self.respuesta), self.name, self.output_format, self.respuesta)
+
+
+class TestScoreExtraction:
+    """Pruebas de la puntuación de coherencia de una respuesta."""
+
+    def test_coherentResponse_hasFullConfidence(self):
+        assert scoreExtraction(COHERENTE) == (1.0, ())
+
+    def test_inconsistentResponse_listsFailedChecks(self):
+        puntuacion = scoreExtraction(DESCUADRADO)
+
+        assert set(puntuacion.failed) == {DESCRIPTIONS, ITEMS_SUM_SUBTOTAL, SUBTOTAL_TAX_TOTAL}
+        assert puntuacion.confidence == pytest.approx(0.25)
+
+    def test_emptyResponse_hasNoConfidence(self):
+        assert scoreExtraction({"is_ticket": True, "items": []}) == (0.0, (HAS_CONTENT,))
+
+    def test_notTicketAndNonObjects(self):
+        assert scoreExtraction({"is_ticket": False}).confidence == 1.0
+        assert scoreExtraction([1, 2]) is None
+
+    def test_withinTolerance_passes(self):
+        respuesta = dict(COHERENTE, subtotal=5.62)
+
+        assert scoreExtraction(respuesta).confidence == 1.0
+
+
+class TestTieredOCREngine:
+    """Pruebas del enrutado por niveles."""
+
+    def _motor(self, barata, fuerte, **kwargs):
+        self.barato, self.fuerte = FakeModel(barata), FakeModel(fuerte)
+        return TieredOCREngine([("flash", self.barato), ("pro", self.fuerte)], **kwargs)
+
+    def test_coherentCheapResponse_isNotEscalated(self):
+        motor = self._motor(COHERENTE, COHERENTE)
+
+        extraccion = asyncio.run(motor.extractAsync(b"img"))
+
+        assert extraccion.data == COHERENTE
+        assert (self.barato.llamadas, self.fuerte.llamadas) == (1, 0)
+        assert motor.getStats()["served_by"] == {"flash": 1, "pro": 0}
+
+    def test_lowConfidence_escalatesToStrongModel(self):
+        motor = self._motor(DESCUADRADO, COHERENTE)
+
+        extraccion = asyncio.run(motor.extractAsync(b"img"))
+
+        assert extraccion.data == COHERENTE
+        stats = motor.getStats()
+        assert stats["escalations"] == 1
+        assert stats["escalation_rate"] == 1.0
+        assert stats["failed_checks"][ITEMS_SUM_SUBTOTAL] == 1
+        assert stats["served_by"]["pro"] == 1
+
+    def test_strongModelNotBetter_keepsCheapResponse(self):
+        peor = {"is_ticket": True, "items": []}
+        motor = self._motor(DESCUADRADO, peor)
+
+        extraccion = asyncio.run(motor.extractAsync(b"img"))
+
+        assert extraccion.data == DESCUADRADO
+        assert motor.getStats()["served_by"]["flash"] == 1
+
+    def test_cheapModelError_escalates(self):
+        motor = self._motor(RuntimeError("cuota agotada"), COHERENTE)
+
+        extraccion = asyncio.run(motor.extractAsync(b"img"))
+
+        assert extraccion.data == COHERENTE
+        assert motor.getStats()["escalated_on_error"] == 1
+
+    @pytest.mark.parametrize("error", [
+        DeadlineExceededError("plazo vencido"),
+        AdmissionRejectedError("cola llena", retry_after=1.0),
+        KeyPoolExhaustedError("sin cupo", retry_after=2.0),
+    ])
+    def test_localLimitError_isNotEscalated(self, error):
+        envuelto = RuntimeError("Error al procesar imagen con Gemini")
+        envuelto.__cause__ = error
+        motor = self._motor(envuelto, COHERENTE)
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(motor.extractAsync(b"img"))
+        assert self.fuerte.llamadas == 0
+        assert motor.getStats()["escalated_on_error"] == 0
+
+    def test_invalidImage_isNotEscalated(self):
+        motor = self._motor(ValueError("imagen no válida"), COHERENTE)
+
+        with pytest.raises(ValueError):
+            asyncio.run(motor.extractAsync(b"img"))
+        assert self.fuerte.llamadas == 0
+
+    @pytest.mark.parametrize("politica,barato,fuerte", [("primary", 1, 0), ("strong", 0, 1)])
+    def test_fixedPolicies_useSingleTier(self, politica, barato, fuerte):
+        motor = self._motor(DESCUADRADO, COHERENTE, policy=politica)
+
+        asyncio.run(motor.extractAsync(b"img"))
+
+        assert (self.barato.llamadas, self.fuerte.llamadas) == (barato, fuerte)
+
+    def test_thresholdIsConfigurable(self):
+        motor = self._motor(DESCUADRADO, COHERENTE, min_confidence=0.2)
+
+        asyncio.run(motor.extractAsync(b"img"))
+
+        assert self.fuerte.llamadas == 0
+
+    def test_invalidPolicy_raises(self):
+        with pytest.raises(ValueError, match="no soportada"):
+            TieredOCREngine([("flash", FakeModel(COHERENTE))], policy="barato")
+
+
+@patch("app.core.lifecycle.OCRService")
+def test_build_withEscalationModel_routesBetweenTwoModels(mock_ocr_class):
+    settings = Settings(ocr_escalation_model="gemini-1.5-pro-latest", tesseract_enabled=False, jobs_db_path=":memory:")
+
+    container = ServiceContainer.build(settings)
+
+    motor = container.getOcrEngine("gemini")
+    assert isinstance(motor, TieredOCREngine)
+    assert [nombre for nombre, _ in motor.tiers] == ["gemini-1.5-flash-latest", "gemini-1.5-pro-latest"]
+    modelos = [llamada.kwargs["model_name"] for llamada in mock_ocr_class.call_args_list]
+    assert modelos == ["gemini-1.5-flash-latest", "gemini-1.5-pro-latest"]
+    container.close()
@@ -0,0 +1,211 @@
+import pytest
+import json
+import time
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from app.models.item import Item
+from app.services.ocr_cache import OcrResultCache
+from app.services.parser_service import ParserService
+from app.services.receipt_pipeline import ReceiptPipeline
+
+
+RAW_TEXT = json.dumps({
+    "is_ticket": True,
+    "items": [{"description": "Café", "quantity": 1, "unit_price": 2.50}],
+    "total": 2.50
+})
+
+
+class TestOcrResultCache:
+    """Pruebas unitarias de la caché de resultados OCR."""
+
+    def test_makeKey_sameBytes_returnsSameKey(self):
+        """Prueba que la clave depende solo del contenido (y de la variante)."""
+        # Arrange & Act
+        key_a = OcrResultCache.makeKey(b"imagen")
+        key_b = OcrResultCache.makeKey(b"imagen")
+        key_c = OcrResultCache.makeKey(b"imagen", variant="eng")
+
+        # Assert
+        assert key_a == key_b
+        assert key_a != key_c
+        assert len(key_a) == 64
+
+    def test_get_missingKey_countsMiss(self):
+        """Prueba que una clave inexistente devuelve None y cuenta un fallo."""
+        cache = OcrResultCache()
+
+        assert cache.get("no-existe") is None
+        assert cache.getStats()["misses"] == 1
+
+    def test_set_thenGet_returnsCopyOfItems(self):
+        """Prueba que un acierto devuelve el texto y copias de los ítems guardados."""
+        # Arrange
+        cache = OcrResultCache()
+        item = Item(id=1, name="Café", quantity=1, price=2.5, total_price=2.5)
+        cache.set("k", RAW_TEXT, {"items": [item], "total": 2.5})
+
+        # Act
+        resultado = cache.get("k")
+
+        # Assert
+        assert resultado["raw_text"] == RAW_TEXT
+        assert resultado["parsed"]["items"][0] == item
+        assert resultado["parsed"]["items"][0] is not item
+        assert cache.getStats()["memory_hits"] == 1
+
+    def test_set_overCapacity_evictsLeastRecentlyUsed(self):
+        """Prueba que el nivel en memoria expulsa la entrada menos usada."""
+        # Arrange
+        cache = OcrResultCache(max_entries=2)
+        cache.set("a", "A")
+        cache.set("b", "B")
+        cache.get("a")  # "a" pasa a ser la más reciente
+
+        # Act
+        cache.set("c", "C")
+
+        # Assert
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.getStats()["evictions"] == 1
+
+    def test_get_expiredEntry_returnsNone(self):
+        """Prueba que las entradas caducadas no se devuelven."""
+        # Arrange
+        cache = OcrResultCache(ttl_seconds=10)
+        with patch("app.services.ocr_cache.time.time", return_value=1000.0):
+            cache.set("k", RAW_TEXT)
+
+        # Act
+        with patch("app.services.ocr_cache.time.time", return_value=1011.0):
+            resultado = cache.get("k")
+
+        # Assert
+        assert resultado is None
+        assert cache.getStats()["expirations"] == 1
+
+    def test_diskTier_survivesNewInstance(self, tmp_path):
+        """Prueba que el nivel en disco conserva las entradas entre instancias (reinicios)."""
+        # Arrange
+        disk_path = str(tmp_path / "ocr_cache.sqlite")
+        first = OcrResultCache(disk_path=disk_path)
+        item = Item(id=1, name="Café", quantity=1, price=2.5, total_price=2.5)
+        first.set("k", RAW_TEXT, {"items": [item], "total": 2.5})
+        first.close()
+
+        # Act
+        second = OcrResultCache(disk_path=disk_path)
+        resultado = second.get("k")
+
+        # Assert
+        assert resultado["raw_text"] == RAW_TEXT
+        assert resultado["parsed"]["items"] == [item]
+        assert second.getStats()["disk_hits"] == 1
+        # La segunda lectura ya se sirve desde memoria
+        second.get("k")
+        assert second.getStats()["memory_hits"] == 1
+        second.close()
+
+    def test_diskTier_overCapacity_keepsNewestEntries(self, tmp_path):
+        """Prueba que el nivel en disco respeta su tamaño máximo."""
+        cache = OcrResultCache(max_entries=1, disk_path=str(tmp_path / "c.sqlite"), disk_max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.set(key, key.upper())
+            time.sleep(0.001)
+
+        assert cache.getStats()["disk_entries"] == 2
+        assert cache.get("a") is None
+        assert cache.get("b")["raw_text"] == "B"
+        cache.close()
+
+
+class TestReceiptPipelineCache:
+    """Pruebas del uso de la caché desde el pipeline."""
+
+    def _ocrService(self):
+        ocr_service = MagicMock()
+        ocr_service.extractTextFromImageAsync = AsyncMock(return_value=RAW_TEXT)
+        return ocr_service
+
+    def test_extractAndParse_repeatedImage_callsOcrOnce(self):
+        """Prueba que una imagen repetida no vuelve a llamar al OCR."""
+        import asyncio
+        # Arrange
+        pipeline = ReceiptPipeline(cache=OcrResultCache())
+        ocr_service = self._ocrService()
+
+        # Act
+        primero = asyncio.run(pipeline.extractAndParse(b"img", ocr_service, ParserService()))
+        segundo = asyncio.run(pipeline.extractAndParse(b"img", ocr_service, ParserService()))
+
+        # Assert
+        assert ocr_service.extractTextFromImageAsync.await_count == 1
+        assert primero["from_cache"] is False
+        assert segundo["from_cache"] is True
+        assert segundo["items"] == primero["items"]
+        assert segundo["raw_text"] == RAW_TEXT
+
+    def test_extractAndParse_cacheKeyAndDiskTier_runOffEventLoop(self):
+        """Prueba que el hash de la clave y la lectura/escritura de la caché no bloquean el event loop."""
+        import asyncio
+        import threading
+        cache = OcrResultCache()
+        pipeline = ReceiptPipeline(cache=cache)
+        hilo_loop = threading.get_ident()
+        hilos = {}
+
+        def registrar(nombre, funcion):
+            def envoltorio(*args, **kwargs):
+                hilos[nombre] = threading.get_ident()
+                return funcion(*args, **kwargs)
+            return envoltorio
+
+        with patch.object(OcrResultCache, "makeKey", registrar("makeKey", OcrResultCache.makeKey)), \
+                patch.object(cache, "get", registrar("get", cache.get)), \
+                patch.object(cache, "set", registrar("set", cache.set)):
+            asyncio.run(pipeline.extractAndParse(b"img", self._ocrService(), ParserService()))
+
+        assert set(hilos) == {"makeKey", "get", "set"}
+        assert hilo_loop not in hilos.values()
+
+    def test_extractAndParse_withoutParsedCache_reparsesRawText(self):
+        """Prueba que, si no se cachea el resultado parseado, se re-parsea el texto guardado."""
+        import asyncio
+        pipeline = ReceiptPipeline(cache=OcrResultCache(), cache_parsed=False)
+        ocr_service = self._ocrService()
+        parser_service = ParserService()
+
+        asyncio.run(pipeline.extractAndParse(b"img", ocr_service, parser_service))
+        with patch.object(parser_service, "parseTextToItems", wraps=parser_service.parseTextToItems) as spy:
+            resultado = asyncio.run(pipeline.extractAndParse(b"img", ocr_service, parser_service))
+
+        spy.assert_called_once_with(RAW_TEXT)
+        assert resultado["total"] == 2.50
+
+    def test_extractAndParse_emptyOcrResponse_isNotCached(self):
+        """Prueba que una respuesta vacía del OCR no se guarda en caché."""
+        import asyncio
+        pipeline = ReceiptPipeline(cache=OcrResultCache())
+        ocr_service = self._ocrService()
+        ocr_service.extractTextFromImageAsync.return_value = ""
+
+        asyncio.run(pipeline.extractAndParse(b"img", ocr_service, ParserService()))
+        asyncio.run(pipeline.extractAndParse(b"img", ocr_service, ParserService()))
+
+        assert ocr_service.extractTextFromImageAsync.await_count == 2
+
+    def test_extractAndParse_withoutKeepRawText_dropsRawTextButCachesIt(self):
+        """Prueba que sin `keep_raw_text` el resultado no lleva `raw_text`, pero la caché sí lo guarda."""
+        import asyncio
+        cache = OcrResultCache()
+        pipeline = ReceiptPipeline(cache=cache, cache_parsed=False, keep_raw_text=False)
+        ocr_service = self._ocrService()
+
+        primero = asyncio.run(pipeline.extractAndParse(b"img", ocr_service, ParserService()))
+        segundo = asyncio.run(pipeline.extractAndParse(b"img", ocr_service, ParserService()))
+
+        assert primero["raw_text"] is None
+        assert segundo["raw_text"] is None
+        assert segundo["total"] == 2.50
+        assert cache.get(OcrResultCache.makeKey(b"img", variant="gemini:spa"))["raw_text"] == RAW_TEXT
@@ -200,4 +200,88 @@ def test_extractTextFromImage_invalid_json_raises_error(mock_genai_module, sampl
     with pytest.raises(RuntimeError) as exc_info:
         ocr_service.extractTextFromImage(sample_image_bytes)
     assert "La respuesta del modelo no es un JSON válido" in str(exc_info.value)
-    mock_model_instance.generate_content.assert_called_once() 
\ No newline at end of file
+    mock_model_instance.generate_content.assert_called_once() 
+@patch('app.services.ocr_service.genai')
+def test_extractTextFromImageAsync_returns_same_json_as_sync(mock_genai_module, sample_image_bytes):
+    """Prueba que la versión asíncrona descarga la llamada a un hilo y devuelve el mismo JSON."""
+    import asyncio
+    import threading
+    from app.services.ocr_service import OCRService
+
+    mock_model_instance = MagicMock()
+    mock_genai_module.GenerativeModel.return_value = mock_model_instance
+    ocr_service = OCRService(api_key="test_api_key")
+
+    expected_json = {"is_ticket": True, "items": [{"description": "Café", "quantity": 1, "unit_price": 2.50}], "total": 2.50}
+    calling_threads = []
+
+    def generateContent(*args, **kwargs):
+        calling_threads.append(threading.current_thread().name)
+        api_response = MagicMock()
+        api_response.parts = [MagicMock(text=json.dumps(expected_json))]
+        return api_response
+
+    mock_model_instance.generate_content.side_effect = generateContent
+
+    resultado = asyncio.run(ocr_service.extractTextFromImageAsync(sample_image_bytes))
+
+    assert json.loads(resultado) == expected_json
+    assert calling_threads and calling_threads[0].startswith("ocr")
+
+@patch('app.services.ocr_service.genai')
+def test_extractTextFromImageAsync_propagates_errors(mock_genai_module, sample_image_bytes):
+    """Prueba que los errores del modelo se propagan igual que en la versión síncrona."""
+    import asyncio
+    from app.services.ocr_service import OCRService
+
+    mock_model_instance = MagicMock()
+    mock_genai_module.GenerativeModel.return_value = mock_model_instance
+    mock_model_instance.generate_content.side_effect = Exception("timeout")
+    ocr_service = OCRService(api_key="test_api_key")
+
+    with pytest.raises(RuntimeError) as exc_info:
+        asyncio.run(ocr_service.extractTextFromImageAsync(sample_image_bytes))
+    assert "Error al procesar imagen con Gemini" in str(exc_info.value)
+
+@patch('app.services.ocr_service.genai')
+def test_warmUp_and_close_manage_thread_pool(mock_genai_module):
+    """Prueba que warmUp arranca el pool de hilos y close lo libera."""
+    from app.services.ocr_service import OCRService
+
+    ocr_service = OCRService(api_key="test_api_key", max_concurrency=2)
+    ocr_service.warmUp()
+    executor = ocr_service._executor
+
+    assert executor is not None
+    ocr_service.close()
+    assert ocr_service._executor is None
+    with pytest.raises(RuntimeError):
+        executor.submit(lambda: None)
+
+@patch('app.services.ocr_service.genai')
+def test_extractAsync_decodesResponseOnce_andParserReusesIt(mock_genai_module, sample_image_bytes):
+    """Prueba que la respuesta del modelo se decodifica una sola vez entre el OCR y el parser."""
+    import asyncio
+    from app.services import json_codec
+    from app.services.ocr_service import OCRService
+    from app.services.parser_service import ParserService
+
+    mock_model_instance = MagicMock()
+    mock_genai_module.GenerativeModel.return_value = mock_model_instance
+    expected_json = {"is_ticket": True, "items": [{"description": "Café", "quantity": 2, "unit_price": 1.5}], "total": 3.0}
+    mock_api_response = MagicMock()
+    mock_api_response.parts = [MagicMock(text="```json\n" + json.dumps(expected_json) + "\n```")]
+    mock_model_instance.generate_content.return_value = mock_api_response
+    ocr_service = OCRService(api_key="test_api_key")
+
+    with patch('app.services.json_codec.loads', wraps=json_codec.loads) as mock_loads:
+        extraction = asyncio.run(ocr_service.extractAsync(sample_image_bytes))
+        resultado = ParserService().parseExtraction(extraction, keep_raw_text=False)
+    ocr_service.close()
+
+    assert mock_loads.call_count == 1
+    assert extraction.data == expected_json
+    assert extraction.text == json.dumps(expected_json)
+    assert [item.name for item in resultado["items"]] == ["Café"]
+    assert resultado["total"] == 3.0
+    assert resultado["raw_text"] is None
@@ -270,6 +270,44 @@ class TestParserService:
             assert resultado1["items"][0].id == 1
             assert resultado2["items"][0].id == 1
 
+        def test_parseExtraction_withDecodedData_doesNotDecodeAgain(self, parserService):
+            """Prueba que parseExtraction usa el JSON ya decodificado por el motor OCR"""
+            # Arrange
+            from app.services.ocr_engine import OCRExtraction
+            data = {"items": [{"description": "Café", "quantity": 1, "unit_price": 1.5}], "total": 1.5}
+            extraction = OCRExtraction(json.dumps(data), "gemini", "json", data)
+
+            # Act
+            with patch("app.services.json_codec.loads") as mock_loads:
+                resultado = parserService.parseExtraction(extraction)
+
+            # Assert
+            mock_loads.assert_not_called()
+            assert resultado["items"][0].name == "Café"
+            assert resultado["raw_text"] == extraction.text
+
+        def test_parseExtraction_withoutDecodedData_parsesText(self, parserService):
+            """Prueba que parseExtraction parsea el texto si el motor no lo decodificó"""
+            # Arrange
+            from app.services.ocr_engine import OCRExtraction
+            extraction = OCRExtraction(json.dumps({"items": [], "total": 2.0}), "gemini", "json")
+
+            # Act
+            resultado = parserService.parseExtraction(extraction, keep_raw_text=False)
+
+            # Assert
+            assert resultado["total"] == 2.0
+            assert resultado["raw_text"] is None
+
+        def test_parseTextToItems_jsonArray_returnsEmptyData(self, parserService):
+            """Prueba que una respuesta JSON que no es un objeto se trata como inválida"""
+            # Act
+            resultado = parserService.parseTextToItems('[{"description": "Café"}]')
+
+            # Assert
+            assert resultado["items"] == []
+            assert resultado["total"] is None
+
         def test_parseTextToItems_notTicket_returnsError(self, parserService):
             """Prueba que parseTextToItems devuelve error cuando no es un ticket"""
             # Arrange
@@ -728,4 +766,89 @@ class TestParserService:
             assert resultado["is_ticket"] is True
             assert resultado["error_message"] is None
 
- 
\ No newline at end of file
+ 
+    class TestPlainTextReceipts:
+        """
+        Pruebas del parser línea a línea usado con motores que devuelven texto plano (Tesseract).
+        """
+
+        TICKET_BAR = "\n".join([
+            "BAR PEPE",
+            "CIF B12345678",
+            "FECHA 12/03/2024 13:45",
+            "2 x CAÑA 1,30 2,60",
+            "AGUA GRANDE 1,30",
+            "CAFE 3 x 1,20 3,60",
+            "SUBTOTAL 6,86",
+            "IVA 10% 0,64",
+            "TOTAL 7,50",
+            "EFECTIVO 10,00",
+            "CAMBIO 2,50",
+        ])
+
+        def test_parseReceiptText_barTicket_extractsItemsAndTotals(self, parserService):
+            """Prueba que se leen ítems (con y sin cantidad) y totales de un ticket en texto plano"""
+            # Act
+            resultado = parserService.parseReceiptText(self.TICKET_BAR)
+
+            # Assert
+            assert [item.name for item in resultado["items"]] == ["CAÑA", "AGUA GRANDE", "CAFE"]
+            assert [item.id for item in resultado["items"]] == [1, 2, 3]
+            assert resultado["items"][0].quantity == 2
+            assert resultado["items"][0].price == 1.30
+            assert resultado["items"][0].total_price == 2.60
+            assert resultado["items"][2].quantity == 3
+            assert resultado["items"][2].total_price == 3.60
+            assert resultado["subtotal"] == 6.86
+            assert resultado["tax"] == 0.64
+            assert resultado["total"] == 7.50
+            assert resultado["is_ticket"] is True
+            assert resultado["raw_text"] == self.TICKET_BAR
+
+        def test_parseReceiptText_paymentAndFiscalLines_areNotItems(self, parserService):
+            """Prueba que pagos, cambio y datos fiscales no se interpretan como artículos"""
+            # Act
+            resultado = parserService.parseReceiptText("TARJETA VISA 25,00\nCAMBIO 0,00\nPAN 1,10")
+
+            # Assert
+            assert [item.name for item in resultado["items"]] == ["PAN"]
+
+        def test_parseReceiptText_quantityWithoutUnitPrice_derivesUnitPrice(self, parserService):
+            """Prueba que el precio unitario se calcula a partir del importe y la cantidad"""
+            # Act
+            resultado = parserService.parseReceiptText("4 CROISSANT 5,00")
+
+            # Assert
+            assert resultado["items"][0].quantity == 4
+            assert resultado["items"][0].price == 1.25
+            assert resultado["items"][0].total_price == 5.00
+
+        def test_parseReceiptText_noTotalLine_calculatesTotalFromItems(self, parserService):
+            """Prueba que sin línea de total se suma el importe de los ítems"""
+            # Act
+            resultado = parserService.parseReceiptText("PAN 1,10\nLECHE 0,95 €")
+
+            # Assert
+            assert resultado["total"] == 2.05
+            assert resultado["subtotal"] == 2.05
+
+        def test_parseReceiptText_noItemsNoTotal_isNotTicket(self, parserService):
+            """Prueba que un texto sin importes se marca como imagen que no es ticket"""
+            # Act
+            resultado = parserService.parseReceiptText("Feliz cumpleaños\nMaría")
+
+            # Assert
+            assert resultado["is_ticket"] is False
+            assert resultado["items"] == []
+            assert "ticket" in resultado["error_message"]
+            assert resultado["detected_content"] == "Feliz cumpleaños"
+
+        def test_parseEngineOutput_dispatchesByFormat(self, parserService):
+            """Prueba que parseEngineOutput usa el parser que corresponde al formato del motor"""
+            # Act
+            desde_json = parserService.parseEngineOutput(json.dumps({"items": [], "total": 3.0}), "json")
+            desde_texto = parserService.parseEngineOutput("TOTAL 3,00", "text")
+
+            # Assert
+            assert desde_json["total"] == 3.0
+            assert desde_texto["total"] == 3.0
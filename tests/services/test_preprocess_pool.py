@@ -0,0 +1,80 @@
+import pytest
+import io
+import os
+from unittest.mock import patch, MagicMock
+
+from PIL import Image
+
+from app.services.image_preprocessor import ImagePreprocessor
+from app.services.preprocess_pool import PreprocessPool
+
+
+def _encode(image: Image.Image, fmt: str = "JPEG") -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def _sharedSegments():
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")} if os.path.isdir("/dev/shm") else set()
+
+
+@pytest.fixture(scope="module")
+def pool():
+    """Pool con dos procesos, compartido por las pruebas del módulo (arrancarlo cuesta ~1 s)."""
+    preprocess_pool = PreprocessPool(ImagePreprocessor(max_side=500), workers=2)
+    yield preprocess_pool
+    preprocess_pool.close()
+
+
+class TestPreprocessPool:
+    """Pruebas del preprocesado de imágenes en un pool de procesos."""
+
+    def test_prepare_matchesInlinePreprocessing(self, pool):
+        """Prueba que el resultado es idéntico al del preprocesado en el propio proceso."""
+        image_bytes = _encode(Image.new("RGB", (1600, 1200), color="white"))
+        segmentos_antes = _sharedSegments()
+
+        resultado = pool.prepare(image_bytes)
+
+        esperado = ImagePreprocessor(max_side=500).prepare(image_bytes)
+        assert resultado == esperado
+        assert (resultado.width, resultado.height) == (500, 375)
+        assert _sharedSegments() == segmentos_antes  # El segmento compartido se libera
+
+    def test_prepare_recordsStatsInParentPreprocessor(self, pool):
+        imagenes_antes = pool.preprocessor.getStats()["images"]
+
+        pool.prepare(_encode(Image.new("RGB", (100, 100), color="white")))
+
+        assert pool.preprocessor.getStats()["images"] == imagenes_antes + 1
+        assert pool.getStats()["shared_bytes"] > 0
+
+    def test_prepare_invalidBytes_raisesValueError(self, pool):
+        with pytest.raises(ValueError):
+            pool.prepare(b"esto no es una imagen")
+
+    def test_prepareMany_keepsOrder(self, pool):
+        tamanos = [(300, 100), (100, 300), (200, 200)]
+        imagenes = [_encode(Image.new("RGB", size, color="white"), "PNG") for size in tamanos]
+
+        resultados = pool.prepareMany(imagenes)
+
+        assert [(r.width, r.height) for r in resultados] == tamanos
+
+    def test_ocrService_sendsImagePreparedInPool(self, pool):
+        """Prueba que OCRService envía al modelo la imagen preparada por el pool."""
+        from app.services.ocr_service import OCRService
+        with patch("app.services.ocr_service.genai") as mock_genai:
+            mock_genai.GenerativeModel.return_value.generate_content.return_value = MagicMock(
+                parts=[MagicMock(text='{"is_ticket": true, "items": []}')]
+            )
+            service = OCRService(api_key="test", image_preprocessor=pool.preprocessor, preprocess_pool=pool)
+            try:
+                service.extractTextFromImage(_encode(Image.new("RGB", (1000, 1000), color="white")))
+            finally:
+                service.close()
+
+        contents = mock_genai.GenerativeModel.return_value.generate_content.call_args[0][0]
+        assert contents[1]["mime_type"] == "image/jpeg"
+        assert Image.open(io.BytesIO(contents[1]["data"])).size == (500, 500)
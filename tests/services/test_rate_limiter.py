@@ -0,0 +1,106 @@
+import pytest
+import asyncio
+
+from app.services.rate_limiter import READ, UPLOAD, RateLimiter, RateLimitMiddleware, TokenBucketStore
+from tests.conftest import FakeClock
+
+
+class TestTokenBucketStore:
+    """Pruebas de los cubos de fichas por cliente."""
+
+    def test_burstThenRefill(self):
+        reloj = FakeClock()
+        cubos = TokenBucketStore(requests_per_minute=60, burst=2, clock=reloj)
+
+        assert [cubos.take("a") for _ in range(2)] == [0.0, 0.0]
+        assert cubos.take("a") == pytest.approx(1.0)
+        reloj.now += 1
+        assert cubos.take("a") == 0.0
+
+    def test_clientsHaveSeparateBuckets(self):
+        cubos = TokenBucketStore(requests_per_minute=1, burst=1, clock=FakeClock())
+
+        assert cubos.take("a") == 0.0
+        assert cubos.take("b") == 0.0
+        assert cubos.take("a") > 0
+
+    def test_maxClients_evictsLeastRecentlyUsed(self):
+        cubos = TokenBucketStore(requests_per_minute=1, burst=1, max_clients=2, clock=FakeClock())
+        cubos.take("a")
+        cubos.take("b")
+        cubos.take("a")  # "a" pasa a ser el más reciente
+
+        cubos.take("c")
+
+        assert len(cubos) == 2
+        assert cubos.evictions == 1
+        assert cubos.take("a") > 0  # "a" se conserva (sin fichas); se descartó "b"
+        assert cubos.take("b") == 0.0
+
+
+class TestRateLimiter:
+    """Pruebas de la clasificación de rutas y la identidad del cliente."""
+
+    @pytest.mark.parametrize("metodo,ruta,clase", [
+        ("POST", "/api/v1/receipts/upload", UPLOAD),
+        ("POST", "/api/v1/receipts/upload/batch", UPLOAD),
+        ("GET", "/api/v1/receipts/abc", READ),
+        ("POST", "/api/v1/receipts/abc/split", READ),
+        ("GET", "/health", None),
+        ("GET", "/metrics", None),
+        ("OPTIONS", "/api/v1/receipts/upload", None),
+    ])
+    def test_classify(self, metodo, ruta, clase):
+        assert RateLimiter.classify(metodo, ruta) == clase
+
+    def test_clientFor_prefersValidApiKeyOverIp(self):
+        limitador = RateLimiter(api_keys=["secreta", " otra "])
+
+        assert limitador.clientFor([(b"x-api-key", b"secreta")], ("10.0.0.1", 1234)) == "key:secreta"
+        assert limitador.clientFor([(b"x-api-key", b"otra")], ("10.0.0.1", 1234)) == "key:otra"
+        assert limitador.clientFor([(b"accept", b"*/*")], ("10.0.0.1", 1234)) == "ip:10.0.0.1"
+
+    def test_clientFor_unknownApiKey_usesIp(self):
+        """Prueba que una clave inventada no da un cubo propio: se limita por IP."""
+        assert RateLimiter(api_keys=["secreta"]).clientFor([(b"x-api-key", b"inventada")], ("10.0.0.1", 1)) == "ip:10.0.0.1"
+        assert RateLimiter().clientFor([(b"x-api-key", b"secreta")], ("10.0.0.1", 1)) == "ip:10.0.0.1"
+
+    def test_routeClassesHaveSeparateBudgets(self):
+        limitador = RateLimiter(upload_per_minute=1, upload_burst=1, clock=FakeClock())
+
+        assert limitador.check(UPLOAD, "ip:1") == 0.0
+        assert limitador.check(UPLOAD, "ip:1") > 0
+        assert limitador.check(READ, "ip:1") == 0.0
+        stats = limitador.getStats()
+        assert stats[UPLOAD]["limited"] == 1
+        assert stats[READ]["allowed"] == 1
+
+
+def test_middleware_rejectsWith429AndRetryAfter():
+    limitador = RateLimiter(upload_per_minute=6, upload_burst=1, clock=FakeClock())
+    llamadas = []
+
+    async def aplicacion(scope, receive, send):
+        llamadas.append(scope["path"])
+
+    middleware = RateLimitMiddleware(aplicacion, getLimiter=lambda app: limitador)
+    scope = {
+        "type": "http", "method": "POST", "path": "/api/v1/receipts/upload",
+        "headers": [], "client": ("10.0.0.1", 1234), "app": None,
+    }
+
+    async def peticion():
+        enviados = []
+
+        async def send(mensaje):
+            enviados.append(mensaje)
+
+        await middleware(scope, None, send)
+        return enviados
+
+    assert asyncio.run(peticion()) == []
+    rechazo = asyncio.run(peticion())
+
+    assert llamadas == ["/api/v1/receipts/upload"]
+    assert rechazo[0]["status"] == 429
+    assert (b"retry-after", b"10") in rechazo[0]["headers"]
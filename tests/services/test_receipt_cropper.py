@@ -0,0 +1,93 @@
+import pytest
+import io
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.services.image_preprocessor import ImagePreprocessor
+from app.services.receipt_cropper import ReceiptCropper
+
+
+def _receipt(width=400, height=1000, seed=0) -> Image.Image:
+    """Ticket sintético: papel blanco con líneas de texto."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), color=(250, 250, 246))
+    draw = ImageDraw.Draw(image)
+    for line in range(2, height // 30):
+        draw.text((20, line * 30), f"PRODUCTO {rng.randint(100, 999)}   {rng.randint(1, 50)},99", fill=(20, 20, 20))
+    return image
+
+
+def _photo(angle=0.0, background=(90, 70, 50), size=(1200, 1600), seed=0) -> Image.Image:
+    """Foto sintética: el ticket girado `angle` grados sobre una mesa con textura."""
+    noise = np.random.default_rng(seed).normal(0, 12, (size[1], size[0], 3))
+    table = Image.fromarray(np.clip(np.array(background) + noise, 0, 255).astype(np.uint8))
+    receipt = _receipt(seed=seed)
+    rotated = receipt.rotate(angle, expand=True)
+    mask = Image.new("L", receipt.size, 255).rotate(angle, expand=True)
+    table.paste(rotated, ((size[0] - rotated.width) // 2, (size[1] - rotated.height) // 2), mask)
+    return table
+
+
+class TestReceiptCropper:
+    """Pruebas del recorte y enderezado del ticket dentro de la foto."""
+
+    @pytest.mark.parametrize("angulo", [0, 10, -20])
+    def test_receiptOnTable_isCroppedAndStraightened(self, angulo):
+        cropper = ReceiptCropper()
+
+        recortada, deteccion = cropper.crop(_photo(angulo))
+
+        assert deteccion is not None
+        assert deteccion.confidence >= cropper.min_confidence
+        # Tamaño del ticket (400x1000) más el margen, sin la mesa y ya recto
+        assert recortada.width == pytest.approx(400, rel=0.1)
+        assert recortada.height == pytest.approx(1000, rel=0.1)
+        gris = np.asarray(recortada.convert("L"))
+        assert gris[gris.shape[0] // 4: -gris.shape[0] // 4, 30:-30].mean() > 200  # Solo papel en el centro
+
+    def test_lowContrastBackground_fallsBackToOriginal(self):
+        """Prueba que sin una detección fiable (ticket sobre fondo claro) se usa la foto entera."""
+        foto = _photo(5, background=(235, 235, 230))
+
+        recortada, deteccion = ReceiptCropper().crop(foto)
+
+        assert deteccion is None
+        assert recortada is foto
+
+    def test_receiptFillingPhoto_isNotCropped(self):
+        foto = _receipt()
+
+        recortada, deteccion = ReceiptCropper().crop(foto)
+
+        assert deteccion is None
+        assert recortada.size == foto.size
+
+    def test_preprocessor_sendsCroppedReceipt(self):
+        """Prueba que el preprocesado envía al modelo el ticket recortado, con menos bytes."""
+        buffer = io.BytesIO()
+        _photo(8).save(buffer, format="JPEG", quality=92)
+        sin_recorte = ImagePreprocessor(max_side=0)
+        con_recorte = ImagePreprocessor(max_side=0, cropper=ReceiptCropper())
+
+        original = sin_recorte.prepare(buffer.getvalue())
+        recortada = con_recorte.prepare(buffer.getvalue())
+
+        assert recortada.cropped is True and original.cropped is False
+        assert recortada.encoded_size_bytes < original.encoded_size_bytes / 2
+        assert con_recorte.getStats()["cropped_images"] == 1
+
+    def test_tesseractPath_receivesCroppedImage(self):
+        """Prueba que el camino de Tesseract también binariza solo el ticket recortado."""
+        from app.services.tesseract_ocr_service import TesseractOCRService
+        buffer = io.BytesIO()
+        _photo(8).save(buffer, format="PNG")
+        service = TesseractOCRService(image_preprocessor=ImagePreprocessor(max_side=0, cropper=ReceiptCropper()))
+        try:
+            binaria = service._preprocessImageForOcr(buffer.getvalue())
+        finally:
+            service.close()
+
+        alto, ancho = binaria.shape
+        assert alto / ancho == pytest.approx(1000 / 400, rel=0.15)
@@ -0,0 +1,167 @@
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+import io
+import os
+
+import numpy as np
+
+from app.services.parser_service import ParserService
+from app.services.receipt_pipeline import ReceiptPipeline
+from app.services.receipt_prefilter import ReceiptPrefilter
+
+
+IMAGEN_TICKET = os.path.join(os.path.dirname(__file__), "..", "images", "restaurante.jpg")
+
+
+def _codificar(img, formato='JPEG'):
+    buffer = io.BytesIO()
+    img.save(buffer, format=formato, quality=90)
+    return buffer.getvalue()
+
+
+def _ticket(ancho=500, alto=1200, fondo=(70, 60, 50)):
+    """Ticket sintético: papel claro con líneas de texto sobre un fondo oscuro (una mesa)."""
+    lienzo = Image.new('RGB', (ancho + 160, alto + 160), fondo)
+    papel = Image.new('RGB', (ancho, alto), (245, 243, 238))
+    draw = ImageDraw.Draw(papel)
+    for top in range(40, alto - 40, 30):
+        draw.text((30, top), "CANA GRANDE   2 x 1,30      2,60", fill=(20, 20, 20))
+    lienzo.paste(papel, (80, 80))
+    return _codificar(lienzo)
+
+
+def _paisaje(ancho=1200, alto=800):
+    """Foto sin texto: degradado de colores con ruido."""
+    rng = np.random.default_rng(0)
+    filas = np.linspace(0, 1, alto)[:, None]
+    pixeles = np.empty((alto, ancho, 3), dtype=np.uint8)
+    pixeles[:, :, 0] = (80 + 100 * filas).astype(np.uint8)
+    pixeles[:, :, 1] = 150
+    pixeles[:, :, 2] = (220 - 120 * filas).astype(np.uint8)
+    pixeles += rng.integers(0, 20, pixeles.shape, dtype=np.uint8)
+    return _codificar(Image.fromarray(pixeles).filter(ImageFilter.GaussianBlur(2)))
+
+
+class TestReceiptPrefilter:
+    """Pruebas del filtro local de imágenes que no son tickets."""
+
+    def test_classify_syntheticReceipt_passes(self):
+        veredicto = ReceiptPrefilter().classify(_ticket())
+
+        assert veredicto.is_ticket
+        assert veredicto.reason is None
+        assert veredicto.text_lines >= 20
+
+    def test_classify_realReceipt_passes(self):
+        with open(IMAGEN_TICKET, "rb") as f:
+            veredicto = ReceiptPrefilter().classify(f.read())
+
+        assert veredicto.is_ticket
+
+    @pytest.mark.parametrize("imagen", [
+        _paisaje(),
+        _codificar(Image.new('RGB', (800, 800), 'white')),
+    ], ids=["paisaje", "folio_en_blanco"])
+    def test_classify_imageWithoutText_isRejected(self, imagen):
+        veredicto = ReceiptPrefilter().classify(imagen)
+
+        assert not veredicto.is_ticket
+        assert veredicto.reason == "no_text"
+        respuesta = veredicto.asModelResponse()
+        assert respuesta["is_ticket"] is False
+        assert respuesta["error_message"] == ReceiptPrefilter.ERROR_MESSAGES["no_text"]
+        assert respuesta["detected_content"]
+
+    def test_classify_darkPaperlessText_isRejectedAsNoPaper(self):
+        """Prueba que el texto sobre un fondo de color (ej. una pizarra) no pasa como ticket."""
+        img = Image.new('RGB', (600, 900), (40, 90, 60))
+        draw = ImageDraw.Draw(img)
+        for top in range(40, 860, 30):
+            draw.rectangle((30, top - 4, 570, top + 14), fill=(200, 120, 60))
+            draw.text((40, top), "MENU DEL DIA   12,50", fill=(10, 10, 10))
+
+        veredicto = ReceiptPrefilter().classify(_codificar(img))
+
+        assert veredicto.reason == "no_paper"
+
+    @pytest.mark.parametrize("imagen", [
+        b"fake image content",
+        _codificar(Image.new('RGB', (50, 50), 'white'), 'PNG'),
+    ], ids=["no_decodificable", "demasiado_pequena"])
+    def test_classify_unjudgeableImage_returnsNone(self, imagen):
+        prefiltro = ReceiptPrefilter()
+
+        assert prefiltro.classify(imagen) is None
+        assert prefiltro.getStats()["skipped"] == 1
+
+    def test_thresholdsAreConfigurable(self):
+        exigente = ReceiptPrefilter(min_text_lines=1000)
+
+        assert exigente.classify(_ticket()).reason == "no_text"
+
+    def test_tesseract_rescuesRejectionWithAmounts(self):
+        prefiltro = ReceiptPrefilter(tesseract_enabled=True)
+
+        with patch("pytesseract.image_to_string", return_value="TOTAL 12,50\n"):
+            veredicto = prefiltro.classify(_paisaje())
+
+        assert veredicto.is_ticket
+        assert prefiltro.getStats()["rescued_by_tesseract"] == 1
+
+    def test_getStats_countsRejections(self):
+        prefiltro = ReceiptPrefilter()
+
+        prefiltro.classify(_ticket())
+        prefiltro.classify(_paisaje())
+
+        stats = prefiltro.getStats()
+        assert stats["checked"] == 2
+        assert stats["passed"] == 1
+        assert stats["rejected"] == 1
+        assert stats["rejections"] == {"no_text": 1}
+        assert stats["avg_ms"] > 0
+
+
+class TestReceiptPipelinePrefilter:
+    """Pruebas del filtro previo desde el pipeline."""
+
+    def _ocrService(self):
+        ocr_service = MagicMock()
+        ocr_service.extractTextFromImageAsync = AsyncMock(return_value='{"is_ticket": true, "items": [], "total": 1.0}')
+        return ocr_service
+
+    def test_extractAndParse_rejectedImage_skipsOcr(self):
+        pipeline = ReceiptPipeline(prefilter=ReceiptPrefilter())
+        ocr_service = self._ocrService()
+
+        resultado = asyncio.run(pipeline.extractAndParse(_paisaje(), ocr_service, ParserService()))
+
+        ocr_service.extractTextFromImageAsync.assert_not_awaited()
+        assert resultado["is_ticket"] is False
+        assert resultado["error_message"] == ReceiptPrefilter.ERROR_MESSAGES["no_text"]
+        assert resultado["from_cache"] is False
+        assert pipeline.getStats()["prefilter"]["rejected"] == 1
+
+    def test_extractAndParse_receipt_callsOcr(self):
+        pipeline = ReceiptPipeline(prefilter=ReceiptPrefilter())
+        ocr_service = self._ocrService()
+
+        resultado = asyncio.run(pipeline.extractAndParse(_ticket(), ocr_service, ParserService()))
+
+        ocr_service.extractTextFromImageAsync.assert_awaited_once()
+        assert resultado["is_ticket"] is True
+
+    def test_streamAndParse_rejectedImage_yieldsOnlyResult(self):
+        pipeline = ReceiptPipeline(prefilter=ReceiptPrefilter())
+        ocr_service = self._ocrService()
+
+        async def recoger():
+            return [evento async for evento in pipeline.streamAndParse(_paisaje(), ocr_service, ParserService())]
+
+        eventos = asyncio.run(recoger())
+
+        assert [tipo for tipo, _ in eventos] == ["result"]
+        assert eventos[0][1]["is_ticket"] is False
+        ocr_service.extractTextFromImageAsync.assert_not_awaited()
@@ -0,0 +1,316 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from PIL import Image
+import asyncio
+import io
+import json
+import random
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+from app.services.api_key_pool import KeyPoolExhaustedError
+from app.services.ocr_engine import OCREngine
+from app.services.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LatencyTracker,
+    OCRTimeoutError,
+    ResilientOCREngine,
+    isRetryableError,
+)
+
+
+TICKET_JSON = json.dumps({"is_ticket": True, "items": [], "total": 1.0})
+
+
+class FakeModelEngine(OCREngine):
+    """
+    Motor OCR local que simula el cliente del modelo.
+    Cada llamada consume el siguiente paso del guion: (latencia en segundos, resultado o excepción).
+    """
+    name = "gemini"
+    output_format = "json"
+
+    def __init__(self, script, default=(0.0, TICKET_JSON)):
+        super().__init__(max_concurrency=4)
+        self.script = list(script)
+        self.default = default
+        self.calls = 0
+
+    def extractTextFromImage(self, image_bytes, language='spa'):
+        self.calls += 1
+        delay, outcome = self.script.pop(0) if self.script else self.default
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class FakeLocalEngine(FakeModelEngine):
+    name = "tesseract"
+    output_format = "text"
+
+
+def _resilient(engine, **kwargs):
+    kwargs.setdefault("backoff_base", 0.001)
+    kwargs.setdefault("backoff_max", 0.002)
+    return ResilientOCREngine(engine, rng=random.Random(0), **kwargs)
+
+
+def _run(resilient, image_bytes=b"img"):
+    try:
+        return asyncio.run(resilient.extractAsync(image_bytes))
+    finally:
+        resilient.engine.close()
+
+
+class TestRetries:
+    """Pruebas de reintentos y timeouts por intento."""
+
+    def test_transientError_isRetriedUntilSuccess(self):
+        """Prueba que un error transitorio del modelo se reintenta y la petición acaba bien."""
+        engine = FakeModelEngine([(0, RuntimeError("Error al procesar imagen con Gemini: 503"))])
+        resilient = _resilient(engine, max_attempts=3)
+
+        resultado = _run(resilient)
+
+        assert resultado.text == TICKET_JSON
+        assert resultado.engine == "gemini"
+        assert engine.calls == 2
+        assert resilient.getStats()["retries"] == 1
+
+    def test_invalidImage_isNotRetried(self):
+        """Prueba que un ValueError (imagen inválida) no se reintenta."""
+        engine = FakeModelEngine([(0, ValueError("Los bytes de la imagen no son válidos"))])
+        resilient = _resilient(engine, max_attempts=3)
+
+        with pytest.raises(ValueError):
+            _run(resilient)
+        assert engine.calls == 1
+
+    def test_attemptTimeout_isRetried(self):
+        """Prueba que un intento que supera su tiempo máximo se abandona y se reintenta."""
+        engine = FakeModelEngine([(0.5, TICKET_JSON)])
+        resilient = _resilient(engine, attempt_timeout=0.05, max_attempts=2)
+
+        inicio = time.perf_counter()
+        resultado = asyncio.run(resilient.extractAsync(b"img"))
+        duracion = time.perf_counter() - inicio
+        engine.close()
+
+        assert resultado.text == TICKET_JSON
+        assert duracion < 0.4
+        assert resilient.getStats()["timeouts"] == 1
+
+    def test_allAttemptsFail_raisesLastError(self):
+        """Prueba que, agotados los reintentos y sin motor alternativo, se propaga el último error."""
+        engine = FakeModelEngine([], default=(0, RuntimeError("caído")))
+        resilient = _resilient(engine, max_attempts=3)
+
+        with pytest.raises(RuntimeError, match="caído"):
+            _run(resilient)
+        assert engine.calls == 3
+        assert resilient.getStats()["failures"] == 1
+
+    def test_backoffDelay_isJitteredAndCapped(self):
+        """Prueba que la espera crece exponencialmente con jitter y nunca supera el máximo."""
+        resilient = ResilientOCREngine(FakeModelEngine([]), backoff_base=0.5, backoff_max=2.0, rng=random.Random(1))
+
+        esperas = [[resilient._backoffDelay(n) for _ in range(200)] for n in (1, 2, 3, 6)]
+
+        assert max(esperas[0]) <= 0.5
+        assert max(esperas[1]) <= 1.0
+        assert max(esperas[3]) <= 2.0
+        assert len(set(esperas[2])) > 100
+
+    def test_isRetryableError_usesGoogleErrorCause(self):
+        """Prueba que se reintentan cuota y 5xx del SDK, pero no otros 4xx."""
+        def wrapped(cause):
+            try:
+                raise RuntimeError("Error al procesar imagen con Gemini") from cause
+            except RuntimeError as e:
+                return e
+
+        assert isRetryableError(wrapped(google_exceptions.ResourceExhausted("quota")))
+        assert isRetryableError(wrapped(google_exceptions.ServiceUnavailable("down")))
+        assert not isRetryableError(wrapped(google_exceptions.InvalidArgument("bad")))
+        assert isRetryableError(OCRTimeoutError("lento"))
+        assert not isRetryableError(ValueError("imagen"))
+
+
+class TestHedging:
+    """Pruebas de las peticiones cubiertas (hedging)."""
+
+    def test_slowAttempt_isHedgedAndFastestAnswerWins(self):
+        """Prueba que tras el p95 se lanza un segundo intento y se usa el que responde primero."""
+        engine = FakeModelEngine([(0.6, "lento")], default=(0.01, TICKET_JSON))
+        resilient = _resilient(engine, hedging_enabled=True, hedge_min_samples=5)
+        for _ in range(20):
+            resilient.latencies.add(0.02)
+
+        inicio = time.perf_counter()
+        resultado = asyncio.run(resilient.extractAsync(b"img"))
+        duracion = time.perf_counter() - inicio
+        engine.close()
+
+        assert resultado.text == TICKET_JSON
+        assert duracion < 0.4
+        stats = resilient.getStats()
+        assert stats["hedges"] == 1
+        assert stats["hedge_wins"] == 1
+
+    def test_withoutEnoughSamples_doesNotHedge(self):
+        """Prueba que no se cubre hasta tener suficientes latencias para estimar el p95."""
+        engine = FakeModelEngine([(0.05, TICKET_JSON)])
+        resilient = _resilient(engine, hedging_enabled=True, hedge_min_samples=5)
+
+        _run(resilient)
+
+        assert engine.calls == 1
+        assert resilient.getStats()["hedges"] == 0
+
+    def test_latencyTracker_percentile(self):
+        """Prueba el cálculo de percentiles de la ventana de latencias."""
+        tracker = LatencyTracker(window_size=100)
+        for valor in range(1, 101):
+            tracker.add(valor / 100)
+
+        assert tracker.percentile(0.95) == 0.95
+        assert tracker.percentile(0.5) == 0.5
+        assert LatencyTracker().percentile(0.95) is None
+
+
+class TestCircuitBreaker:
+    """Pruebas del disyuntor."""
+
+    def test_breaker_opensOnFailureRateAndRecoversAfterProbe(self):
+        """Prueba el ciclo closed -> open -> half_open -> closed."""
+        ahora = [0.0]
+        breaker = CircuitBreaker(failure_rate_threshold=0.5, window_size=4, min_calls=4, open_seconds=10, clock=lambda: ahora[0])
+
+        for exito in (True, False, True, False):
+            breaker.recordSuccess() if exito else breaker.recordFailure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.allowRequest() is False
+        assert breaker.retryAfter() == 10
+
+        ahora[0] = 10.0
+        assert breaker.allowRequest() is True   # petición de prueba
+        assert breaker.allowRequest() is False  # solo una a la vez
+        breaker.recordSuccess()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_breaker_failedProbe_reopens(self):
+        """Prueba que si la petición de prueba falla el circuito vuelve a abrirse."""
+        ahora = [0.0]
+        breaker = CircuitBreaker(window_size=2, min_calls=2, open_seconds=5, clock=lambda: ahora[0])
+        breaker.recordFailure()
+        breaker.recordFailure()
+        ahora[0] = 6.0
+
+        assert breaker.allowRequest() is True
+        breaker.recordFailure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.getStats()["opened"] == 2
+
+    def test_openCircuit_failsFastWithoutCallingModel(self):
+        """Prueba que con el circuito abierto se falla de inmediato sin llamar al modelo."""
+        engine = FakeModelEngine([], default=(0, RuntimeError("caído")))
+        breaker = CircuitBreaker(window_size=2, min_calls=2, open_seconds=30)
+        resilient = _resilient(engine, max_attempts=2, circuit_breaker=breaker)
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(resilient.extractAsync(b"img"))
+        llamadas = engine.calls
+        with pytest.raises(CircuitOpenError) as exc_info:
+            asyncio.run(resilient.extractAsync(b"img"))
+        engine.close()
+
+        assert engine.calls == llamadas == 2
+        assert exc_info.value.retry_after > 0
+        assert resilient.getStats()["short_circuited"] == 1
+
+    def test_keyPoolExhausted_doesNotOpenBreakerNorRetry(self):
+        """Prueba que el pool de claves sin cupo es contrapresión local: ni reintento ni fallo del motor."""
+        def agotado():
+            error = RuntimeError("Error al procesar imagen con Gemini: sin cupo")
+            error.__cause__ = KeyPoolExhaustedError("Todas las claves han agotado su cupo", retry_after=3.0)
+            return error
+
+        engine = FakeModelEngine([(0, agotado()) for _ in range(6)])
+        breaker = CircuitBreaker(window_size=2, min_calls=2, open_seconds=30)
+        resilient = _resilient(engine, max_attempts=3, circuit_breaker=breaker)
+
+        for _ in range(6):
+            with pytest.raises(RuntimeError) as exc_info:
+                asyncio.run(resilient.extractAsync(b"img"))
+            assert exc_info.value.__cause__.retry_after == 3.0
+        engine.close()
+
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.getStats()["opened"] == 0
+        assert engine.calls == 6
+        assert resilient.getStats()["retries"] == 0
+
+    def test_openCircuit_routesToFallbackEngine(self):
+        """Prueba que con el circuito abierto la petición se desvía al motor alternativo."""
+        engine = FakeModelEngine([], default=(0, RuntimeError("caído")))
+        fallback = FakeLocalEngine([], default=(0, "TOTAL 1,00"))
+        breaker = CircuitBreaker(window_size=1, min_calls=1, open_seconds=30)
+        resilient = _resilient(engine, max_attempts=1, circuit_breaker=breaker, fallback=fallback)
+
+        primero = asyncio.run(resilient.extractAsync(b"img"))
+        segundo = asyncio.run(resilient.extractAsync(b"img"))
+        engine.close()
+        fallback.close()
+
+        assert primero.engine == segundo.engine == "tesseract"
+        assert primero.output_format == "text"
+        assert engine.calls == 1
+        assert resilient.getStats()["fallbacks"] == 2
+
+
+@pytest.fixture
+def sample_image_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (50, 50), color='white').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@patch('app.services.ocr_service.genai')
+def test_geminiService_transientServiceUnavailable_isRetried(mock_genai_module, sample_image_bytes):
+    """Prueba de extremo a extremo con el OCRService real y un cliente de modelo falso."""
+    from app.services.ocr_service import OCRService
+
+    respuesta = MagicMock()
+    respuesta.parts = [MagicMock(text=TICKET_JSON)]
+    model = mock_genai_module.GenerativeModel.return_value
+    model.generate_content.side_effect = [google_exceptions.ServiceUnavailable("overloaded"), respuesta]
+    resilient = _resilient(OCRService(api_key="test_api_key", request_timeout=5), max_attempts=2)
+
+    resultado = _run(resilient, sample_image_bytes)
+
+    assert json.loads(resultado.text)["total"] == 1.0
+    assert model.generate_content.call_count == 2
+    assert model.generate_content.call_args.kwargs == {"request_options": {"timeout": 5}}
+
+
+def test_streamAsync_errorBeforeFirstChunk_isRetried():
+    """Prueba que en streaming se reintenta si el fallo ocurre antes de entregar ningún trozo."""
+    engine = FakeModelEngine([(0, RuntimeError("503"))])
+    resilient = _resilient(engine, max_attempts=2)
+
+    async def consume():
+        return [piece async for piece in resilient.streamAsync(b"img")]
+
+    piezas = asyncio.run(consume())
+    engine.close()
+
+    assert piezas[0] == TICKET_JSON
+    assert piezas[-1].text == TICKET_JSON
+    assert piezas[-1].engine == "gemini"
+    assert engine.calls == 2
+    assert resilient.getStats()["retries"] == 1
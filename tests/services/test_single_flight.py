@@ -0,0 +1,159 @@
+import pytest
+import asyncio
+import json
+from unittest.mock import MagicMock, AsyncMock
+
+from app.services.ocr_cache import OcrResultCache
+from app.services.parser_service import ParserService
+from app.services.receipt_pipeline import ReceiptPipeline
+from app.services.single_flight import SingleFlight
+
+
+class TestSingleFlight:
+    """Pruebas unitarias del agrupador single-flight."""
+
+    def test_do_concurrentSameKey_executesOnce(self):
+        """Prueba que llamadas concurrentes con la misma clave comparten una ejecución."""
+        # Arrange
+        single_flight = SingleFlight()
+        executions = []
+
+        async def work():
+            executions.append(1)
+            await asyncio.sleep(0.05)
+            return "resultado"
+
+        async def scenario():
+            return await asyncio.gather(*(single_flight.do("k", work) for _ in range(5)))
+
+        # Act
+        resultados = asyncio.run(scenario())
+
+        # Assert
+        assert resultados == ["resultado"] * 5
+        assert len(executions) == 1
+        stats = single_flight.getStats()
+        assert stats["calls"] == 5
+        assert stats["executions"] == 1
+        assert stats["coalesced"] == 4
+        assert stats["in_flight"] == 0
+
+    def test_do_differentKeys_executeSeparately(self):
+        """Prueba que claves distintas no se agrupan."""
+        single_flight = SingleFlight()
+
+        async def scenario():
+            async def work(value):
+                await asyncio.sleep(0.01)
+                return value
+            return await asyncio.gather(
+                single_flight.do("a", lambda: work("a")),
+                single_flight.do("b", lambda: work("b")),
+            )
+
+        assert asyncio.run(scenario()) == ["a", "b"]
+        assert single_flight.getStats()["executions"] == 2
+
+    def test_do_failure_propagatesToAllWaiters(self):
+        """Prueba que el error de la ejecución compartida llega a todas las llamadas agrupadas."""
+        # Arrange
+        single_flight = SingleFlight()
+
+        async def failingWork():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("fallo del modelo")
+
+        async def scenario():
+            return await asyncio.gather(
+                *(single_flight.do("k", failingWork) for _ in range(3)), return_exceptions=True
+            )
+
+        # Act
+        resultados = asyncio.run(scenario())
+
+        # Assert
+        assert all(isinstance(r, RuntimeError) and "fallo del modelo" in str(r) for r in resultados)
+        assert single_flight.getStats()["failures"] == 1
+
+    def test_do_afterCompletion_executesAgain(self):
+        """Prueba que una llamada posterior (no concurrente) vuelve a ejecutarse."""
+        single_flight = SingleFlight()
+        counter = {"n": 0}
+
+        async def work():
+            counter["n"] += 1
+            return counter["n"]
+
+        async def scenario():
+            return await single_flight.do("k", work), await single_flight.do("k", work)
+
+        assert asyncio.run(scenario()) == (1, 2)
+
+    def test_do_oneWaiterCancelled_othersStillGetResult(self):
+        """Prueba que cancelar una de las llamadas agrupadas no cancela la ejecución compartida."""
+        single_flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        async def scenario():
+            first = asyncio.create_task(single_flight.do("k", work))
+            second = asyncio.create_task(single_flight.do("k", work))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await second, first
+
+        resultado, first = asyncio.run(scenario())
+        assert resultado == "ok"
+        assert first.cancelled()
+
+    def test_do_allWaitersCancelled_cancelsExecution(self):
+        """Prueba que si nadie espera ya el resultado, la ejecución compartida se cancela."""
+        single_flight = SingleFlight()
+        finished = []
+
+        async def work():
+            await asyncio.sleep(0.2)
+            finished.append(True)
+
+        async def scenario():
+            waiter = asyncio.create_task(single_flight.do("k", work))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            await asyncio.sleep(0.3)
+
+        asyncio.run(scenario())
+        assert finished == []
+        assert single_flight.inFlight() == 0
+
+
+class TestPipelineSingleFlight:
+    """Pruebas de la agrupación de subidas idénticas en el pipeline."""
+
+    def test_extractAndParse_concurrentIdenticalUploads_callOcrOnce(self):
+        """Prueba que subidas idénticas simultáneas generan una sola llamada al modelo."""
+        # Arrange
+        raw_text = json.dumps({"is_ticket": True, "items": [{"description": "Pan", "quantity": 1, "unit_price": 1.2}]})
+        ocr_service = MagicMock()
+
+        async def slowOcr(*args, **kwargs):
+            await asyncio.sleep(0.05)
+            return raw_text
+
+        ocr_service.extractTextFromImageAsync = AsyncMock(side_effect=slowOcr)
+        pipeline = ReceiptPipeline(cache=OcrResultCache(), single_flight=SingleFlight())
+
+        async def scenario():
+            return await asyncio.gather(
+                *(pipeline.extractAndParse(b"img", ocr_service, ParserService()) for _ in range(4))
+            )
+
+        # Act
+        resultados = asyncio.run(scenario())
+
+        # Assert
+        assert ocr_service.extractTextFromImageAsync.await_count == 1
+        assert all(r["items"][0].name == "Pan" for r in resultados)
+        assert resultados[0]["items"][0] is not resultados[1]["items"][0]
+        assert pipeline.getStats()["single_flight"]["coalesced"] == 3
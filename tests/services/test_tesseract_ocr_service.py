@@ -0,0 +1,102 @@
+import pytest
+from unittest.mock import patch
+from PIL import Image, ImageDraw
+import asyncio
+import io
+
+import numpy as np
+
+from app.services.image_preprocessor import ImagePreprocessor
+from app.services.tesseract_ocr_service import TesseractOCRService
+
+
+TEXTO_TICKET = "2 x CAÑA 1,30 2,60\nTOTAL 2,60\n"
+
+
+@pytest.fixture
+def sample_image_bytes():
+    img = Image.new('RGB', (300, 200), color='white')
+    ImageDraw.Draw(img).text((10, 10), "TOTAL 2,60", fill='black')
+    img_byte_arr = io.BytesIO()
+    img.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+
+@pytest.fixture
+def tesseract_disponible():
+    """Simula que el ejecutable de Tesseract está instalado."""
+    with patch("app.services.tesseract_ocr_service.shutil.which", return_value="/usr/bin/tesseract"):
+        yield
+
+
+@patch("app.services.tesseract_ocr_service.pytesseract.image_to_string", return_value=TEXTO_TICKET)
+def test_extractTextFromImage_returnsPlainText(mock_image_to_string, tesseract_disponible, sample_image_bytes):
+    """Prueba que el motor devuelve el texto de Tesseract y le pasa una imagen binarizada."""
+    ocr_service = TesseractOCRService(page_segmentation_mode=4)
+
+    resultado = ocr_service.extractTextFromImage(sample_image_bytes, language="spa")
+
+    assert resultado == TEXTO_TICKET.strip()
+    imagen, = mock_image_to_string.call_args.args
+    assert isinstance(imagen, np.ndarray)
+    assert imagen.ndim == 2
+    assert set(np.unique(imagen)) <= {0, 255}
+    assert imagen.shape[1] == TesseractOCRService.MIN_WIDTH
+    assert mock_image_to_string.call_args.kwargs == {"lang": "spa", "config": "--psm 4"}
+
+
+@patch("app.services.tesseract_ocr_service.pytesseract.image_to_string", return_value=TEXTO_TICKET)
+def test_extractTextFromImage_usesImagePreprocessor(mock_image_to_string, tesseract_disponible, sample_image_bytes):
+    """Prueba que, si hay preprocesador, la imagen se decodifica con él."""
+    preprocessor = ImagePreprocessor(max_side=2048)
+    ocr_service = TesseractOCRService(image_preprocessor=preprocessor)
+
+    with patch.object(preprocessor, "decode", wraps=preprocessor.decode) as mock_decode:
+        ocr_service.extractTextFromImage(sample_image_bytes)
+
+    mock_decode.assert_called_once_with(sample_image_bytes)
+
+
+def test_extractTextFromImage_invalidBytes_raisesValueError(tesseract_disponible):
+    """Prueba que unos bytes que no son imagen lanzan ValueError."""
+    ocr_service = TesseractOCRService()
+
+    with pytest.raises(ValueError) as exc_info:
+        ocr_service.extractTextFromImage(b"not an image")
+    assert "Los bytes de la imagen no son válidos" in str(exc_info.value)
+
+
+def test_extractTextFromImage_missingBinary_raisesTesseractNotFound(sample_image_bytes):
+    """Prueba que sin el ejecutable se lanza el error que el endpoint traduce a error de configuración."""
+    ocr_service = TesseractOCRService(tesseract_cmd="/nonexistent/tesseract")
+
+    with pytest.raises(RuntimeError) as exc_info:
+        ocr_service.extractTextFromImage(sample_image_bytes)
+    assert "Tesseract no encontrado" in str(exc_info.value)
+
+
+@patch("app.services.tesseract_ocr_service.pytesseract.image_to_string", side_effect=Exception("boom"))
+def test_extractTextFromImage_tesseractFailure_raisesRuntimeError(mock_image_to_string, tesseract_disponible, sample_image_bytes):
+    """Prueba que los fallos de Tesseract se convierten en RuntimeError."""
+    ocr_service = TesseractOCRService()
+
+    with pytest.raises(RuntimeError) as exc_info:
+        ocr_service.extractTextFromImage(sample_image_bytes)
+    assert "Error al procesar imagen con Tesseract" in str(exc_info.value)
+
+
+@patch("app.services.tesseract_ocr_service.pytesseract.image_to_string", return_value=TEXTO_TICKET)
+def test_extractTextFromImageAsync_runsInEngineThreadPool(mock_image_to_string, tesseract_disponible, sample_image_bytes):
+    """Prueba que la versión asíncrona usa el pool de hilos propio del motor."""
+    import threading
+    calling_threads = []
+    mock_image_to_string.side_effect = lambda *a, **k: calling_threads.append(threading.current_thread().name) or TEXTO_TICKET
+    ocr_service = TesseractOCRService(max_concurrency=1)
+
+    try:
+        resultado = asyncio.run(ocr_service.extractTextFromImageAsync(sample_image_bytes))
+    finally:
+        ocr_service.close()
+
+    assert resultado == TEXTO_TICKET.strip()
+    assert calling_threads[0].startswith("ocr-tesseract")
@@ -0,0 +1,204 @@
+import pytest
+from PIL import Image, ImageDraw
+import asyncio
+import io
+import json
+import threading
+import time
+
+import numpy as np
+
+from app.services.ocr_engine import OCREngine
+from app.services.parser_service import ParserService
+from app.services.tiled_ocr import TiledOCREngine, TileSplitter, mergeTileOutputs
+
+
+LINEAS = 100
+PASO = 40        # Altura de cada línea del ticket (barra + hueco)
+ANCHO = 400
+
+
+def _ticketLargo(lineas=LINEAS):
+    """
+    Ticket sintético de `lineas` líneas: cada línea es una barra negra cuyo ancho
+    codifica su número, así un motor falso puede "leerla" desde cualquier franja.
+    """
+    img = Image.new('RGB', (ANCHO, lineas * PASO), color='white')
+    draw = ImageDraw.Draw(img)
+    for indice in range(lineas):
+        top = indice * PASO + 10
+        draw.rectangle((10, top, 10 + 20 + 3 * indice, top + 19), fill='black')
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _leerLineas(image_bytes):
+    """Devuelve los números de las líneas completas que aparecen en la imagen."""
+    gray = np.asarray(Image.open(io.BytesIO(image_bytes)).convert("L")) < 128
+    filas = gray.any(axis=1)
+    indices, fila = [], 0
+    while fila < len(filas):
+        if not filas[fila]:
+            fila += 1
+            continue
+        inicio = fila
+        while fila < len(filas) and filas[fila]:
+            fila += 1
+        if inicio == 0 or fila == len(filas):
+            continue  # Línea cortada por el borde de la franja
+        ancho = int(gray[(inicio + fila) // 2].sum())
+        indices.append(round((ancho - 21) / 3))
+    return indices
+
+
+class FakeBarEngine(OCREngine):
+    """Motor falso que "lee" las barras de la imagen, tarda `latency` y mide la concurrencia."""
+    name = "gemini"
+    output_format = "json"
+
+    def __init__(self, latency=0.0):
+        super().__init__(max_concurrency=16)
+        self.latency = latency
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def extractTextFromImage(self, image_bytes, language='spa'):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.latency)
+            items = [
+                {"description": f"Producto {indice}", "quantity": 1, "unit_price": 1.0, "total_price": 1.0}
+                for indice in _leerLineas(image_bytes)
+            ]
+            return json.dumps({"is_ticket": True, "items": items, "total": float(LINEAS)})
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+class TestTileSplitter:
+    """Pruebas del corte en franjas."""
+
+    def test_isTall_usesAspectRatio(self):
+        splitter = TileSplitter(min_aspect_ratio=3.0)
+
+        assert splitter.isTall(400, 1600)
+        assert not splitter.isTall(400, 1000)
+        assert not splitter.isTallImage(b"no es una imagen")
+
+    def test_planTiles_coversWholeImageCuttingOnBlankRows(self):
+        """Prueba que las franjas se solapan, cubren toda la imagen y no parten ninguna línea."""
+        gray = np.asarray(Image.open(io.BytesIO(_ticketLargo())).convert("L"))
+        splitter = TileSplitter(tile_aspect_ratio=1.5, overlap=0.15)
+
+        franjas = splitter.planTiles(gray)
+
+        assert len(franjas) > 1
+        assert franjas[0][0] == 0
+        assert franjas[-1][1] == gray.shape[0]
+        for (_, fin), (inicio, _) in zip(franjas, franjas[1:]):
+            assert inicio < fin  # Solape
+        for inicio, fin in franjas:
+            assert gray[inicio].min() > 128
+            assert gray[fin - 1].min() > 128 or fin == gray.shape[0]
+
+    def test_planTiles_respectsMaxTiles(self):
+        gray = np.full((20000, 100), 255, dtype=np.uint8)
+
+        franjas = TileSplitter(max_tiles=4).planTiles(gray)
+
+        assert len(franjas) == 4
+        assert franjas[-1][1] == 20000
+
+
+class TestMerge:
+    """Pruebas de la unión de resultados de las franjas."""
+
+    def test_mergeJson_removesOverlapDuplicatesAndKeepsLastTotals(self):
+        a = json.dumps({"is_ticket": True, "items": [{"description": "Pan"}, {"description": "Leche "}], "total": None})
+        b = json.dumps({"is_ticket": True, "items": [{"description": "leche"}, {"description": "Café"}], "total": 3.5})
+
+        texto, eliminados = mergeTileOutputs([a, b], "json")
+
+        resultado = json.loads(texto)
+        assert [item["description"] for item in resultado["items"]] == ["Pan", "Leche ", "Café"]
+        assert resultado["total"] == 3.5
+        assert eliminados == 1
+
+    def test_mergeJson_repeatedItemsOutsideOverlapAreKept(self):
+        """Dos cañas seguidas en la misma franja no son un duplicado del solape."""
+        a = json.dumps({"is_ticket": True, "items": [{"description": "Caña"}, {"description": "Caña"}]})
+        b = json.dumps({"is_ticket": True, "items": [{"description": "Tapa"}]})
+
+        texto, eliminados = mergeTileOutputs([a, b], "json")
+
+        assert len(json.loads(texto)["items"]) == 3
+        assert eliminados == 0
+
+    def test_mergeText_joinsLines(self):
+        texto, eliminados = mergeTileOutputs(["PAN 1,00\nLECHE 2,00", "LECHE 2,00\nTOTAL 3,00"], "text")
+
+        assert texto == "PAN 1,00\nLECHE 2,00\nTOTAL 3,00"
+        assert eliminados == 1
+
+
+class TestTiledOCREngine:
+    """Pruebas del motor por franjas."""
+
+    def test_tallReceipt_isReadInParallelWithoutDuplicates(self):
+        """Prueba que un ticket largo se lee por franjas en paralelo y los IDs son correlativos."""
+        engine = FakeBarEngine(latency=0.1)
+        tiled = TiledOCREngine(engine, TileSplitter())
+
+        inicio = time.perf_counter()
+        resultado = asyncio.run(tiled.extractAsync(_ticketLargo()))
+        duracion = time.perf_counter() - inicio
+        engine.close()
+
+        parsed = ParserService().parseTextToItems(resultado.text)
+        assert [item.name for item in parsed["items"]] == [f"Producto {i}" for i in range(LINEAS)]
+        assert [item.id for item in parsed["items"]] == list(range(1, LINEAS + 1))
+        assert parsed["total"] == float(LINEAS)
+        stats = tiled.getStats()
+        assert stats["tiles"] == engine.calls > 1
+        assert stats["duplicates_removed"] > 0
+        assert engine.max_active > 1
+        assert duracion < engine.calls * engine.latency / 2
+
+    def test_shortReceipt_isDelegatedUnchanged(self):
+        engine = FakeBarEngine()
+        tiled = TiledOCREngine(engine, TileSplitter())
+
+        resultado = asyncio.run(tiled.extractAsync(_ticketLargo(lineas=5)))
+        engine.close()
+
+        assert engine.calls == 1
+        assert len(json.loads(resultado.text)["items"]) == 5
+        assert tiled.getStats()["tiled_images"] == 0
+
+    def test_streamAsync_tallReceipt_yieldsMergedResult(self):
+        engine = FakeBarEngine()
+        tiled = TiledOCREngine(engine, TileSplitter())
+
+        async def consume():
+            return [pieza async for pieza in tiled.streamAsync(_ticketLargo())]
+
+        piezas = asyncio.run(consume())
+        engine.close()
+
+        assert piezas[0] == piezas[-1].text
+        assert len(json.loads(piezas[-1].text)["items"]) == LINEAS
+
+    def test_syncExtraction_matchesAsync(self):
+        engine = FakeBarEngine()
+        tiled = TiledOCREngine(engine, TileSplitter())
+        imagen = _ticketLargo()
+
+        assert tiled.extractTextFromImage(imagen) == asyncio.run(tiled.extractAsync(imagen)).text
+        engine.close()
@@ -0,0 +1,178 @@
+import pytest
+import asyncio
+import io
+import json
+from typing import Optional
+
+from PIL import Image
+from starlette.exceptions import HTTPException
+
+from app.services.upload_limits import UploadLimitMiddleware, UploadLimits, UploadRejectedError, sniffImageFormat
+
+
+def _encode(image: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class FakeUpload:
+    """Sustituto mínimo de `UploadFile`: lectura asíncrona por trozos y tamaño opcional."""
+
+    def __init__(self, data: bytes, size: Optional[int] = None):
+        self._buffer = io.BytesIO(data)
+        self.size = size
+        self.reads = []
+
+    async def read(self, size: int = -1) -> bytes:
+        chunk = self._buffer.read(size)
+        self.reads.append(len(chunk))
+        return chunk
+
+    async def seek(self, offset: int) -> None:
+        self._buffer.seek(offset)
+
+
+class TestSniffImageFormat:
+
+    @pytest.mark.parametrize("formato", ["JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF"])
+    def test_supportedFormats_areRecognised(self, formato):
+        datos = _encode(Image.new("RGB", (8, 8), color="white"), formato)
+
+        assert sniffImageFormat(datos[:16]) == formato
+
+    @pytest.mark.parametrize("cabecera", [b"", b"%PDF-1.7", b"<html>", b"fake image content", b"RIFF\x00\x00\x00\x00WAVE"])
+    def test_otherContent_isNotAnImage(self, cabecera):
+        assert sniffImageFormat(cabecera) is None
+
+
+class TestUploadLimits:
+    """Pruebas de los límites de tamaño, tipo y píxeles de las subidas."""
+
+    def test_check_declaredSizeTooLarge_rejectsWithoutReading(self):
+        limites = UploadLimits(max_bytes=1000)
+        subida = FakeUpload(b"\xff\xd8\xff" + b"x" * 2000, size=2003)
+
+        with pytest.raises(UploadRejectedError) as exc_info:
+            asyncio.run(limites.check(subida))
+
+        assert exc_info.value.status_code == 413
+        assert subida.reads == []
+        assert limites.getStats()["rejected_size"] == 1
+
+    def test_check_notAnImage_rejectsWith415(self):
+        limites = UploadLimits()
+
+        with pytest.raises(UploadRejectedError) as exc_info:
+            asyncio.run(limites.check(FakeUpload(b"%PDF-1.7 documento", size=18)))
+
+        assert exc_info.value.status_code == 415
+        assert limites.getStats()["rejected_type"] == 1
+
+    def test_checkThenRead_returnsWholeImage(self):
+        """Prueba que la comprobación de la firma no consume los primeros bytes de la imagen."""
+        limites = UploadLimits()
+        datos = _encode(Image.new("RGB", (64, 64), color="white"), "PNG")
+        subida = FakeUpload(datos, size=len(datos))
+
+        formato = asyncio.run(limites.check(subida))
+        leidos = asyncio.run(limites.read(subida))
+
+        assert formato == "PNG"
+        assert leidos == datos
+        assert limites.getStats()["accepted"] == 1
+
+    def test_read_unknownSize_stopsAtLimit(self):
+        """Prueba que, sin tamaño declarado, se deja de leer en cuanto se pasa del máximo."""
+        limites = UploadLimits(max_bytes=2500, chunk_size=1000)
+        subida = FakeUpload(b"\xff\xd8\xff" + b"x" * 100000)
+
+        with pytest.raises(UploadRejectedError) as exc_info:
+            asyncio.run(limites.read(subida))
+
+        assert exc_info.value.status_code == 413
+        assert sum(subida.reads) == 3000
+
+    def test_read_decompressionBomb_rejectedFromHeader(self):
+        """Prueba que un PNG de pocos KB con demasiados píxeles se rechaza sin decodificarlo."""
+        limites = UploadLimits(max_pixels=10_000_000)
+        bomba = _encode(Image.new("1", (8000, 6000), color=1), "PNG")
+
+        with pytest.raises(UploadRejectedError) as exc_info:
+            asyncio.run(limites.read(FakeUpload(bomba, size=len(bomba))))
+
+        assert exc_info.value.status_code == 413
+        assert limites.getStats()["rejected_pixels"] == 1
+
+    def test_read_largeJpeg_isAcceptedForDraftDecoding(self):
+        """Prueba que un JPEG con más píxeles del máximo se acepta: se decodificará reducido."""
+        limites = UploadLimits(max_pixels=10_000_000)
+        foto = _encode(Image.new("RGB", (8000, 6000), color="white"), "JPEG")
+
+        assert asyncio.run(limites.read(FakeUpload(foto, size=len(foto)))) == foto
+
+    @pytest.mark.parametrize("metodo, ruta, esperado", [
+        ("POST", "/api/v1/receipts/upload", 1000 + 100),
+        ("POST", "/api/v1/receipts/upload/stream", 1000 + 100),
+        ("POST", "/api/v1/receipts/upload/batch", 3 * (1000 + 100)),
+        ("POST", "/api/v1/receipts/abc/split", None),
+        ("GET", "/api/v1/receipts/abc", None),
+    ])
+    def test_bodyLimit(self, metodo, ruta, esperado):
+        limites = UploadLimits(max_bytes=1000, batch_max_files=3, multipart_overhead=100)
+
+        assert limites.bodyLimit(metodo, ruta) == esperado
+
+
+def _scope(headers):
+    return {"type": "http", "method": "POST", "path": "/api/v1/receipts/upload", "headers": headers, "app": None}
+
+
+def test_middleware_declaredLengthTooLarge_rejectsBeforeReadingBody():
+    limites = UploadLimits(max_bytes=1000, multipart_overhead=0)
+    llamadas = []
+
+    async def aplicacion(scope, receive, send):
+        llamadas.append(scope["path"])
+
+    async def receive():
+        raise AssertionError("no se debe leer el cuerpo")
+
+    async def peticion():
+        enviados = []
+
+        async def send(mensaje):
+            enviados.append(mensaje)
+
+        await UploadLimitMiddleware(aplicacion, getLimits=lambda app: limites)(
+            _scope([(b"content-length", b"5000")]), receive, send
+        )
+        return enviados
+
+    enviados = asyncio.run(peticion())
+
+    assert llamadas == []
+    assert enviados[0]["status"] == 413
+    assert "tamaño máximo" in json.loads(enviados[1]["body"])["detail"]
+
+
+def test_middleware_streamedBodyOverLimit_stopsReading():
+    """Prueba que un cuerpo sin Content-Length se corta en cuanto pasa del límite."""
+    limites = UploadLimits(max_bytes=1000, multipart_overhead=0)
+    trozos = [{"type": "http.request", "body": b"x" * 600, "more_body": True} for _ in range(10)]
+    leidos = []
+
+    async def receive():
+        leidos.append(1)
+        return trozos.pop(0)
+
+    async def aplicacion(scope, receive, send):
+        while (await receive()).get("more_body"):
+            pass
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(UploadLimitMiddleware(aplicacion, getLimits=lambda app: limites)(_scope([]), receive, None))
+
+    assert exc_info.value.status_code == 413
+    assert len(leidos) == 2
+    assert limites.getStats()["rejected_size"] == 1